@@ -4,7 +4,9 @@ from fastapi.templating import Jinja2Templates
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 import os
-import httpx
+from http_clients import get_http_client
+from phone_keys import com_phone_key
+from stats_rollup import registrar_mensagem
 import logging
 
 logger = logging.getLogger(__name__)
@@ -105,25 +107,26 @@ async def send_message_to_client(phone: str = Form(...), message: str = Form(...
     """Enviar mensagem para cliente via admin"""
     try:
         # Enviar via Z-API
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{ZAPI_URL}/send-text",
-                json={
-                    "phone": phone,
-                    "message": message
-                },
-                timeout=30.0
-            )
+        client = get_http_client("zapi")
+        response = await client.post(
+            f"{ZAPI_URL}/send-text",
+            json={
+                "phone": phone,
+                "message": message
+            }
+        )
         
         # Salvar no MongoDB
-        await db.conversas.insert_one({
+        mensagem = {
             "phone": phone,
             "message": message,
             "role": "assistant",
             "mode": "human",
             "timestamp": datetime.now(),
             "sent_by": "admin_panel"
-        })
+        }
+        await db.conversas.insert_one(com_phone_key(mensagem))
+        await registrar_mensagem(mensagem)
         
         return JSONResponse({"status": "success", "message": "Mensagem enviada"})
         
@@ -153,15 +156,14 @@ async def return_to_ia(phone: str):
         )
         
         # Enviar mensagem automática para o cliente
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{ZAPI_URL}/send-text",
-                json={
-                    "phone": phone,
-                    "message": "✅ Você está de volta ao atendimento automático! Como posso ajudar?"
-                },
-                timeout=30.0
-            )
+        client = get_http_client("zapi")
+        await client.post(
+            f"{ZAPI_URL}/send-text",
+            json={
+                "phone": phone,
+                "message": "✅ Você está de volta ao atendimento automático! Como posso ajudar?"
+            }
+        )
         
         return JSONResponse({"status": "success", "message": "Conversa devolvida para IA"})
         
@@ -0,0 +1,85 @@
+"""
+admin_cache_routes.py - Painel dos caches (resultados de Vision e respostas do GPT-4o)
+"""
+
+from fastapi import APIRouter, Request
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.templating import Jinja2Templates
+from typing import Optional
+import logging
+
+from vision_cache import get_visao_cache_stats, limpar_cache_visao
+from response_cache import get_respostas_cache_stats, listar_respostas, remover_resposta
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+templates = Jinja2Templates(directory="templates")
+
+router = APIRouter(prefix="/admin/cache", tags=["Admin Cache"])
+
+# ==================================================================
+# ROTAS DA PÁGINA
+# ==================================================================
+
+@router.get("/", response_class=HTMLResponse)
+async def admin_cache_page(request: Request):
+    """Página dos caches"""
+    try:
+        return templates.TemplateResponse("admin_cache.html", {
+            "request": request
+        })
+    except Exception as e:
+        logger.error(f"Erro ao carregar página de caches: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+# ==================================================================
+# API ENDPOINTS
+# ==================================================================
+
+@router.get("/api/visao")
+async def api_visao_stats():
+    """Hit rate e tamanho do cache de Vision"""
+    try:
+        return JSONResponse(await get_visao_cache_stats())
+    except Exception as e:
+        logger.error(f"Erro ao buscar stats do cache de Vision: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@router.post("/api/visao/limpar")
+async def api_visao_limpar(tarefa: Optional[str] = None):
+    """Apaga as entradas do cache de Vision (de uma tarefa ou todas)"""
+    try:
+        removidas = await limpar_cache_visao(tarefa)
+        logger.info(f"[VISAO-CACHE] {removidas} entradas removidas pelo admin (tarefa={tarefa or 'todas'})")
+        return JSONResponse({"success": True, "removidas": removidas})
+    except Exception as e:
+        logger.error(f"Erro ao limpar cache de Vision: {e}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.get("/api/respostas")
+async def api_respostas(limite: int = 100):
+    """Hit rate do cache de respostas e as respostas em cache (mais usadas primeiro)"""
+    try:
+        return JSONResponse({
+            "stats": await get_respostas_cache_stats(),
+            "respostas": await listar_respostas(min(limite, 500))
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar cache de respostas: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@router.post("/api/respostas/limpar")
+async def api_respostas_limpar(id: Optional[str] = None):
+    """Apaga uma resposta em cache (ou todas)"""
+    try:
+        removidas = await remover_resposta(id)
+        logger.info(f"[RESPOSTAS-CACHE] {removidas} respostas removidas pelo admin (id={id or 'todas'})")
+        return JSONResponse({"success": True, "removidas": removidas})
+    except Exception as e:
+        logger.error(f"Erro ao limpar cache de respostas: {e}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
@@ -131,37 +131,25 @@ async def api_toggle_manutencao(request: Request):
 
 @router.get("/api/stats")
 async def api_get_stats():
-    """Retorna estatísticas do dia com dados reais"""
+    """Retorna estatísticas do dia (lidas do rollup pré-agregado)"""
     try:
-        # Buscar conversas de hoje
+        from stats_rollup import somar_por, somar, clientes_no_periodo
         hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
-        # Contar mensagens de hoje
-        mensagens_hoje = await db.conversas.count_documents({
-            "timestamp": {"$gte": hoje}
-        })
-
-        # Contar clientes únicos de hoje
-        clientes_hoje = await db.conversas.distinct("phone", {
-            "timestamp": {"$gte": hoje}
-        })
+        # Mensagens de hoje por modo (ia/human) num unico agregado
+        mensagens_por_modo = await somar_por("mensagens", "mode", hoje)
 
-        # Contar transferências para humano hoje
-        transferencias_hoje = await db.conversas.count_documents({
-            "timestamp": {"$gte": hoje},
-            "mode": "human"
-        })
+        # Clientes únicos de hoje
+        clientes_hoje, _ = await clientes_no_periodo(hoje)
 
-        # Contar conversões (pagamentos) hoje
-        conversoes_hoje = await db.conversoes.count_documents({
-            "timestamp": {"$gte": hoje}
-        })
+        # Conversões (pagamentos) hoje
+        conversoes_hoje = await somar("conversoes", hoje)
 
         return {
-            "mensagens": mensagens_hoje,
+            "mensagens": sum(mensagens_por_modo.values()),
             "conversas": len(clientes_hoje),
-            "transferencias": transferencias_hoje,
-            "conversoes": conversoes_hoje
+            "transferencias": mensagens_por_modo.get("human", 0),
+            "conversoes": conversoes_hoje["total"]
         }
     except Exception as e:
         logger.error(f"Erro ao buscar estatísticas: {e}")
@@ -407,3 +395,60 @@ async def api_get_operator():
     except Exception as e:
         logger.error(f"Erro ao obter config operador: {e}")
         return {"success": False, "error": str(e)}
+
+
+# ==================================================================
+# INDICES DO MONGODB - AUDITORIA
+# ==================================================================
+
+@router.get("/api/indices/auditoria")
+async def api_auditoria_indices():
+    """Roda explain() nas consultas conhecidas e aponta COLLSCAN / SORT em memoria"""
+    try:
+        from db_indexes import auditar_consultas
+        relatorio = await auditar_consultas(db)
+        return {
+            "success": True,
+            "total": len(relatorio),
+            "problemas": sum(1 for r in relatorio if not r["ok"]),
+            "consultas": relatorio
+        }
+    except Exception as e:
+        logger.error(f"Erro na auditoria de indices: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@router.post("/api/indices/criar")
+async def api_criar_indices():
+    """Cria (idempotente) os indices declarados em db_indexes.py"""
+    try:
+        from db_indexes import garantir_indices
+        resultado = await garantir_indices(db)
+        return {"success": True, "colecoes": resultado}
+    except Exception as e:
+        logger.error(f"Erro ao criar indices: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@router.post("/api/migracoes/phone-key")
+async def api_migrar_phone_key():
+    """Roda novamente o backfill de phone_key (conversas, cliente_estados, crm_contacts)"""
+    try:
+        from phone_keys import migrar_phone_keys
+        resultado = await migrar_phone_keys(db, forcar=True)
+        return {"success": resultado.get("concluida", False), **resultado}
+    except Exception as e:
+        logger.error(f"Erro na migracao de phone_key: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@router.post("/api/rollup/reconstruir")
+async def api_reconstruir_rollup():
+    """Recalcula o rollup de estatisticas a partir de conversas, conversoes e orcamentos"""
+    try:
+        from stats_rollup import reconstruir_rollup
+        resultado = await reconstruir_rollup(forcar=True)
+        return {"success": resultado.get("concluida", False), **resultado}
+    except Exception as e:
+        logger.error(f"Erro ao reconstruir rollup: {e}")
+        return {"success": False, "error": str(e)}
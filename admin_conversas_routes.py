@@ -13,6 +13,11 @@ import os
 import logging
 import traceback
 
+from stats_rollup import (
+    extrair_valor, registrar_conversao, ajustar_valor_conversao,
+    somar, serie_diaria, clientes_no_periodo
+)
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -24,18 +29,6 @@ client = AsyncIOMotorClient(MONGODB_URI)
 db = client.mia_database
 
 
-def extrair_valor(conversao_doc):
-    """Extrai valor de forma flexível"""
-    valor = conversao_doc.get("valor") or conversao_doc.get("value") or 0
-    if isinstance(valor, str):
-        try:
-            valor = valor.replace("$", "").replace("R$", "").replace(",", "").strip()
-            valor = float(valor)
-        except:
-            valor = 0
-    return float(valor) if valor else 0.0
-
-
 @router.get("/admin/conversas", response_class=HTMLResponse)
 async def admin_conversas_page(request: Request):
     """Página principal"""
@@ -53,46 +46,32 @@ async def admin_conversas_page(request: Request):
 
 @router.get("/admin/conversas/api/stats")
 async def api_get_stats(periodo: str = "15"):
-    """Retorna estatísticas completas com cálculos reais"""
+    """Retorna estatísticas completas (lidas do rollup pré-agregado)"""
     try:
         dias = int(periodo)
         data_inicio = datetime.now() - timedelta(days=dias)
 
-        conversoes_docs = await db.conversoes.find({
-            "timestamp": {"$gte": data_inicio}
-        }).to_list(1000)
-        
-        total_conversoes = len(conversoes_docs)
-        valor_total = sum(extrair_valor(doc) for doc in conversoes_docs)
+        conversoes = await somar("conversoes", data_inicio)
+        total_conversoes = conversoes["total"]
+        valor_total = conversoes["valor"]
 
-        clientes_unicos = await db.conversas.distinct("phone", {
-            "timestamp": {"$gte": data_inicio}
-        })
+        clientes_unicos, clientes_convertidos = await clientes_no_periodo(data_inicio)
         total_clientes = len(clientes_unicos)
 
         taxa_conversao = (total_conversoes / total_clientes * 100) if total_clientes > 0 else 0
 
-        conversas_ia = await db.conversas.find({
-            "timestamp": {"$gte": data_inicio},
-            "role": "assistant"
-        }).to_list(10000)
-        
-        tempo_ia_minutos = len(conversas_ia) * 2
+        conversas_ia = await somar("mensagens", data_inicio, role="assistant")
+        tempo_ia_minutos = conversas_ia["total"] * 2
 
-        conversas_humano = await db.conversas.find({
-            "timestamp": {"$gte": data_inicio},
-            "mode": "human"
-        }).to_list(10000)
-        
-        tempo_humano_minutos = len(conversas_humano) * 5
+        conversas_humano = await somar("mensagens", data_inicio, mode="human")
+        tempo_humano_minutos = conversas_humano["total"] * 5
 
         leads_nao_convertidos = await db.leads_followup.count_documents({
             "status": {"$ne": "converted"}
         })
 
         if leads_nao_convertidos == 0:
-            clientes_convertidos = [doc.get("phone") for doc in conversoes_docs]
-            leads_nao_convertidos = len([c for c in clientes_unicos if c not in clientes_convertidos])
+            leads_nao_convertidos = len(clientes_unicos - clientes_convertidos)
 
         return {
             "valor_total": round(valor_total, 2),
@@ -129,38 +108,10 @@ async def api_get_chart_data(periodo: str = "15"):
         dias = int(periodo)
         data_inicio = datetime.now() - timedelta(days=dias)
 
-        conversoes_docs = await db.conversoes.find({
-            "timestamp": {"$gte": data_inicio}
-        }).to_list(1000)
-        
-        conversoes_por_dia = {}
-        for doc in conversoes_docs:
-            if doc.get("timestamp"):
-                data = doc["timestamp"].strftime("%Y-%m-%d")
-                if data not in conversoes_por_dia:
-                    conversoes_por_dia[data] = {"total": 0, "valor": 0}
-                conversoes_por_dia[data]["total"] += 1
-                conversoes_por_dia[data]["valor"] += extrair_valor(doc)
-
-        pipeline_ia = [
-            {"$match": {"timestamp": {"$gte": data_inicio}, "role": "assistant"}},
-            {"$group": {
-                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-                "total": {"$sum": 1}
-            }},
-            {"$sort": {"_id": 1}}
-        ]
-        atendimentos_ia = await db.conversas.aggregate(pipeline_ia).to_list(100)
-
-        pipeline_humano = [
-            {"$match": {"timestamp": {"$gte": data_inicio}, "mode": "human"}},
-            {"$group": {
-                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-                "total": {"$sum": 1}
-            }},
-            {"$sort": {"_id": 1}}
-        ]
-        atendimentos_humano = await db.conversas.aggregate(pipeline_humano).to_list(100)
+        # Series diarias do rollup pré-agregado
+        conversoes_por_dia = await serie_diaria("conversoes", data_inicio)
+        atendimentos_ia = await serie_diaria("mensagens", data_inicio, role="assistant")
+        atendimentos_humano = await serie_diaria("mensagens", data_inicio, mode="human")
 
         labels = []
         conversoes_data = []
@@ -176,11 +127,8 @@ async def api_get_chart_data(periodo: str = "15"):
             conversoes_data.append(conv["total"])
             valores_data.append(round(conv["valor"], 2))
 
-            ia = next((a for a in atendimentos_ia if a["_id"] == data), None)
-            ia_data.append(ia["total"] if ia else 0)
-
-            hum = next((h for h in atendimentos_humano if h["_id"] == data), None)
-            humano_data.append(hum["total"] if hum else 0)
+            ia_data.append(atendimentos_ia.get(data, {}).get("total", 0))
+            humano_data.append(atendimentos_humano.get(data, {}).get("total", 0))
 
         return {
             "labels": labels,
@@ -387,11 +335,13 @@ async def api_delete_lead(lead_id: str):
 async def api_delete_conversao(conversao_id: str):
     """Deleta conversão"""
     try:
-        result = await db.conversoes.delete_one({"_id": ObjectId(conversao_id)})
+        conversao = await db.conversoes.find_one_and_delete({"_id": ObjectId(conversao_id)})
 
-        if result.deleted_count == 0:
+        if not conversao:
             return {"success": False, "error": "Conversion not found"}
 
+        await registrar_conversao(conversao, sinal=-1)
+
         logger.info(f"✅ Conversão deletada: {conversao_id}")
 
         return {"success": True, "message": "Conversion deleted"}
@@ -425,14 +375,16 @@ async def api_edit_conversao(conversao_id: str, request: Request):
             "message": data.get("observacao", ""),
         }
 
-        result = await db.conversoes.update_one(
+        anterior = await db.conversoes.find_one_and_update(
             {"_id": ObjectId(conversao_id)},
             {"$set": update_fields}
         )
 
-        if result.matched_count == 0:
+        if not anterior:
             return {"success": False, "error": "Conversion not found"}
 
+        await ajustar_valor_conversao(anterior, valor)
+
         logger.info(f"✅ Conversão editada: {conversao_id} - {phone} - ${valor}")
 
         return {"success": True, "message": "Conversion updated"}
@@ -471,6 +423,7 @@ async def api_registrar_conversao(request: Request):
         }
 
         result = await db.conversoes.insert_one(conversao)
+        await registrar_conversao(conversao)
         
         await db.leads_followup.update_one(
             {"phone": phone},
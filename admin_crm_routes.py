@@ -13,6 +13,9 @@ import os
 import re
 import logging
 
+from phone_keys import phone_key
+from estado_cache import obter_estado
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin/crm", tags=["Admin CRM"])
@@ -54,6 +57,7 @@ async def criar_ou_atualizar_contato(phone: str, dados: dict = None):
         # Atualizar contato existente
         update_data = {
             "last_contact": agora,
+            "phone_key": phone_key(phone_limpo),
             "total_interactions": contato.get("total_interactions", 0) + 1
         }
 
@@ -76,6 +80,7 @@ async def criar_ou_atualizar_contato(phone: str, dados: dict = None):
         # Criar novo contato
         novo_contato = {
             "phone": phone_limpo,
+            "phone_key": phone_key(phone_limpo),
             "nome": dados.get("nome") if dados else None,
             "email": dados.get("email") if dados else None,
             "idioma": dados.get("idioma", "pt") if dados else "pt",
@@ -104,8 +109,8 @@ async def extrair_info_conversa(phone: str):
     email = None
     idioma = "pt"
 
-    # Buscar no cliente_estados
-    estado = await db.cliente_estados.find_one({"phone": phone})
+    # Buscar no cliente_estados (pelo cache de estado do bot)
+    estado = await obter_estado(phone)
     if estado:
         nome = estado.get("nome")
         idioma = estado.get("idioma", "pt")
@@ -212,9 +217,9 @@ async def api_get_contact(contact_id: str):
         if not contato:
             return {"success": False, "error": "Contato nao encontrado"}
 
-        # Buscar conversas recentes
+        # Buscar conversas recentes (igualdade no phone_key indexado)
         conversas = await db.conversas.find(
-            {"phone": {"$regex": contato["phone"]}}
+            {"phone_key": contato.get("phone_key") or phone_key(contato["phone"])}
         ).sort("timestamp", -1).limit(20).to_list(20)
 
         conversas_formatadas = []
@@ -273,6 +278,7 @@ async def api_create_contact(request: Request):
 
         novo_contato = {
             "phone": phone_limpo,
+            "phone_key": phone_key(phone_limpo),
             "nome": data.get("nome", "").strip() or None,
             "email": data.get("email", "").strip() or None,
             "idioma": data.get("idioma", "pt"),
@@ -412,6 +418,7 @@ async def api_import_whatsapp_contacts():
 
                 novo_contato = {
                     "phone": phone_limpo,
+                    "phone_key": phone_key(phone_limpo),
                     "nome": info.get("nome"),
                     "email": info.get("email"),
                     "idioma": info.get("idioma", "pt"),
@@ -451,21 +458,31 @@ async def api_import_whatsapp_contacts():
 async def api_crm_stats():
     """Retorna estatisticas do CRM"""
     try:
-        total = await db.crm_contacts.count_documents({})
-        novos = await db.crm_contacts.count_documents({"status": "novo"})
-        em_contato = await db.crm_contacts.count_documents({"status": "em_contato"})
-        qualificados = await db.crm_contacts.count_documents({"status": "qualificado"})
-        convertidos = await db.crm_contacts.count_documents({"status": "convertido"})
-        perdidos = await db.crm_contacts.count_documents({"status": "perdido"})
-
-        # Contatos com email
-        com_email = await db.crm_contacts.count_documents({"email": {"$ne": None, "$ne": ""}})
-
-        # Ultimos 7 dias
         data_7_dias = datetime.now() - timedelta(days=7)
-        novos_7_dias = await db.crm_contacts.count_documents({
-            "created_at": {"$gte": data_7_dias}
-        })
+
+        # Todas as contagens numa unica passada (antes eram 8 count_documents)
+        pipeline = [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "novos": {"$sum": {"$cond": [{"$eq": ["$status", "novo"]}, 1, 0]}},
+            "em_contato": {"$sum": {"$cond": [{"$eq": ["$status", "em_contato"]}, 1, 0]}},
+            "qualificados": {"$sum": {"$cond": [{"$eq": ["$status", "qualificado"]}, 1, 0]}},
+            "convertidos": {"$sum": {"$cond": [{"$eq": ["$status", "convertido"]}, 1, 0]}},
+            "perdidos": {"$sum": {"$cond": [{"$eq": ["$status", "perdido"]}, 1, 0]}},
+            "com_email": {"$sum": {"$cond": [{"$ne": [{"$ifNull": ["$email", ""]}, ""]}, 1, 0]}},
+            "novos_7_dias": {"$sum": {"$cond": [{"$gte": ["$created_at", data_7_dias]}, 1, 0]}}
+        }}]
+        resultado = await db.crm_contacts.aggregate(pipeline).to_list(length=1)
+        contagem = resultado[0] if resultado else {}
+
+        total = contagem.get("total", 0)
+        novos = contagem.get("novos", 0)
+        em_contato = contagem.get("em_contato", 0)
+        qualificados = contagem.get("qualificados", 0)
+        convertidos = contagem.get("convertidos", 0)
+        perdidos = contagem.get("perdidos", 0)
+        com_email = contagem.get("com_email", 0)
+        novos_7_dias = contagem.get("novos_7_dias", 0)
 
         return {
             "success": True,
@@ -539,7 +556,7 @@ async def api_remove_tag(contact_id: str, tag: str):
 @router.post("/api/bulk-whatsapp")
 async def api_bulk_whatsapp(request: Request):
     """Envia mensagem em massa via WhatsApp usando Z-API"""
-    import httpx
+    from http_clients import get_http_client
     import os
     import asyncio
 
@@ -575,40 +592,40 @@ async def api_bulk_whatsapp(request: Request):
         sent = 0
         failed = 0
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for contact in contacts:
-                phone = contact.get("phone", "")
-                nome = contact.get("nome", "Customer")
+        client = get_http_client("zapi")
+        for contact in contacts:
+            phone = contact.get("phone", "")
+            nome = contact.get("nome", "Customer")
 
-                if not phone:
-                    failed += 1
-                    continue
+            if not phone:
+                failed += 1
+                continue
 
-                # Personalize message
-                personalized_msg = message_template.replace("{nome}", nome)
+            # Personalize message
+            personalized_msg = message_template.replace("{nome}", nome)
 
-                try:
-                    url = f"{ZAPI_BASE_URL}/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/send-text"
-                    headers = {"Client-Token": ZAPI_CLIENT_TOKEN} if ZAPI_CLIENT_TOKEN else {}
+            try:
+                url = f"{ZAPI_BASE_URL}/instances/{ZAPI_INSTANCE_ID}/token/{ZAPI_TOKEN}/send-text"
+                headers = {"Client-Token": ZAPI_CLIENT_TOKEN} if ZAPI_CLIENT_TOKEN else {}
 
-                    response = await client.post(
-                        url,
-                        headers=headers,
-                        json={"phone": phone, "message": personalized_msg}
-                    )
+                response = await client.post(
+                    url,
+                    headers=headers,
+                    json={"phone": phone, "message": personalized_msg}
+                )
 
-                    if response.status_code == 200:
-                        sent += 1
-                    else:
-                        failed += 1
-                        logger.error(f"[BULK] Failed to send to {phone}: {response.text}")
+                if response.status_code == 200:
+                    sent += 1
+                else:
+                    failed += 1
+                    logger.error(f"[BULK] Failed to send to {phone}: {response.text}")
 
-                    # Small delay to avoid rate limiting
-                    await asyncio.sleep(1)
+                # Small delay to avoid rate limiting
+                await asyncio.sleep(1)
 
-                except Exception as e:
-                    failed += 1
-                    logger.error(f"[BULK] Error sending to {phone}: {e}")
+            except Exception as e:
+                failed += 1
+                logger.error(f"[BULK] Error sending to {phone}: {e}")
 
         return {"success": True, "sent": sent, "failed": failed, "total": len(contacts)}
 
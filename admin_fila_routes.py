@@ -0,0 +1,83 @@
+"""
+admin_fila_routes.py - Painel da fila de webhooks (dead-letter)
+"""
+
+from fastapi import APIRouter, Request
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.templating import Jinja2Templates
+import logging
+
+from webhook_queue import listar_jobs, reprocessar_job, descartar_job, get_fila_stats
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+templates = Jinja2Templates(directory="templates")
+
+router = APIRouter(prefix="/admin/fila", tags=["Admin Fila"])
+
+# ==================================================================
+# ROTAS DA PÁGINA
+# ==================================================================
+
+@router.get("/", response_class=HTMLResponse)
+async def admin_fila_page(request: Request):
+    """Página da fila de webhooks / dead-letter"""
+    try:
+        return templates.TemplateResponse("admin_fila.html", {
+            "request": request
+        })
+    except Exception as e:
+        logger.error(f"Erro ao carregar página da fila: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+# ==================================================================
+# API ENDPOINTS
+# ==================================================================
+
+@router.get("/api/stats")
+async def api_fila_stats():
+    """Contagem de jobs por status"""
+    try:
+        return JSONResponse(await get_fila_stats())
+    except Exception as e:
+        logger.error(f"Erro ao buscar stats da fila: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@router.get("/api/jobs")
+async def api_fila_jobs(status: str = "dead", limit: int = 100):
+    """Lista jobs por status (padrao: dead-letter)"""
+    try:
+        jobs = await listar_jobs(status=status, limit=min(limit, 500))
+        return JSONResponse({"jobs": jobs, "total": len(jobs)})
+    except Exception as e:
+        logger.error(f"Erro ao listar jobs da fila: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@router.post("/api/jobs/{job_id}/reprocessar")
+async def api_reprocessar_job(job_id: str):
+    """Reenvia um job do dead-letter para a fila"""
+    try:
+        ok = await reprocessar_job(job_id)
+        if not ok:
+            return JSONResponse({"success": False, "error": "Job nao encontrado no dead-letter"}, status_code=404)
+        return JSONResponse({"success": True})
+    except Exception as e:
+        logger.error(f"Erro ao reprocessar job {job_id}: {e}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+
+@router.post("/api/jobs/{job_id}/descartar")
+async def api_descartar_job(job_id: str):
+    """Remove um job do dead-letter"""
+    try:
+        ok = await descartar_job(job_id)
+        if not ok:
+            return JSONResponse({"success": False, "error": "Job nao encontrado no dead-letter"}, status_code=404)
+        return JSONResponse({"success": True})
+    except Exception as e:
+        logger.error(f"Erro ao descartar job {job_id}: {e}")
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
@@ -12,7 +12,8 @@ from bson import ObjectId
 import os
 import logging
 import re
-from google_drive import is_drive_enabled, get_client_folder, get_folder_link
+from google_drive import is_drive_enabled, get_client_folder_async, get_folder_link
+from stats_rollup import somar
 
 logger = logging.getLogger(__name__)
 
@@ -141,7 +142,7 @@ async def api_update_status(request: Request):
                     phone = orcamento.get("phone", "")
                     nome = orcamento.get("nome", "")
                     if phone:
-                        folder_id = get_client_folder(phone, nome)
+                        folder_id = await get_client_folder_async(phone, nome)
                         if folder_id:
                             update_fields["google_drive_folder"] = get_folder_link(folder_id)
                             update_fields["google_drive_folder_id"] = folder_id
@@ -171,29 +172,20 @@ async def api_orcamentos_stats():
         # Últimos 30 dias
         data_30d = datetime.now() - timedelta(days=30)
 
-        # Total de orçamentos
-        total = await db.orcamentos.count_documents({})
-        total_30d = await db.orcamentos.count_documents({"created_at": {"$gte": data_30d}})
-
-        # Por status
-        pendentes = await db.orcamentos.count_documents({"status": "pendente"})
-        confirmados = await db.orcamentos.count_documents({"status": "confirmado"})
-        pagos = await db.orcamentos.count_documents({"status": "pago"})
-
-        # Valor total
-        pipeline = [
-            {"$group": {"_id": None, "total": {"$sum": "$valor"}}}
-        ]
-        valor_result = await db.orcamentos.aggregate(pipeline).to_list(length=1)
-        valor_total = valor_result[0]["total"] if valor_result else 0
-
-        # Valor últimos 30 dias
-        pipeline_30d = [
-            {"$match": {"created_at": {"$gte": data_30d}}},
-            {"$group": {"_id": None, "total": {"$sum": "$valor"}}}
-        ]
-        valor_30d_result = await db.orcamentos.aggregate(pipeline_30d).to_list(length=1)
-        valor_30d = valor_30d_result[0]["total"] if valor_30d_result else 0
+        # Totais e valores (rollup pré-agregado)
+        geral = await somar("orcamentos")
+        ultimos_30d = await somar("orcamentos", data_30d)
+        total, valor_total = geral["total"], geral["valor"]
+        total_30d, valor_30d = ultimos_30d["total"], ultimos_30d["valor"]
+
+        # Por status (o status muda depois da criacao: contado na colecao, numa unica passada)
+        por_status = {
+            r["_id"]: r["total"]
+            async for r in db.orcamentos.aggregate([{"$group": {"_id": "$status", "total": {"$sum": 1}}}])
+        }
+        pendentes = por_status.get("pendente", 0)
+        confirmados = por_status.get("confirmado", 0)
+        pagos = por_status.get("pago", 0)
 
         return {
             "success": True,
@@ -13,6 +13,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 import logging
 
+from stats_rollup import somar_por
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 
@@ -46,23 +48,27 @@ async def get_leads_stats(days: int = 30):
             
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Get leads from MongoDB
-        leads = await db['leads'].find({
-            'created_at': {'$gte': start_date.isoformat()}
-        }).to_list(length=None)
+        # Aggregate in MongoDB (totals by origin) instead of loading every lead
+        pipeline = [
+            {'$match': {'created_at': {'$gte': start_date.isoformat()}}},
+            {'$group': {
+                '_id': {'$ifNull': ['$origin', 'Unknown']},
+                'total': {'$sum': 1},
+                'converted': {'$sum': {'$cond': [{'$eq': ['$status', 'converted']}, 1, 0]}},
+                'revenue': {'$sum': {'$cond': [{'$eq': ['$status', 'converted']}, {'$ifNull': ['$service_value', 0]}, 0]}}
+            }}
+        ]
+        by_origin = await db['leads'].aggregate(pipeline).to_list(length=None)
         
         # Calculate statistics
-        total = len(leads)
-        converted = sum(1 for l in leads if l.get('status') == 'converted')
-        total_revenue = sum(l.get('service_value', 0) for l in leads if l.get('status') == 'converted')
+        total = sum(o['total'] for o in by_origin)
+        converted = sum(o['converted'] for o in by_origin)
+        total_revenue = sum(o['revenue'] for o in by_origin)
         avg_ticket = total_revenue / converted if converted > 0 else 0
         conversion_rate = (converted / total * 100) if total > 0 else 0
         
         # By origin
-        origins = {}
-        for lead in leads:
-            origin = lead.get('origin', 'Unknown')
-            origins[origin] = origins.get(origin, 0) + 1
+        origins = {o['_id']: o['total'] for o in by_origin}
         
         return {
             "success": True,
@@ -394,25 +400,17 @@ async def admin_dashboard(request: Request):
             })
         
         # Buscar estatísticas
-        total_conversas = await db.conversas.count_documents({})
+        total_conversas = await db.conversas.estimated_document_count()
         total_leads = await db.leads.count_documents({})
         total_documentos = await db.documentos.count_documents({})
         total_transferencias = await db.transferencias.count_documents({"status": "PENDENTE"})
 
-        # Conversas por canal (últimos 7 dias)
+        # Conversas por canal (últimos 7 dias, do rollup pré-agregado)
         date_limit = datetime.now() - timedelta(days=7)
-        conversas_whatsapp = await db.conversas.count_documents({
-            "canal": "WhatsApp",
-            "timestamp": {"$gte": date_limit}
-        })
-        conversas_instagram = await db.conversas.count_documents({
-            "canal": "Instagram",
-            "timestamp": {"$gte": date_limit}
-        })
-        conversas_webchat = await db.conversas.count_documents({
-            "canal": "WebChat",
-            "timestamp": {"$gte": date_limit}
-        })
+        por_canal = await somar_por("mensagens", "canal", date_limit)
+        conversas_whatsapp = por_canal.get("WhatsApp", 0)
+        conversas_instagram = por_canal.get("Instagram", 0)
+        conversas_webchat = por_canal.get("WebChat", 0)
 
         # Últimas conversas
         ultimas_conversas = await db.conversas.find().sort("timestamp", -1).limit(10).to_list(length=10)
@@ -688,7 +686,7 @@ async def api_stats():
             raise HTTPException(status_code=503, detail="MongoDB não disponível")
         
         stats = {
-            "total_conversas": await db.conversas.count_documents({}),
+            "total_conversas": await db.conversas.estimated_document_count(),
             "total_leads": await db.leads.count_documents({}),
             "total_documentos": await db.documentos.count_documents({}),
             "transferencias_pendentes": await db.transferencias.count_documents({"status": "PENDENTE"}),
@@ -50,6 +50,9 @@ def get_database():
 
 db = get_database()
 
+# Cache de prompts compilados (importado depois de `db`, que o training_cache usa)
+from training_cache import invalidar_treinamento
+
 # ============================================================
 # PÁGINA DE TREINAMENTO
 # ============================================================
@@ -57,6 +60,8 @@ db = get_database()
 @router.get("/", response_class=HTMLResponse)
 async def admin_treinamento(request: Request):
     """Página de treinamento da IA"""
+    # Importado aqui: response_router -> response_cache importa `db` deste modulo
+    from response_router import CONFIG_PADRAO as ROTEAMENTO_PADRAO, get_roteamento_stats
     try:
         # Buscar bot "Mia"
         bot = await db.bots.find_one({"name": "Mia"})
@@ -78,12 +83,15 @@ async def admin_treinamento(request: Request):
             result = await db.bots.insert_one(bot)
             bot["_id"] = result.inserted_id
             logger.info("✅ Bot Mia criado no MongoDB")
+            invalidar_treinamento("bot criado")
         
         return templates.TemplateResponse("admin_treinamento.html", {
             "request": request,
             "personalidade": bot.get("personality", {}),
             "conhecimentos": bot.get("knowledge_base", []),
-            "faqs": bot.get("faqs", [])
+            "faqs": bot.get("faqs", []),
+            "roteamento": {**ROTEAMENTO_PADRAO, **(bot.get("roteamento") or {})},
+            "roteamento_stats": get_roteamento_stats()
         })
     except Exception as e:
         logger.error(f"❌ Erro ao carregar página de treinamento: {e}")
@@ -126,6 +134,8 @@ async def salvar_personalidade(
         
         logger.info(f"✅ Personalidade atualizada! Delay: {response_delay}s")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -157,6 +167,8 @@ async def adicionar_conhecimento(
         
         logger.info(f"✅ Conhecimento adicionado: {title}")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -214,6 +226,8 @@ async def editar_conhecimento(
         
         logger.info(f"✅ Conhecimento editado: {title}")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -231,6 +245,8 @@ async def deletar_conhecimento(item_id: str):
         
         logger.info(f"✅ Conhecimento deletado: {item_id}")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -262,6 +278,8 @@ async def adicionar_faq(
         
         logger.info(f"✅ FAQ adicionado: {question}")  # CORRIGIDO: era 'pergunta'
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -319,6 +337,8 @@ async def editar_faq(
         
         logger.info(f"✅ FAQ editado: {question}")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
         
     except Exception as e:
@@ -336,12 +356,58 @@ async def deletar_faq(item_id: str):
         
         logger.info(f"✅ FAQ deletado: {item_id}")
         
+        invalidar_treinamento("admin")
+
         return RedirectResponse(url="/admin/treinamento", status_code=303)
 
     except Exception as e:
         logger.error(f"❌ Erro ao deletar FAQ: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================
+# ROTAS DE EDIÇÃO - ROTEAMENTO (camadas antes do GPT-4o)
+# ============================================================
+
+@router.post("/roteamento")
+async def salvar_roteamento(
+    habilitado: bool = Form(False),
+    deterministico: bool = Form(False),
+    faq: bool = Form(False),
+    faq_similaridade_min: float = Form(0.6),
+    cache: bool = Form(False),
+    modelo_pequeno: bool = Form(False),
+    modelo_pequeno_nome: str = Form("gpt-4o-mini")
+):
+    """Salvar configuracao do roteamento de respostas (response_router)"""
+    try:
+        await db.bots.update_one(
+            {"name": "Mia"},
+            {
+                "$set": {
+                    "roteamento": {
+                        "habilitado": habilitado,
+                        "deterministico": deterministico,
+                        "faq": faq,
+                        "faq_similaridade_min": min(max(faq_similaridade_min, 0.3), 1.0),
+                        "cache": cache,
+                        "modelo_pequeno": modelo_pequeno,
+                        "modelo_pequeno_nome": modelo_pequeno_nome.strip() or "gpt-4o-mini"
+                    },
+                    "updated_at": datetime.now()
+                }
+            }
+        )
+
+        logger.info(f"✅ Roteamento atualizado! Ativo: {habilitado}")
+
+        invalidar_treinamento("roteamento")
+
+        return RedirectResponse(url="/admin/treinamento", status_code=303)
+
+    except Exception as e:
+        logger.error(f"❌ Erro ao salvar roteamento: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 # ============================================================
 # ROTA DE CORRECAO - ADICIONAR IDs FALTANTES
@@ -390,6 +456,7 @@ async def corrigir_ids_faltantes():
                     }
                 }
             )
+            invalidar_treinamento("corrigir-ids")
 
         return JSONResponse({
             "success": True,
@@ -7,7 +7,7 @@ import os
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-import httpx
+from http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -48,26 +48,26 @@ class GoogleAdsAPI:
         if self.access_token and self.token_expiry and datetime.now() < self.token_expiry:
             return self.access_token
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.TOKEN_URL,
-                data={
-                    "client_id": GOOGLE_ADS_CLIENT_ID,
-                    "client_secret": GOOGLE_ADS_CLIENT_SECRET,
-                    "refresh_token": GOOGLE_ADS_REFRESH_TOKEN,
-                    "grant_type": "refresh_token"
-                }
-            )
+        client = get_http_client("google_ads")
+        response = await client.post(
+            self.TOKEN_URL,
+            data={
+                "client_id": GOOGLE_ADS_CLIENT_ID,
+                "client_secret": GOOGLE_ADS_CLIENT_SECRET,
+                "refresh_token": GOOGLE_ADS_REFRESH_TOKEN,
+                "grant_type": "refresh_token"
+            }
+        )
 
-            if response.status_code == 200:
-                data = response.json()
-                self.access_token = data["access_token"]
-                self.token_expiry = datetime.now() + timedelta(seconds=data.get("expires_in", 3600) - 60)
-                logger.info("[GOOGLE ADS] Access token refreshed successfully")
-                return self.access_token
-            else:
-                logger.error(f"[GOOGLE ADS] Failed to refresh token: {response.text}")
-                raise Exception(f"Failed to refresh Google Ads token: {response.text}")
+        if response.status_code == 200:
+            data = response.json()
+            self.access_token = data["access_token"]
+            self.token_expiry = datetime.now() + timedelta(seconds=data.get("expires_in", 3600) - 60)
+            logger.info("[GOOGLE ADS] Access token refreshed successfully")
+            return self.access_token
+        else:
+            logger.error(f"[GOOGLE ADS] Failed to refresh token: {response.text}")
+            raise Exception(f"Failed to refresh Google Ads token: {response.text}")
 
     async def get_campaigns(self, days: int = 30) -> List[Dict]:
         """Busca campanhas e metricas do Google Ads (2 etapas: campanhas + metricas)"""
@@ -99,95 +99,95 @@ class GoogleAdsAPI:
 
             campaigns_map = {}
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
+            client = get_http_client("google_ads")
+            response = await client.post(
+                url,
+                headers=headers,
+                json={"query": campaign_query}
+            )
+
+            if response.status_code == 200:
+                data = response.json()
+                logger.info(f"[GOOGLE ADS] Campaigns query response: {data}")
+
+                for result in data:
+                    if "results" in result:
+                        for row in result["results"]:
+                            campaign = row.get("campaign", {})
+                            camp_id = campaign.get("id", "")
+                            campaigns_map[camp_id] = {
+                                "id": camp_id,
+                                "name": campaign.get("name", ""),
+                                "status": campaign.get("status", "UNKNOWN"),
+                                "type": campaign.get("advertisingChannelType", ""),
+                                "impressions": 0,
+                                "clicks": 0,
+                                "cost": 0.0,
+                                "conversions": 0.0,
+                                "ctr": 0.0,
+                                "avg_cpc": 0.0,
+                                "platform": "Google Ads"
+                            }
+
+                logger.info(f"[GOOGLE ADS] Found {len(campaigns_map)} campaigns in step 1")
+            else:
+                logger.error(f"[GOOGLE ADS] Campaign query error: {response.status_code} - {response.text}")
+                return []
+
+            # Etapa 2: Buscar metricas com filtro de data (campanhas sem dados nao aparecem, mas ja temos a lista)
+            if campaigns_map:
+                end_date = datetime.now()
+                start_date = end_date - timedelta(days=days)
+
+                metrics_query = f"""
+                    SELECT
+                        campaign.id,
+                        metrics.impressions,
+                        metrics.clicks,
+                        metrics.cost_micros,
+                        metrics.conversions,
+                        metrics.ctr,
+                        metrics.average_cpc
+                    FROM campaign
+                    WHERE segments.date BETWEEN '{start_date.strftime('%Y-%m-%d')}' AND '{end_date.strftime('%Y-%m-%d')}'
+                """
+
+                metrics_response = await client.post(
                     url,
                     headers=headers,
-                    json={"query": campaign_query}
+                    json={"query": metrics_query}
                 )
 
-                if response.status_code == 200:
-                    data = response.json()
-                    logger.info(f"[GOOGLE ADS] Campaigns query response: {data}")
+                if metrics_response.status_code == 200:
+                    metrics_data = metrics_response.json()
+                    logger.info(f"[GOOGLE ADS] Metrics query response received")
 
-                    for result in data:
+                    for result in metrics_data:
                         if "results" in result:
                             for row in result["results"]:
                                 campaign = row.get("campaign", {})
+                                metrics = row.get("metrics", {})
                                 camp_id = campaign.get("id", "")
-                                campaigns_map[camp_id] = {
-                                    "id": camp_id,
-                                    "name": campaign.get("name", ""),
-                                    "status": campaign.get("status", "UNKNOWN"),
-                                    "type": campaign.get("advertisingChannelType", ""),
-                                    "impressions": 0,
-                                    "clicks": 0,
-                                    "cost": 0.0,
-                                    "conversions": 0.0,
-                                    "ctr": 0.0,
-                                    "avg_cpc": 0.0,
-                                    "platform": "Google Ads"
-                                }
-
-                    logger.info(f"[GOOGLE ADS] Found {len(campaigns_map)} campaigns in step 1")
+
+                                if camp_id in campaigns_map:
+                                    cost_micros = metrics.get("costMicros", 0)
+                                    cost = int(cost_micros) / 1_000_000 if cost_micros else 0
+
+                                    # Agregar metricas (soma por segmento de data)
+                                    campaigns_map[camp_id]["impressions"] += int(metrics.get("impressions", 0))
+                                    campaigns_map[camp_id]["clicks"] += int(metrics.get("clicks", 0))
+                                    campaigns_map[camp_id]["cost"] += cost
+                                    campaigns_map[camp_id]["conversions"] += float(metrics.get("conversions", 0))
+
+                    # Calcular CTR e CPC medio apos agregacao
+                    for camp in campaigns_map.values():
+                        if camp["impressions"] > 0:
+                            camp["ctr"] = round((camp["clicks"] / camp["impressions"]) * 100, 2)
+                        if camp["clicks"] > 0:
+                            camp["avg_cpc"] = round(camp["cost"] / camp["clicks"], 2)
+                        camp["cost"] = round(camp["cost"], 2)
                 else:
-                    logger.error(f"[GOOGLE ADS] Campaign query error: {response.status_code} - {response.text}")
-                    return []
-
-                # Etapa 2: Buscar metricas com filtro de data (campanhas sem dados nao aparecem, mas ja temos a lista)
-                if campaigns_map:
-                    end_date = datetime.now()
-                    start_date = end_date - timedelta(days=days)
-
-                    metrics_query = f"""
-                        SELECT
-                            campaign.id,
-                            metrics.impressions,
-                            metrics.clicks,
-                            metrics.cost_micros,
-                            metrics.conversions,
-                            metrics.ctr,
-                            metrics.average_cpc
-                        FROM campaign
-                        WHERE segments.date BETWEEN '{start_date.strftime('%Y-%m-%d')}' AND '{end_date.strftime('%Y-%m-%d')}'
-                    """
-
-                    metrics_response = await client.post(
-                        url,
-                        headers=headers,
-                        json={"query": metrics_query}
-                    )
-
-                    if metrics_response.status_code == 200:
-                        metrics_data = metrics_response.json()
-                        logger.info(f"[GOOGLE ADS] Metrics query response received")
-
-                        for result in metrics_data:
-                            if "results" in result:
-                                for row in result["results"]:
-                                    campaign = row.get("campaign", {})
-                                    metrics = row.get("metrics", {})
-                                    camp_id = campaign.get("id", "")
-
-                                    if camp_id in campaigns_map:
-                                        cost_micros = metrics.get("costMicros", 0)
-                                        cost = int(cost_micros) / 1_000_000 if cost_micros else 0
-
-                                        # Agregar metricas (soma por segmento de data)
-                                        campaigns_map[camp_id]["impressions"] += int(metrics.get("impressions", 0))
-                                        campaigns_map[camp_id]["clicks"] += int(metrics.get("clicks", 0))
-                                        campaigns_map[camp_id]["cost"] += cost
-                                        campaigns_map[camp_id]["conversions"] += float(metrics.get("conversions", 0))
-
-                        # Calcular CTR e CPC medio apos agregacao
-                        for camp in campaigns_map.values():
-                            if camp["impressions"] > 0:
-                                camp["ctr"] = round((camp["clicks"] / camp["impressions"]) * 100, 2)
-                            if camp["clicks"] > 0:
-                                camp["avg_cpc"] = round(camp["cost"] / camp["clicks"], 2)
-                            camp["cost"] = round(camp["cost"], 2)
-                    else:
-                        logger.warning(f"[GOOGLE ADS] Metrics query error: {metrics_response.status_code} - campaigns will show 0 metrics")
+                    logger.warning(f"[GOOGLE ADS] Metrics query error: {metrics_response.status_code} - campaigns will show 0 metrics")
 
             campaigns = list(campaigns_map.values())
             logger.info(f"[GOOGLE ADS] Fetched {len(campaigns)} campaigns total")
@@ -233,56 +233,56 @@ class MetaAdsAPI:
                 "limit": 100
             }
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
-
-                if response.status_code != 200:
-                    logger.error(f"[META ADS] Failed to fetch campaigns: {response.text}")
-                    return []
-
-                campaigns_data = response.json().get("data", [])
-                campaigns = []
-
-                for camp in campaigns_data:
-                    # Buscar insights (metricas) para cada campanha
-                    insights_url = f"{self.BASE_URL}/{camp['id']}/insights"
-                    insights_params = {
-                        "access_token": META_ACCESS_TOKEN,
-                        "fields": "impressions,clicks,spend,actions,ctr,cpc",
-                        "time_range": f'{{"since":"{start_date.strftime("%Y-%m-%d")}","until":"{end_date.strftime("%Y-%m-%d")}"}}'
-                    }
-
-                    insights_response = await client.get(insights_url, params=insights_params)
-
-                    metrics = {}
-                    if insights_response.status_code == 200:
-                        insights_data = insights_response.json().get("data", [])
-                        if insights_data:
-                            metrics = insights_data[0]
-
-                    # Extrair conversoes das actions
-                    conversions = 0
-                    actions = metrics.get("actions", [])
-                    for action in actions:
-                        if action.get("action_type") in ["lead", "purchase", "complete_registration"]:
-                            conversions += int(action.get("value", 0))
-
-                    campaigns.append({
-                        "id": camp.get("id", ""),
-                        "name": camp.get("name", ""),
-                        "status": camp.get("status", "UNKNOWN"),
-                        "type": camp.get("objective", ""),
-                        "impressions": int(metrics.get("impressions", 0)),
-                        "clicks": int(metrics.get("clicks", 0)),
-                        "cost": round(float(metrics.get("spend", 0)), 2),
-                        "conversions": conversions,
-                        "ctr": round(float(metrics.get("ctr", 0)), 2),
-                        "avg_cpc": round(float(metrics.get("cpc", 0)), 2),
-                        "platform": "Meta Ads"
-                    })
-
-                logger.info(f"[META ADS] Fetched {len(campaigns)} campaigns")
-                return campaigns
+            client = get_http_client("meta_ads")
+            response = await client.get(url, params=params)
+
+            if response.status_code != 200:
+                logger.error(f"[META ADS] Failed to fetch campaigns: {response.text}")
+                return []
+
+            campaigns_data = response.json().get("data", [])
+            campaigns = []
+
+            for camp in campaigns_data:
+                # Buscar insights (metricas) para cada campanha
+                insights_url = f"{self.BASE_URL}/{camp['id']}/insights"
+                insights_params = {
+                    "access_token": META_ACCESS_TOKEN,
+                    "fields": "impressions,clicks,spend,actions,ctr,cpc",
+                    "time_range": f'{{"since":"{start_date.strftime("%Y-%m-%d")}","until":"{end_date.strftime("%Y-%m-%d")}"}}'
+                }
+
+                insights_response = await client.get(insights_url, params=insights_params)
+
+                metrics = {}
+                if insights_response.status_code == 200:
+                    insights_data = insights_response.json().get("data", [])
+                    if insights_data:
+                        metrics = insights_data[0]
+
+                # Extrair conversoes das actions
+                conversions = 0
+                actions = metrics.get("actions", [])
+                for action in actions:
+                    if action.get("action_type") in ["lead", "purchase", "complete_registration"]:
+                        conversions += int(action.get("value", 0))
+
+                campaigns.append({
+                    "id": camp.get("id", ""),
+                    "name": camp.get("name", ""),
+                    "status": camp.get("status", "UNKNOWN"),
+                    "type": camp.get("objective", ""),
+                    "impressions": int(metrics.get("impressions", 0)),
+                    "clicks": int(metrics.get("clicks", 0)),
+                    "cost": round(float(metrics.get("spend", 0)), 2),
+                    "conversions": conversions,
+                    "ctr": round(float(metrics.get("ctr", 0)), 2),
+                    "avg_cpc": round(float(metrics.get("cpc", 0)), 2),
+                    "platform": "Meta Ads"
+                })
+
+            logger.info(f"[META ADS] Fetched {len(campaigns)} campaigns")
+            return campaigns
 
         except Exception as e:
             logger.error(f"[META ADS] Exception: {str(e)}")
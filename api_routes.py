@@ -25,9 +25,10 @@ import logging
 from google_drive import (
     save_whatsapp_media_to_drive,
     is_drive_enabled,
-    get_client_folder,
+    get_client_folder_async,
     get_folder_link
 )
+from stats_rollup import registrar_orcamento
 
 logger = logging.getLogger(__name__)
 
@@ -121,7 +122,7 @@ async def create_project(request: Request):
     # Vincular pasta do Google Drive se existir
     if is_drive_enabled() and phone:
         try:
-            folder_id = get_client_folder(phone, nome)
+            folder_id = await get_client_folder_async(phone, nome)
             if folder_id:
                 orcamento["google_drive_folder"] = get_folder_link(folder_id)
                 orcamento["google_drive_folder_id"] = folder_id
@@ -130,6 +131,7 @@ async def create_project(request: Request):
 
     result = await db.orcamentos.insert_one(orcamento)
     orcamento_id = str(result.inserted_id)
+    await registrar_orcamento(orcamento)
 
     logger.info(f"[API] Projeto criado: {orcamento_id} para {phone} ({nome})")
 
@@ -0,0 +1,222 @@
+"""
+Benchmark do intent_engine contra os detectores antigos (um lower() e uma
+varredura por detector, um re.search por palavra no de atendente humano).
+Tambem confere se os dois lados concordam em cada intencao: "novos" sao
+deteccoes que so o motor tem - acento, alongamento e erro de digitacao,
+mas podem ser falsos positivos, entao devem ser conferidos. Os casos de
+CORPUS_NEGATIVO (palavras reais a uma letra de um termo) nao podem
+disparar as intencoes listadas.
+
+Execute: python bench_intents.py              (corpus de exemplo embutido)
+         python bench_intents.py --mongo 5000 (ultimas N mensagens de clientes em conversas)
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import unicodedata
+from typing import Dict, List
+
+from intent_engine import INTENCOES, analisar
+
+# Mensagens reais (anonimizadas) de clientes no WhatsApp
+CORPUS_EXEMPLO = [
+    "Olá, bom dia! Gostaria de um orçamento para tradução de certidão de nascimento",
+    "quanto fica pra traduzir meu diploma?",
+    "Hi, I need a certified translation of my birth certificate, how much?",
+    "Hola, necesito traducir mi título universitario, cuánto cuesta?",
+    "Quero falar com um atendente por favor",
+    "vc nao entende o que eu to falando",
+    "O pessoal do consulado pediu a tradução juramentada",
+    "achei caro, tem como fazer um desconto?",
+    "vou pensar e te aviso",
+    "ok pode seguir",
+    "sim",
+    "Paguei agora pelo zelle, segue o comprovante",
+    "fiz o pix de R$ 150",
+    "ainda não recebi a tradução, poderia verificar se foi enviada?",
+    "where is my translation? I paid yesterday",
+    "Is it ready?",
+    "Beatriz me atendeu da outra vez, pode passar pra ela?",
+    "perfeito, obrigada!",
+    "São 3 páginas, frente e verso",
+    "preciso para o USCIS até sexta",
+    "ALERT: Query Targeting: Scanned Objects / Returned has gone above 1000",
+    "[SYSTEM] cluster0 restarted",
+    "too expensive, any discount?",
+    "Let me think about it, I'm comparing prices",
+    "dale, hagámoslo",
+    "vamos fechar então",
+    "Boa tarde, tudo bem? Vocês traduzem histórico escolar?",
+    "thanks! sending payment now",
+    "mandei a foto, consegue ver?",
+    "meu nome é Carlos",
+    # Sem acento, alongamentos e erros de digitacao
+    "NÃOOO ENTENDE 😡",
+    "quero um atendnte",
+    "siiiiim pode sim",
+    "tem descotno?",
+    "cade a traduçao??",
+    "let’s do it 👍",
+]
+
+# Palavras comuns a uma letra de distancia de termos: a correcao de
+# digitacao nao pode transforma-las em intencoes
+CORPUS_NEGATIVO = {
+    "vou pegar os documentos amanha": ("confirmacao",),
+    "estou perto do consulado": ("confirmacao", "ok"),
+    "o nome tem acento no e": ("confirmacao",),
+    "he thinks it's fine": ("agradecimento",),
+    "o documento e caro pra mim": ("confirmacao", "ok"),
+    "fala com o meu marido": ("humano",),
+    "a pessoal do cartorio": ("humano",),
+    "ainda estamos combinando com a escola": ("ok",),
+}
+
+
+# ============================================================
+# DETECTORES ANTIGOS (mesmas listas, algoritmo anterior)
+# ============================================================
+# As listas antigas repetiam cada termo com e sem acento; a tabela nova
+# so tem a forma sem acento, entao aqui o texto perde os acentos antes
+def _minusculas(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _legado_contem(intencao: str, texto: str) -> bool:
+    texto_lower = _minusculas(texto)
+    return any(termo in texto_lower for termo in INTENCOES[intencao]["termos"])
+
+
+def _legado_humano(texto: str) -> bool:
+    texto_lower = _minusculas(texto)
+    for palavra in INTENCOES["humano"]["termos"]:
+        if re.search(r'\b' + re.escape(palavra) + r'\b', texto_lower):
+            return True
+    return False
+
+
+def _legado_sistema(texto: str) -> bool:
+    for pattern in INTENCOES["sistema"]["termos"]:
+        if re.search(pattern, texto, re.IGNORECASE):
+            return True
+    return False
+
+
+def legado(texto: str) -> Dict[str, object]:
+    """Um turno com os detectores antigos"""
+    return {
+        "sistema": _legado_sistema(texto),
+        "humano": _legado_humano(texto),
+        "desconto": _legado_contem("desconto", texto),
+        "followup_traducao": _legado_contem("followup_traducao", texto),
+        "confirmacao": _legado_contem("confirmacao", texto),
+        "comprovante": _legado_contem("comprovante", texto),
+        "indecisao": _legado_contem("indecisao", texto),
+        "conversao": _legado_contem("conversao", texto),
+    }
+
+
+def motor(texto: str) -> Dict[str, object]:
+    """Um turno com o intent_engine (uma varredura, reaproveitada pelos detectores)"""
+    encontradas = analisar(texto)
+    return {
+        nome: nome in encontradas
+        for nome in ("sistema", "humano", "desconto", "followup_traducao",
+                     "confirmacao", "comprovante", "indecisao", "conversao")
+    }
+
+
+# ============================================================
+# CORPUS E MEDICAO
+# ============================================================
+async def carregar_corpus_mongo(limite: int) -> List[str]:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URI") or os.getenv("MONGODB_URL"))
+    db = client.get_database()
+    cursor = db.conversas.find(
+        {"role": "user", "message": {"$type": "string"}}, {"message": 1}
+    ).sort("timestamp", -1).limit(limite)
+    return [doc["message"] async for doc in cursor if doc["message"].strip()]
+
+
+def medir(funcao, corpus: List[str], repeticoes: int) -> float:
+    """Microssegundos por mensagem"""
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for texto in corpus:
+            funcao(texto)
+    return (time.perf_counter() - inicio) / (repeticoes * len(corpus)) * 1e6
+
+
+def main():
+    if "--mongo" in sys.argv:
+        posicao = sys.argv.index("--mongo")
+        limite = int(sys.argv[posicao + 1]) if len(sys.argv) > posicao + 1 else 5000
+        corpus = asyncio.run(carregar_corpus_mongo(limite))
+        origem = f"MongoDB ({len(corpus)} mensagens)"
+    else:
+        corpus = CORPUS_EXEMPLO
+        origem = f"corpus de exemplo ({len(corpus)} mensagens)"
+
+    if not corpus:
+        print("Corpus vazio")
+        return
+
+    repeticoes = max(1, 20000 // len(corpus))
+    print(f"Corpus: {origem}, {repeticoes} repeticoes\n")
+
+    us_legado = medir(legado, corpus, repeticoes)
+
+    # Sem cache: cada mensagem varrida de novo (pior caso do motor)
+    analisar.cache_clear()
+    us_motor_frio = medir(lambda t: (analisar.cache_clear(), motor(t)), corpus, repeticoes)
+
+    # Com cache: varios detectores do mesmo turno sobre o mesmo texto
+    analisar.cache_clear()
+    us_motor = medir(motor, corpus, repeticoes)
+
+    print(f"{'detectores antigos':<28}{us_legado:>10.1f} us/mensagem")
+    print(f"{'intent_engine (sem cache)':<28}{us_motor_frio:>10.1f} us/mensagem  ({us_legado / us_motor_frio:.1f}x)")
+    print(f"{'intent_engine (com cache)':<28}{us_motor:>10.1f} us/mensagem  ({us_legado / us_motor:.1f}x)")
+
+    # Concordancia por intencao
+    analisar.cache_clear()
+    divergencias: Dict[str, List[str]] = {}
+    for texto in corpus:
+        antigo, novo = legado(texto), motor(texto)
+        for nome, valor in antigo.items():
+            if novo[nome] != valor:
+                divergencias.setdefault(nome, []).append(texto)
+
+    print("\nConcordancia com os detectores antigos:")
+    for nome in legado(corpus[0]).keys():
+        textos = divergencias.get(nome, [])
+        novos = [t for t in textos if motor(t)[nome] is True]
+        perdidos = [t for t in textos if t not in novos]
+        print(f"  {nome:<20}{(1 - len(textos) / len(corpus)) * 100:>7.1f}%   novos: {len(novos):<4} perdidos: {len(perdidos)}")
+        for texto in perdidos[:3]:
+            print(f"      perdido: {texto[:70]!r}")
+        for texto in novos[:3]:
+            print(f"      novo:    {texto[:70]!r}")
+
+    # Falsos positivos conhecidos
+    analisar.cache_clear()
+    falhas = [
+        (texto, nome)
+        for texto, proibidas in CORPUS_NEGATIVO.items()
+        for nome in proibidas if nome in analisar(texto)
+    ]
+    print(f"\nCasos negativos: {len(CORPUS_NEGATIVO) - len({t for t, _ in falhas})}/{len(CORPUS_NEGATIVO)} sem falso positivo")
+    for texto, nome in falhas:
+        print(f"      falso positivo ({nome}): {texto!r}")
+
+
+if __name__ == "__main__":
+    main()
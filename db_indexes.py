@@ -0,0 +1,243 @@
+"""
+============================================================
+INDICES DO MONGODB - Declaracao central + auditoria
+============================================================
+Todas as colecoes quentes (conversas, cliente_estados,
+crm_contacts, conversoes, orcamentos...) tem seus indices
+declarados aqui e criados no startup. create_indexes e
+idempotente: indices que ja existem com a mesma especificacao
+sao ignorados pelo Mongo.
+
+A auditoria roda explain() nas consultas conhecidas do projeto
+e aponta as que ainda fazem COLLSCAN (varredura da colecao) ou
+ordenacao em memoria.
+============================================================
+"""
+
+import logging
+from typing import Dict, List, Any
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# INDICES DECLARADOS POR COLECAO
+# ============================================================
+INDICES: Dict[str, List[IndexModel]] = {
+    "conversas": [
+        IndexModel([("phone", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("role", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("mode", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("phone_key", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "cliente_estados": [
+        # phone+versao: conferencia de versao do estado_cache sem ler o documento
+        IndexModel([("phone", ASCENDING), ("versao", ASCENDING)]),
+        IndexModel([("phone_key", ASCENDING)]),
+    ],
+    "crm_contacts": [
+        IndexModel([("phone", ASCENDING)]),
+        IndexModel([("phone_key", ASCENDING)]),
+        IndexModel([("last_contact", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("last_contact", DESCENDING)]),
+    ],
+    "conversoes": [
+        IndexModel([("timestamp", DESCENDING)]),
+    ],
+    "orcamentos": [
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("phone", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "transferencias": [
+        IndexModel([("status", ASCENDING)]),
+    ],
+    "leads_followup": [
+        IndexModel([("phone", ASCENDING)]),
+    ],
+    "webchat_conversas": [
+        IndexModel([("session_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "portal_orders": [
+        IndexModel([("phone", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("order_id", ASCENDING)]),
+        # Uma execucao do pipeline por (telefone, documento): retentativas nao criam outro pedido
+        IndexModel(
+            [("chave_idempotencia", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"chave_idempotencia": {"$type": "string"}}
+        ),
+    ],
+    "documentos_vistos": [
+        IndexModel([("phone_key", ASCENDING), ("sha256", ASCENDING)], unique=True),
+        IndexModel([("phone_key", ASCENDING), ("visto_em", DESCENDING)]),
+        # Documento sem reenvio por 120 dias e esquecido
+        IndexModel([("visto_em", ASCENDING)], expireAfterSeconds=120 * 24 * 3600),
+    ],
+    "drive_pastas": [
+        IndexModel([("parent_id", ASCENDING), ("atualizado_em", ASCENDING)]),
+    ],
+    "visao_cache": [
+        IndexModel([("tarefa", ASCENDING)]),
+        # Resultado de Vision expira na data gravada em expira_em
+        IndexModel([("expira_em", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "respostas_cache": [
+        # Entradas da versao atual do treinamento, mais usadas primeiro
+        IndexModel([("versao_treinamento", ASCENDING), ("hits", DESCENDING)]),
+        IndexModel([("expira_em", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "sistema": [
+        IndexModel([("key", ASCENDING)]),
+    ],
+    "stats_rollup": [
+        # Um documento por hora x canal x role x mode (upserts concorrentes nao duplicam)
+        IndexModel(
+            [("tipo", ASCENDING), ("inicio", ASCENDING), ("canal", ASCENDING), ("role", ASCENDING), ("mode", ASCENDING)],
+            unique=True
+        ),
+    ],
+    "webhook_jobs": [
+        IndexModel(
+            [("message_id", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"message_id": {"$type": "string", "$gt": ""}}
+        ),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("updated_at", DESCENDING)]),
+        # Jobs concluidos expiram sozinhos depois de 7 dias
+        IndexModel(
+            [("finished_at", ASCENDING)],
+            expireAfterSeconds=7 * 24 * 3600,
+            partialFilterExpression={"status": "done"}
+        ),
+    ],
+}
+
+# ============================================================
+# CONSULTAS CONHECIDAS (para auditoria com explain)
+# ============================================================
+# Valores de exemplo: o plano depende do formato da consulta, nao do valor
+_PHONE = "5511999999999"
+CONSULTAS_CONHECIDAS: List[Dict[str, Any]] = [
+    {"nome": "contexto da conversa", "colecao": "conversas",
+     "filtro": {"phone": _PHONE}, "sort": {"timestamp": -1}, "limit": 10},
+    {"nome": "conversas por phone_key", "colecao": "conversas",
+     "filtro": {"phone_key": _PHONE[-10:]}, "sort": {"timestamp": -1}, "limit": 100},
+    {"nome": "ultima mensagem do cliente por phone_key", "colecao": "conversas",
+     "filtro": {"role": "user", "phone_key": _PHONE[-10:]}, "sort": {"timestamp": -1}, "limit": 1},
+    {"nome": "mensagens do dia", "colecao": "conversas",
+     "filtro": {"timestamp": {"$gte": "__DATA__"}}},
+    {"nome": "respostas da IA no periodo", "colecao": "conversas",
+     "filtro": {"role": "assistant", "timestamp": {"$gte": "__DATA__"}}},
+    {"nome": "conversas em modo humano", "colecao": "conversas",
+     "filtro": {"mode": "human", "timestamp": {"$gte": "__DATA__"}}},
+    {"nome": "ultimas conversas", "colecao": "conversas",
+     "filtro": {}, "sort": {"timestamp": -1}, "limit": 30},
+    {"nome": "estado do cliente", "colecao": "cliente_estados",
+     "filtro": {"phone": _PHONE}, "limit": 1},
+    {"nome": "contato CRM por telefone", "colecao": "crm_contacts",
+     "filtro": {"phone": _PHONE}, "limit": 1},
+    {"nome": "contato CRM por phone_key", "colecao": "crm_contacts",
+     "filtro": {"phone_key": _PHONE[-10:]}, "limit": 1},
+    {"nome": "lista CRM por status", "colecao": "crm_contacts",
+     "filtro": {"status": "novo"}, "sort": {"last_contact": -1}, "limit": 50},
+    {"nome": "conversoes do periodo", "colecao": "conversoes",
+     "filtro": {"timestamp": {"$gte": "__DATA__"}}, "sort": {"timestamp": -1}},
+    {"nome": "orcamentos recentes", "colecao": "orcamentos",
+     "filtro": {}, "sort": {"created_at": -1}, "limit": 500},
+    {"nome": "orcamentos por status", "colecao": "orcamentos",
+     "filtro": {"status": "pendente"}, "sort": {"created_at": -1}},
+    {"nome": "transferencias pendentes", "colecao": "transferencias",
+     "filtro": {"status": "PENDENTE"}},
+    {"nome": "historico webchat", "colecao": "webchat_conversas",
+     "filtro": {"session_id": "sessao"}, "sort": {"timestamp": -1}, "limit": 10},
+    {"nome": "rollup de mensagens do periodo", "colecao": "stats_rollup",
+     "filtro": {"tipo": "mensagens", "inicio": {"$gte": "__DATA__"}}},
+    {"nome": "documento ja visto por SHA", "colecao": "documentos_vistos",
+     "filtro": {"phone_key": _PHONE[-10:], "sha256": "0" * 64}, "limit": 1},
+    {"nome": "candidatos por dHash", "colecao": "documentos_vistos",
+     "filtro": {"phone_key": _PHONE[-10:], "dhash": {"$type": "string"}}, "sort": {"visto_em": -1}, "limit": 200},
+    {"nome": "resultado de Vision em cache", "colecao": "visao_cache",
+     "filtro": {"_id": "0" * 64 + ":analise_documento:000000000000", "expira_em": {"$gt": "__DATA__"}}, "limit": 1},
+    {"nome": "respostas em cache da versao do treinamento", "colecao": "respostas_cache",
+     "filtro": {"versao_treinamento": "000000000000", "expira_em": {"$gt": "__DATA__"}},
+     "sort": {"hits": -1}, "limit": 2000},
+    {"nome": "jobs da fila por status", "colecao": "webhook_jobs",
+     "filtro": {"status": "dead"}, "sort": {"updated_at": -1}, "limit": 100},
+]
+
+
+async def garantir_indices(db) -> Dict[str, Any]:
+    """Cria os indices declarados (idempotente). Retorna o resultado por colecao."""
+    resultado = {}
+    for colecao, indices in INDICES.items():
+        try:
+            nomes = await db[colecao].create_indexes(indices)
+            resultado[colecao] = {"ok": True, "indices": nomes}
+        except Exception as e:
+            # Ex: indice com mesmo nome e opcoes diferentes - nao bloquear o startup
+            resultado[colecao] = {"ok": False, "erro": str(e)}
+            logger.error(f"[INDICES] Erro ao criar indices de '{colecao}': {e}")
+
+    total_ok = sum(1 for r in resultado.values() if r["ok"])
+    logger.info(f"[INDICES] Indices verificados em {total_ok}/{len(INDICES)} colecoes")
+    return resultado
+
+
+def _estagios(plano: Dict[str, Any]) -> List[str]:
+    """Lista todos os estagios de um plano de execucao (arvore inputStage/inputStages)"""
+    estagios = [plano.get("stage", "")]
+    if "inputStage" in plano:
+        estagios += _estagios(plano["inputStage"])
+    for filho in plano.get("inputStages", []):
+        estagios += _estagios(filho)
+    # Planos do SBE (Mongo 5+) ficam dentro de queryPlan
+    if "queryPlan" in plano:
+        estagios += _estagios(plano["queryPlan"])
+    return estagios
+
+
+def _resolver_datas(valor: Any, data) -> Any:
+    """Troca o marcador "__DATA__" dos filtros de exemplo por uma data real"""
+    if valor == "__DATA__":
+        return data
+    if isinstance(valor, dict):
+        return {k: _resolver_datas(v, data) for k, v in valor.items()}
+    return valor
+
+
+async def auditar_consultas(db) -> List[Dict[str, Any]]:
+    """Roda explain() nas consultas conhecidas e marca COLLSCAN / SORT em memoria"""
+    from datetime import datetime, timedelta
+    data_exemplo = datetime.now() - timedelta(days=1)
+
+    relatorio = []
+    for consulta in CONSULTAS_CONHECIDAS:
+        filtro = _resolver_datas(consulta["filtro"], data_exemplo)
+        comando = {"find": consulta["colecao"], "filter": filtro}
+        if consulta.get("sort"):
+            comando["sort"] = consulta["sort"]
+        if consulta.get("limit"):
+            comando["limit"] = consulta["limit"]
+
+        item = {"nome": consulta["nome"], "colecao": consulta["colecao"], "filtro": consulta["filtro"]}
+        try:
+            explain = await db.command("explain", comando, verbosity="queryPlanner")
+            plano = explain.get("queryPlanner", {}).get("winningPlan", {})
+            estagios = _estagios(plano)
+            item["estagios"] = estagios
+            item["collscan"] = "COLLSCAN" in estagios
+            item["sort_em_memoria"] = "SORT" in estagios
+            item["ok"] = not item["collscan"] and not item["sort_em_memoria"]
+        except Exception as e:
+            item["erro"] = str(e)
+            item["ok"] = False
+        relatorio.append(item)
+
+    problemas = [r["nome"] for r in relatorio if not r["ok"]]
+    if problemas:
+        logger.warning(f"[INDICES] Consultas sem indice adequado: {problemas}")
+    return relatorio
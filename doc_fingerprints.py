@@ -0,0 +1,160 @@
+"""
+============================================================
+DOCUMENTOS JA VISTOS - Indice de SHA-256 + dHash por telefone
+============================================================
+A deduplicacao por URL da Z-API so pega o mesmo webhook repetido
+em ~30s. Quando o cliente reenvia a mesma foto ou PDF dias depois,
+o bot chamava Vision de novo, criava outro pedido no Portal
+(processar_documento_para_portal) e subia outra copia no Drive.
+
+Cada documento recebido e registrado na colecao
+`documentos_vistos`, por phone_key:
+
+- sha256: identidade exata dos bytes (mesmo PDF/foto reenviado)
+- dhash:  hash perceptual de 256 bits das imagens (mesma foto
+  recomprimida pelo WhatsApp, reescalada ou com outro EXIF);
+  duas imagens sao a mesma se a distancia de Hamming for pequena.
+  Paginas de texto parecidas podem colidir, entao o dHash so vale
+  para reaproveitar analise/pedido; o Drive exige SHA igual
+- analise / analise_pdf: resultado de Vision ja obtido
+- order_id / order_code: pedido do Portal criado para ele
+- google_drive: resultado do upload no Drive
+
+Antes de chamar Vision, criar pedido ou subir no Drive, o fluxo
+consulta o indice e reaproveita o que ja existe. Registros sem uso
+por 120 dias expiram (indice TTL em db_indexes).
+
+Configuracao:
+  - DOC_DHASH_DISTANCIA_MAX: bits diferentes (de 256) para considerar a mesma imagem (padrao 12)
+============================================================
+"""
+
+import os
+import asyncio
+import logging
+from io import BytesIO
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+from pymongo import ReturnDocument
+
+from admin_training_routes import db
+from phone_keys import phone_key
+from media_store import obter_artefato, obter_mime
+
+logger = logging.getLogger(__name__)
+
+DOC_DHASH_DISTANCIA_MAX = int(os.getenv("DOC_DHASH_DISTANCIA_MAX", "12"))
+
+# Miniatura do dHash: (LADO + 1) x LADO pixels -> LADO * LADO bits
+LADO_DHASH = 16
+
+# Candidatos por dHash avaliados por telefone (mais recentes)
+LIMITE_CANDIDATOS = 200
+
+_stats: Dict[str, int] = {"consultas": 0, "iguais_sha": 0, "parecidos_dhash": 0, "registrados": 0, "erros": 0}
+
+
+def calcular_dhash(dados: bytes) -> Optional[str]:
+    """dHash de 256 bits (hex): compara o brilho de pixels vizinhos numa miniatura 17x16"""
+    try:
+        from PIL import Image, ImageOps
+        imagem = ImageOps.exif_transpose(Image.open(BytesIO(dados)))
+        largura = LADO_DHASH + 1
+        pixels = list(imagem.convert("L").resize((largura, LADO_DHASH), Image.LANCZOS).getdata())
+        valor = 0
+        for linha in range(LADO_DHASH):
+            for coluna in range(LADO_DHASH):
+                valor = (valor << 1) | (pixels[linha * largura + coluna] > pixels[linha * largura + coluna + 1])
+        return f"{valor:0{LADO_DHASH * LADO_DHASH // 4}x}"
+    except Exception as e:
+        logger.warning(f"[DOC-VISTO] Nao foi possivel calcular dHash: {e}")
+        return None
+
+
+def distancia(dhash_a: str, dhash_b: str) -> int:
+    """Distancia de Hamming entre dois dHash"""
+    return bin(int(dhash_a, 16) ^ int(dhash_b, 16)).count("1")
+
+
+async def _dhash(midia_id: str) -> Optional[str]:
+    """dHash da midia (so imagens), calculado uma vez por midia"""
+    if not obter_mime(midia_id).startswith("image/"):
+        return None
+    dhash = await obter_artefato(midia_id, "dhash", lambda dados: asyncio.to_thread(calcular_dhash, dados))
+    return dhash or None
+
+
+async def buscar_documento(phone: str, midia_id: str, parecidos: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Registro de um documento igual (SHA) ou, com parecidos=True, parecido
+    (dHash) ja enviado pelo telefone. None se e a primeira vez.
+    """
+    _stats["consultas"] += 1
+    chave = phone_key(phone)
+    try:
+        doc = await db.documentos_vistos.find_one({"phone_key": chave, "sha256": midia_id})
+        if doc:
+            _stats["iguais_sha"] += 1
+            return doc
+        if not parecidos:
+            return None
+
+        dhash = await _dhash(midia_id)
+        if not dhash:
+            return None
+
+        candidatos = db.documentos_vistos.find(
+            {"phone_key": chave, "dhash": {"$type": "string"}}, {"_id": 1, "dhash": 1, "criado_em": 1}
+        ).sort("visto_em", -1).limit(LIMITE_CANDIDATOS)
+        melhor, melhor_distancia = None, DOC_DHASH_DISTANCIA_MAX + 1
+        async for candidato in candidatos:
+            d = distancia(dhash, candidato["dhash"])
+            if d < melhor_distancia:
+                melhor, melhor_distancia = candidato, d
+        if melhor is None:
+            return None
+        _stats["parecidos_dhash"] += 1
+        logger.info(f"[DOC-VISTO] {phone}: imagem parecida com documento de {melhor.get('criado_em')} (distancia {melhor_distancia})")
+        return await db.documentos_vistos.find_one({"_id": melhor["_id"]})
+
+    except Exception as e:
+        _stats["erros"] += 1
+        logger.error(f"[DOC-VISTO] Erro ao buscar documento de {phone}: {e}")
+        return None
+
+
+async def registrar_documento(phone: str, midia_id: str, registro: Optional[Dict[str, Any]] = None, **campos) -> Optional[Dict[str, Any]]:
+    """
+    Grava campos (analise, order_code, google_drive...) no registro do documento.
+    `registro` e o resultado de buscar_documento: quando a midia e uma copia
+    parecida, os campos vao para o registro original.
+    """
+    try:
+        agora = datetime.now()
+        filtro = {"_id": registro["_id"]} if registro else {"phone_key": phone_key(phone), "sha256": midia_id}
+        update: Dict[str, Any] = {"$set": {**campos, "visto_em": agora}}
+        if not registro:
+            update["$setOnInsert"] = {
+                "phone": phone,
+                "mime": obter_mime(midia_id),
+                "dhash": await _dhash(midia_id),
+                "criado_em": agora
+            }
+        doc = await db.documentos_vistos.find_one_and_update(
+            filtro, update, upsert=registro is None, return_document=ReturnDocument.AFTER
+        )
+        _stats["registrados"] += 1
+        return doc
+    except Exception as e:
+        _stats["erros"] += 1
+        logger.error(f"[DOC-VISTO] Erro ao registrar documento de {phone}: {e}")
+        return None
+
+
+def get_doc_fingerprint_stats() -> Dict[str, Any]:
+    """Metricas do indice (para endpoints de debug/admin)"""
+    return {
+        "distancia_max": DOC_DHASH_DISTANCIA_MAX,
+        **_stats
+    }
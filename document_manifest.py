@@ -0,0 +1,144 @@
+"""
+============================================================
+MANIFESTO DO DOCUMENTO - Analise de todas as paginas do lote
+============================================================
+O orcamento de um lote de imagens era feito olhando so a
+primeira imagem e multiplicando pela quantidade recebida. Um
+lote misto (certidao de nascimento + diploma, ou paginas em
+idiomas diferentes) saia com tipo e idioma errados.
+
+Agora cada imagem do lote e classificada (em paralelo, com
+limite de concorrencia - a latencia total fica perto de uma
+chamada) e os resultados viram um manifesto:
+
+{
+    "documentos": [
+        {"tipo", "idioma_origem", "idioma_destino", "paginas", "imagens": [1, 2]}
+    ],
+    "total_pages": paginas reais (soma das paginas estimadas por imagem),
+    "tipo": "certidao de nascimento + diploma",
+    "idioma_origem": "portugues",
+    "idioma_destino": destino mais pedido,
+    "descricao": descricoes curtas das paginas
+}
+
+O manifesto e gravado em documento_info e usado pelo
+gerar_orcamento_final.
+
+Configuracao:
+  - DOC_ANALISE_CONCORRENCIA: paginas analisadas ao mesmo tempo (padrao 4)
+============================================================
+"""
+
+import os
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+DOC_ANALISE_CONCORRENCIA = int(os.getenv("DOC_ANALISE_CONCORRENCIA", "4"))
+
+
+async def analisar_paginas(
+    midias: List[str],
+    analisar: Callable[[str], Awaitable[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """Roda `analisar(midia_id)` para todas as imagens (no maximo N ao mesmo tempo), na ordem do lote"""
+    semaforo = asyncio.Semaphore(max(1, DOC_ANALISE_CONCORRENCIA))
+
+    async def _uma(midia_id: str) -> Dict[str, Any]:
+        async with semaforo:
+            return await analisar(midia_id)
+
+    return list(await asyncio.gather(*(_uma(m) for m in midias)))
+
+
+def _texto(valor: Any, padrao: str) -> str:
+    texto = str(valor or "").strip()
+    return texto or padrao
+
+
+def _paginas(analise: Dict[str, Any]) -> int:
+    """Paginas reais de uma imagem (ex: 2 certidoes lado a lado = 2)"""
+    paginas = analise.get("paginas_estimadas", 1)
+    try:
+        return max(1, int(paginas))
+    except (TypeError, ValueError):
+        return 1
+
+
+def montar_manifesto(analises: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Junta as analises por imagem em documentos (mesmo tipo + idioma de origem)"""
+    documentos: Dict[tuple, Dict[str, Any]] = {}
+    destinos: Counter = Counter()
+    # Grafia original de cada destino (o contador usa minusculas)
+    grafias: Dict[str, str] = {}
+    descricoes: List[str] = []
+
+    for numero, analise in enumerate(analises, start=1):
+        tipo = _texto(analise.get("tipo_documento"), "documento")
+        origem = _texto(analise.get("idioma_origem"), "a identificar")
+        destino = _texto(analise.get("idioma_destino_sugerido"), "ingles")
+        paginas = _paginas(analise)
+
+        chave = (tipo.lower(), origem.lower())
+        doc = documentos.get(chave)
+        if doc is None:
+            doc = {"tipo": tipo, "idioma_origem": origem, "idioma_destino": destino, "paginas": 0, "imagens": []}
+            documentos[chave] = doc
+        doc["paginas"] += paginas
+        doc["imagens"].append(numero)
+        destinos[destino.lower()] += paginas
+        grafias.setdefault(destino.lower(), destino)
+
+        descricao = _texto(analise.get("descricao_curta"), "")
+        if descricao and descricao not in descricoes:
+            descricoes.append(descricao)
+
+    lista = list(documentos.values())
+    idioma_destino = "ingles"
+    if destinos:
+        idioma_destino = grafias[destinos.most_common(1)[0][0]]
+
+    origens = []
+    for d in lista:
+        if d["idioma_origem"] not in origens:
+            origens.append(d["idioma_origem"])
+
+    return {
+        "documentos": lista,
+        "total_pages": sum(d["paginas"] for d in lista) or 1,
+        "tipo": " + ".join(d["tipo"] for d in lista) or "documento",
+        "idioma_origem": " / ".join(origens) or "a identificar",
+        "idioma_destino": idioma_destino,
+        "descricao": "; ".join(descricoes) or "documento"
+    }
+
+
+def descrever_documentos(documentos: List[Dict[str, Any]]) -> str:
+    """Linhas do manifesto para prompts/mensagens: '- diploma (portugues): 2 paginas'"""
+    return "\n".join(
+        f"- {d['tipo']} ({d['idioma_origem']}): {d['paginas']} pagina{'s' if d['paginas'] > 1 else ''}"
+        for d in documentos
+    )
+
+
+if __name__ == "__main__":
+    # Conferencia rapida: python document_manifest.py
+    misto = montar_manifesto([
+        {"tipo_documento": "Certidao", "idioma_origem": "portugues", "idioma_destino_sugerido": "ingles"},
+        {"tipo_documento": "Certidao", "idioma_origem": "portugues", "idioma_destino_sugerido": "Espanhol"},
+        {"tipo_documento": "Certidao", "idioma_origem": "portugues", "idioma_destino_sugerido": "espanhol"},
+    ])
+    assert misto["idioma_destino"] == "Espanhol", misto
+    assert misto["total_pages"] == 3 and len(misto["documentos"]) == 1, misto
+
+    dois = montar_manifesto([
+        {"tipo_documento": "diploma", "idioma_origem": "portugues", "paginas_estimadas": 2},
+        {"tipo_documento": "certidao", "idioma_origem": "espanhol", "idioma_destino_sugerido": "ingles"},
+    ])
+    assert dois["tipo"] == "diploma + certidao" and dois["total_pages"] == 3, dois
+    assert montar_manifesto([])["total_pages"] == 1
+    print("ok")
@@ -0,0 +1,236 @@
+"""
+============================================================
+CACHE DE ESTADO DO CLIENTE - cliente_estados em memoria
+============================================================
+Um unico turno de conversa le o estado do cliente varias vezes
+(webhook, process_message_with_ai, processar_etapa_*,
+gerar_orcamento_final) e grava varias vezes (etapa, nome,
+idioma, documento_info...). Cada chamada era uma ida ao Mongo.
+
+- Leitura: cache por telefone com TTL e limite LRU
+- Escrita: dentro de um turno (turno_estado) as alteracoes sao
+  acumuladas e gravadas num unico update no fim do turno
+- Fora de um turno (rotas admin, tasks em segundo plano) a
+  escrita e imediata
+- Versao: todo documento tem o campo `versao`, incrementado a
+  cada gravacao. A primeira leitura de cada turno confere a
+  versao no Mongo (consulta coberta pelo indice phone+versao)
+  e a gravacao so aplica se a versao nao mudou; se outro worker
+  gravou no meio tempo, o estado e recarregado (conflito logado)
+
+Configuracao:
+  - ESTADO_CACHE_TTL_SEGUNDOS: validade de uma entrada (padrao 60)
+  - ESTADO_CACHE_MAX: telefones mantidos em memoria (padrao 2000)
+  - ESTADO_CACHE_VALIDAR_TURNO: "false" desliga a conferencia de versao por turno
+============================================================
+"""
+
+import os
+import time
+import copy
+import logging
+import contextvars
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Iterable
+
+from pymongo import ReturnDocument
+
+from admin_training_routes import db
+from phone_keys import phone_key
+
+logger = logging.getLogger(__name__)
+
+ESTADO_CACHE_TTL_SEGUNDOS = float(os.getenv("ESTADO_CACHE_TTL_SEGUNDOS", "60"))
+ESTADO_CACHE_MAX = int(os.getenv("ESTADO_CACHE_MAX", "2000"))
+ESTADO_CACHE_VALIDAR_TURNO = os.getenv("ESTADO_CACHE_VALIDAR_TURNO", "true").lower() == "true"
+
+# {phone: {"doc": dict ou None, "carregado_em": float}} em ordem LRU
+_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+_stats: Dict[str, int] = {
+    "hits": 0, "misses": 0, "validacoes": 0, "recarregados": 0,
+    "escritas": 0, "escritas_coalescidas": 0, "gravacoes": 0, "conflitos": 0, "evictions": 0
+}
+
+
+class _Turno:
+    """Alteracoes pendentes de um turno: {phone: {"set": {...}, "unset": set()}}"""
+
+    def __init__(self):
+        self.ativo = True
+        self.pendentes: Dict[str, Dict[str, Any]] = {}
+        self.validados: set = set()
+
+
+_turno_atual: contextvars.ContextVar[Optional[_Turno]] = contextvars.ContextVar("turno_estado", default=None)
+
+
+def _turno() -> Optional[_Turno]:
+    turno = _turno_atual.get()
+    return turno if turno is not None and turno.ativo else None
+
+
+def _guardar(phone: str, doc: Optional[dict]):
+    _cache[phone] = {"doc": doc, "carregado_em": time.time()}
+    _cache.move_to_end(phone)
+    while len(_cache) > ESTADO_CACHE_MAX:
+        _cache.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def _entrada_valida(phone: str) -> Optional[Dict[str, Any]]:
+    entrada = _cache.get(phone)
+    if entrada is None:
+        return None
+    if time.time() - entrada["carregado_em"] >= ESTADO_CACHE_TTL_SEGUNDOS:
+        del _cache[phone]
+        return None
+    _cache.move_to_end(phone)
+    return entrada
+
+
+def _versao(doc: Optional[dict]) -> Optional[int]:
+    return doc.get("versao") if doc else None
+
+
+async def _carregar(phone: str) -> Optional[dict]:
+    doc = await db.cliente_estados.find_one({"phone": phone})
+    _guardar(phone, doc)
+    return doc
+
+
+async def obter_estado(phone: str) -> Optional[dict]:
+    """
+    Documento do cliente (ou None se nao existe), com as alteracoes
+    pendentes do turno ja aplicadas. Retorna uma copia.
+    """
+    turno = _turno()
+    entrada = _entrada_valida(phone)
+
+    if entrada is None:
+        _stats["misses"] += 1
+        doc = await _carregar(phone)
+        if turno:
+            turno.validados.add(phone)
+    else:
+        _stats["hits"] += 1
+        doc = entrada["doc"]
+        if turno and ESTADO_CACHE_VALIDAR_TURNO and phone not in turno.validados:
+            # Outro worker pode ter gravado desde que este cache foi carregado
+            _stats["validacoes"] += 1
+            atual = await db.cliente_estados.find_one({"phone": phone}, {"_id": 0, "versao": 1})
+            if (atual is None) != (doc is None) or _versao(atual) != _versao(doc):
+                _stats["recarregados"] += 1
+                doc = await _carregar(phone)
+            turno.validados.add(phone)
+
+    doc = copy.deepcopy(doc)
+    pendente = turno.pendentes.get(phone) if turno else None
+    if pendente:
+        doc = doc or {"phone": phone}
+        doc.update(pendente["set"])
+        for campo in pendente["unset"]:
+            doc.pop(campo, None)
+    return doc
+
+
+async def _gravar(phone: str, campos: Dict[str, Any], remover: Iterable[str] = ()) -> Optional[dict]:
+    """Um update no Mongo, condicionado a versao em cache (se houver)"""
+    update: Dict[str, Any] = {"$inc": {"versao": 1}}
+    if campos:
+        update["$set"] = campos
+    if remover:
+        update["$unset"] = {c: "" for c in remover}
+
+    doc = None
+    entrada = _cache.get(phone)
+    if entrada is not None and entrada["doc"] is not None:
+        v = _versao(entrada["doc"])
+        filtro = {"phone": phone, "versao": v} if v is not None else {"phone": phone, "versao": {"$exists": False}}
+        doc = await db.cliente_estados.find_one_and_update(filtro, update, return_document=ReturnDocument.AFTER)
+        if doc is None:
+            _stats["conflitos"] += 1
+            logger.warning(f"[ESTADO] Conflito de versao para {phone} (gravado por outro processo), recarregando")
+
+    if doc is None:
+        update["$setOnInsert"] = {"phone_key": phone_key(phone)}
+        doc = await db.cliente_estados.find_one_and_update(
+            {"phone": phone}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+    _stats["gravacoes"] += 1
+    _guardar(phone, doc)
+    return doc
+
+
+async def gravar_estado(phone: str, campos: Dict[str, Any], remover: Iterable[str] = ()):
+    """
+    Altera o estado do cliente. Dentro de um turno as alteracoes sao acumuladas
+    e gravadas no fim (descarregar_turno); fora de um turno grava na hora.
+    """
+    _stats["escritas"] += 1
+    turno = _turno()
+    if turno is None:
+        await _gravar(phone, dict(campos), list(remover))
+        return
+
+    pendente = turno.pendentes.setdefault(phone, {"set": {}, "unset": set()})
+    if len(pendente["set"]) or len(pendente["unset"]):
+        _stats["escritas_coalescidas"] += 1
+    for campo, valor in campos.items():
+        pendente["set"][campo] = valor
+        pendente["unset"].discard(campo)
+    for campo in remover:
+        pendente["unset"].add(campo)
+        pendente["set"].pop(campo, None)
+
+
+async def descarregar_turno(turno: _Turno):
+    """Grava as alteracoes acumuladas do turno (um update por telefone)"""
+    pendentes, turno.pendentes = turno.pendentes, {}
+    for phone, pendente in pendentes.items():
+        try:
+            await _gravar(phone, pendente["set"], list(pendente["unset"]))
+        except Exception as e:
+            invalidar_estado(phone)
+            logger.error(f"[ESTADO] Erro ao gravar estado de {phone}: {e}")
+
+
+@asynccontextmanager
+async def turno_estado():
+    """Escopo de um turno (um evento do webhook): escritas no estado saem num unico update no fim"""
+    if _turno() is not None:
+        # Turno aninhado: o turno externo grava
+        yield
+        return
+
+    turno = _Turno()
+    token = _turno_atual.set(turno)
+    try:
+        yield
+    finally:
+        # Tasks criadas durante o turno herdam o contexto; depois daqui gravam direto
+        turno.ativo = False
+        _turno_atual.reset(token)
+        await descarregar_turno(turno)
+
+
+def invalidar_estado(phone: Optional[str] = None):
+    """Descarta o estado em cache de um telefone (ou de todos)"""
+    if phone is None:
+        _cache.clear()
+    else:
+        _cache.pop(phone, None)
+
+
+def get_estado_cache_stats() -> Dict[str, Any]:
+    """Metricas do cache (para endpoints de debug/admin)"""
+    leituras = _stats["hits"] + _stats["misses"]
+    return {
+        "ttl_segundos": ESTADO_CACHE_TTL_SEGUNDOS,
+        "max": ESTADO_CACHE_MAX,
+        "telefones_em_cache": len(_cache),
+        "hit_rate": round(_stats["hits"] / leituras * 100, 1) if leituras else 0,
+        **_stats
+    }
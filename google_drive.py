@@ -7,83 +7,314 @@ organizada no Google Drive usando Service Account.
 
 Estrutura: WhatsApp Documents/{phone}/{data}_{filename}
 
+Servico de upload:
+- Um pool de threads dedicado (nao o executor padrao do asyncio),
+  cada thread com o seu proprio service/http autorizado - httplib2
+  nao e thread-safe, mas instancias separadas podem rodar juntas,
+  entao nao ha mais um lock global serializando o Drive
+- Fila limitada: quando esta cheia, quem chama espera a vez
+  (sem acumular uploads sem fim na memoria)
+- Arquivos maiores que um chunk usam upload resumable em partes;
+  arquivos pequenos vao numa unica requisicao multipart
+- Erros 5xx/429 sao repetidos com backoff exponencial
+  (num_retries do googleapiclient)
+
+Pastas dos clientes (phone -> folder_id):
+- LRU em memoria na frente da colecao `drive_pastas` no Mongo:
+  o mapeamento sobrevive a restart/deploy
+- No startup, aquecer_cache_pastas lista em paginas (1000 por
+  pagina) todas as pastas da raiz e sincroniza o Mongo e o LRU
+- garantir_pastas_clientes busca/cria varias pastas de uma vez
+  com batch requests do Drive (ate 100 operacoes por requisicao)
+
 Configuracao:
   - GOOGLE_DRIVE_CREDENTIALS_JSON: JSON da service account (env var)
   - GOOGLE_DRIVE_FOLDER_ID: ID da pasta raiz "WhatsApp Documents"
+  - DRIVE_WORKERS: threads de upload (padrao 3)
+  - DRIVE_FILA_MAX: operacoes na fila + em andamento (padrao 50)
+  - DRIVE_CHUNK_MB: tamanho de cada parte do upload resumable (padrao 5)
+  - DRIVE_RETRIES: tentativas extras em 5xx/429 (padrao 5)
+  - DRIVE_PASTAS_CACHE_MAX: pastas de clientes no LRU em memoria (padrao 5000)
 ============================================================
 """
 
 import os
 import json
+import time
+import queue
+import asyncio
 import logging
 import threading
 from datetime import datetime
-from typing import Optional
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, List
 from io import BytesIO
 
+from pymongo import UpdateOne
+
+from admin_training_routes import db
+
 logger = logging.getLogger(__name__)
 
 # Google Drive config
 GOOGLE_DRIVE_CREDENTIALS_JSON = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON", "")
 GOOGLE_DRIVE_FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID", "")
 
-# Cache de folder IDs por cliente para evitar buscas repetidas
-_client_folder_cache: dict = {}
+DRIVE_WORKERS = max(1, int(os.getenv("DRIVE_WORKERS", "3")))
+DRIVE_FILA_MAX = max(1, int(os.getenv("DRIVE_FILA_MAX", "50")))
+DRIVE_CHUNK_MB = float(os.getenv("DRIVE_CHUNK_MB", "5"))
+DRIVE_RETRIES = int(os.getenv("DRIVE_RETRIES", "5"))
+DRIVE_PASTAS_CACHE_MAX = int(os.getenv("DRIVE_PASTAS_CACHE_MAX", "5000"))
 
-# Flag para indicar se o Drive esta configurado
-_drive_enabled: bool = False
-_drive_service = None
+# Partes do upload resumable precisam ser multiplas de 256 KB
+_CHUNK_BASE = 256 * 1024
+DRIVE_CHUNK_BYTES = max(_CHUNK_BASE, int(DRIVE_CHUNK_MB * 1024 * 1024) // _CHUNK_BASE * _CHUNK_BASE)
 
-# Lock para serializar operacoes do Google Drive (httplib2 nao e thread-safe)
-_drive_lock = threading.Lock()
+# Timeout de cada requisicao HTTP ao Drive
+DRIVE_TIMEOUT_SEGUNDOS = 120
 
+# Limite de operacoes por batch request do Drive
+DRIVE_BATCH_MAX = 100
 
-def _init_drive_service():
-    """Inicializa o servico do Google Drive com Service Account"""
-    global _drive_enabled, _drive_service
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# LRU de folder IDs por cliente (frente da colecao drive_pastas); lido pelas threads do pool
+_client_folder_cache: "OrderedDict[str, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Lock por pasta de cliente: duas threads nao criam a mesma pasta em duplicidade
+_folder_locks: Dict[str, threading.Lock] = {}
+_folder_locks_guard = threading.Lock()
+
+# Flag para indicar se o Drive esta configurado (None = ainda nao verificado)
+_drive_enabled: Optional[bool] = None
+_credentials_info: Optional[dict] = None
+
+# Service/http por thread (httplib2 nao e thread-safe)
+_local = threading.local()
 
-    if _drive_service is not None:
-        return _drive_service
+# Pool de upload: fila limitada + threads dedicadas
+_fila: Optional[queue.Queue] = None
+_vagas: Optional[asyncio.Semaphore] = None
+_threads: list = []
+_pool_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "operacoes": 0, "em_andamento": 0, "uploads": 0, "uploads_resumable": 0,
+    "bytes_enviados": 0, "falhas": 0, "fila_cheia": 0, "ms_upload": 0.0,
+    "pastas_hits_memoria": 0, "pastas_hits_mongo": 0, "pastas_buscadas_drive": 0,
+    "pastas_criadas_lote": 0, "pastas_aquecidas": 0
+}
+
+
+def _contar(campo: str, valor: float = 1):
+    with _stats_lock:
+        _stats[campo] += valor
+
+
+def _verificar_config() -> bool:
+    """Valida as variaveis de ambiente uma unica vez"""
+    global _drive_enabled, _credentials_info
+
+    if _drive_enabled is not None:
+        return _drive_enabled
 
     if not GOOGLE_DRIVE_CREDENTIALS_JSON:
         logger.warning("[GDRIVE] GOOGLE_DRIVE_CREDENTIALS_JSON nao configurado - upload desabilitado")
         _drive_enabled = False
-        return None
+        return False
 
     if not GOOGLE_DRIVE_FOLDER_ID:
         logger.warning("[GDRIVE] GOOGLE_DRIVE_FOLDER_ID nao configurado - upload desabilitado")
         _drive_enabled = False
+        return False
+
+    try:
+        import googleapiclient  # noqa: F401
+        _credentials_info = json.loads(GOOGLE_DRIVE_CREDENTIALS_JSON)
+        _drive_enabled = True
+    except ImportError:
+        logger.error("[GDRIVE] google-api-python-client nao instalado. Rode: pip install google-api-python-client google-auth")
+        _drive_enabled = False
+    except Exception as e:
+        logger.error(f"[GDRIVE] GOOGLE_DRIVE_CREDENTIALS_JSON invalido: {e}")
+        _drive_enabled = False
+    return _drive_enabled
+
+
+def _init_drive_service():
+    """Servico do Google Drive da thread atual (criado na primeira chamada de cada thread)"""
+    service = getattr(_local, "service", None)
+    if service is not None:
+        return service
+
+    if not _verificar_config():
         return None
 
     try:
+        import httplib2
+        import google_auth_httplib2
         from google.oauth2 import service_account
         from googleapiclient.discovery import build
 
-        credentials_info = json.loads(GOOGLE_DRIVE_CREDENTIALS_JSON)
         credentials = service_account.Credentials.from_service_account_info(
-            credentials_info,
+            _credentials_info,
             scopes=["https://www.googleapis.com/auth/drive.file"]
         )
-        _drive_service = build("drive", "v3", credentials=credentials)
-        _drive_enabled = True
-        logger.info("[GDRIVE] Servico Google Drive inicializado com sucesso")
-        return _drive_service
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=DRIVE_TIMEOUT_SEGUNDOS))
+        _local.service = build("drive", "v3", http=http, cache_discovery=False)
+        logger.info(f"[GDRIVE] Servico Google Drive inicializado na thread {threading.current_thread().name}")
+        return _local.service
 
-    except ImportError:
-        logger.error("[GDRIVE] google-api-python-client nao instalado. Rode: pip install google-api-python-client google-auth")
-        _drive_enabled = False
-        return None
     except Exception as e:
         logger.error(f"[GDRIVE] Erro ao inicializar Drive: {e}")
-        _drive_enabled = False
         return None
 
 
 def is_drive_enabled() -> bool:
     """Verifica se o Google Drive esta configurado e habilitado"""
-    if _drive_service is None:
-        _init_drive_service()
-    return _drive_enabled
+    return _verificar_config()
+
+
+# ============================================================
+# POOL DE THREADS DO DRIVE
+# ============================================================
+def _iniciar_pool():
+    """Cria a fila e as threads na primeira operacao"""
+    global _fila, _vagas
+    with _pool_lock:
+        if _fila is not None:
+            return
+        _fila = queue.Queue(maxsize=DRIVE_FILA_MAX)
+        _vagas = asyncio.Semaphore(DRIVE_FILA_MAX)
+        for i in range(DRIVE_WORKERS):
+            thread = threading.Thread(target=_worker, name=f"gdrive-{i}", daemon=True)
+            thread.start()
+            _threads.append(thread)
+        logger.info(f"[GDRIVE] Pool iniciado: {DRIVE_WORKERS} threads, fila de {DRIVE_FILA_MAX}")
+
+
+def _resolver(future: asyncio.Future, resultado: Any, erro: Optional[BaseException]):
+    if future.cancelled():
+        return
+    if erro is not None:
+        future.set_exception(erro)
+    else:
+        future.set_result(resultado)
+
+
+def _worker():
+    """Thread do pool: executa as operacoes da fila com o service proprio da thread"""
+    while True:
+        job = _fila.get()
+        if job is None:
+            break
+        funcao, args, future, loop = job
+        _contar("em_andamento")
+        try:
+            resultado, erro = funcao(*args), None
+        except Exception as e:
+            resultado, erro = None, e
+        finally:
+            _contar("em_andamento", -1)
+        loop.call_soon_threadsafe(_resolver, future, resultado, erro)
+
+
+async def _executar_no_pool(funcao: Callable, *args) -> Any:
+    """Executa funcao(*args) numa thread do pool; espera vaga se a fila estiver cheia"""
+    _iniciar_pool()
+    _contar("operacoes")
+    async with _vagas:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            _fila.put_nowait((funcao, args, future, loop))
+        except queue.Full:
+            # So acontece se chamadas canceladas deixaram jobs para tras
+            _contar("fila_cheia")
+            raise RuntimeError("Fila do Google Drive cheia")
+        return await future
+
+
+def parar_drive_workers():
+    """Sinaliza as threads do pool para encerrar (shutdown)"""
+    if _fila is None:
+        return
+    for _ in _threads:
+        try:
+            _fila.put_nowait(None)
+        except queue.Full:
+            break
+
+
+def get_drive_stats() -> Dict[str, Any]:
+    """Metricas do pool do Drive (para endpoints de debug/admin)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        "habilitado": bool(_drive_enabled),
+        "workers": DRIVE_WORKERS,
+        "fila_max": DRIVE_FILA_MAX,
+        "chunk_bytes": DRIVE_CHUNK_BYTES,
+        "na_fila": _fila.qsize() if _fila is not None else 0,
+        "pastas_em_cache": len(_client_folder_cache),
+        "pastas_cache_max": DRIVE_PASTAS_CACHE_MAX,
+        "ms_upload_medio": round(stats["ms_upload"] / stats["uploads"], 1) if stats["uploads"] else 0,
+        **stats
+    }
+
+
+# ============================================================
+# PASTAS
+# ============================================================
+def _cache_get(phone: str) -> Optional[str]:
+    with _cache_lock:
+        folder_id = _client_folder_cache.get(phone)
+        if folder_id:
+            _client_folder_cache.move_to_end(phone)
+        return folder_id
+
+
+def _cache_put(phone: str, folder_id: str):
+    with _cache_lock:
+        _client_folder_cache[phone] = folder_id
+        _client_folder_cache.move_to_end(phone)
+        while len(_client_folder_cache) > DRIVE_PASTAS_CACHE_MAX:
+            _client_folder_cache.popitem(last=False)
+
+
+def _pasta_id_mongo(phone: str) -> str:
+    # A raiz faz parte da chave: trocar GOOGLE_DRIVE_FOLDER_ID nao reaproveita pastas da raiz antiga
+    return f"{GOOGLE_DRIVE_FOLDER_ID}:{phone}"
+
+
+async def _buscar_pastas_mongo(phones: List[str]) -> Dict[str, str]:
+    """Mapeamentos persistidos {phone: folder_id}"""
+    try:
+        cursor = db.drive_pastas.find({"_id": {"$in": [_pasta_id_mongo(p) for p in phones]}})
+        return {doc["phone"]: doc["folder_id"] async for doc in cursor}
+    except Exception as e:
+        logger.error(f"[GDRIVE] Erro ao buscar pastas no Mongo: {e}")
+        return {}
+
+
+async def _salvar_pastas_mongo(pastas: Dict[str, str]):
+    """Grava os mapeamentos {phone: folder_id} (upsert em bulk)"""
+    if not pastas:
+        return
+    agora = datetime.now()
+    try:
+        await db.drive_pastas.bulk_write([
+            UpdateOne(
+                {"_id": _pasta_id_mongo(phone)},
+                {"$set": {"phone": phone, "folder_id": folder_id, "parent_id": GOOGLE_DRIVE_FOLDER_ID, "atualizado_em": agora}},
+                upsert=True
+            )
+            for phone, folder_id in pastas.items()
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"[GDRIVE] Erro ao salvar {len(pastas)} pastas no Mongo: {e}")
 
 
 def _find_folder(service, folder_name: str, parent_id: str) -> Optional[str]:
@@ -92,15 +323,17 @@ def _find_folder(service, folder_name: str, parent_id: str) -> Optional[str]:
         query = (
             f"name = '{folder_name}' and "
             f"'{parent_id}' in parents and "
-            f"mimeType = 'application/vnd.google-apps.folder' and "
+            f"mimeType = '{FOLDER_MIME}' and "
             f"trashed = false"
         )
+        # Pasta mais antiga primeiro: mesma escolha do aquecimento quando ha nomes repetidos
         results = service.files().list(
             q=query,
             spaces="drive",
             fields="files(id, name)",
+            orderBy="createdTime",
             pageSize=1
-        ).execute()
+        ).execute(num_retries=DRIVE_RETRIES)
 
         files = results.get("files", [])
         if files:
@@ -117,13 +350,13 @@ def _create_folder(service, folder_name: str, parent_id: str) -> Optional[str]:
     try:
         file_metadata = {
             "name": folder_name,
-            "mimeType": "application/vnd.google-apps.folder",
+            "mimeType": FOLDER_MIME,
             "parents": [parent_id]
         }
         folder = service.files().create(
             body=file_metadata,
             fields="id"
-        ).execute()
+        ).execute(num_retries=DRIVE_RETRIES)
 
         folder_id = folder.get("id")
         logger.info(f"[GDRIVE] Pasta criada: '{folder_name}' (ID: {folder_id})")
@@ -142,6 +375,13 @@ def _get_or_create_folder(service, folder_name: str, parent_id: str) -> Optional
     return _create_folder(service, folder_name, parent_id)
 
 
+def _lock_da_pasta(chave: str) -> threading.Lock:
+    with _folder_locks_guard:
+        if chave not in _folder_locks:
+            _folder_locks[chave] = threading.Lock()
+        return _folder_locks[chave]
+
+
 def get_client_folder(phone: str, nome: str = "") -> Optional[str]:
     """
     Obtem (ou cria) a pasta do cliente no Google Drive.
@@ -149,6 +389,7 @@ def get_client_folder(phone: str, nome: str = "") -> Optional[str]:
     race conditions entre chamadas com/sem nome do cliente.
     Estrutura: WhatsApp Documents/{phone}/
     Retorna o ID da pasta ou None se Drive nao estiver configurado.
+    Sincrona: em codigo async usar get_client_folder_async.
     """
     service = _init_drive_service()
     if not service:
@@ -156,39 +397,274 @@ def get_client_folder(phone: str, nome: str = "") -> Optional[str]:
 
     # Verificar cache
     cache_key = phone
-    if cache_key in _client_folder_cache:
-        return _client_folder_cache[cache_key]
+    folder_id = _cache_get(cache_key)
+    if folder_id:
+        return folder_id
 
     # Usar APENAS o telefone como nome da pasta (evita pastas duplicadas)
     folder_name = phone
 
-    with _drive_lock:
+    with _lock_da_pasta(cache_key):
         # Re-verificar cache depois do lock (outra thread pode ter preenchido)
-        if cache_key in _client_folder_cache:
-            return _client_folder_cache[cache_key]
+        folder_id = _cache_get(cache_key)
+        if folder_id:
+            return folder_id
 
+        _contar("pastas_buscadas_drive")
         folder_id = _get_or_create_folder(service, folder_name, GOOGLE_DRIVE_FOLDER_ID)
         if folder_id:
-            _client_folder_cache[cache_key] = folder_id
+            _cache_put(cache_key, folder_id)
             logger.info(f"[GDRIVE] Pasta do cliente obtida: '{folder_name}' (ID: {folder_id})")
 
     return folder_id
 
 
+async def get_client_folder_async(phone: str, nome: str = "") -> Optional[str]:
+    """Pasta do cliente: LRU -> Mongo (drive_pastas) -> Drive numa thread do pool"""
+    if not is_drive_enabled():
+        return None
+
+    folder_id = _cache_get(phone)
+    if folder_id:
+        _contar("pastas_hits_memoria")
+        return folder_id
+
+    folder_id = (await _buscar_pastas_mongo([phone])).get(phone)
+    if folder_id:
+        _contar("pastas_hits_mongo")
+        _cache_put(phone, folder_id)
+        return folder_id
+
+    try:
+        folder_id = await _executar_no_pool(get_client_folder, phone, nome)
+    except Exception as e:
+        logger.error(f"[GDRIVE] Erro ao obter pasta de {phone}: {e}")
+        return None
+    if folder_id:
+        await _salvar_pastas_mongo({phone: folder_id})
+    return folder_id
+
+
+def _executar_lote(service, requisicoes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Executa {request_id: requisicao} em batch requests (DRIVE_BATCH_MAX por vez).
+    Respostas com 5xx/429 sao reenviadas em novos batches com backoff.
+    Retorna {request_id: resposta} das que deram certo.
+    """
+    respostas: Dict[str, Any] = {}
+    pendentes = dict(requisicoes)
+    for tentativa in range(DRIVE_RETRIES + 1):
+        if not pendentes:
+            break
+        if tentativa:
+            time.sleep(min(2 ** tentativa, 30))
+        repetir: Dict[str, Any] = {}
+
+        def _callback(request_id, resposta, erro):
+            if erro is None:
+                respostas[request_id] = resposta
+                return
+            status = getattr(getattr(erro, "resp", None), "status", 0)
+            if status == 429 or status >= 500:
+                repetir[request_id] = pendentes[request_id]
+            else:
+                logger.error(f"[GDRIVE] Erro no batch ({request_id}): {erro}")
+
+        ids = list(pendentes.keys())
+        for inicio in range(0, len(ids), DRIVE_BATCH_MAX):
+            batch = service.new_batch_http_request(callback=_callback)
+            for request_id in ids[inicio:inicio + DRIVE_BATCH_MAX]:
+                batch.add(pendentes[request_id], request_id=request_id)
+            batch.execute()
+        # Requisicoes sem midia podem ser adicionadas de novo no batch seguinte
+        pendentes = repetir
+
+    if pendentes:
+        logger.error(f"[GDRIVE] {len(pendentes)} operacoes do batch falharam apos {DRIVE_RETRIES} tentativas")
+    return respostas
+
+
+def _obter_ou_criar_pastas_em_lote(phones: List[str]) -> Dict[str, str]:
+    """Busca as pastas em batch e cria as que faltam em batch (roda numa thread do pool)"""
+    service = _init_drive_service()
+    if not service:
+        return {}
+
+    phones = sorted(set(phones))
+    # Locks em ordem fixa: sem deadlock com get_client_folder de outras threads
+    locks = [_lock_da_pasta(phone) for phone in phones]
+    for lock in locks:
+        lock.acquire()
+    try:
+        pastas = {phone: _cache_get(phone) for phone in phones}
+        faltando = [phone for phone, folder_id in pastas.items() if not folder_id]
+
+        buscas = {
+            phone: service.files().list(
+                q=(f"name = '{phone}' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and "
+                   f"mimeType = '{FOLDER_MIME}' and trashed = false"),
+                spaces="drive",
+                fields="files(id, name)",
+                orderBy="createdTime",
+                pageSize=1
+            )
+            for phone in faltando
+        }
+        for phone, resposta in _executar_lote(service, buscas).items():
+            files = resposta.get("files", [])
+            if files:
+                pastas[phone] = files[0]["id"]
+
+        criacoes = {
+            phone: service.files().create(
+                body={"name": phone, "mimeType": FOLDER_MIME, "parents": [GOOGLE_DRIVE_FOLDER_ID]},
+                fields="id"
+            )
+            for phone in faltando if not pastas.get(phone)
+        }
+        criadas = _executar_lote(service, criacoes)
+        for phone, resposta in criadas.items():
+            pastas[phone] = resposta.get("id")
+        if criadas:
+            _contar("pastas_criadas_lote", len(criadas))
+            logger.info(f"[GDRIVE] {len(criadas)} pastas de clientes criadas em lote")
+
+        resultado = {phone: folder_id for phone, folder_id in pastas.items() if folder_id}
+        for phone, folder_id in resultado.items():
+            _cache_put(phone, folder_id)
+        return resultado
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+async def garantir_pastas_clientes(phones: List[str]) -> Dict[str, str]:
+    """
+    Pastas de varios clientes de uma vez: LRU -> Mongo -> busca e criacao
+    em batch no Drive. Retorna {phone: folder_id} das que existem.
+    """
+    if not is_drive_enabled() or not phones:
+        return {}
+
+    pastas = {phone: _cache_get(phone) for phone in set(phones)}
+    faltando = [phone for phone, folder_id in pastas.items() if not folder_id]
+    if faltando:
+        do_mongo = await _buscar_pastas_mongo(faltando)
+        for phone, folder_id in do_mongo.items():
+            _cache_put(phone, folder_id)
+        pastas.update(do_mongo)
+        faltando = [phone for phone in faltando if phone not in do_mongo]
+
+    if faltando:
+        try:
+            do_drive = await _executar_no_pool(_obter_ou_criar_pastas_em_lote, faltando)
+        except Exception as e:
+            logger.error(f"[GDRIVE] Erro ao obter pastas em lote: {e}")
+            do_drive = {}
+        await _salvar_pastas_mongo(do_drive)
+        pastas.update(do_drive)
+
+    return {phone: folder_id for phone, folder_id in pastas.items() if folder_id}
+
+
+def _listar_pastas_clientes() -> Dict[str, str]:
+    """Todas as pastas da raiz, paginadas (roda numa thread do pool). Nome repetido: vale a mais antiga"""
+    service = _init_drive_service()
+    if not service:
+        return {}
+
+    pastas: Dict[str, str] = {}
+    page_token = None
+    while True:
+        resposta = service.files().list(
+            q=f"'{GOOGLE_DRIVE_FOLDER_ID}' in parents and mimeType = '{FOLDER_MIME}' and trashed = false",
+            spaces="drive",
+            fields="nextPageToken, files(id, name)",
+            orderBy="createdTime",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute(num_retries=DRIVE_RETRIES)
+        for arquivo in resposta.get("files", []):
+            pastas.setdefault(arquivo["name"], arquivo["id"])
+        page_token = resposta.get("nextPageToken")
+        if not page_token:
+            return pastas
+
+
+async def aquecer_cache_pastas() -> int:
+    """
+    Startup: lista as pastas de clientes no Drive e sincroniza drive_pastas
+    (inclusive removendo mapeamentos de pastas que nao existem mais) e o LRU.
+    Retorna quantas pastas foram encontradas.
+    """
+    if not is_drive_enabled():
+        return 0
+
+    inicio = datetime.now()
+    try:
+        pastas = await _executar_no_pool(_listar_pastas_clientes)
+    except Exception as e:
+        logger.error(f"[GDRIVE] Erro ao listar pastas para aquecer o cache: {e}")
+        return 0
+
+    await _salvar_pastas_mongo(pastas)
+    try:
+        await db.drive_pastas.delete_many({"parent_id": GOOGLE_DRIVE_FOLDER_ID, "atualizado_em": {"$lt": inicio}})
+    except Exception as e:
+        logger.error(f"[GDRIVE] Erro ao remover pastas antigas do Mongo: {e}")
+
+    # Ordem de criacao: as mais recentes ficam no LRU quando ha mais pastas que o limite
+    for phone, folder_id in list(pastas.items())[-DRIVE_PASTAS_CACHE_MAX:]:
+        _cache_put(phone, folder_id)
+    _contar("pastas_aquecidas", len(pastas))
+    logger.info(f"[GDRIVE] Cache de pastas aquecido: {len(pastas)} pastas em {(datetime.now() - inicio).total_seconds():.1f}s")
+    return len(pastas)
+
+
 def get_folder_link(folder_id: str) -> str:
     """Retorna o link web da pasta no Google Drive"""
     return f"https://drive.google.com/drive/folders/{folder_id}"
 
 
+def _enviar_arquivo(service, file_bytes: bytes, file_metadata: dict, mime_type: str) -> dict:
+    """Cria o arquivo: multipart numa requisicao se couber num chunk, senao resumable em partes"""
+    from googleapiclient.http import MediaIoBaseUpload
+
+    if len(file_bytes) <= DRIVE_CHUNK_BYTES:
+        media = MediaIoBaseUpload(BytesIO(file_bytes), mimetype=mime_type, resumable=False)
+        return service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id, webViewLink"
+        ).execute(num_retries=DRIVE_RETRIES)
+
+    _contar("uploads_resumable")
+    media = MediaIoBaseUpload(BytesIO(file_bytes), mimetype=mime_type, chunksize=DRIVE_CHUNK_BYTES, resumable=True)
+    request = service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields="id, webViewLink"
+    )
+    resposta = None
+    while resposta is None:
+        # Cada parte e repetida sozinha em 5xx/429; o upload continua de onde parou
+        status, resposta = request.next_chunk(num_retries=DRIVE_RETRIES)
+        if status:
+            logger.info(f"[GDRIVE] '{file_metadata['name']}': {int(status.progress() * 100)}% enviado")
+    return resposta
+
+
 def upload_file_to_drive(
     file_bytes: bytes,
     filename: str,
     mime_type: str,
     phone: str,
-    nome: str = ""
+    nome: str = "",
+    folder_id: Optional[str] = None
 ) -> Optional[dict]:
     """
     Faz upload de um arquivo para o Google Drive na pasta do cliente.
+    Sincrona: em codigo async usar upload_file_to_drive_async (pool de threads).
 
     Args:
         file_bytes: Conteudo do arquivo em bytes
@@ -196,6 +672,7 @@ def upload_file_to_drive(
         mime_type: Tipo MIME (ex: image/jpeg, application/pdf)
         phone: Telefone do cliente
         nome: Nome do cliente (opcional)
+        folder_id: Pasta do cliente ja resolvida (opcional)
 
     Returns:
         dict com {file_id, file_link, folder_id, folder_link} ou None se falhar
@@ -206,42 +683,34 @@ def upload_file_to_drive(
         return None
 
     try:
-        from googleapiclient.http import MediaIoBaseUpload
+        inicio = time.monotonic()
 
         # Obter pasta do cliente
         logger.info(f"[GDRIVE] Iniciando upload: '{filename}' ({len(file_bytes)} bytes) para {phone}")
-        folder_id = get_client_folder(phone, nome)
+        folder_id = folder_id or get_client_folder(phone, nome)
         if not folder_id:
             logger.error(f"[GDRIVE] Nao conseguiu criar/obter pasta para {phone}")
+            _contar("falhas")
             return None
 
         # Prefixar filename com data/hora
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         final_filename = f"{timestamp}_{filename}"
 
-        # Upload com lock para thread-safety (httplib2 nao e thread-safe)
         file_metadata = {
             "name": final_filename,
             "parents": [folder_id]
         }
-
-        media = MediaIoBaseUpload(
-            BytesIO(file_bytes),
-            mimetype=mime_type,
-            resumable=True
-        )
-
-        with _drive_lock:
-            file_result = service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields="id, webViewLink"
-            ).execute()
+        file_result = _enviar_arquivo(service, file_bytes, file_metadata, mime_type)
 
         file_id = file_result.get("id")
         file_link = file_result.get("webViewLink", f"https://drive.google.com/file/d/{file_id}/view")
 
-        logger.info(f"[GDRIVE] Upload CONCLUIDO: {final_filename} para {phone} (ID: {file_id})")
+        ms = (time.monotonic() - inicio) * 1000
+        _contar("uploads")
+        _contar("bytes_enviados", len(file_bytes))
+        _contar("ms_upload", ms)
+        logger.info(f"[GDRIVE] Upload CONCLUIDO: {final_filename} para {phone} (ID: {file_id}) em {ms:.0f}ms")
 
         return {
             "file_id": file_id,
@@ -252,6 +721,7 @@ def upload_file_to_drive(
         }
 
     except Exception as e:
+        _contar("falhas")
         logger.error(f"[GDRIVE] ERRO ao fazer upload de '{filename}' para {phone}: {e}", exc_info=True)
         return None
 
@@ -264,23 +734,16 @@ async def upload_file_to_drive_async(
     nome: str = ""
 ) -> Optional[dict]:
     """
-    Versao async do upload - executa em thread separada para nao bloquear o event loop.
-    A Google Drive API e sincrona, entao rodamos em executor.
+    Versao async do upload - executa numa thread do pool do Drive para nao bloquear o event loop.
+    A Google Drive API e sincrona; cada thread do pool tem o seu proprio service.
     """
-    import asyncio
-
     try:
-        loop = asyncio.get_running_loop()
-        result = await loop.run_in_executor(
-            None,
-            upload_file_to_drive,
-            file_bytes,
-            filename,
-            mime_type,
-            phone,
-            nome
-        )
-        return result
+        # Pasta resolvida antes (LRU/Mongo): a thread do pool so faz o upload
+        folder_id = await get_client_folder_async(phone, nome)
+        if not folder_id:
+            logger.error(f"[GDRIVE] Nao conseguiu criar/obter pasta para {phone}")
+            return None
+        return await _executar_no_pool(upload_file_to_drive, file_bytes, filename, mime_type, phone, nome, folder_id)
     except Exception as e:
         logger.error(f"[GDRIVE] Erro async upload '{filename}' para {phone}: {e}", exc_info=True)
         return None
@@ -0,0 +1,150 @@
+"""
+============================================================
+CLIENTES HTTP COMPARTILHADOS - Um pool por servico externo
+============================================================
+Em vez de abrir um httpx.AsyncClient novo a cada chamada (novo
+handshake TCP+TLS com a Z-API a cada mensagem), cada servico
+externo tem um cliente com pool de conexoes que vive enquanto a
+aplicacao estiver no ar:
+
+- Criados no startup, fechados no shutdown
+- HTTP/2 quando o pacote `h2` estiver instalado
+- Limites de conexao e timeouts por servico
+- Metricas de saturacao do pool (requisicoes em voo, pico,
+  requisicoes que esperaram conexao livre, pool timeouts)
+============================================================
+"""
+
+import time
+import logging
+import importlib.util
+from typing import Dict, Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 depende do pacote opcional `h2` (pip install httpx[http2])
+HTTP2_DISPONIVEL = importlib.util.find_spec("h2") is not None
+
+# Politica por servico: timeout (total, connect, pool) e limites de conexao
+UPSTREAMS: Dict[str, Dict[str, Any]] = {
+    "zapi": {"timeout": 30.0, "connect": 5.0, "pool": 10.0, "max_connections": 20, "max_keepalive": 10},
+    "zapi_media": {"timeout": 60.0, "connect": 5.0, "pool": 15.0, "max_connections": 10, "max_keepalive": 5},
+    "portal": {"timeout": 30.0, "connect": 10.0, "pool": 10.0, "max_connections": 10, "max_keepalive": 5},
+    "google_ads": {"timeout": 30.0, "connect": 10.0, "pool": 10.0, "max_connections": 5, "max_keepalive": 2},
+    "meta_ads": {"timeout": 30.0, "connect": 10.0, "pool": 10.0, "max_connections": 5, "max_keepalive": 2},
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_metricas: Dict[str, Dict[str, float]] = {}
+
+
+class _TransporteMonitorado(httpx.AsyncHTTPTransport):
+    """Transport do httpx que conta requisicoes em voo para medir saturacao do pool"""
+
+    def __init__(self, nome: str, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        self._nome = nome
+        self._max_connections = max_connections
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        m = _metricas[self._nome]
+        m["requests"] += 1
+        m["in_flight"] += 1
+        m["peak_in_flight"] = max(m["peak_in_flight"], m["in_flight"])
+        if m["in_flight"] > self._max_connections:
+            # Todas as conexoes ocupadas: esta requisicao vai esperar no pool
+            m["waited_for_connection"] += 1
+        inicio = time.monotonic()
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            m["pool_timeouts"] += 1
+            raise
+        except Exception:
+            m["errors"] += 1
+            raise
+        finally:
+            m["in_flight"] -= 1
+            m["total_ms"] += (time.monotonic() - inicio) * 1000
+
+
+def _criar_client(nome: str) -> httpx.AsyncClient:
+    politica = UPSTREAMS[nome]
+    limits = httpx.Limits(
+        max_connections=politica["max_connections"],
+        max_keepalive_connections=politica["max_keepalive"],
+        keepalive_expiry=30.0
+    )
+    _metricas[nome] = {
+        "requests": 0, "in_flight": 0, "peak_in_flight": 0,
+        "waited_for_connection": 0, "pool_timeouts": 0, "errors": 0, "total_ms": 0.0
+    }
+    transport = _TransporteMonitorado(
+        nome,
+        politica["max_connections"],
+        http2=HTTP2_DISPONIVEL,
+        limits=limits,
+        retries=1  # Retry apenas de falha de conexao
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(politica["timeout"], connect=politica["connect"], pool=politica["pool"])
+    )
+
+
+def timeout_do_servico(nome: str, total: float) -> httpx.Timeout:
+    """
+    Timeout por requisicao com outro total (ex: upload grande), mantendo
+    connect e pool da politica do servico. Passar so `timeout=60.0` no
+    request substituiria a politica inteira.
+    """
+    politica = UPSTREAMS[nome]
+    return httpx.Timeout(total, connect=politica["connect"], pool=politica["pool"])
+
+
+def get_http_client(nome: str) -> httpx.AsyncClient:
+    """
+    Retorna o cliente compartilhado do servico.
+    Cria sob demanda se for usado antes do startup (ex: scripts).
+    """
+    client = _clients.get(nome)
+    if client is None or client.is_closed:
+        client = _criar_client(nome)
+        _clients[nome] = client
+    return client
+
+
+async def iniciar_http_clients():
+    """Cria os clientes de todos os servicos (chamar no startup)"""
+    for nome in UPSTREAMS:
+        get_http_client(nome)
+    logger.info(f"[HTTP] {len(_clients)} clientes HTTP criados (HTTP/2: {'sim' if HTTP2_DISPONIVEL else 'nao'})")
+
+
+async def fechar_http_clients():
+    """Fecha os pools de conexao (chamar no shutdown)"""
+    for nome, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"[HTTP] Erro ao fechar cliente '{nome}': {e}")
+    _clients.clear()
+
+
+def get_http_stats() -> Dict[str, Any]:
+    """Metricas de uso/saturacao por servico (para endpoints de debug/admin)"""
+    servicos = {}
+    for nome, m in _metricas.items():
+        servicos[nome] = {
+            "max_connections": UPSTREAMS[nome]["max_connections"],
+            "requests": int(m["requests"]),
+            "in_flight": int(m["in_flight"]),
+            "peak_in_flight": int(m["peak_in_flight"]),
+            "waited_for_connection": int(m["waited_for_connection"]),
+            "pool_timeouts": int(m["pool_timeouts"]),
+            "errors": int(m["errors"]),
+            "avg_ms": round(m["total_ms"] / m["requests"], 1) if m["requests"] else 0
+        }
+    return {"http2": HTTP2_DISPONIVEL, "servicos": servicos}
@@ -0,0 +1,200 @@
+"""
+============================================================
+LOTE DE IMAGENS - Agrupamento por telefone com janela de silencio
+============================================================
+O cliente manda as paginas de um documento como varias imagens
+seguidas. Antes, cada webhook de imagem ficava parado 4s
+(asyncio.sleep) e comparava horarios para adivinhar se era a
+ultima: um upload de 10 paginas segurava 10 corrotinas e a
+decisao de quem perguntava dependia de corrida de tempo.
+
+Agora o webhook so adiciona a imagem ao lote e retorna:
+
+- Um unico timer por telefone, reiniciado a cada imagem
+- Quando a janela de silencio termina (ou o lote atinge o limite
+  de imagens) o lote e fechado e o callback de fechamento roda
+  UMA vez, na vez do telefone na fila de webhooks
+- URLs repetidas (Z-API reenvia o mesmo webhook) sao ignoradas,
+  inclusive logo depois do fechamento do lote
+- Os jobs da fila de cada imagem so sao concluidos depois do
+  callback (webhook_queue.concluir_jobs): se a instancia reiniciar
+  com o lote aberto, os jobs voltam a rodar e o lote e refeito
+
+Configuracao:
+  - IMAGE_BATCH_JANELA_SEGUNDOS: silencio que fecha o lote (padrao 4)
+  - IMAGE_BATCH_MAX_IMAGENS: fecha o lote ao atingir (padrao 20)
+  - IMAGE_BATCH_DEDUP_SEGUNDOS: memoria de URLs ja fechadas (padrao 600)
+============================================================
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Callable, Awaitable, Dict, Any, List
+
+from webhook_queue import executar_no_ator, concluir_jobs
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BATCH_JANELA_SEGUNDOS = float(os.getenv("IMAGE_BATCH_JANELA_SEGUNDOS", "4"))
+IMAGE_BATCH_MAX_IMAGENS = int(os.getenv("IMAGE_BATCH_MAX_IMAGENS", "20"))
+IMAGE_BATCH_DEDUP_SEGUNDOS = float(os.getenv("IMAGE_BATCH_DEDUP_SEGUNDOS", "600"))
+
+# Resultado de adicionar_imagem
+ADICIONADA = "adicionada"
+DUPLICADA = "duplicada"
+
+# Callback de fechamento (registrado pelo main.py): callback(phone, itens)
+_callback: Optional[Callable[[str, List[Any]], Awaitable[Any]]] = None
+
+_stats: Dict[str, int] = {
+    "imagens": 0, "duplicadas": 0, "lotes_fechados": 0,
+    "fechados_por_silencio": 0, "fechados_por_limite": 0, "timers_reiniciados": 0
+}
+
+
+class _Lote:
+    """Imagens ainda nao entregues de um telefone"""
+
+    def __init__(self, chave: str):
+        self.chave = chave
+        self.itens: List[Any] = []
+        self.jobs: List[Any] = []
+        self.urls: set = set()
+        self.timer: Optional[asyncio.Task] = None
+        self.fechado = False
+
+
+_lotes: Dict[str, _Lote] = {}
+
+# URLs de lotes ja fechados: {phone: {url: fechado_em}}
+_urls_fechadas: Dict[str, Dict[str, float]] = {}
+
+
+def registrar_callback(callback: Callable[[str, List[Any]], Awaitable[Any]]):
+    """Define a funcao chamada com (phone, itens) quando um lote fecha"""
+    global _callback
+    _callback = callback
+
+
+def _url_recente(phone: str, url: str) -> bool:
+    fechada_em = _urls_fechadas.get(phone, {}).get(url)
+    return fechada_em is not None and time.time() - fechada_em < IMAGE_BATCH_DEDUP_SEGUNDOS
+
+
+def _limpar_urls_fechadas():
+    limite = time.time() - IMAGE_BATCH_DEDUP_SEGUNDOS
+    for phone in list(_urls_fechadas.keys()):
+        urls = {u: t for u, t in _urls_fechadas[phone].items() if t >= limite}
+        if urls:
+            _urls_fechadas[phone] = urls
+        else:
+            del _urls_fechadas[phone]
+
+
+def adicionar_imagem(phone: str, item: Any, url: str = "", chave: Optional[str] = None, job: Any = None) -> str:
+    """
+    Adiciona um item ao lote do telefone e reinicia o timer. Retorna
+    ADICIONADA ou DUPLICADA (URL ja vista: o item nao entra no lote).
+    `chave` e a chave do ator na fila de webhooks (padrao: o proprio phone).
+    `job` e o job da fila com conclusao adiada ate o fechamento do lote.
+    """
+    lote = _lotes.get(phone)
+    if url and ((lote and url in lote.urls) or _url_recente(phone, url)):
+        _stats["duplicadas"] += 1
+        logger.warning(f"[LOTE-IMG] Imagem duplicada ignorada para {phone}: {url[:50]}")
+        return DUPLICADA
+
+    if lote is None:
+        lote = _Lote(chave or phone)
+        _lotes[phone] = lote
+
+    lote.itens.append(item)
+    if job is not None:
+        lote.jobs.append(job)
+    if url:
+        lote.urls.add(url)
+    _stats["imagens"] += 1
+
+    if len(lote.itens) >= IMAGE_BATCH_MAX_IMAGENS:
+        _stats["fechados_por_limite"] += 1
+        _fechar(phone, lote)
+        return ADICIONADA
+
+    if lote.timer is not None:
+        lote.timer.cancel()
+        _stats["timers_reiniciados"] += 1
+    lote.timer = asyncio.create_task(_aguardar_silencio(phone, lote))
+    return ADICIONADA
+
+
+async def _aguardar_silencio(phone: str, lote: _Lote):
+    try:
+        await asyncio.sleep(IMAGE_BATCH_JANELA_SEGUNDOS)
+    except asyncio.CancelledError:
+        return
+    _stats["fechados_por_silencio"] += 1
+    _fechar(phone, lote)
+
+
+def _fechar(phone: str, lote: _Lote):
+    """Fecha o lote uma unica vez e agenda o callback na vez do telefone"""
+    # Sem await ate aqui: a checagem e a remocao sao atomicas no event loop
+    if lote.fechado or _lotes.get(phone) is not lote:
+        return
+    lote.fechado = True
+    del _lotes[phone]
+    if lote.timer is not None and lote.timer is not asyncio.current_task():
+        lote.timer.cancel()
+
+    _limpar_urls_fechadas()
+    agora = time.time()
+    _urls_fechadas.setdefault(phone, {}).update({url: agora for url in lote.urls})
+    _stats["lotes_fechados"] += 1
+    logger.info(f"[LOTE-IMG] Lote de {phone} fechado com {len(lote.itens)} imagem(ns)")
+
+    itens, jobs = lote.itens, lote.jobs
+    if _callback is None:
+        logger.error(f"[LOTE-IMG] Nenhum callback registrado - lote de {phone} descartado")
+        asyncio.create_task(concluir_jobs(jobs, "lote de imagens sem callback"))
+        return
+
+    async def _entregar():
+        try:
+            await _callback(phone, itens)
+            await concluir_jobs(jobs)
+        except Exception as e:
+            logger.error(f"[LOTE-IMG] Erro no fechamento do lote de {phone}: {e}")
+            # Jobs vao para o dead-letter (/admin/fila) e podem ser reprocessados
+            await concluir_jobs(jobs, f"fechamento do lote: {e}")
+
+    executar_no_ator(lote.chave, _entregar)
+
+
+def cancelar_lote(phone: str) -> List[Any]:
+    """Descarta o lote aberto do telefone (sem callback) e retorna os itens"""
+    lote = _lotes.pop(phone, None)
+    if lote is None:
+        return []
+    lote.fechado = True
+    if lote.timer is not None:
+        lote.timer.cancel()
+    if lote.jobs:
+        asyncio.create_task(concluir_jobs(lote.jobs))
+    return lote.itens
+
+
+def imagens_no_lote(phone: str) -> int:
+    lote = _lotes.get(phone)
+    return len(lote.itens) if lote else 0
+
+
+def get_image_batch_stats() -> Dict[str, Any]:
+    """Metricas do agrupamento (para endpoints de debug/admin)"""
+    return {
+        "janela_segundos": IMAGE_BATCH_JANELA_SEGUNDOS,
+        "max_imagens": IMAGE_BATCH_MAX_IMAGENS,
+        "lotes_abertos": len(_lotes),
+        **_stats
+    }
@@ -0,0 +1,204 @@
+"""
+============================================================
+PREPARO DE IMAGENS - Normalizacao antes dos modelos de Vision
+============================================================
+A Z-API entrega fotos de celular em resolucao cheia (3000-4000px,
+2-5 MB). Esses bytes iam direto em base64 para o GPT-4o/Claude:
+upload lento, requisicoes enormes e mais tokens de imagem do que
+a leitura de um documento precisa.
+
+Cada imagem passa por um perfil de preparo conforme a tarefa:
+
+- Orientacao EXIF aplicada (foto "deitada" vira a posicao real)
+- Lado maior limitado (legivel para documentos, sem excesso)
+- Escala de cinza opcional ("auto" = so se a foto ja e quase
+  monocromatica, ex: documento preto e branco)
+- JPEG com qualidade do perfil, reduzida aos poucos (e depois a
+  resolucao) ate caber no tamanho alvo
+- Se a original ja e um JPEG pequeno, sem rotacao e dentro do
+  limite, ela e usada como esta
+
+Perfis padrao:
+  - classificacao: identificar tipo de documento / comprovante
+  - extracao: ler nomes, datas e valores (mais resolucao e cor)
+
+Metricas por tarefa: bytes economizados, tempo de preparo, tokens
+de imagem estimados (regra de tiles do GPT-4o) e latencia de
+upload estimada que deixou de existir.
+
+Configuracao:
+  - IMAGE_PREP_ENABLED: "false" envia as imagens originais (padrao true)
+  - IMAGE_PREP_PERFIS: JSON que sobrescreve campos dos perfis, ex:
+    {"extracao": {"max_lado": 2400, "qualidade": 90}}
+  - IMAGE_PREP_UPLOAD_KBPS: banda de upload para estimar a latencia (padrao 1000)
+============================================================
+"""
+
+import os
+import json
+import math
+import time
+import logging
+from io import BytesIO
+from collections import deque
+from typing import Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() == "true"
+IMAGE_PREP_UPLOAD_KBPS = float(os.getenv("IMAGE_PREP_UPLOAD_KBPS", "1000"))
+
+PERFIS: Dict[str, Dict[str, Any]] = {
+    "classificacao": {"max_lado": 1024, "cinza": "auto", "qualidade": 70, "qualidade_min": 45, "alvo_kb": 180},
+    "extracao": {"max_lado": 2048, "cinza": False, "qualidade": 85, "qualidade_min": 60, "alvo_kb": 700},
+}
+
+try:
+    for _tarefa, _campos in json.loads(os.getenv("IMAGE_PREP_PERFIS", "") or "{}").items():
+        PERFIS.setdefault(_tarefa, dict(PERFIS["extracao"])).update(_campos)
+except Exception as e:
+    logger.error(f"[IMG-PREP] IMAGE_PREP_PERFIS invalido, usando perfis padrao: {e}")
+
+# Saturacao media (0-255) abaixo da qual a foto e tratada como documento P&B
+LIMIAR_SATURACAO_CINZA = 18
+
+_stats: Dict[str, Dict[str, float]] = {}
+_recentes: deque = deque(maxlen=50)
+
+
+def _stats_for(tarefa: str) -> Dict[str, float]:
+    if tarefa not in _stats:
+        _stats[tarefa] = {
+            "imagens": 0, "mantidas_originais": 0, "convertidas_cinza": 0, "erros": 0,
+            "bytes_entrada": 0, "bytes_saida": 0, "tokens_entrada": 0, "tokens_saida": 0,
+            "ms_preparo": 0.0, "ms_upload_economizados": 0.0
+        }
+    return _stats[tarefa]
+
+
+def tokens_visao(largura: int, altura: int) -> int:
+    """Tokens estimados de uma imagem no GPT-4o (detail high): 85 + 170 por tile de 512px"""
+    if not largura or not altura:
+        return 0
+    escala = min(1.0, 2048 / max(largura, altura))
+    largura, altura = largura * escala, altura * escala
+    escala = min(1.0, 768 / min(largura, altura))
+    largura, altura = largura * escala, altura * escala
+    return 85 + 170 * math.ceil(largura / 512) * math.ceil(altura / 512)
+
+
+def _quase_monocromatica(imagem) -> bool:
+    amostra = imagem.convert("RGB").resize((64, 64)).convert("HSV")
+    saturacao = list(amostra.getdata(band=1))
+    return sum(saturacao) / len(saturacao) < LIMIAR_SATURACAO_CINZA
+
+
+def _codificar(imagem, qualidade: int) -> bytes:
+    saida = BytesIO()
+    imagem.save(saida, format="JPEG", quality=qualidade, optimize=True, progressive=True)
+    return saida.getvalue()
+
+
+def _base64_ms(n_bytes: int) -> float:
+    """Tempo estimado de upload do base64 (4/3 dos bytes) na banda configurada"""
+    return (n_bytes * 4 / 3) / (IMAGE_PREP_UPLOAD_KBPS * 1024) * 1000
+
+
+def preparar_imagem(dados: bytes, tarefa: str = "extracao") -> Tuple[bytes, str]:
+    """
+    Normaliza a imagem para a tarefa e retorna (bytes, mime).
+    Sincrono e CPU-bound: chamar via asyncio.to_thread. Em erro
+    (ou desligado) retorna os bytes originais como image/jpeg.
+    """
+    if not IMAGE_PREP_ENABLED:
+        return dados, "image/jpeg"
+
+    from PIL import Image, ImageOps
+
+    perfil = PERFIS.get(tarefa) or PERFIS["extracao"]
+    stats = _stats_for(tarefa)
+    inicio = time.monotonic()
+    try:
+        imagem = Image.open(BytesIO(dados))
+        formato = imagem.format
+        largura_orig, altura_orig = imagem.size
+        orientacao = imagem.getexif().get(0x0112, 1)
+        tokens_entrada = tokens_visao(largura_orig, altura_orig)
+        alvo = perfil["alvo_kb"] * 1024
+
+        if (formato == "JPEG" and orientacao == 1 and len(dados) <= alvo
+                and max(largura_orig, altura_orig) <= perfil["max_lado"]):
+            saida, mime, cinza = dados, "image/jpeg", False
+            stats["mantidas_originais"] += 1
+        else:
+            imagem = ImageOps.exif_transpose(imagem)
+            imagem.thumbnail((perfil["max_lado"], perfil["max_lado"]), Image.LANCZOS)
+
+            cinza = perfil["cinza"] is True or (perfil["cinza"] == "auto" and _quase_monocromatica(imagem))
+            imagem = imagem.convert("L" if cinza else "RGB")
+
+            qualidade = perfil["qualidade"]
+            saida = _codificar(imagem, qualidade)
+            while len(saida) > alvo and qualidade > perfil["qualidade_min"]:
+                qualidade = max(perfil["qualidade_min"], qualidade - 10)
+                saida = _codificar(imagem, qualidade)
+            while len(saida) > alvo and min(imagem.size) > 512:
+                imagem = imagem.resize((int(imagem.width * 0.85), int(imagem.height * 0.85)), Image.LANCZOS)
+                saida = _codificar(imagem, qualidade)
+            mime = "image/jpeg"
+
+            if cinza:
+                stats["convertidas_cinza"] += 1
+
+        largura, altura = Image.open(BytesIO(saida)).size if saida is not dados else (largura_orig, altura_orig)
+        ms_preparo = (time.monotonic() - inicio) * 1000
+        ms_upload = _base64_ms(len(dados)) - _base64_ms(len(saida))
+
+        stats["imagens"] += 1
+        stats["bytes_entrada"] += len(dados)
+        stats["bytes_saida"] += len(saida)
+        stats["tokens_entrada"] += tokens_entrada
+        stats["tokens_saida"] += tokens_visao(largura, altura)
+        stats["ms_preparo"] += ms_preparo
+        stats["ms_upload_economizados"] += ms_upload
+        _recentes.append({
+            "tarefa": tarefa,
+            "original": f"{largura_orig}x{altura_orig}",
+            "final": f"{largura}x{altura}",
+            "cinza": cinza,
+            "bytes_entrada": len(dados),
+            "bytes_saida": len(saida),
+            "ms_preparo": round(ms_preparo, 1),
+            "ms_upload_economizados": round(ms_upload, 1)
+        })
+        logger.info(
+            f"[IMG-PREP] {tarefa}: {largura_orig}x{altura_orig} {len(dados) // 1024}KB -> "
+            f"{largura}x{altura} {len(saida) // 1024}KB em {ms_preparo:.0f}ms"
+        )
+        return saida, mime
+
+    except Exception as e:
+        stats["erros"] += 1
+        logger.error(f"[IMG-PREP] Erro ao preparar imagem ({tarefa}), usando original: {e}")
+        return dados, "image/jpeg"
+
+
+def get_image_prep_stats() -> Dict[str, Any]:
+    """Metricas do preparo por tarefa e ultimas imagens (para endpoints de debug/admin)"""
+    por_tarefa = {}
+    for tarefa, s in _stats.items():
+        por_tarefa[tarefa] = {
+            **s,
+            "bytes_economizados": s["bytes_entrada"] - s["bytes_saida"],
+            "reducao_percentual": round((1 - s["bytes_saida"] / s["bytes_entrada"]) * 100, 1) if s["bytes_entrada"] else 0,
+            "tokens_economizados": s["tokens_entrada"] - s["tokens_saida"],
+            "ms_preparo_medio": round(s["ms_preparo"] / s["imagens"], 1) if s["imagens"] else 0,
+            "ms_latencia_liquida_economizada": round(s["ms_upload_economizados"] - s["ms_preparo"], 1)
+        }
+    return {
+        "habilitado": IMAGE_PREP_ENABLED,
+        "perfis": PERFIS,
+        "upload_kbps_estimado": IMAGE_PREP_UPLOAD_KBPS,
+        "por_tarefa": por_tarefa,
+        "recentes": list(_recentes)
+    }
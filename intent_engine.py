@@ -0,0 +1,417 @@
+"""
+============================================================
+MOTOR DE INTENCOES - Deteccao de palavras-chave em uma passada
+============================================================
+Cada mensagem de texto passava por varios detectores
+(detectar_solicitacao_humano, detectar_pedido_desconto,
+detectar_followup_traducao, detectar_indecisao,
+detectar_conversao, is_system_message...). Cada um fazia o seu
+lower() e varria a propria lista de novo - o de atendente humano
+montava e rodava um re.search por palavra (~40 regex por turno).
+
+Agora as listas ficam numa tabela unica (INTENCOES) e cada
+intencao vira UMA regex de alternancia, compilada no import
+(termos mais longos primeiro). analisar(texto) roda todas as
+intencoes sobre a mensagem e devolve as correspondencias com
+posicao; o resultado fica em cache por texto, entao os varios
+detectores do mesmo turno reaproveitam a mesma varredura.
+
+Modos de casamento:
+- contem:  o termo em qualquer lugar do texto (como `termo in texto`)
+- palavra: o termo inteiro, com \\b nas pontas ("pessoa" nao casa "pessoal")
+- regex:   padroes prontos, sem diferenciar maiusculas, sobre o
+           texto original em minusculas (alertas de sistema)
+
+Texto normalizado e erros de digitacao:
+- contem/palavra rodam sobre text_normalizer.normalizar(texto)
+  (sem acento, casefold, sem emoji, sem letras alongadas). Os
+  termos da tabela ja sao escritos nessa forma - uma entrada
+  cobre "nao"/"não"/"NÃO"
+- Palavras do texto a distancia de edicao 1 de uma palavra de
+  PALAVRAS_CORRIGIVEIS sao corrigidas para ela ("atendnte" ->
+  "atendente"), usando um indice de delecoes montado no import: o
+  custo continua proporcional ao tamanho da mensagem. So quando ha
+  um unico candidato, e nunca quando a diferenca e so no final
+  ("pessoal", "operadora", "humana" nao viram termos)
+- PALAVRAS_CORRIGIVEIS e uma lista explicita de palavras longas
+  sem vizinhas reais. O vocabulario inteiro nao serve: palavras
+  comuns ficam a uma letra de termos ("pegar" -> "pagar", "perto"
+  -> "certo", "acento" -> "aceito", "thinks" -> "thanks") e
+  viravam confirmacoes e agradecimentos falsos
+
+Posicoes sao do texto normalizado e corrigido (ou de texto.lower()
+na intencao "sistema").
+Benchmark contra os detectores antigos: python bench_intents.py
+============================================================
+"""
+
+import re
+import logging
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from text_normalizer import normalizar, distancia_limitada
+
+logger = logging.getLogger(__name__)
+
+# Mensagens distintas com varredura em cache
+CACHE_MENSAGENS = 512
+
+# Correcao de digitacao: distancia maxima
+DISTANCIA_MAX = 1
+
+# Unicas palavras para as quais um erro de digitacao e corrigido: longas e sem
+# palavra real a uma letra de distancia (nada de "pagar", "certo", "aceito",
+# "thanks", "claro" - "pegar", "perto", "acento", "thinks", "caro" existem)
+PALAVRAS_CORRIGIVEIS = frozenset({
+    # Atendimento humano
+    "atendente", "atendimento", "humano", "entende",
+    # Desconto
+    "desconto", "descuento", "discount", "abatimento",
+    # Traducao e pagamento
+    "traducao", "traduccion", "translation", "orcamento",
+    "comprovante", "pagamento", "transferencia", "payment", "receipt", "transaction",
+    # Confirmacao e agradecimento
+    "prosseguir", "continuar", "confirmar", "combinado", "entendido",
+    "perfeito", "perfecto", "beleza", "hagamoslo",
+    "obrigado", "obrigada", "agradeco", "gracias",
+    # Indecisao
+    "expensive", "pesquisando",
+})
+
+_stats: Dict[str, int] = {"mensagens": 0, "palavras_corrigidas": 0}
+
+
+class Correspondencia(NamedTuple):
+    intencao: str
+    termo: str
+    inicio: int
+    fim: int
+
+
+# ============================================================
+# TABELA DE INTENCOES
+# ============================================================
+INTENCOES: Dict[str, Dict] = {
+    # Alertas de sistema (MongoDB Atlas, etc.) que o bot nao deve processar
+    "sistema": {"modo": "regex", "termos": [
+        # MongoDB Atlas Alerts
+        r"ALERT:",
+        r"Query Targeting",
+        r"Scanned Objects",
+        r"View Metrics",
+        r"Acknowledge Alert",
+        r"mongodb\.com",
+        r"cluster\d+",
+        r"atlas",
+        # General system patterns
+        r"^\[SYSTEM\]",
+        r"^\[ALERTA\]",
+        r"^NOTIFICATION:",
+        r"^NOTIFICAÇÃO:",
+    ]},
+
+    # Termos de contem/palavra escritos na forma normalizada (sem acento, minusculas)
+
+    # Cliente pedindo atendente humano (palavra inteira: evita falsos positivos)
+    "humano": {"modo": "palavra", "termos": [
+        # Palavras principais
+        "atendente", "humano", "pessoa", "operador",
+        # Nomes dos atendentes
+        "beatriz", "eduarda",
+        # Frases comuns
+        "falar com alguem",
+        "falar com humano", "falar com atendente",
+        "falar com uma pessoa", "falar com pessoa",
+        "atendimento humano", "atendente humano",
+        "quero falar", "preciso falar",
+        "quero um atendente", "quero atendente",
+        "preciso de atendente", "preciso atendente",
+        "transferir", "transfere",
+        # English
+        "speak with someone", "talk to someone", "human agent",
+        "real person", "speak to a person", "talk to a person",
+        # Variações de frustração
+        "nao entende",
+        "nao esta entendendo",
+        "quero pessoa real", "pessoa de verdade",
+        "falar com gente", "alguem real"
+    ]},
+
+    "desconto": {"modo": "contem", "termos": [
+        # Portugues
+        "desconto", "abatimento", "reduzir o valor", "reduzir o preco",
+        "mais barato", "baixar o preco",
+        "abaixar o valor", "abaixar o preco",
+        "diminuir o valor", "diminuir o preco",
+        "valor menor", "preco menor",
+        "tem como diminuir", "fazer por menos",
+        "preco melhor", "valor melhor",
+        "condicao especial",
+        "muito caro", "achei caro", "caro demais",
+        # English
+        "discount", "lower price", "cheaper", "reduce the price",
+        "better price", "price match", "any deals",
+        "too expensive", "can you do less",
+        # Spanish
+        "descuento", "rebaja", "reducir el precio", "mas barato",
+        "muy caro", "demasiado caro"
+    ]},
+
+    # Status de traducao ja paga ("nao recebi a traducao", "cadê minha traducao")
+    "followup_traducao": {"modo": "contem", "termos": [
+        # Portugues - nao recebeu
+        "nao recebi a traducao",
+        "ainda nao recebi",
+        "nao recebi ainda",
+        "nao chegou a traducao",
+        "cade a traducao",
+        "quando vou receber", "quando recebo",
+        "minha traducao",
+        "verificar se foi enviada", "verificar se a traducao",
+        "status da traducao",
+        "prazo da traducao",
+        "ja foi enviada",
+        "ja enviaram",
+        "esta pronta", "ta pronta",
+        "ficou pronta", "ja ficou",
+        # English
+        "didn't receive the translation", "didnt receive the translation",
+        "haven't received", "havent received",
+        "did not receive", "not received yet",
+        "where is my translation", "translation status",
+        "when will i receive", "is it ready",
+        "has it been sent", "was it sent",
+        "still waiting for the translation", "waiting for my translation",
+        # Spanish
+        "no recibi la traduccion",
+        "aun no recibi",
+        "donde esta mi traduccion",
+        "ya fue enviada", "esta lista"
+    ]},
+
+    # Confirmacao de prosseguimento (etapa AGUARDANDO_CONFIRMACAO)
+    "confirmacao": {"modo": "contem", "termos": [
+        "vou prosseguir", "pode prosseguir", "pode fazer", "pode iniciar",
+        "vamos continuar", "pode dar andamento", "confirmo", "ok, pode seguir",
+        "quero prosseguir", "pode comecar", "seguimos com a traducao",
+        "vamos fazer", "pode seguir", "confirmar",
+        "quero fazer", "vou fazer", "sim, pode", "sim pode", "fechado", "fechar",
+        "vamos fechar", "aceito", "aceitar", "concordo", "let's do it", "let's proceed",
+        "yes", "yes please", "go ahead", "proceed", "confirm", "i confirm",
+        # Confirmacoes coloquiais em portugues
+        "podemo", "podemos", "vamo", "vamos", "bora", "claro", "claro que sim",
+        "com certeza", "pode sim", "sim", "isso", "isso mesmo", "certo", "perfeito",
+        "beleza", "blz", "ok", "okay", "tudo bem", "ta bom", "pode ser",
+        "prosseguir", "continuar", "continuidade", "dar continuidade",
+        "fazendo o pagamento", "vou pagar", "vou enviar", "estou fazendo",
+        # Confirmacoes em espanhol
+        "si", "dale", "claro que si", "por supuesto", "de acuerdo",
+        "perfecto", "listo", "va", "hagamoslo", "adelante",
+        # Confirmacoes em ingles
+        "sure", "absolutely", "of course", "sounds good", "let's go",
+        "i'll pay", "i will pay", "making the payment", "sending payment",
+        "paying now", "i agree", "deal", "perfect", "great", "alright"
+    ]},
+
+    "comprovante": {"modo": "contem", "termos": [
+        "comprovante", "pagamento", "pago", "paid", "receipt", "transaction",
+        "transfer", "venmo", "zelle", "cashapp", "paypal", "bank", "transferencia",
+        "pix", "deposito", "amount", "total",
+        "confirmation", "ref", "transaction id"
+    ]},
+
+    # Indecisao ou pesquisa de preco
+    "indecisao": {"modo": "contem", "termos": [
+        # Portugues
+        "vou pensar", "ta caro", "esta caro",
+        "estou pesquisando", "outro orcamento",
+        "preco alto", "vou ver", "comparar",
+        "muito caro", "caro demais", "pensar melhor", "vou avaliar",
+        "pesquisar mais", "outros precos",
+        "vou consultar", "deixa eu ver", "preciso pensar",
+        "nao sei se", "achei caro", "valor alto",
+        # English
+        "shopping around", "too expensive", "other quotes",
+        "thinking about it", "let me check", "too much",
+        "a bit expensive", "expensive", "other options",
+        "i'll think", "i will think", "need to think",
+        "comparing prices", "compare prices", "checking other",
+        "let me think", "not sure if", "seems expensive",
+        "high price", "pricey",
+        # Espanhol
+        "voy a pensar", "muy caro", "demasiado caro",
+        "estoy buscando", "otros presupuestos", "precio alto",
+        "voy a ver", "comparar precios", "dejame ver",
+        "necesito pensar", "no estoy seguro"
+    ]},
+
+    # Pagamento realizado (conversao)
+    "conversao": {"modo": "contem", "termos": [
+        "paguei", "transferi", "pix", "pagamento", "transferencia", "depositei", "enviei o pagamento"
+    ]},
+
+    # Turnos curtos respondidos sem IA (response_router, camada deterministica)
+    "agradecimento": {"modo": "palavra", "termos": [
+        "obrigado", "obrigada", "obg", "brigado", "brigada", "valeu", "vlw", "agradeco",
+        "thanks", "thank you", "thx", "ty",
+        "gracias", "muchas gracias"
+    ]},
+    "saudacao": {"modo": "palavra", "termos": [
+        "oi", "oie", "oii", "ola", "opa", "bom dia", "boa tarde", "boa noite", "tudo bem", "tudo bom",
+        "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
+        "hola", "buenos dias", "buenas tardes", "buenas noches", "que tal"
+    ]},
+    "ok": {"modo": "palavra", "termos": [
+        "ok", "okay", "blz", "beleza", "certo", "entendi", "entendido", "combinado", "perfeito", "otimo",
+        "got it", "alright", "perfect", "great", "sounds good",
+        "vale", "listo", "perfecto", "entiendo", "de acuerdo"
+    ]},
+}
+
+
+def _compilar(config: Dict) -> "re.Pattern":
+    """Uma regex de alternancia por intencao (termos mais longos primeiro)"""
+    if config["modo"] == "regex":
+        return re.compile("|".join(f"(?:{p})" for p in config["termos"]), re.IGNORECASE)
+
+    termos = sorted({normalizar(t) for t in config["termos"]}, key=len, reverse=True)
+    alternancia = "|".join(re.escape(t) for t in termos)
+    if config["modo"] == "palavra":
+        return re.compile(rf"\b(?:{alternancia})\b")
+    return re.compile(alternancia)
+
+
+_PADROES: Dict[str, "re.Pattern"] = {nome: _compilar(config) for nome, config in INTENCOES.items()}
+_PALAVRA = re.compile(r"\w+")
+
+
+def _delecoes(palavra: str) -> Set[str]:
+    return {palavra[:i] + palavra[i + 1:] for i in range(len(palavra))}
+
+
+# Vocabulario das intencoes e indice de delecoes (palavra e variacoes sem uma letra -> palavras)
+_VOCABULARIO: Set[str] = {
+    palavra
+    for config in INTENCOES.values() if config["modo"] != "regex"
+    for termo in config["termos"]
+    for palavra in _PALAVRA.findall(normalizar(termo))
+}
+_INDICE_DELECOES: Dict[str, Set[str]] = {}
+for _palavra in PALAVRAS_CORRIGIVEIS & _VOCABULARIO:
+    for _variacao in _delecoes(_palavra) | {_palavra}:
+        _INDICE_DELECOES.setdefault(_variacao, set()).add(_palavra)
+_TAMANHO_MIN_CORRIGIVEL = min(len(p) for p in PALAVRAS_CORRIGIVEIS) - DISTANCIA_MAX
+
+
+def _variacao_no_final(a: str, b: str) -> bool:
+    """Diferenca so nas ultimas letras: flexao ("pessoal", "humana"), nao erro de digitacao"""
+    return a.startswith(b) or b.startswith(a) or a[:-2] == b[:-2]
+
+
+# Palavras longas so aceitam troca/transposicao de letras: com uma letra a mais ou a
+# menos costumam ser outra flexao ("combinando" -> "combinado")
+_TAMANHO_SO_TROCA = 8
+
+
+def _edicao_permitida(a: str, b: str) -> bool:
+    return len(b) < _TAMANHO_SO_TROCA or len(a) == len(b)
+
+
+@lru_cache(maxsize=4096)
+def _corrigir_palavra(palavra: str) -> str:
+    """Palavra de PALAVRAS_CORRIGIVEIS a distancia <= DISTANCIA_MAX, se houver exatamente uma"""
+    if palavra in _VOCABULARIO or len(palavra) < _TAMANHO_MIN_CORRIGIVEL:
+        return palavra
+    candidatos: Set[str] = set()
+    for variacao in _delecoes(palavra) | {palavra}:
+        candidatos |= _INDICE_DELECOES.get(variacao, set())
+    validos = [
+        c for c in candidatos
+        if not _variacao_no_final(palavra, c) and _edicao_permitida(palavra, c)
+        and distancia_limitada(palavra, c, DISTANCIA_MAX) <= DISTANCIA_MAX
+    ]
+    return validos[0] if len(validos) == 1 else palavra
+
+
+def _corrigir(texto: str) -> str:
+    def _troca(m: "re.Match") -> str:
+        correta = _corrigir_palavra(m.group(0))
+        if correta != m.group(0):
+            _stats["palavras_corrigidas"] += 1
+        return correta
+    return _PALAVRA.sub(_troca, texto)
+
+
+@lru_cache(maxsize=CACHE_MENSAGENS)
+def texto_canonico(texto: str) -> str:
+    """Texto normalizado e com erros de digitacao corrigidos (o que as intencoes veem)"""
+    return _corrigir(normalizar(texto))
+
+
+@lru_cache(maxsize=CACHE_MENSAGENS)
+def analisar(texto: str) -> Dict[str, Tuple[Correspondencia, ...]]:
+    """
+    Todas as intencoes encontradas no texto, com as correspondencias
+    (termo e posicao). Intencoes sem correspondencia nao aparecem.
+    O retorno e compartilhado pelo cache: nao alterar.
+    """
+    if not texto:
+        return {}
+    _stats["mensagens"] += 1
+    texto_lower = texto.lower()
+    canonico = texto_canonico(texto)
+    encontradas: Dict[str, Tuple[Correspondencia, ...]] = {}
+    for nome, padrao in _PADROES.items():
+        alvo = texto_lower if INTENCOES[nome]["modo"] == "regex" else canonico
+        correspondencias = tuple(
+            Correspondencia(nome, m.group(0), m.start(), m.end())
+            for m in padrao.finditer(alvo)
+        )
+        if correspondencias:
+            encontradas[nome] = correspondencias
+    return encontradas
+
+
+def tem_intencao(texto: str, intencao: str) -> bool:
+    return intencao in analisar(texto)
+
+
+def termos_encontrados(texto: str, intencao: str) -> List[str]:
+    """Termos distintos da intencao presentes no texto, na ordem em que aparecem"""
+    vistos: List[str] = []
+    for c in analisar(texto).get(intencao, ()):
+        if c.termo not in vistos:
+            vistos.append(c.termo)
+    return vistos
+
+
+def texto_restante(texto: str, intencoes: Tuple[str, ...]) -> str:
+    """Texto canonico sem os trechos que casaram com as intencoes dadas"""
+    canonico = texto_canonico(texto)
+    trechos = sorted(
+        (c for nome in intencoes for c in analisar(texto).get(nome, ()) if nome != "sistema"),
+        key=lambda c: c.inicio
+    )
+    partes, posicao = [], 0
+    for c in trechos:
+        if c.inicio >= posicao:
+            partes.append(canonico[posicao:c.inicio])
+            posicao = c.fim
+    partes.append(canonico[posicao:])
+    return " ".join(" ".join(partes).split())
+
+
+def get_intent_stats() -> Dict:
+    """Tamanho das tabelas e uso do cache (para endpoints de debug/admin)"""
+    info = analisar.cache_info()
+    consultas = info.hits + info.misses
+    return {
+        "intencoes": {nome: len(config["termos"]) for nome, config in INTENCOES.items()},
+        "vocabulario": len(_VOCABULARIO),
+        **_stats,
+        "cache_hits": info.hits,
+        "cache_misses": info.misses,
+        "cache_hit_rate": round(info.hits / consultas * 100, 1) if consultas else 0,
+        "cache_tamanho": info.currsize
+    }
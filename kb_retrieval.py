@@ -0,0 +1,178 @@
+"""
+============================================================
+BUSCA NA BASE DE CONHECIMENTO - BM25 sobre KB e FAQs
+============================================================
+Em vez de colocar TODA a base de conhecimento e TODAS as FAQs no
+system prompt (tokens crescem a cada item cadastrado), cada
+mensagem recebe apenas os itens mais relevantes.
+
+- Indice BM25 em Python puro, sem dependencias externas
+- Reconstruido quando o treinamento muda (via training_cache)
+- Bases pequenas (ate KB_RETRIEVAL_TOP_K itens) entram inteiras
+- Economia de tokens registrada por requisicao (log + metricas)
+
+Configuracao:
+  - KB_RETRIEVAL_ENABLED: "false" desliga a busca e volta ao prompt completo
+  - KB_RETRIEVAL_TOP_K: itens por mensagem (padrao 6)
+============================================================
+"""
+
+import os
+import re
+import math
+import logging
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+KB_RETRIEVAL_ENABLED = os.getenv("KB_RETRIEVAL_ENABLED", "true").lower() == "true"
+KB_RETRIEVAL_TOP_K = int(os.getenv("KB_RETRIEVAL_TOP_K", "6"))
+
+# Parametros classicos do BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Palavras muito comuns (pt/en/es) que nao ajudam a achar o item certo
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "para", "por", "com", "que", "se", "eu", "voce", "voces", "me", "meu", "minha",
+    "ao", "aos", "the", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "it", "you",
+    "i", "my", "el", "la", "los", "las", "y", "en", "un", "una", "es", "con", "mi", "tu"
+}
+
+# Metricas acumuladas de economia
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Minusculas, sem acentos, apenas palavras com 2+ letras e fora das stopwords"""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return [t for t in re.findall(r"[a-z0-9]+", texto) if len(t) > 1 and t not in STOPWORDS]
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa de tokens (~4 caracteres por token)"""
+    return max(1, len(texto) // 4) if texto else 0
+
+
+class IndiceConhecimento:
+    """Indice BM25 sobre os itens da base de conhecimento e FAQs do bot"""
+
+    def __init__(self, knowledge_base: List[dict], faqs: List[dict]):
+        self.itens: List[Dict[str, Any]] = []
+
+        for item in knowledge_base or []:
+            titulo = item.get("title") or item.get("titulo") or "Info"
+            conteudo = item.get("content") or item.get("conteudo") or ""
+            self.itens.append({
+                "tipo": "kb",
+                "texto": f"**{titulo}:**\n{conteudo}",
+                # Titulo conta em dobro
+                "termos": tokenizar(titulo) * 2 + tokenizar(conteudo)
+            })
+
+        for item in faqs or []:
+            pergunta = item.get("question") or item.get("pergunta") or ""
+            resposta = item.get("answer") or item.get("resposta") or ""
+            self.itens.append({
+                "tipo": "faq",
+                "texto": f"P: {pergunta}\nR: {resposta}",
+                "termos": tokenizar(pergunta) * 2 + tokenizar(resposta)
+            })
+
+        self._freqs = [Counter(item["termos"]) for item in self.itens]
+        self._tamanhos = [len(item["termos"]) for item in self.itens]
+        self._media = (sum(self._tamanhos) / len(self._tamanhos)) if self._tamanhos else 0.0
+
+        # IDF por termo
+        df: Counter = Counter()
+        for freq in self._freqs:
+            df.update(freq.keys())
+        n = len(self.itens)
+        self._idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+
+        self.tokens_total = sum(estimar_tokens(item["texto"]) for item in self.itens)
+
+    def __len__(self) -> int:
+        return len(self.itens)
+
+    def buscar(self, consulta: str, k: int) -> List[int]:
+        """Indices dos k itens mais relevantes (score > 0), em ordem de relevancia"""
+        termos = set(tokenizar(consulta))
+        if not termos or not self.itens:
+            return []
+
+        scores = []
+        for i, freq in enumerate(self._freqs):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._tamanhos[i] / (self._media or 1))
+            for termo in termos:
+                tf = freq.get(termo)
+                if tf:
+                    score += self._idf[termo] * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((score, i))
+
+        scores.sort(reverse=True)
+        return [i for _, i in scores[:k]]
+
+
+def montar_secoes(indice: IndiceConhecimento, selecionados: List[int]) -> str:
+    """Monta as secoes BASE DE CONHECIMENTO / PERGUNTAS FREQUENTES com os itens escolhidos"""
+    kb = [indice.itens[i]["texto"] for i in selecionados if indice.itens[i]["tipo"] == "kb"]
+    faqs = [indice.itens[i]["texto"] for i in selecionados if indice.itens[i]["tipo"] == "faq"]
+    partes = []
+    if kb:
+        partes.append("**BASE DE CONHECIMENTO:**\n" + "\n\n".join(kb))
+    if faqs:
+        partes.append("**PERGUNTAS FREQUENTES:**\n" + "\n\n".join(faqs))
+    return "\n\n".join(partes)
+
+
+def montar_prompt_relevante(canal: str, prompt_base: str, indice: Optional[IndiceConhecimento], consulta: str) -> str:
+    """
+    Junta o prompt base (personalidade/regras) com os itens relevantes para a consulta.
+    Registra a economia de tokens em relacao ao prompt com a base completa.
+    """
+    if indice is None or len(indice) == 0:
+        return prompt_base
+
+    if len(indice) <= KB_RETRIEVAL_TOP_K:
+        selecionados = list(range(len(indice)))
+    else:
+        selecionados = indice.buscar(consulta, KB_RETRIEVAL_TOP_K)
+
+    secoes = montar_secoes(indice, selecionados)
+    prompt = f"{prompt_base}\n\n{secoes}" if secoes else prompt_base
+
+    tokens_usados = sum(estimar_tokens(indice.itens[i]["texto"]) for i in selecionados)
+    economia = indice.tokens_total - tokens_usados
+    pct = (economia / indice.tokens_total * 100) if indice.tokens_total else 0
+
+    s = _stats.setdefault(canal, {"requests": 0, "tokens_total": 0, "tokens_usados": 0})
+    s["requests"] += 1
+    s["tokens_total"] += indice.tokens_total
+    s["tokens_usados"] += tokens_usados
+
+    logger.info(
+        f"[KB-BUSCA] {canal}: {len(selecionados)}/{len(indice)} itens, "
+        f"~{tokens_usados} tokens de conhecimento (economia ~{economia} tokens, {pct:.0f}%)"
+    )
+    return prompt
+
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    """Economia acumulada por canal (para endpoints de debug/admin)"""
+    canais = {}
+    for canal, s in _stats.items():
+        economia = s["tokens_total"] - s["tokens_usados"]
+        canais[canal] = {
+            "requests": s["requests"],
+            "tokens_economizados": economia,
+            "economia_media_por_request": round(economia / s["requests"]) if s["requests"] else 0,
+            "economia_pct": round(economia / s["tokens_total"] * 100, 1) if s["tokens_total"] else 0
+        }
+    return {"enabled": KB_RETRIEVAL_ENABLED, "top_k": KB_RETRIEVAL_TOP_K, "canais": canais}
@@ -0,0 +1,160 @@
+"""
+============================================================
+IDENTIFICACAO DE IDIOMA - N-gramas de caracteres (pt/en/es)
+============================================================
+detectar_idioma contava palavras tipicas de tres listas curtas
+e caia em portugues quando empatava. Mensagens curtas ("ok",
+"thanks!", "dale") e palavras que nao estavam nas listas eram
+classificadas errado, o estado do cliente ficava com o idioma
+errado e process_message_with_ai forcava esse idioma na resposta.
+
+Agora o idioma vem de um classificador Naive Bayes sobre
+n-gramas de caracteres (1 a 3 letras, com as bordas das
+palavras), com perfis treinados por train_language_id.py e
+gravados em language_id_profile.json (ao lado deste modulo):
+
+- identificar_idioma(texto) -> Deteccao(idioma, confianca, confiavel)
+- confianca e a probabilidade do idioma escolhido (0 a 1);
+  confiavel = confianca >= IDIOMA_CONFIANCA_MIN e texto com
+  letras suficientes. Quem chama so troca o idioma do cliente
+  quando a deteccao e confiavel
+- Acentos ajudam ("não", "traducción"), mas o perfil tambem foi
+  treinado sem acento, como os clientes escrevem no celular
+- Uma consulta ao dicionario por n-grama; resultado em cache por
+  texto
+
+Usado pelo texto e audio do WhatsApp (main.py) e pelo WebChat.
+
+Configuracao:
+  - IDIOMA_CONFIANCA_MIN: confianca minima para trocar o idioma (padrao 0.9)
+============================================================
+"""
+
+import os
+import re
+import json
+import math
+import time
+import logging
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDIOMA_CONFIANCA_MIN = float(os.getenv("IDIOMA_CONFIANCA_MIN", "0.9"))
+
+ARQUIVO_PERFIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "language_id_profile.json")
+
+IDIOMAS = ("pt", "en", "es")
+IDIOMA_PADRAO = "pt"
+
+# Tamanhos de n-grama usados no treino e na deteccao
+ORDENS = (1, 2, 3)
+
+# Abaixo disso ("ok", "k") nenhuma deteccao e confiavel
+LETRAS_MIN = 3
+
+# Os n-gramas de 1, 2 e 3 letras se sobrepoem (nao sao independentes);
+# sem esse fator a probabilidade satura em 1.0 ja na segunda palavra
+FATOR_INDEPENDENCIA = 1 / len(ORDENS)
+
+# Mensagens distintas com deteccao em cache
+CACHE_DETECCOES = 1024
+
+_APOSTROFOS = str.maketrans({"’": "'", "‘": "'", "´": "'", "`": "'"})
+_NAO_LETRA = re.compile(r"[^\w']+|[\d_]+")
+_LETRA_REPETIDA = re.compile(r"(\w)\1{2,}")
+
+
+class Deteccao(NamedTuple):
+    idioma: str
+    confianca: float
+    confiavel: bool
+
+
+# {ngrama: (logp_pt, logp_en, logp_es)} e logp dos n-gramas fora do perfil
+_tabela: Dict[str, Tuple[float, ...]] = {}
+_piso: Tuple[float, ...] = ()
+
+_stats: Dict[str, float] = {"deteccoes": 0, "confiaveis": 0, "us_total": 0.0, **{i: 0 for i in IDIOMAS}}
+
+
+def preparar(texto: str) -> List[str]:
+    """Palavras do texto em minusculas, so letras (acentos mantidos), sem alongamento"""
+    texto = _LETRA_REPETIDA.sub(r"\1", texto.translate(_APOSTROFOS).casefold())
+    return _NAO_LETRA.sub(" ", texto).split()
+
+
+def ngramas(palavras: List[str]) -> List[str]:
+    """N-gramas de caracteres de cada palavra com as bordas (" de ", " d", "e ")"""
+    resultado = []
+    for palavra in palavras:
+        palavra = f" {palavra} "
+        for n in ORDENS:
+            resultado.extend(palavra[i:i + n] for i in range(len(palavra) - n + 1) if palavra[i:i + n] != " ")
+    return resultado
+
+
+def carregar_perfil(caminho: str = ARQUIVO_PERFIL) -> bool:
+    """Le os perfis treinados; sem perfil toda deteccao retorna o idioma padrao sem confianca"""
+    global _tabela, _piso
+    try:
+        with open(caminho, encoding="utf-8") as arquivo:
+            perfil = json.load(arquivo)
+        pisos = [perfil["piso"][idioma] for idioma in IDIOMAS]
+        tabela: Dict[str, Tuple[float, ...]] = {}
+        for ngrama in set().union(*(perfil["perfis"][idioma] for idioma in IDIOMAS)):
+            tabela[ngrama] = tuple(
+                perfil["perfis"][idioma].get(ngrama, piso) for idioma, piso in zip(IDIOMAS, pisos)
+            )
+        _tabela, _piso = tabela, tuple(pisos)
+        identificar_idioma.cache_clear()
+        logger.info(f"[IDIOMA] Perfil carregado: {len(tabela)} n-gramas")
+        return True
+    except Exception as e:
+        logger.error(f"[IDIOMA] Erro ao carregar perfil {caminho}: {e}")
+        return False
+
+
+@lru_cache(maxsize=CACHE_DETECCOES)
+def identificar_idioma(texto: str) -> Deteccao:
+    """Idioma (pt, en, es) mais provavel do texto e a confianca da escolha"""
+    inicio = time.perf_counter()
+    palavras = preparar(texto or "")
+    if not _tabela or sum(len(p) for p in palavras) < LETRAS_MIN:
+        return Deteccao(IDIOMA_PADRAO, 0.0, False)
+
+    pontos = [0.0] * len(IDIOMAS)
+    for ngrama in ngramas(palavras):
+        logps = _tabela.get(ngrama, _piso)
+        for i, logp in enumerate(logps):
+            pontos[i] += logp
+
+    # Softmax dos log-verossimilhancas (prior uniforme)
+    maximo = max(pontos)
+    pesos = [math.exp((p - maximo) * FATOR_INDEPENDENCIA) for p in pontos]
+    melhor = pontos.index(maximo)
+    confianca = round(pesos[melhor] / sum(pesos), 3)
+    deteccao = Deteccao(IDIOMAS[melhor], confianca, confianca >= IDIOMA_CONFIANCA_MIN)
+
+    _stats["deteccoes"] += 1
+    _stats["confiaveis"] += deteccao.confiavel
+    _stats[deteccao.idioma] += 1
+    _stats["us_total"] += (time.perf_counter() - inicio) * 1e6
+    return deteccao
+
+
+def get_idioma_stats() -> Dict[str, float]:
+    """Deteccoes por idioma e tempo medio (para endpoints de debug/admin)"""
+    deteccoes = _stats["deteccoes"]
+    return {
+        "ngramas_perfil": len(_tabela),
+        "confianca_min": IDIOMA_CONFIANCA_MIN,
+        **_stats,
+        "us_total": round(_stats["us_total"], 1),
+        "us_medio": round(_stats["us_total"] / deteccoes, 1) if deteccoes else 0,
+        "cache": identificar_idioma.cache_info()._asdict()
+    }
+
+
+carregar_perfil()
@@ -0,0 +1,156 @@
+"""
+============================================================
+GATEWAY LLM - Chamadas assincronas para OpenAI e Anthropic
+============================================================
+Todas as chamadas de IA (GPT-4o, Vision, Whisper, Claude) passam
+por aqui, para nao bloquear o event loop do webhook.
+
+- Clientes AsyncOpenAI / AsyncAnthropic compartilhados
+- Concorrencia limitada por semaforo (evita estourar rate limit)
+- Timeout por chamada com cancelamento real da requisicao
+- Contadores simples por tarefa (chamadas, timeouts, erros)
+
+Configuracao:
+  - LLM_MAX_CONCURRENCY: chamadas simultaneas (padrao 8)
+  - LLM_TIMEOUT_SECONDS: timeout padrao por chamada (padrao 60)
+  - LLM_AUDIO_TIMEOUT_SECONDS: timeout do Whisper (padrao 120)
+============================================================
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from openai import AsyncOpenAI
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_AUDIO_TIMEOUT_SECONDS = float(os.getenv("LLM_AUDIO_TIMEOUT_SECONDS", "120"))
+
+# Clientes compartilhados (retries internos do SDK ficam dentro do timeout do gateway)
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=2)
+anthropic_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""), max_retries=2)
+
+# Semaforo criado sob demanda (precisa existir dentro do event loop)
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+# Metricas por tarefa: {task: {"calls", "timeouts", "errors", "cancelled", "total_ms"}}
+_llm_stats: Dict[str, Dict[str, float]] = {}
+_llm_in_flight: int = 0
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
+
+def _stats_for(task: str) -> Dict[str, float]:
+    if task not in _llm_stats:
+        _llm_stats[task] = {"calls": 0, "timeouts": 0, "errors": 0, "cancelled": 0, "total_ms": 0.0}
+    return _llm_stats[task]
+
+
+async def _run(task: str, timeout: float, coro_factory):
+    """
+    Executa uma chamada de IA respeitando o semaforo e o timeout.
+    O tempo de espera na fila do semaforo conta no timeout, assim o
+    chamador nunca espera mais que `timeout` segundos no total.
+    Em timeout ou cancelamento a requisicao HTTP em andamento e cancelada.
+    """
+    stats = _stats_for(task)
+    stats["calls"] += 1
+    inicio = time.monotonic()
+
+    async def _guarded():
+        global _llm_in_flight
+        async with _get_semaphore():
+            _llm_in_flight += 1
+            try:
+                return await coro_factory()
+            finally:
+                _llm_in_flight -= 1
+
+    try:
+        return await asyncio.wait_for(_guarded(), timeout=timeout)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        logger.error(f"[LLM] Timeout em '{task}' apos {timeout:.0f}s")
+        raise
+    except asyncio.CancelledError:
+        stats["cancelled"] += 1
+        logger.warning(f"[LLM] Chamada '{task}' cancelada")
+        raise
+    except Exception as e:
+        stats["errors"] += 1
+        logger.error(f"[LLM] Erro em '{task}': {e}")
+        raise
+    finally:
+        stats["total_ms"] += (time.monotonic() - inicio) * 1000
+
+
+async def chat_completion(task: str, timeout: Optional[float] = None, **kwargs):
+    """
+    Chat completion OpenAI (texto ou Vision).
+    Aceita os mesmos parametros de client.chat.completions.create.
+    """
+    return await _run(
+        task,
+        timeout or LLM_TIMEOUT_SECONDS,
+        lambda: openai_client.chat.completions.create(**kwargs)
+    )
+
+
+async def transcribe_audio(task: str, timeout: Optional[float] = None, **kwargs):
+    """Transcricao Whisper. Aceita os parametros de client.audio.transcriptions.create."""
+    return await _run(
+        task,
+        timeout or LLM_AUDIO_TIMEOUT_SECONDS,
+        lambda: openai_client.audio.transcriptions.create(**kwargs)
+    )
+
+
+async def claude_message(task: str, timeout: Optional[float] = None, **kwargs):
+    """Mensagem Claude (Anthropic). Aceita os parametros de client.messages.create."""
+    return await _run(
+        task,
+        timeout or LLM_TIMEOUT_SECONDS,
+        lambda: anthropic_client.messages.create(**kwargs)
+    )
+
+
+def get_llm_stats() -> Dict[str, Any]:
+    """Retorna metricas do gateway (para endpoints de debug/admin)"""
+    tarefas = {}
+    for task, s in _llm_stats.items():
+        tarefas[task] = {
+            "calls": int(s["calls"]),
+            "timeouts": int(s["timeouts"]),
+            "errors": int(s["errors"]),
+            "cancelled": int(s["cancelled"]),
+            "avg_ms": round(s["total_ms"] / s["calls"], 1) if s["calls"] else 0
+        }
+    return {
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "in_flight": _llm_in_flight,
+        "timeout_seconds": LLM_TIMEOUT_SECONDS,
+        "tasks": tarefas
+    }
+
+
+async def close_llm_clients():
+    """Fecha as conexoes HTTP dos clientes de IA (chamar no shutdown)"""
+    try:
+        await openai_client.close()
+    except Exception as e:
+        logger.error(f"[LLM] Erro ao fechar cliente OpenAI: {e}")
+    try:
+        await anthropic_client.close()
+    except Exception as e:
+        logger.error(f"[LLM] Erro ao fechar cliente Anthropic: {e}")
@@ -20,8 +20,6 @@ from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import httpx
-from openai import OpenAI
-import anthropic
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorClient
 import logging
@@ -29,7 +27,6 @@ from typing import Optional, Dict, Any, List
 from pydantic import BaseModel
 import traceback
 import json
-import base64
 from io import BytesIO
 import time
 import re
@@ -46,8 +43,37 @@ from admin_conversas_routes import router as conversas_router
 from admin_orcamentos_routes import router as orcamentos_router
 from webchat_routes import router as webchat_router
 from admin_crm_routes import router as crm_router, criar_ou_atualizar_contato
-from google_drive import save_whatsapp_media_to_drive, is_drive_enabled
+from google_drive import (
+    save_whatsapp_media_to_drive, is_drive_enabled, parar_drive_workers, get_drive_stats,
+    aquecer_cache_pastas
+)
 from api_routes import router as api_router
+from admin_fila_routes import router as fila_router
+from admin_cache_routes import router as cache_router
+from webhook_queue import enfileirar_evento, iniciar_workers, parar_workers, chave_ordem, job_atual, adiar_conclusao, enviar_uma_vez
+from image_batch import adicionar_imagem, imagens_no_lote, registrar_callback, get_image_batch_stats, ADICIONADA
+from db_indexes import garantir_indices
+from phone_keys import phone_key, com_phone_key, migrar_phone_keys, is_phone_lid, lid_to_phone_map, telefone_do_evento
+from pdf_engine import fechar_pool, get_pdf_stats
+from media_store import (
+    guardar_midia, obter_bytes, obter_mime, obter_base64_preparada, obter_primeira_pagina_base64,
+    obter_num_paginas, obter_resultado_visao, reter, liberar, get_media_stats
+)
+from image_prep import get_image_prep_stats
+from vision_cache import obter_ou_calcular, versao_prompt, get_visao_cache_stats
+from pipeline_dag import Etapa, reservar_execucao, executar_dag, get_pipeline_stats
+from intent_engine import tem_intencao, termos_encontrados, get_intent_stats
+from language_id import identificar_idioma, get_idioma_stats
+from response_router import rotear_mensagem, registrar_chamada_llm, guardar_resposta_gerada, get_roteamento_stats
+from response_cache import get_respostas_cache_stats
+from doc_fingerprints import buscar_documento, registrar_documento, get_doc_fingerprint_stats
+from document_manifest import analisar_paginas, montar_manifesto, descrever_documentos
+from stats_rollup import registrar_mensagem, registrar_conversao, registrar_orcamento, reconstruir_rollup
+from estado_cache import obter_estado, gravar_estado, turno_estado, get_estado_cache_stats
+from http_clients import get_http_client, iniciar_http_clients, fechar_http_clients, get_http_stats, timeout_do_servico
+from kb_retrieval import IndiceConhecimento, montar_prompt_relevante, get_retrieval_stats, KB_RETRIEVAL_ENABLED
+from training_cache import obter_prompt, obter_artefato, invalidar_treinamento, iniciar_change_stream, parar_change_stream, get_cache_info
+from llm_gateway import chat_completion, transcribe_audio, claude_message, close_llm_clients, get_llm_stats
 
 # ============================================================
 # CONFIGURACAO DE LOGGING
@@ -100,38 +126,18 @@ Nuestro equipo está desconectado en este momento, pero puede hacer su pedido di
 # ============================================================
 # FILTRO DE MENSAGENS DE SISTEMA
 # ============================================================
-SYSTEM_MESSAGE_PATTERNS = [
-    # MongoDB Atlas Alerts
-    r"ALERT:",
-    r"Query Targeting",
-    r"Scanned Objects",
-    r"View Metrics",
-    r"Acknowledge Alert",
-    r"mongodb\.com",
-    r"cluster\d+",
-    r"atlas",
-    # General system patterns
-    r"^\[SYSTEM\]",
-    r"^\[ALERTA\]",
-    r"^NOTIFICATION:",
-    r"^NOTIFICAÇÃO:",
-]
-
 def is_system_message(text: str) -> bool:
     """
     Detecta se a mensagem é um alerta de sistema (MongoDB, etc.)
     Essas mensagens NÃO devem ser processadas pelo bot.
+    Padrões na intenção "sistema" do intent_engine.
     """
     if not text:
         return False
 
-    text_lower = text.lower()
-
-    # Verificar padrões de mensagem de sistema
-    for pattern in SYSTEM_MESSAGE_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            logger.info(f"[FILTRO] Mensagem de sistema detectada: {text[:50]}...")
-            return True
+    if tem_intencao(text, "sistema"):
+        logger.info(f"[FILTRO] Mensagem de sistema detectada: {text[:50]}...")
+        return True
 
     return False
 
@@ -159,11 +165,7 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Clientes
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Cliente Anthropic (Claude) para extracao de dados de documentos
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY", ""))
+# Clientes de IA (OpenAI / Anthropic) ficam no llm_gateway (async, com limite de concorrencia)
 
 # ============================================================
 # CONFIGURACOES DO PORTAL LEGACY
@@ -195,6 +197,46 @@ async def cleanup_kb_origem():
 @app.on_event("startup")
 async def startup_cleanup():
     await cleanup_kb_origem()
+    invalidar_treinamento("startup")
+    iniciar_change_stream()
+
+
+@app.on_event("startup")
+async def startup_indices():
+    await garantir_indices(db)
+    # Backfill unico do phone_key em segundo plano (nao atrasa o startup)
+    asyncio.create_task(migrar_phone_keys(db))
+    # Primeira construcao do rollup de estatisticas (so roda uma vez)
+    asyncio.create_task(reconstruir_rollup())
+
+
+@app.on_event("startup")
+async def startup_http_clients():
+    await iniciar_http_clients()
+
+
+@app.on_event("startup")
+async def startup_webhook_workers():
+    registrar_callback(fechar_lote_imagens)
+    await iniciar_workers(processar_job_webhook)
+    asyncio.create_task(limpar_sessoes_imagem_periodicamente())
+
+
+@app.on_event("startup")
+async def startup_google_drive():
+    # Pastas dos clientes carregadas em segundo plano (nao atrasa o startup)
+    if is_drive_enabled():
+        asyncio.create_task(aquecer_cache_pastas())
+
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    await parar_workers()
+    await parar_change_stream()
+    await close_llm_clients()
+    await fechar_http_clients()
+    fechar_pool()
+    parar_drive_workers()
 
 
 # ============================================================
@@ -217,7 +259,7 @@ MAX_DEBUG_LOG_SIZE = 50  # Manter apenas os ultimos 50 eventos
 # Z-API pode enviar LIDs (Linked IDs) em vez de telefones reais
 # quando fromMe=true. Mantemos um cache para resolver LIDs.
 # ============================================================
-lid_to_phone_map = {}  # {lid_digits: real_phone}
+# lid_to_phone_map fica em phone_keys (compartilhado com a chave da fila)
 MAX_LID_MAP_SIZE = 500
 
 def add_webhook_debug(event_type: str, data: dict):
@@ -302,21 +344,6 @@ def normalizar_telefone_eua(numero: str) -> str:
     return apenas_digitos
 
 
-def is_phone_lid(phone_digits: str) -> bool:
-    """Detecta se um numero e um LID (Linked ID) do WhatsApp/Z-API em vez de telefone real.
-    LIDs sao IDs internos com 14+ digitos que NAO correspondem a numeros de telefone validos.
-    Telefones validos: EUA=11 digitos (1+10), Brasil=12-13 digitos (55+DDD+num)."""
-    if not phone_digits:
-        return True
-    # LIDs tipicamente tem 14+ digitos e NAO comecam com codigo de pais conhecido
-    if len(phone_digits) >= 14:
-        return True
-    # Telefone sem digitos suficientes para ser valido
-    if len(phone_digits) < 10:
-        return True
-    return False
-
-
 async def resolver_phone_de_lid(phone_lid: str) -> Optional[str]:
     """Tenta resolver um LID para o telefone real do cliente.
     Busca em: cache em memoria -> cliente_estados recente -> conversas recentes."""
@@ -494,43 +521,10 @@ ETAPAS = {
     "PAGAMENTO_RECEBIDO": "pagamento_recebido"
 }
 
-# Palavras para detectar confirmacao de prosseguimento
-PALAVRAS_CONFIRMACAO = [
-    "vou prosseguir", "pode prosseguir", "pode fazer", "pode iniciar",
-    "vamos continuar", "pode dar andamento", "confirmo", "ok, pode seguir",
-    "quero prosseguir", "pode começar", "pode comecar", "seguimos com a tradução",
-    "seguimos com a traducao", "vamos fazer", "pode seguir", "confirmar",
-    "quero fazer", "vou fazer", "sim, pode", "sim pode", "fechado", "fechar",
-    "vamos fechar", "aceito", "aceitar", "concordo", "let's do it", "let's proceed",
-    "yes", "yes please", "go ahead", "proceed", "confirm", "i confirm",
-    # Confirmacoes coloquiais em portugues
-    "podemo", "podemos", "vamo", "vamos", "bora", "claro", "claro que sim",
-    "com certeza", "pode sim", "sim", "isso", "isso mesmo", "certo", "perfeito",
-    "beleza", "blz", "ok", "okay", "tudo bem", "ta bom", "tá bom", "pode ser",
-    "prosseguir", "continuar", "continuidade", "dar continuidade",
-    "fazendo o pagamento", "vou pagar", "vou enviar", "estou fazendo",
-    # Confirmacoes em espanhol
-    "si", "sí", "dale", "claro que sí", "por supuesto", "de acuerdo",
-    "perfecto", "listo", "va", "vamos", "hagámoslo", "adelante",
-    # Confirmacoes em ingles
-    "sure", "absolutely", "of course", "sounds good", "let's go",
-    "i'll pay", "i will pay", "making the payment", "sending payment",
-    "paying now", "i agree", "deal", "perfect", "great", "alright"
-]
-
-# Palavras para detectar comprovante de pagamento
-PALAVRAS_COMPROVANTE = [
-    "comprovante", "pagamento", "pago", "paid", "receipt", "transaction",
-    "transfer", "venmo", "zelle", "cashapp", "paypal", "bank", "transferência",
-    "transferencia", "pix", "deposito", "depósito", "amount", "total",
-    "confirmation", "ref", "transaction id"
-]
-
-
 async def get_cliente_estado(phone: str) -> dict:
     """Busca o estado atual do cliente no atendimento"""
     try:
-        estado = await db.cliente_estados.find_one({"phone": phone})
+        estado = await obter_estado(phone)
         if not estado:
             return {
                 "phone": phone,
@@ -557,10 +551,7 @@ async def get_cliente_estado(phone: str) -> dict:
             if any(p in nome_lower for p in palavras_invalidas):
                 estado["nome"] = ""
                 # Limpar no banco tambem
-                await db.cliente_estados.update_one(
-                    {"phone": phone},
-                    {"$set": {"nome": "", "updated_at": datetime.now()}}
-                )
+                await gravar_estado(phone, {"nome": "", "updated_at": datetime.now()})
                 logger.warning(f"[SANITIZE] Nome invalido '{nome}' limpo para {phone}")
 
         return estado
@@ -569,15 +560,18 @@ async def get_cliente_estado(phone: str) -> dict:
         return {"phone": phone, "etapa": ETAPAS["INICIAL"], "idioma": "pt"}
 
 
+async def salvar_conversa(doc: dict):
+    """Grava uma mensagem em conversas (com phone_key) e atualiza o rollup de estatisticas"""
+    result = await db.conversas.insert_one(com_phone_key(doc))
+    await registrar_mensagem(doc)
+    return result
+
+
 async def set_cliente_estado(phone: str, **kwargs):
-    """Atualiza o estado do cliente"""
+    """Atualiza o estado do cliente (agrupado com as demais alteracoes do turno)"""
     try:
         kwargs["updated_at"] = datetime.now()
-        await db.cliente_estados.update_one(
-            {"phone": phone},
-            {"$set": kwargs},
-            upsert=True
-        )
+        await gravar_estado(phone, kwargs)
         logger.info(f"Estado atualizado para {phone}: {kwargs}")
         return True
     except Exception as e:
@@ -586,71 +580,50 @@ async def set_cliente_estado(phone: str, **kwargs):
 
 
 def detectar_idioma(texto: str) -> str:
-    """Detecta idioma do texto (pt, en, es)"""
-    texto_lower = texto.lower()
+    """Detecta idioma do texto (pt, en, es) pelos n-gramas de caracteres (language_id)"""
+    return identificar_idioma(texto).idioma
+
 
-    # Palavras tipicas de cada idioma
-    palavras_pt = ["olá", "ola", "bom dia", "boa tarde", "boa noite", "obrigado", "obrigada",
-                   "por favor", "quero", "preciso", "pode", "gostaria", "como", "quanto"]
-    palavras_en = ["hello", "hi", "good morning", "good afternoon", "thank you", "thanks",
-                   "please", "want", "need", "can", "would", "how", "much", "price"]
-    palavras_es = ["hola", "buenos días", "buenas tardes", "gracias", "por favor",
-                   "quiero", "necesito", "puede", "cuánto", "precio", "traducción"]
+async def get_idioma_salvo(phone: str) -> Optional[str]:
+    """Idioma gravado no estado do cliente (None para cliente novo - sem o padrao "pt")"""
+    try:
+        estado = await obter_estado(phone)
+        return (estado or {}).get("idioma")
+    except Exception as e:
+        logger.error(f"Erro ao buscar idioma salvo: {e}")
+        return None
 
-    # Contar matches
-    count_pt = sum(1 for p in palavras_pt if p in texto_lower)
-    count_en = sum(1 for p in palavras_en if p in texto_lower)
-    count_es = sum(1 for p in palavras_es if p in texto_lower)
 
-    if count_en > count_pt and count_en > count_es:
-        return "en"
-    elif count_es > count_pt and count_es > count_en:
-        return "es"
-    return "pt"
+async def atualizar_idioma_cliente(phone: str, texto: str, estado: Optional[Dict] = None) -> Optional[str]:
+    """
+    Grava no estado o idioma da mensagem, so quando a deteccao e confiavel
+    ("ok", "sim", nomes e numeros nao trocam o idioma da conversa).
+    Retorna o idioma detectado ou None se a deteccao nao foi confiavel.
+    """
+    deteccao = identificar_idioma(texto)
+    if not deteccao.confiavel:
+        return None
+    if estado is None:
+        estado = await get_cliente_estado(phone)
+    if deteccao.idioma != estado.get("idioma"):
+        logger.info(f"[IDIOMA] {phone}: {estado.get('idioma')} -> {deteccao.idioma} (confianca {deteccao.confianca})")
+        await set_cliente_estado(phone, idioma=deteccao.idioma)
+    return deteccao.idioma
 
 
 def detectar_confirmacao_prosseguimento(texto: str) -> bool:
     """Detecta se cliente confirmou que quer prosseguir com o servico"""
-    texto_lower = texto.lower()
-    return any(palavra in texto_lower for palavra in PALAVRAS_CONFIRMACAO)
+    return tem_intencao(texto, "confirmacao")
 
 
 def detectar_possivel_comprovante(texto: str) -> bool:
     """Detecta se texto indica possivel comprovante de pagamento"""
-    texto_lower = texto.lower()
-    return any(palavra in texto_lower for palavra in PALAVRAS_COMPROVANTE)
-
-
-# Palavras/frases que indicam indecisao ou pesquisa de preco
-PALAVRAS_INDECISAO = [
-    # Portugues
-    "vou pensar", "tá caro", "ta caro", "está caro", "esta caro",
-    "estou pesquisando", "outro orçamento", "outro orcamento",
-    "preço alto", "preco alto", "vou ver", "comparar",
-    "muito caro", "caro demais", "pensar melhor", "vou avaliar",
-    "pesquisar mais", "outros precos", "outros preços",
-    "vou consultar", "deixa eu ver", "preciso pensar",
-    "nao sei se", "não sei se", "achei caro", "valor alto",
-    # English
-    "shopping around", "too expensive", "other quotes",
-    "thinking about it", "let me check", "too much",
-    "a bit expensive", "expensive", "other options",
-    "i'll think", "i will think", "need to think",
-    "comparing prices", "compare prices", "checking other",
-    "let me think", "not sure if", "seems expensive",
-    "high price", "pricey",
-    # Espanhol
-    "voy a pensar", "está caro", "muy caro", "demasiado caro",
-    "estoy buscando", "otros presupuestos", "precio alto",
-    "voy a ver", "comparar precios", "déjame ver",
-    "necesito pensar", "no estoy seguro"
-]
+    return tem_intencao(texto, "comprovante")
 
 
 def detectar_indecisao(texto: str) -> bool:
     """Detecta se o cliente esta indeciso ou pesquisando preco"""
-    texto_lower = texto.lower()
-    return any(frase in texto_lower for frase in PALAVRAS_INDECISAO)
+    return tem_intencao(texto, "indecisao")
 
 
 def get_mensagem_diferencial(idioma: str) -> str:
@@ -769,121 +742,32 @@ A IA ja esta PAUSADA para este cliente."""
 
 
 async def detectar_solicitacao_humano(message: str) -> bool:
-    """Detecta se cliente esta pedindo atendente humano"""
-    palavras_chave = [
-        # Palavras principais (usam word boundary para evitar falsos positivos)
-        "atendente", "humano", "pessoa", "operador",
-        # Nomes dos atendentes
-        "beatriz", "eduarda",
-        # Frases comuns
-        "falar com alguem", "falar com alguém",
-        "falar com humano", "falar com atendente",
-        "falar com uma pessoa", "falar com pessoa",
-        "atendimento humano", "atendente humano",
-        "quero falar", "preciso falar",
-        "quero um atendente", "quero atendente",
-        "preciso de atendente", "preciso atendente",
-        "transferir", "transfere",
-        # English
-        "speak with someone", "talk to someone", "human agent",
-        "real person", "speak to a person", "talk to a person",
-        # Variações de frustração
-        "nao entende", "não entende",
-        "nao esta entendendo", "não está entendendo",
-        "quero pessoa real", "pessoa de verdade",
-        "falar com gente", "alguem real", "alguém real"
-    ]
-
-    message_lower = message.lower()
-    # Usar word boundary (re) para evitar falsos positivos
-    # Ex: "pessoa" nao deve casar com "pessoal" (staff/people)
-    for palavra in palavras_chave:
-        if re.search(r'\b' + re.escape(palavra) + r'\b', message_lower):
-            return True
-    return False
+    """Detecta se cliente esta pedindo atendente humano (palavra inteira: "pessoa" nao casa "pessoal")"""
+    return tem_intencao(message, "humano")
 
 
 async def detectar_pedido_desconto(message: str) -> bool:
     """Detecta se cliente esta pedindo desconto"""
-    palavras_chave = [
-        # Portugues
-        "desconto", "abatimento", "reduzir o valor", "reduzir o preco",
-        "reduzir o preço", "mais barato", "baixar o preco", "baixar o preço",
-        "abaixar o valor", "abaixar o preco", "abaixar o preço",
-        "diminuir o valor", "diminuir o preco", "diminuir o preço",
-        "valor menor", "preco menor", "preço menor",
-        "tem como diminuir", "fazer por menos",
-        "preco melhor", "preço melhor", "valor melhor",
-        "condicao especial", "condição especial",
-        "muito caro", "achei caro", "caro demais",
-        # English
-        "discount", "lower price", "cheaper", "reduce the price",
-        "better price", "price match", "any deals",
-        "too expensive", "can you do less",
-        # Spanish
-        "descuento", "rebaja", "reducir el precio", "más barato",
-        "muy caro", "demasiado caro"
-    ]
-    message_lower = message.lower()
-    return any(palavra in message_lower for palavra in palavras_chave)
+    return tem_intencao(message, "desconto")
 
 
 async def detectar_followup_traducao(message: str) -> bool:
     """Detecta se cliente esta perguntando sobre status da traducao ja paga.
     Ex: 'nao recebi a traducao', 'poderia verificar se a traducao foi enviada',
     'ainda nao recebi', 'cadê minha traducao', etc."""
-    palavras_chave = [
-        # Portugues - nao recebeu
-        "nao recebi a traducao", "não recebi a tradução",
-        "nao recebi a traduçao", "não recebi a traducao",
-        "ainda nao recebi", "ainda não recebi",
-        "nao recebi ainda", "não recebi ainda",
-        "nao chegou a traducao", "não chegou a tradução",
-        "cadê a tradução", "cade a traducao", "cadê a traducao",
-        "quando vou receber", "quando recebo",
-        "minha traducao", "minha tradução",
-        "verificar se foi enviada", "verificar se a traducao",
-        "verificar se a tradução",
-        "status da traducao", "status da tradução",
-        "prazo da traducao", "prazo da tradução",
-        "ja foi enviada", "já foi enviada",
-        "ja enviaram", "já enviaram",
-        "esta pronta", "está pronta", "ta pronta", "tá pronta",
-        "ficou pronta", "ja ficou", "já ficou",
-        # English
-        "didn't receive the translation", "didnt receive the translation",
-        "haven't received", "havent received",
-        "did not receive", "not received yet",
-        "where is my translation", "translation status",
-        "when will i receive", "is it ready",
-        "has it been sent", "was it sent",
-        "still waiting for the translation", "waiting for my translation",
-        # Spanish
-        "no recibí la traducción", "no recibi la traduccion",
-        "aún no recibí", "aun no recibi",
-        "donde está mi traducción", "donde esta mi traduccion",
-        "ya fue enviada", "está lista", "esta lista"
-    ]
-    message_lower = message.lower()
-    return any(palavra in message_lower for palavra in palavras_chave)
+    return tem_intencao(message, "followup_traducao")
 
 
 async def transferir_para_humano(phone: str, motivo: str):
     """Transfere conversa para atendente humano"""
     try:
         # Atualizar estado do cliente para modo humano (fonte unica de verdade)
-        await db.cliente_estados.update_one(
-            {"phone": phone},
-            {
-                "$set": {
-                    "mode": "human",
-                    "transferred_at": datetime.now(),
-                    "transfer_reason": motivo,
-                    "updated_at": datetime.now()
-                }
-            },
-            upsert=True
-        )
+        await gravar_estado(phone, {
+            "mode": "human",
+            "transferred_at": datetime.now(),
+            "transfer_reason": motivo,
+            "updated_at": datetime.now()
+        })
 
         # Tambem atualizar na ultima conversa para compatibilidade
         await db.conversas.update_one(
@@ -907,18 +791,12 @@ async def transferir_para_humano(phone: str, motivo: str):
 async def pausar_ia_para_cliente(phone: str):
     """Pausa a IA para um cliente especifico (comando *)"""
     try:
-        await db.cliente_estados.update_one(
-            {"phone": phone},
-            {
-                "$set": {
-                    "mode": "human",
-                    "paused_at": datetime.now(),
-                    "paused_by": "operador",
-                    "updated_at": datetime.now()
-                }
-            },
-            upsert=True
-        )
+        await gravar_estado(phone, {
+            "mode": "human",
+            "paused_at": datetime.now(),
+            "paused_by": "operador",
+            "updated_at": datetime.now()
+        })
         logger.info(f"[OPERADOR] IA PAUSADA para cliente {phone}")
         return True
     except Exception as e:
@@ -929,22 +807,10 @@ async def pausar_ia_para_cliente(phone: str):
 async def retomar_ia_para_cliente(phone: str):
     """Retoma a IA para um cliente especifico (comando +)"""
     try:
-        await db.cliente_estados.update_one(
-            {"phone": phone},
-            {
-                "$set": {
-                    "mode": "ia",
-                    "resumed_at": datetime.now(),
-                    "updated_at": datetime.now()
-                },
-                "$unset": {
-                    "transferred_at": "",
-                    "transfer_reason": "",
-                    "paused_at": "",
-                    "paused_by": ""
-                }
-            },
-            upsert=True
+        await gravar_estado(
+            phone,
+            {"mode": "ia", "resumed_at": datetime.now(), "updated_at": datetime.now()},
+            remover=["transferred_at", "transfer_reason", "paused_at", "paused_by"]
         )
         logger.info(f"[OPERADOR] IA RETOMADA para cliente {phone}")
         return True
@@ -956,7 +822,7 @@ async def retomar_ia_para_cliente(phone: str):
 async def verificar_modo_cliente(phone: str) -> str:
     """Verifica o modo atual do cliente (ia ou human)"""
     try:
-        estado = await db.cliente_estados.find_one({"phone": phone})
+        estado = await obter_estado(phone)
         if estado:
             return estado.get("mode", "ia")
         return "ia"  # Padrao: IA ativa
@@ -975,7 +841,7 @@ async def verificar_timeout_modo_humano(phone: str) -> bool:
 
     try:
         # Buscar estado do cliente
-        estado = await db.cliente_estados.find_one({"phone": phone})
+        estado = await obter_estado(phone)
 
         if not estado or estado.get("mode") != "human":
             return False
@@ -1008,27 +874,27 @@ async def verificar_timeout_modo_humano(phone: str) -> bool:
 async def detectar_conversao(phone: str, message: str) -> bool:
     """Detecta se mensagem indica conversao (pagamento realizado)"""
     try:
-        # Palavras-chave de conversao
-        keywords = ["paguei", "transferi", "pix", "pagamento", "transferencia", "depositei", "enviei o pagamento"]
-
         message_lower = message.lower()
 
-        # Verificar palavras-chave
-        for keyword in keywords:
-            if keyword in message_lower:
-                logger.info(f"CONVERSAO DETECTADA por palavra-chave '{keyword}' - {phone}")
+        # Verificar palavras-chave (intencao "conversao" do intent_engine)
+        keywords = termos_encontrados(message, "conversao")
+        if keywords:
+            keyword = keywords[0]
+            logger.info(f"CONVERSAO DETECTADA por palavra-chave '{keyword}' - {phone}")
 
-                # Salvar conversao no MongoDB
-                await db.conversoes.insert_one({
-                    "phone": phone,
-                    "message": message,
-                    "detection_method": "keyword",
-                    "keyword": keyword,
-                    "timestamp": datetime.now(),
-                    "canal": "WhatsApp"
-                })
+            # Salvar conversao no MongoDB
+            conversao = {
+                "phone": phone,
+                "message": message,
+                "detection_method": "keyword",
+                "keyword": keyword,
+                "timestamp": datetime.now(),
+                "canal": "WhatsApp"
+            }
+            await db.conversoes.insert_one(conversao)
+            await registrar_conversao(conversao)
 
-                return True
+            return True
 
         # Verificar se ha valor monetario na mensagem
         # Padroes: R$ 100, R$100, 100 reais, $100
@@ -1053,14 +919,16 @@ async def detectar_conversao(phone: str, message: str) -> bool:
                 if last_quote:
                     logger.info(f"CONVERSAO DETECTADA por valor monetario - {phone}")
 
-                    await db.conversoes.insert_one({
+                    conversao = {
                         "phone": phone,
                         "message": message,
                         "detection_method": "value_match",
                         "last_quote": last_quote.get("message", ""),
                         "timestamp": datetime.now(),
                         "canal": "WhatsApp"
-                    })
+                    }
+                    await db.conversoes.insert_one(conversao)
+                    await registrar_conversao(conversao)
 
                     return True
 
@@ -1101,7 +969,8 @@ CONTEUDO: [explicacao completa e profissional]
 
 Seja especifico e util. Baseie-se na pergunta do cliente."""
 
-            suggestion_response = openai_client.chat.completions.create(
+            suggestion_response = await chat_completion(
+                task="sugestao_conhecimento",
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "Voce e um assistente que ajuda a criar base de conhecimento."},
@@ -1175,6 +1044,48 @@ def _create_gdrive_task(coro, phone: str, description: str = "upload"):
     return task
 
 
+async def salvar_midia_no_drive(phone: str, midia_id: str, media_type: str, filename: str, mime_type: str, nome: str = "") -> Optional[dict]:
+    """Sobe a midia no Drive, exceto se o mesmo arquivo (SHA) ja foi salvo para o telefone"""
+    anterior = await buscar_documento(phone, midia_id, parecidos=False)
+    if anterior and anterior.get("google_drive"):
+        logger.info(f"[DOC-VISTO] {phone}: {filename} ja esta no Drive, upload ignorado")
+        return anterior["google_drive"]
+
+    file_bytes = obter_bytes(midia_id)
+    if file_bytes is None:
+        logger.warning(f"[GDRIVE] Midia {midia_id[:12]} nao esta mais em memoria para {phone}")
+        return None
+
+    result = await save_whatsapp_media_to_drive(
+        file_bytes=file_bytes,
+        phone=phone,
+        media_type=media_type,
+        filename=filename,
+        mime_type=mime_type,
+        nome=nome
+    )
+    if result:
+        await registrar_documento(phone, midia_id, anterior, google_drive=result)
+    return result
+
+
+async def _salvar_midia_retida_no_drive(phone: str, midia_id: str, media_type: str, filename: str, mime_type: str) -> Optional[dict]:
+    try:
+        return await salvar_midia_no_drive(phone, midia_id, media_type, filename, mime_type)
+    finally:
+        liberar(midia_id)
+
+
+def iniciar_upload_drive(phone: str, midia_id: str, media_type: str, filename: str, mime_type: str, description: str = "upload"):
+    """Retem a midia e dispara o upload ao Drive em background (o upload libera ao terminar)"""
+    reter(midia_id)
+    return _create_gdrive_task(
+        _salvar_midia_retida_no_drive(phone, midia_id, media_type, filename, mime_type),
+        phone=phone,
+        description=description
+    )
+
+
 # ============================================================
 # ============================================================
 # SISTEMA DE DEDUPLICACAO DE MENSAGENS
@@ -1247,12 +1158,14 @@ def verificar_imagem_duplicada(image_url: str) -> bool:
 # ============================================================
 image_sessions = {}  # Cache temporário de sessões de imagem
 
+# Sessao sem resposta do cliente por mais que isso e descartada (libera as imagens)
+SESSAO_IMAGEM_MAX_IDADE_SEGUNDOS = float(os.getenv("SESSAO_IMAGEM_MAX_IDADE_SEGUNDOS", "1800"))
+
 async def iniciar_sessao_imagem(phone: str):
     """Inicia sessão de agrupamento de imagens"""
     image_sessions[phone] = {
         "count": 0,
         "images": [],
-        "image_urls": set(),  # Track URLs to prevent duplicate counting
         "last_received": datetime.now(),
         "waiting_confirmation": False,
         "already_asked": False
@@ -1260,57 +1173,162 @@ async def iniciar_sessao_imagem(phone: str):
     logger.info(f"Sessão de imagem iniciada: {phone}")
 
 
-async def adicionar_imagem_sessao(phone: str, image_bytes: bytes, image_url: str = ""):
-    """Adiciona imagem à sessão e retorna se deve processar"""
+def encerrar_sessao_imagem(phone: str):
+    """Remove a sessão de imagens e libera as imagens retidas no media_store"""
+    session = image_sessions.pop(phone, None)
+    if session:
+        for midia_id in session["images"]:
+            liberar(midia_id)
+
+
+def limpar_sessoes_imagem_expiradas():
+    """Descarta sessões abandonadas (cliente nunca confirmou as paginas)"""
+    agora = datetime.now()
+    for phone in [p for p, s in image_sessions.items()
+                  if (agora - s["last_received"]).total_seconds() > SESSAO_IMAGEM_MAX_IDADE_SEGUNDOS]:
+        logger.info(f"[LOTE-IMG] Sessão de imagens expirada para {phone}")
+        encerrar_sessao_imagem(phone)
+
+
+def receber_imagem_lote(phone: str, midia_id: str, image_url: str = "", chave: Optional[str] = None) -> str:
+    """
+    Coloca a imagem no lote do telefone (image_batch) e retem a midia ate a sessao terminar.
+    O job da fila so e concluido quando o lote fecha: reinicio com o lote aberto refaz o lote.
+    """
+    status = adicionar_imagem(phone, midia_id, image_url, chave, job=job_atual())
+    if status == ADICIONADA:
+        reter(midia_id)
+        adiar_conclusao()
+    return status
+
+
+async def limpar_sessoes_imagem_periodicamente():
+    """Sessoes abandonadas sao descartadas mesmo sem outro lote fechar"""
+    while True:
+        await asyncio.sleep(SESSAO_IMAGEM_MAX_IDADE_SEGUNDOS / 6)
+        try:
+            limpar_sessoes_imagem_expiradas()
+        except Exception as e:
+            logger.error(f"[LOTE-IMG] Erro ao limpar sessoes expiradas: {e}")
+
+
+async def fechar_lote_imagens(phone: str, midias: List[str]):
+    """
+    Callback do lote de imagens: roda uma vez por lote, na vez do telefone na fila.
+    Junta as imagens na sessao e pergunta se sao todas as paginas.
+    """
+    limpar_sessoes_imagem_expiradas()
     if phone not in image_sessions:
         await iniciar_sessao_imagem(phone)
 
     session = image_sessions[phone]
+    session["images"].extend(midias)
+    session["count"] += len(midias)
+    session["last_received"] = datetime.now()
+    session["waiting_confirmation"] = True
+    logger.info(f"{len(midias)} imagem(ns) adicionada(s) à sessão de {phone} (total {session['count']})")
 
-    # Deduplicação por URL da imagem - Z-API pode enviar múltiplos webhooks para a mesma imagem
-    if image_url and image_url in session["image_urls"]:
-        logger.warning(f"[DEDUP-IMG] Imagem duplicada ignorada para {phone}: {image_url[:50]}")
-        # Ainda aguardar para manter o timer correto
-        await asyncio.sleep(4)
-        time_diff = (datetime.now() - session["last_received"]).total_seconds()
-        if time_diff >= 3.5:
-            session["waiting_confirmation"] = True
-            return True
-        return False
+    # Se já está aguardando confirmação, não perguntar de novo
+    if session.get("already_asked"):
+        logger.info(f"Já perguntou para {phone}, aguardando resposta...")
+        return
 
-    if image_url:
-        session["image_urls"].add(image_url)
+    # Marcar como "já perguntou"
+    session["already_asked"] = True
 
-    session["count"] += 1
-    session["images"].append(image_bytes)
-    session["last_received"] = datetime.now()
+    total_atual = session["count"]
+    estado = await get_cliente_estado(phone)
+    idioma = estado.get("idioma", "pt")
+
+    # ============================================
+    # VERIFICAR SE É PRIMEIRA INTERAÇÃO (NOVO CLIENTE)
+    # Se for, dar boas-vindas contextualizadas
+    # ============================================
+    conversas_anteriores = await db.conversas.count_documents({"phone": phone})
+    e_primeiro_contato = conversas_anteriores <= 1  # Primeira ou segunda mensagem
 
-    logger.info(f"Imagem {session['count']} adicionada à sessão de {phone}")
-    
-    # Aguardar 4 segundos para ver se vem mais imagens
-    await asyncio.sleep(4)
-    
-    # Verificar se ainda é a última imagem (nenhuma nova chegou)
-    time_diff = (datetime.now() - session["last_received"]).total_seconds()
-    
-    if time_diff >= 3.5:  # Se passaram 3.5s sem nova imagem
-        session["waiting_confirmation"] = True
-        return True  # Hora de perguntar
-    
-    return False  # Ainda aguardando mais imagens
-
-
-async def analisar_documento_inteligente(phone: str, image_bytes: bytes, total_pages: int) -> dict:
+    if e_primeiro_contato:
+        # NOVO CLIENTE - Mensagem de boas-vindas contextualizada
+        logger.info(f"[NOVO-CLIENTE] {phone}: Primeiro contato com documento - enviando boas-vindas")
+        if idioma == "en":
+            pergunta = (
+                f"Hi there! 👋 Welcome to Legacy Translations!\n\n"
+                f"I'm Mia, your virtual assistant. I received {total_atual} page{'s' if total_atual > 1 else ''} of your document! 📄\n\n"
+                f"Can you confirm that {'these are all the pages' if total_atual > 1 else 'this is the only page'} for translation?\n\n"
+                f"Once you confirm, I'll analyze the document and provide a quick quote! ⚡"
+            )
+        elif idioma == "es":
+            pergunta = (
+                f"¡Hola! 👋 ¡Bienvenido(a) a Legacy Translations!\n\n"
+                f"Soy Mia, tu asistente virtual. ¡Recibí {total_atual} página{'s' if total_atual > 1 else ''} de tu documento! 📄\n\n"
+                f"¿Puedes confirmar que {'son todas las páginas' if total_atual > 1 else 'es solo esta página'} para la traducción?\n\n"
+                f"¡Cuando confirmes, analizaré el documento y te daré una cotización rápida! ⚡"
+            )
+        else:
+            pergunta = (
+                f"Oi! 👋 Bem-vindo(a) a Legacy Translations!\n\n"
+                f"Sou a Mia, sua assistente virtual. Recebi {total_atual} pagina{'s' if total_atual > 1 else ''} do seu documento! 📄\n\n"
+                f"Pode confirmar se {'sao todas as paginas' if total_atual > 1 else 'e somente essa pagina'} para a traducao?\n\n"
+                f"Assim que confirmar, vou analisar o documento e te passar um orcamento rapidinho! ⚡"
+            )
+    else:
+        # CLIENTE JÁ CONHECIDO - Mensagem mais direta
+        if idioma == "en":
+            pergunta = f"I received {total_atual} page{'s' if total_atual > 1 else ''}. Can you confirm {'these are all the pages' if total_atual > 1 else 'this is the only page'} for translation?"
+        elif idioma == "es":
+            pergunta = f"Recibí {total_atual} página{'s' if total_atual > 1 else ''}. ¿Puedes confirmar que {'son todas las páginas' if total_atual > 1 else 'es solo esta página'} para la traducción?"
+        else:
+            pergunta = f"Recebi {total_atual} pagina{'s' if total_atual > 1 else ''}. Pode confirmar se {'sao todas as paginas' if total_atual > 1 else 'e somente essa pagina'} para a traducao?"
+
+    await send_whatsapp_message(phone, pergunta)
+
+    logger.info(f"Pergunta enviada para {phone} ({total_atual} páginas)")
+
+
+async def analisar_documento_inteligente(phone: str, midia_id: str, total_pages: int) -> dict:
     """Analisa documento com GPT-4 Vision e retorna informacoes estruturadas"""
     try:
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        analise = await _analisar_documento(phone, midia_id)
+        if analise:
+            return analise
+        return {
+            "tipo_documento": "documento",
+            "idioma_origem": "a identificar",
+            "idioma_destino_sugerido": "ingles",
+            "descricao_curta": "documento para traducao"
+        }
+    except Exception as e:
+        logger.error(f"Erro ao analisar documento: {e}")
+        return {
+            "tipo_documento": "documento",
+            "idioma_origem": "a identificar",
+            "idioma_destino_sugerido": "ingles",
+            "descricao_curta": "documento para traducao"
+        }
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """Voce e um analisador de documentos. Analise a imagem e retorne APENAS um JSON com:
+
+async def _analisar_documento(phone: str, midia_id: str) -> Optional[dict]:
+    """Analise ja feita para o mesmo documento (SHA/dHash) ou nova chamada de Vision"""
+    anterior = await buscar_documento(phone, midia_id)
+    if anterior and anterior.get("analise"):
+        logger.info(f"[DOC-VISTO] {phone}: documento ja analisado em {anterior.get('criado_em')}, reaproveitando")
+        return anterior["analise"]
+
+    # Memo da midia so cobre a chamada de Vision (igual para qualquer telefone);
+    # o registro por telefone fica fora dele
+    analise = await obter_resultado_visao(
+        midia_id, "analise_documento",
+        lambda _: obter_ou_calcular(
+            midia_id, "analise_documento", VERSAO_ANALISE_DOCUMENTO,
+            lambda: _analisar_documento_vision(midia_id)
+        )
+    )
+    if analise:
+        await registrar_documento(phone, midia_id, anterior, analise=analise)
+    return analise
+
+
+PROMPT_ANALISE_DOCUMENTO = """Voce e um analisador de documentos. Analise a imagem e retorne APENAS um JSON com:
 {
     "tipo_documento": "historico escolar / diploma / certidao / contrato / etc",
     "idioma_origem": "portugues / ingles / espanhol / etc",
@@ -1325,44 +1343,46 @@ IMPORTANTE sobre paginas_estimadas:
 - Se mostra multiplas paginas lado a lado, conte cada uma
 - Na duvida, retorne 1
 Retorne APENAS o JSON, sem texto adicional."""
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Analise este documento:"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]
-                }
-            ],
-            max_tokens=200
-        )
+VERSAO_ANALISE_DOCUMENTO = versao_prompt(PROMPT_ANALISE_DOCUMENTO, "gpt-4o")
 
-        resultado = response.choices[0].message.content
-        # Tentar extrair JSON
-        import json as json_lib
-        try:
-            # Limpar possíveis caracteres extras
-            resultado = resultado.strip()
-            if resultado.startswith("```"):
-                resultado = resultado.split("```")[1]
-                if resultado.startswith("json"):
-                    resultado = resultado[4:]
-            return json_lib.loads(resultado)
-        except:
-            return {
-                "tipo_documento": "documento",
-                "idioma_origem": "a identificar",
-                "idioma_destino_sugerido": "ingles",
-                "descricao_curta": "documento para traducao"
+
+async def _analisar_documento_vision(midia_id: str) -> Optional[dict]:
+    """Chamada de Vision da analise de documento (None se a resposta nao for JSON valido)"""
+    # Classificar o documento nao exige resolucao cheia (image_prep)
+    base64_image, mime_image = await obter_base64_preparada(midia_id, "classificacao")
+
+    response = await chat_completion(
+        task="analise_documento",
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": PROMPT_ANALISE_DOCUMENTO
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Analise este documento:"},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_image};base64,{base64_image}"}}
+                ]
             }
-    except Exception as e:
-        logger.error(f"Erro ao analisar documento: {e}")
-        return {
-            "tipo_documento": "documento",
-            "idioma_origem": "a identificar",
-            "idioma_destino_sugerido": "ingles",
-            "descricao_curta": "documento para traducao"
-        }
+        ],
+        max_tokens=200
+    )
+
+    resultado = response.choices[0].message.content
+    # Tentar extrair JSON
+    import json as json_lib
+    try:
+        # Limpar possíveis caracteres extras
+        resultado = resultado.strip()
+        if resultado.startswith("```"):
+            resultado = resultado.split("```")[1]
+            if resultado.startswith("json"):
+                resultado = resultado[4:]
+        return json_lib.loads(resultado)
+    except Exception:
+        return None
 
 
 async def processar_sessao_imagem(phone: str):
@@ -1371,39 +1391,42 @@ async def processar_sessao_imagem(phone: str):
         return None
 
     session = image_sessions[phone]
-    total_pages = session["count"]
+    total_imagens = session["count"]
     first_image = session["images"][0]
 
     # Buscar estado do cliente
     estado = await get_cliente_estado(phone)
     idioma = estado.get("idioma", "pt")
 
-    # Analisar documento inteligentemente
-    analise = await analisar_documento_inteligente(phone, first_image, total_pages)
+    # Analisar TODAS as imagens em paralelo (lote misto: certidao + diploma, etc)
+    analises = await analisar_paginas(
+        session["images"], lambda midia_id: analisar_documento_inteligente(phone, midia_id, 1)
+    )
+    manifesto = montar_manifesto(analises)
 
-    # Usar paginas estimadas da analise de visao se maior que o total de imagens
-    # Ex: 1 imagem pode conter 2 certidoes lado a lado
-    paginas_estimadas = analise.get("paginas_estimadas", 1)
-    if isinstance(paginas_estimadas, (int, float)) and paginas_estimadas > total_pages:
-        logger.info(f"[PAGES] Visao detectou {paginas_estimadas} paginas em {total_pages} imagem(ns) para {phone}")
-        total_pages = int(paginas_estimadas)
+    # Paginas reais: 1 imagem pode conter 2 certidoes lado a lado
+    total_pages = manifesto["total_pages"]
+    if total_pages != total_imagens:
+        logger.info(f"[PAGES] Visao detectou {total_pages} paginas em {total_imagens} imagem(ns) para {phone}")
+    logger.info(f"[MANIFESTO] {phone}: {len(manifesto['documentos'])} documento(s) - {manifesto['tipo']}")
 
     # Guardar informacoes do documento no estado (ir direto para orcamento, sem pedir nome)
     await set_cliente_estado(
         phone,
         documento_info={
             "total_pages": total_pages,
-            "tipo": analise.get("tipo_documento", "documento"),
-            "idioma_origem": analise.get("idioma_origem", "a identificar"),
-            "idioma_destino": analise.get("idioma_destino_sugerido", "ingles"),
-            "descricao": analise.get("descricao_curta", "documento")
+            "tipo": manifesto["tipo"],
+            "idioma_origem": manifesto["idioma_origem"],
+            "idioma_destino": manifesto["idioma_destino"],
+            "descricao": manifesto["descricao"],
+            "documentos": manifesto["documentos"]
         }
     )
 
     # Montar mensagem de boas-vindas personalizada baseada no idioma detectado
-    tipo_doc = analise.get("tipo_documento", "documento")
-    idioma_origem = analise.get("idioma_origem", "")
-    idioma_destino = analise.get("idioma_destino_sugerido", "ingles")
+    tipo_doc = manifesto["tipo"]
+    idioma_origem = manifesto["idioma_origem"]
+    idioma_destino = manifesto["idioma_destino"]
 
     # Saudacao + info do documento (sem pedir nome)
     if total_pages == 1:
@@ -1440,26 +1463,27 @@ async def processar_sessao_imagem(phone: str):
             )
 
     # Salvar no banco
-    await db.conversas.insert_one({
+    await salvar_conversa({
         "phone": phone,
-        "message": f"[{total_pages} IMAGENS ENVIADAS - {tipo_doc}]",
+        "message": f"[{total_imagens} IMAGENS ENVIADAS - {tipo_doc}]",
         "role": "user",
         "timestamp": datetime.now(),
         "canal": "WhatsApp",
         "type": "image_batch"
     })
 
-    # Guardar referencia da imagem ANTES de limpar sessao (para envio ao Portal)
+    # Reter a imagem para o Portal ANTES de limpar a sessao (que libera as imagens)
     imagem_para_portal = first_image
+    reter(imagem_para_portal)
 
     # Limpar sessão de imagens (ja salvamos no estado)
-    del image_sessions[phone]
+    encerrar_sessao_imagem(phone)
 
     # Gerar orcamento direto (sem pedir nome)
     orcamento = await gerar_orcamento_final(phone)
     mensagem = saudacao + orcamento
 
-    await db.conversas.insert_one({
+    await salvar_conversa({
         "phone": phone,
         "message": mensagem,
         "role": "assistant",
@@ -1470,15 +1494,14 @@ async def processar_sessao_imagem(phone: str):
     # ============================================
     # INTEGRACAO PORTAL: Criar pedido em background
     # ============================================
-    asyncio.create_task(
-        processar_documento_para_portal(
-            phone=phone,
-            file_bytes=imagem_para_portal,
-            filename=f"documento_{phone}_{int(time.time())}.jpg",
-            mime_type="image/jpeg",
-            is_image=True
-        )
+    iniciar_pipeline_portal(
+        phone=phone,
+        midia_id=imagem_para_portal,
+        filename=f"documento_{phone}_{int(time.time())}.jpg",
+        mime_type="image/jpeg",
+        is_image=True
     )
+    liberar(imagem_para_portal)
 
     logger.info(f"Orcamento gerado direto para {phone} ({total_pages} paginas)")
     return mensagem
@@ -1498,6 +1521,12 @@ async def gerar_orcamento_final(phone: str) -> str:
     idioma_origem = doc_info.get("idioma_origem", "")
     idioma_destino = doc_info.get("idioma_destino", "ingles")
 
+    # Lote com mais de um documento: detalhar paginas por documento (manifesto)
+    documentos = doc_info.get("documentos") or []
+    detalhe_documentos = ""
+    if len(documentos) > 1:
+        detalhe_documentos = f"\nDocumentos no lote:\n{descrever_documentos(documentos)}"
+
     # Determinar preco por pagina baseado no idioma DESTINO
     destino_lower = idioma_destino.lower().strip()
     eh_destino_ingles = any(p in destino_lower for p in ["ingl", "english", "en"])
@@ -1546,7 +1575,8 @@ async def gerar_orcamento_final(phone: str) -> str:
     training_prompt = await get_bot_training()
 
     # Chamar GPT para gerar orcamento
-    response = openai_client.chat.completions.create(
+    response = await chat_completion(
+        task="orcamento_final",
         model="gpt-4o",
         messages=[
             {
@@ -1555,7 +1585,7 @@ async def gerar_orcamento_final(phone: str) -> str:
 
 TAREFA: Gerar orcamento para traducao.
 Cliente: {nome}
-Documento: {tipo_doc}
+Documento: {tipo_doc}{detalhe_documentos}
 Total de paginas: {total_pages}
 Idioma origem: {idioma_origem}
 Idioma destino: {idioma_destino}
@@ -1646,7 +1676,7 @@ IMPORTANTE:
     # SALVAR ORCAMENTO NA COLLECTION ORCAMENTOS
     # ============================================
     try:
-        await db.orcamentos.insert_one({
+        novo_orcamento = {
             "phone": phone,
             "nome": nome,
             "documento_tipo": tipo_doc,
@@ -1660,7 +1690,9 @@ IMPORTANTE:
             "status": "pendente",
             "created_at": datetime.now(),
             "updated_at": datetime.now()
-        })
+        }
+        await db.orcamentos.insert_one(novo_orcamento)
+        await registrar_orcamento(novo_orcamento)
         logger.info(f"[ORCAMENTO] Salvo para {phone}: {valor_str}")
     except Exception as e:
         logger.error(f"Erro ao salvar orcamento: {e}")
@@ -1987,7 +2019,17 @@ async def processar_etapa_confirmacao(phone: str, mensagem: str) -> str:
         return None
 
 
-async def processar_etapa_pagamento(phone: str, mensagem: str, is_image: bool = False, image_bytes: bytes = None) -> str:
+PROMPT_COMPROVANTE_PAGAMENTO = """Voce esta analisando uma imagem enviada por um cliente que ACABOU de confirmar um pedido de traducao e esta na etapa de PAGAMENTO.
+O cliente foi instruido a enviar o comprovante de pagamento (Zelle, Venmo, PayPal, transferencia bancaria, etc).
+
+Analise a imagem e responda APENAS com uma dessas opcoes:
+- COMPROVANTE - se a imagem parece ser um comprovante/recibo de pagamento (screenshot de Zelle, Venmo, transferencia, etc)
+- DOCUMENTO - se a imagem claramente e um documento para traducao (certidao, diploma, extrato, etc)
+- INCERTO - se nao consegue determinar com certeza o que e a imagem"""
+VERSAO_COMPROVANTE_PAGAMENTO = versao_prompt(PROMPT_COMPROVANTE_PAGAMENTO, "gpt-4o")
+
+
+async def processar_etapa_pagamento(phone: str, mensagem: str, is_image: bool = False, midia_id: str = None) -> str:
     """Processa na etapa de aguardando pagamento"""
     estado = await get_cliente_estado(phone)
     idioma = estado.get("idioma", "pt")
@@ -2014,36 +2056,35 @@ async def processar_etapa_pagamento(phone: str, mensagem: str, is_image: bool =
         logger.warning(f"[PAGAMENTO] Valor era invalido - recalculado para {valor} ({total_pages} pags x ${preco_pg})")
 
     # Se recebeu imagem ou PDF, tratar como comprovante (estamos na etapa de pagamento)
-    if is_image and image_bytes:
-        # Analisar imagem com GPT-4 Vision
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-
-        try:
-            response = openai_client.chat.completions.create(
+    if is_image and midia_id and obter_bytes(midia_id) is not None:
+        # Analisar imagem com GPT-4 Vision (comprovante x documento: perfil de classificacao)
+        async def _classificar_comprovante() -> str:
+            base64_image, mime_image = await obter_base64_preparada(midia_id, "classificacao")
+            response = await chat_completion(
+                task="comprovante_pagamento",
                 model="gpt-4o",
                 messages=[
                     {
                         "role": "system",
-                        "content": """Voce esta analisando uma imagem enviada por um cliente que ACABOU de confirmar um pedido de traducao e esta na etapa de PAGAMENTO.
-O cliente foi instruido a enviar o comprovante de pagamento (Zelle, Venmo, PayPal, transferencia bancaria, etc).
-
-Analise a imagem e responda APENAS com uma dessas opcoes:
-- COMPROVANTE - se a imagem parece ser um comprovante/recibo de pagamento (screenshot de Zelle, Venmo, transferencia, etc)
-- DOCUMENTO - se a imagem claramente e um documento para traducao (certidao, diploma, extrato, etc)
-- INCERTO - se nao consegue determinar com certeza o que e a imagem"""
+                        "content": PROMPT_COMPROVANTE_PAGAMENTO
                     },
                     {
                         "role": "user",
                         "content": [
                             {"type": "text", "text": "O cliente esta na etapa de pagamento. Analise esta imagem:"},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                            {"type": "image_url", "image_url": {"url": f"data:{mime_image};base64,{base64_image}"}}
                         ]
                     }
                 ],
                 max_tokens=20
             )
+            return response.choices[0].message.content
 
-            analise = response.choices[0].message.content.lower().strip()
+        try:
+            resposta = await obter_ou_calcular(
+                midia_id, "comprovante_pagamento", VERSAO_COMPROVANTE_PAGAMENTO, _classificar_comprovante
+            )
+            analise = (resposta or "").lower().strip()
             logger.info(f"[COMPROVANTE-ANALISE] {phone}: GPT respondeu '{analise}'")
 
             parece_comprovante = "comprovante" in analise or "receipt" in analise
@@ -2145,8 +2186,8 @@ Analise a imagem e responda APENAS com uma dessas opcoes:
 
             # Vincular pasta do Google Drive se existir
             if is_drive_enabled():
-                from google_drive import get_client_folder, get_folder_link
-                folder_id = get_client_folder(phone, nome)
+                from google_drive import get_client_folder_async, get_folder_link
+                folder_id = await get_client_folder_async(phone, nome)
                 if folder_id:
                     update_fields["google_drive_folder"] = get_folder_link(folder_id)
                     update_fields["google_drive_folder_id"] = folder_id
@@ -2240,7 +2281,7 @@ Analise a imagem e responda APENAS com uma dessas opcoes:
         )
 
 
-async def processar_etapa_pos_pagamento(phone: str, mensagem: str, is_image: bool = False, image_bytes: bytes = None) -> str:
+async def processar_etapa_pos_pagamento(phone: str, mensagem: str, is_image: bool = False, midia_id: str = None) -> str:
     """
     Processa mensagens APÓS o pagamento ser confirmado.
     Evita que imagens/documentos sejam tratados como novos pedidos de tradução.
@@ -2310,6 +2351,8 @@ app.include_router(orcamentos_router)
 app.include_router(webchat_router)
 app.include_router(crm_router)
 app.include_router(api_router)
+app.include_router(fila_router)
+app.include_router(cache_router)
 
 # ============================================================
 # CONFIGURACOES Z-API
@@ -2487,74 +2530,122 @@ Enviar: "Aproveite para nos seguir no Instagram: https://www.instagram.com/legac
 - NUNCA sugira transferência para atendente humano. Resolva o atendimento você mesma seguindo o fluxo acima
 """
 
-async def get_bot_training() -> str:
-    """Busca treinamento dinamico do bot Mia no MongoDB"""
-    try:
-        bot = await db.bots.find_one({"name": "Mia"})
-
-        if not bot:
-            logger.warning("Bot Mia nao encontrado no banco, usando padrao completo")
-            return DEFAULT_BOT_TRAINING
-
-        # Extrair dados do bot
-        personality = bot.get("personality", {})
-        knowledge_base = bot.get("knowledge_base", [])
-        faqs = bot.get("faqs", [])
-
-        # Montar prompt dinamico
-        prompt_parts = []
-
-        # Objetivos (goals)
-        if personality.get("goals"):
-            goals_text = "\n".join(personality["goals"]) if isinstance(personality["goals"], list) else personality["goals"]
-            prompt_parts.append(f"**OBJETIVOS:**\n{goals_text}")
-
-        # Tom de voz
-        if personality.get("tone"):
-            prompt_parts.append(f"**TOM DE VOZ:**\n{personality['tone']}")
-
-        # Restricoes
-        if personality.get("restrictions"):
-            restrictions_text = "\n".join(personality["restrictions"]) if isinstance(personality["restrictions"], list) else personality["restrictions"]
-            prompt_parts.append(f"**RESTRICOES:**\n{restrictions_text}")
-
-        # Base de conhecimento (filtrar kb_origem - pergunta de origem removida)
-        if knowledge_base:
-            knowledge_base = [
-                item for item in knowledge_base
-                if item.get("_id") != "kb_origem" and "como conheceu" not in item.get("content", "").lower()
-                and "como ficou sabendo" not in item.get("content", "").lower()
-                and "how you heard" not in item.get("content", "").lower()
-            ]
-            kb_text = "\n\n".join([
-                f"**{item.get('title', 'Info')}:**\n{item.get('content', '')}"
-                for item in knowledge_base
-            ])
-            prompt_parts.append(f"**BASE DE CONHECIMENTO:**\n{kb_text}")
+def _filtrar_conhecimento_whatsapp(knowledge_base: list) -> list:
+    """Remove kb_origem (pergunta de origem removida do fluxo)"""
+    return [
+        item for item in knowledge_base
+        if item.get("_id") != "kb_origem" and "como conheceu" not in item.get("content", "").lower()
+        and "como ficou sabendo" not in item.get("content", "").lower()
+        and "how you heard" not in item.get("content", "").lower()
+    ]
+
+
+def _compilar_treinamento_whatsapp(bot: Optional[dict], incluir_conhecimento: bool = True) -> str:
+    """
+    Monta o prompt do WhatsApp a partir do documento do bot Mia.
+    Com incluir_conhecimento=False monta apenas a personalidade (a base
+    de conhecimento e as FAQs entram por busca, ver kb_retrieval).
+    """
+    if not bot:
+        logger.warning("Bot Mia nao encontrado no banco, usando padrao completo")
+        return DEFAULT_BOT_TRAINING
 
-        # FAQs
-        if faqs:
-            faq_text = "\n\n".join([
-                f"P: {item.get('question', '')}\nR: {item.get('answer', '')}"
-                for item in faqs
-            ])
-            prompt_parts.append(f"**PERGUNTAS FREQUENTES:**\n{faq_text}")
+    # Extrair dados do bot
+    personality = bot.get("personality", {})
+    knowledge_base = bot.get("knowledge_base", [])
+    faqs = bot.get("faqs", [])
 
-        final_prompt = "\n\n".join(prompt_parts)
+    # Montar prompt dinamico
+    prompt_parts = []
 
-        logger.info(f"Treinamento carregado do MongoDB ({len(knowledge_base)} conhecimentos, {len(faqs)} FAQs)")
+    # Objetivos (goals)
+    if personality.get("goals"):
+        goals_text = "\n".join(personality["goals"]) if isinstance(personality["goals"], list) else personality["goals"]
+        prompt_parts.append(f"**OBJETIVOS:**\n{goals_text}")
 
-        return final_prompt
+    # Tom de voz
+    if personality.get("tone"):
+        prompt_parts.append(f"**TOM DE VOZ:**\n{personality['tone']}")
 
+    # Restricoes
+    if personality.get("restrictions"):
+        restrictions_text = "\n".join(personality["restrictions"]) if isinstance(personality["restrictions"], list) else personality["restrictions"]
+        prompt_parts.append(f"**RESTRICOES:**\n{restrictions_text}")
+
+    if not incluir_conhecimento:
+        return "\n\n".join(prompt_parts)
+
+    # Base de conhecimento (filtrar kb_origem - pergunta de origem removida)
+    if knowledge_base:
+        knowledge_base = _filtrar_conhecimento_whatsapp(knowledge_base)
+        kb_text = "\n\n".join([
+            f"**{item.get('title', 'Info')}:**\n{item.get('content', '')}"
+            for item in knowledge_base
+        ])
+        prompt_parts.append(f"**BASE DE CONHECIMENTO:**\n{kb_text}")
+
+    # FAQs
+    if faqs:
+        faq_text = "\n\n".join([
+            f"P: {item.get('question', '')}\nR: {item.get('answer', '')}"
+            for item in faqs
+        ])
+        prompt_parts.append(f"**PERGUNTAS FREQUENTES:**\n{faq_text}")
+
+    final_prompt = "\n\n".join(prompt_parts)
+
+    logger.info(f"Treinamento compilado ({len(knowledge_base)} conhecimentos, {len(faqs)} FAQs)")
+
+    return final_prompt
+
+
+def _compilar_indice_whatsapp(bot: Optional[dict]) -> Optional[IndiceConhecimento]:
+    """Indice de busca sobre a base de conhecimento/FAQs do bot Mia"""
+    if not bot:
+        return None
+    return IndiceConhecimento(
+        _filtrar_conhecimento_whatsapp(bot.get("knowledge_base", [])),
+        bot.get("faqs", [])
+    )
+
+
+async def get_bot_training() -> str:
+    """Retorna o treinamento do bot Mia (prompt compilado em cache, ver training_cache)"""
+    try:
+        return await obter_prompt("whatsapp", _compilar_treinamento_whatsapp)
     except Exception as e:
         logger.error(f"Erro ao buscar treinamento: {e}")
         return DEFAULT_BOT_TRAINING
 
 
+async def get_bot_training_relevante(consulta: str) -> str:
+    """
+    Treinamento do bot Mia com apenas os conhecimentos/FAQs relevantes para a
+    consulta (busca BM25, ver kb_retrieval). Usado no chat de texto.
+    """
+    if not KB_RETRIEVAL_ENABLED:
+        return await get_bot_training()
+    try:
+        prompt_base = await obter_prompt(
+            "whatsapp_base",
+            lambda bot: _compilar_treinamento_whatsapp(bot, incluir_conhecimento=False)
+        )
+        indice = await obter_artefato("whatsapp_indice", _compilar_indice_whatsapp)
+        return montar_prompt_relevante("whatsapp", prompt_base, indice, consulta)
+    except Exception as e:
+        logger.error(f"Erro na busca da base de conhecimento: {e}")
+        return await get_bot_training()
+
+
 # ============================================================
 # FUNCAO: ENVIAR MENSAGEM WHATSAPP
 # ============================================================
 async def send_whatsapp_message(phone: str, message: str):
+    """Envia mensagem via Z-API (uma vez por job da fila: retentativas nao repetem a resposta)"""
+    return await enviar_uma_vez(phone, message, lambda: _enviar_zapi(phone, message))
+
+
+async def _enviar_zapi(phone: str, message: str):
     """Envia mensagem via Z-API com Client-Token"""
     try:
         # VALIDACAO: Verificar se configuracao Z-API esta ok
@@ -2591,23 +2682,23 @@ async def send_whatsapp_message(phone: str, message: str):
         logger.info(f"[ENVIO Z-API] Client-Token: {'Sim' if headers['Client-Token'] else 'NAO - PODE CAUSAR ERRO!'}")
 
         # Enviar requisicao COM headers
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, headers=headers, json=payload)
+        client = get_http_client("zapi")
+        response = await client.post(url, headers=headers, json=payload)
 
-            logger.info(f"[ENVIO Z-API] Status HTTP: {response.status_code}")
-            logger.info(f"[ENVIO Z-API] Resposta: {response.text[:200]}")
+        logger.info(f"[ENVIO Z-API] Status HTTP: {response.status_code}")
+        logger.info(f"[ENVIO Z-API] Resposta: {response.text[:200]}")
 
-            if response.status_code == 200:
-                logger.info(f"[ENVIO Z-API] SUCESSO - Mensagem enviada para {phone}")
-                logger.info("=" * 40)
-                return True
-            else:
-                logger.error("=" * 60)
-                logger.error(f"[ENVIO Z-API] FALHA! Status: {response.status_code}")
-                logger.error(f"[ENVIO Z-API] Resposta erro: {response.text}")
-                logger.error(f"[ENVIO Z-API] Telefone: {phone}")
-                logger.error("=" * 60)
-                return False
+        if response.status_code == 200:
+            logger.info(f"[ENVIO Z-API] SUCESSO - Mensagem enviada para {phone}")
+            logger.info("=" * 40)
+            return True
+        else:
+            logger.error("=" * 60)
+            logger.error(f"[ENVIO Z-API] FALHA! Status: {response.status_code}")
+            logger.error(f"[ENVIO Z-API] Resposta erro: {response.text}")
+            logger.error(f"[ENVIO Z-API] Telefone: {phone}")
+            logger.error("=" * 60)
+            return False
 
     except httpx.TimeoutException:
         logger.error(f"[ENVIO Z-API] TIMEOUT ao enviar para {phone} (30s)")
@@ -2629,15 +2720,15 @@ async def download_media_from_zapi(media_url: str) -> Optional[bytes]:
     try:
         logger.info(f"Baixando midia: {media_url[:100]}")
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(media_url)
+        client = get_http_client("zapi_media")
+        response = await client.get(media_url)
 
-            if response.status_code == 200:
-                logger.info(f"Midia baixada ({len(response.content)} bytes)")
-                return response.content
-            else:
-                logger.error(f"Erro ao baixar midia: {response.status_code}")
-                return None
+        if response.status_code == 200:
+            logger.info(f"Midia baixada ({len(response.content)} bytes)")
+            return response.content
+        else:
+            logger.error(f"Erro ao baixar midia: {response.status_code}")
+            return None
 
     except Exception as e:
         logger.error(f"Erro ao baixar midia: {str(e)}")
@@ -2674,32 +2765,32 @@ async def portal_login() -> Optional[str]:
             "password": LEGACY_PORTAL_PASSWORD
         }
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-
-            if response.status_code == 200:
-                data = response.json()
-                token = data.get("token") or data.get("access_token") or data.get("accessToken")
-                if token:
-                    from datetime import timedelta
-                    _portal_token_cache["token"] = token
-                    _portal_token_cache["expires_at"] = datetime.now() + timedelta(minutes=50)
-                    logger.info("[PORTAL] Login realizado com sucesso")
-                    return token
-                else:
-                    logger.error(f"[PORTAL] Login retornou 200 mas sem token: {response.text[:200]}")
-                    return None
+        client = get_http_client("portal")
+        response = await client.post(url, json=payload)
+
+        if response.status_code == 200:
+            data = response.json()
+            token = data.get("token") or data.get("access_token") or data.get("accessToken")
+            if token:
+                from datetime import timedelta
+                _portal_token_cache["token"] = token
+                _portal_token_cache["expires_at"] = datetime.now() + timedelta(minutes=50)
+                logger.info("[PORTAL] Login realizado com sucesso")
+                return token
             else:
-                logger.error(f"[PORTAL] Falha no login: {response.status_code} - {response.text[:200]}")
+                logger.error(f"[PORTAL] Login retornou 200 mas sem token: {response.text[:200]}")
                 return None
+        else:
+            logger.error(f"[PORTAL] Falha no login: {response.status_code} - {response.text[:200]}")
+            return None
 
     except Exception as e:
         logger.error(f"[PORTAL] Erro no login: {str(e)}")
         return None
 
 
-async def extrair_dados_com_claude(phone: str, image_bytes: Optional[bytes] = None, pdf_bytes: Optional[bytes] = None) -> dict:
-    """Usa Claude (Anthropic) para extrair dados do cliente e documento da conversa"""
+async def extrair_dados_com_claude(phone: str, midia_id: Optional[str] = None) -> dict:
+    """Usa Claude (Anthropic) para extrair dados do cliente e documento (midia_id do media_store) da conversa"""
     try:
         if not os.getenv("ANTHROPIC_API_KEY"):
             logger.warning("[CLAUDE] ANTHROPIC_API_KEY nao configurada, usando dados do estado do cliente")
@@ -2725,39 +2816,31 @@ async def extrair_dados_com_claude(phone: str, image_bytes: Optional[bytes] = No
 
         # Se tiver imagem, incluir para analise visual
         content_parts = []
-        if image_bytes:
-            base64_img = base64.b64encode(image_bytes).decode('utf-8')
+        if midia_id and obter_mime(midia_id).startswith("image/"):
+            # Imagem normalizada para extracao de dados (image_prep)
+            base64_img, mime_img = await obter_base64_preparada(midia_id, "extracao")
             content_parts.append({
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
+                    "media_type": mime_img,
                     "data": base64_img
                 }
             })
-        elif pdf_bytes:
-            # Converter primeira pagina do PDF para imagem
-            try:
-                temp_pdf = f"/tmp/claude_pdf_{phone}_{int(time.time())}.pdf"
-                with open(temp_pdf, "wb") as f:
-                    f.write(pdf_bytes)
-                from pdf2image import convert_from_path
-                pages = convert_from_path(temp_pdf, dpi=150, first_page=1, last_page=1)
-                if pages:
-                    img_buf = BytesIO()
-                    pages[0].save(img_buf, format='PNG')
-                    base64_img = base64.b64encode(img_buf.getvalue()).decode('utf-8')
-                    content_parts.append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/png",
-                            "data": base64_img
-                        }
-                    })
-                os.remove(temp_pdf)
-            except Exception as e:
-                logger.warning(f"[CLAUDE] Nao foi possivel converter PDF para imagem: {e}")
+        elif midia_id:
+            # Primeira pagina do PDF (renderizada uma vez e compartilhada com a Vision)
+            base64_img = await obter_primeira_pagina_base64(midia_id)
+            if base64_img:
+                content_parts.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/png",
+                        "data": base64_img
+                    }
+                })
+            else:
+                logger.warning("[CLAUDE] Nao foi possivel converter PDF para imagem")
 
         content_parts.append({
             "type": "text",
@@ -2792,7 +2875,8 @@ IMPORTANTE: Retorne APENAS o JSON, sem markdown, sem texto adicional."""
             "content": content_parts
         })
 
-        response = anthropic_client.messages.create(
+        response = await claude_message(
+            task="extracao_dados_claude",
             model="claude-sonnet-4-20250514",
             max_tokens=500,
             messages=claude_messages
@@ -2865,23 +2949,23 @@ async def criar_pedido_portal(dados_cliente: dict) -> Optional[dict]:
 
         logger.info(f"[PORTAL] Criando pedido: {json.dumps(payload, ensure_ascii=False)[:300]}")
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, headers=headers, json=payload)
+        client = get_http_client("portal")
+        response = await client.post(url, headers=headers, json=payload)
 
-            if response.status_code in (200, 201):
-                result = response.json()
-                order_id = result.get("id") or result.get("_id") or result.get("orderId") or result.get("order_id")
-                order_code = result.get("orderCode") or result.get("order_code") or result.get("code") or str(order_id)[:8] if order_id else "N/A"
+        if response.status_code in (200, 201):
+            result = response.json()
+            order_id = result.get("id") or result.get("_id") or result.get("orderId") or result.get("order_id")
+            order_code = result.get("orderCode") or result.get("order_code") or result.get("code") or str(order_id)[:8] if order_id else "N/A"
 
-                logger.info(f"[PORTAL] Pedido criado com sucesso! ID: {order_id}, Codigo: {order_code}")
-                return {
-                    "order_id": str(order_id),
-                    "order_code": order_code,
-                    "full_response": result
-                }
-            else:
-                logger.error(f"[PORTAL] Falha ao criar pedido: {response.status_code} - {response.text[:300]}")
-                return None
+            logger.info(f"[PORTAL] Pedido criado com sucesso! ID: {order_id}, Codigo: {order_code}")
+            return {
+                "order_id": str(order_id),
+                "order_code": order_code,
+                "full_response": result
+            }
+        else:
+            logger.error(f"[PORTAL] Falha ao criar pedido: {response.status_code} - {response.text[:300]}")
+            return None
 
     except Exception as e:
         logger.error(f"[PORTAL] Erro ao criar pedido: {str(e)}")
@@ -2909,15 +2993,15 @@ async def upload_documento_portal(order_id: str, file_bytes: bytes, filename: st
 
         logger.info(f"[PORTAL] Fazendo upload de {filename} ({len(file_bytes)} bytes) para pedido {order_id}")
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, headers=headers, files=files)
+        client = get_http_client("portal")
+        response = await client.post(url, headers=headers, files=files, timeout=timeout_do_servico("portal", 60.0))
 
-            if response.status_code in (200, 201):
-                logger.info(f"[PORTAL] Upload concluido com sucesso para pedido {order_id}")
-                return True
-            else:
-                logger.error(f"[PORTAL] Falha no upload: {response.status_code} - {response.text[:300]}")
-                return False
+        if response.status_code in (200, 201):
+            logger.info(f"[PORTAL] Upload concluido com sucesso para pedido {order_id}")
+            return True
+        else:
+            logger.error(f"[PORTAL] Falha no upload: {response.status_code} - {response.text[:300]}")
+            return False
 
     except Exception as e:
         logger.error(f"[PORTAL] Erro no upload: {str(e)}")
@@ -2969,96 +3053,130 @@ O documento ja foi enviado para o Portal Legacy."""
         return False
 
 
-async def processar_documento_para_portal(phone: str, file_bytes: bytes, filename: str = "documento.pdf", mime_type: str = "application/pdf", is_image: bool = False):
-    """Pipeline completo: extrair dados -> criar pedido -> upload -> notificar
-    Executa em background sem bloquear o fluxo principal do bot"""
+def iniciar_pipeline_portal(phone: str, midia_id: str, filename: str = "documento.pdf", mime_type: str = "application/pdf", is_image: bool = False):
+    """Retem a midia e dispara o pipeline do Portal em background (o pipeline libera ao terminar)"""
+    reter(midia_id)
+    asyncio.create_task(
+        processar_documento_para_portal(
+            phone=phone,
+            midia_id=midia_id,
+            filename=filename,
+            mime_type=mime_type,
+            is_image=is_image
+        )
+    )
+
+
+async def processar_documento_para_portal(phone: str, midia_id: str, filename: str = "documento.pdf", mime_type: str = "application/pdf", is_image: bool = False):
+    """Pipeline em DAG: extrair dados -> criar pedido -> (upload | notificar), com o Drive em paralelo.
+    Idempotente por (telefone, hash do documento). Executa em background sem bloquear o fluxo principal do bot"""
     try:
         logger.info(f"[PORTAL-PIPELINE] Iniciando processamento para {phone}")
 
-        # 1. Extrair dados com Claude
-        if is_image:
-            dados = await extrair_dados_com_claude(phone, image_bytes=file_bytes)
-        else:
-            dados = await extrair_dados_com_claude(phone, pdf_bytes=file_bytes)
+        file_bytes = obter_bytes(midia_id)
+        if file_bytes is None:
+            logger.error(f"[PORTAL-PIPELINE] Midia {midia_id[:12]} nao esta mais em memoria para {phone}")
+            return
 
-        # 2. Criar pedido no Portal
-        resultado_pedido = await criar_pedido_portal(dados)
+        chave = f"{phone_key(phone)}:{midia_id}"
+        # So o mesmo arquivo (SHA-256): paginas diferentes do mesmo modelo de
+        # certidao tem dHash parecido e precisam de pedido proprio
+        anterior = await buscar_documento(phone, midia_id, parecidos=False)
+
+        # 0. Documento reenviado (pedido anterior ao pipeline em DAG): reaproveitar o pedido
+        if anterior and anterior.get("order_code") and not await db.portal_orders.find_one({"chave_idempotencia": chave}, {"_id": 1}):
+            logger.info(f"[DOC-VISTO] {phone}: documento ja tem o pedido {anterior['order_code']}, nenhum pedido novo criado")
+            await db.portal_orders.update_one(
+                {"order_id": anterior.get("order_id")},
+                {"$set": {"reenviado_em": datetime.now()}, "$inc": {"reenvios": 1}}
+            )
+            return
 
-        if not resultado_pedido:
-            logger.error(f"[PORTAL-PIPELINE] Falha ao criar pedido para {phone}")
+        # Mesma chave: retoma a execucao anterior (etapas concluidas nao rodam de novo)
+        execucao = await reservar_execucao(db.portal_orders, chave, {
+            "phone": phone,
+            "sha256": midia_id,
+            "upload_ok": False,
+            "google_drive": None
+        })
+        if execucao is None:
             return
 
-        order_id = resultado_pedido["order_id"]
-        order_code = resultado_pedido["order_code"]
+        async def _extrair(r: dict):
+            return await extrair_dados_com_claude(phone, midia_id)
 
-        # 3. Upload do documento
-        upload_ok = await upload_documento_portal(order_id, file_bytes, filename, mime_type)
+        async def _criar_pedido(r: dict):
+            resultado_pedido = await criar_pedido_portal(r["extrair"])
+            if not resultado_pedido:
+                raise RuntimeError("Portal nao criou o pedido")
+            await registrar_documento(
+                phone, midia_id, anterior,
+                order_id=resultado_pedido["order_id"], order_code=resultado_pedido["order_code"]
+            )
+            return resultado_pedido
+
+        async def _upload(r: dict):
+            return await upload_documento_portal(r["criar_pedido"]["order_id"], file_bytes, filename, mime_type)
+
+        async def _drive(r: dict):
+            dados = r["extrair"]
+            gdrive_result = await salvar_midia_no_drive(
+                phone=phone,
+                midia_id=midia_id,
+                media_type="image" if is_image else "document",
+                filename=filename,
+                mime_type=mime_type,
+                nome=dados.get("nome", "") if dados else ""
+            )
+            if gdrive_result:
+                logger.info(f"[GDRIVE] Documento salvo no Drive para {phone}: {gdrive_result['folder_link']}")
+            else:
+                logger.warning(f"[GDRIVE] Falha ao salvar documento no Drive para {phone}")
+            return gdrive_result
 
-        if not upload_ok:
-            logger.warning(f"[PORTAL-PIPELINE] Upload falhou para pedido {order_code}, mas pedido foi criado")
+        async def _notificar(r: dict):
+            return await notificar_operador_novo_pedido(r["extrair"], r["criar_pedido"]["order_code"])
 
-        # 3.5. Upload ao Google Drive (em paralelo, nao bloqueia o fluxo)
-        gdrive_result = None
+        etapas = [
+            Etapa("extrair", _extrair, campos=lambda dados: {"dados_cliente": dados}),
+            Etapa("criar_pedido", _criar_pedido, ["extrair"], campos=lambda pedido: {"order_id": pedido["order_id"], "order_code": pedido["order_code"]}),
+            Etapa("upload_portal", _upload, ["criar_pedido"], campos=lambda ok: {"upload_ok": ok}),
+            Etapa("notificar_operador", _notificar, ["criar_pedido"]),
+        ]
+        # O Drive nao depende do Portal: roda junto com a criacao do pedido
         if is_drive_enabled():
-            try:
-                nome_cliente = dados.get("nome", "") if dados else ""
-                gdrive_result = await save_whatsapp_media_to_drive(
-                    file_bytes=file_bytes,
-                    phone=phone,
-                    media_type="image" if is_image else "document",
-                    filename=filename,
-                    mime_type=mime_type,
-                    nome=nome_cliente
-                )
-                if gdrive_result:
-                    logger.info(f"[GDRIVE] Documento salvo no Drive para {phone}: {gdrive_result['folder_link']}")
-                else:
-                    logger.warning(f"[GDRIVE] Falha ao salvar documento no Drive para {phone}")
-            except Exception as gdrive_err:
-                logger.error(f"[GDRIVE] Erro no upload para {phone}: {gdrive_err}")
+            etapas.append(Etapa("google_drive", _drive, ["extrair"], campos=lambda gdrive: {"google_drive": gdrive}))
 
-        # 4. Notificar operador via WhatsApp
-        await notificar_operador_novo_pedido(dados, order_code)
+        resultados = await executar_dag(db.portal_orders, execucao, etapas)
 
-        # 5. Salvar registro no MongoDB
-        await db.portal_orders.insert_one({
-            "phone": phone,
-            "order_id": order_id,
-            "order_code": order_code,
-            "dados_cliente": dados,
-            "upload_ok": upload_ok,
-            "google_drive": gdrive_result,
-            "created_at": datetime.now()
-        })
+        pedido = resultados.get("criar_pedido")
+        if not pedido:
+            logger.error(f"[PORTAL-PIPELINE] Falha ao criar pedido para {phone}")
+            return
+        if not resultados.get("upload_portal"):
+            logger.warning(f"[PORTAL-PIPELINE] Upload falhou para pedido {pedido['order_code']}, mas pedido foi criado")
 
-        logger.info(f"[PORTAL-PIPELINE] Pipeline concluido para {phone} - Pedido: {order_code}")
+        logger.info(f"[PORTAL-PIPELINE] Pipeline concluido para {phone} - Pedido: {pedido['order_code']}")
 
     except Exception as e:
         logger.error(f"[PORTAL-PIPELINE] Erro no pipeline para {phone}: {str(e)}")
         logger.error(traceback.format_exc())
+    finally:
+        liberar(midia_id)
 
 
 # ============================================================
 # FUNCAO: PROCESSAR IMAGEM COM GPT-4 VISION
 # ============================================================
-async def process_image_with_vision(image_bytes: bytes, phone: str) -> str:
-    """Analisa imagem com GPT-4 Vision"""
+async def process_image_with_vision(midia_id: str, phone: str) -> str:
+    """Analisa imagem (midia_id do media_store) com GPT-4 Vision"""
     try:
-        logger.info(f"Processando imagem com Vision ({len(image_bytes)} bytes)")
-
-        # Converter para base64
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        logger.info(f"Processando imagem com Vision ({midia_id[:12]})")
 
         # Buscar treinamento dinamico
         training_prompt = await get_bot_training()
 
-        # Chamar GPT-4 Vision
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""{training_prompt}
+        prompt_sistema = f"""{training_prompt}
 
 TAREFA ESPECIAL - ANALISE DE IMAGEM:
 Voce recebeu uma imagem de documento. Analise e forneca:
@@ -3068,30 +3186,47 @@ Voce recebeu uma imagem de documento. Analise e forneca:
 - Orcamento baseado nas regras de preco do treinamento
 - Prazo de entrega
 Seja direto e objetivo na resposta."""
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Analise este documento e me de um orcamento de traducao."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+
+        async def _analisar_imagem() -> str:
+            # Imagem normalizada para leitura do conteudo (image_prep)
+            base64_image, mime_image = await obter_base64_preparada(midia_id, "extracao")
+
+            # Chamar GPT-4 Vision
+            response = await chat_completion(
+                task="imagem_vision",
+                model="gpt-4o",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": prompt_sistema
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Analise este documento e me de um orcamento de traducao."
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{mime_image};base64,{base64_image}"
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=800
-        )
+                        ]
+                    }
+                ],
+                max_tokens=800
+            )
+            return response.choices[0].message.content
 
-        analysis = response.choices[0].message.content
+        # Versao inclui o treinamento: mudou o treinamento, a analise e refeita
+        analysis = await obter_ou_calcular(
+            midia_id, "imagem_vision", versao_prompt(prompt_sistema, "gpt-4o"), _analisar_imagem
+        )
 
         # Salvar no banco
-        await db.conversas.insert_one({
+        await salvar_conversa({
             "phone": phone,
             "message": "[IMAGEM ENVIADA]",
             "role": "user",
@@ -3100,7 +3235,7 @@ Seja direto e objetivo na resposta."""
             "type": "image"
         })
 
-        await db.conversas.insert_one({
+        await salvar_conversa({
             "phone": phone,
             "message": analysis,
             "role": "assistant",
@@ -3120,88 +3255,91 @@ Seja direto e objetivo na resposta."""
 # ============================================================
 # FUNCAO: PROCESSAR PDF COM VISION
 # ============================================================
-async def process_pdf_with_vision(pdf_bytes: bytes, phone: str) -> str:
-    """Analisa PDF convertendo paginas em imagens e usando GPT-4 Vision"""
+async def process_pdf_with_vision(midia_id: str, phone: str) -> str:
+    """Analisa PDF (midia_id do media_store) convertendo a primeira pagina em imagem e usando GPT-4 Vision"""
     try:
-        logger.info(f"Processando PDF ({len(pdf_bytes)} bytes)")
-
-        # Salvar PDF temporariamente
-        temp_pdf_path = f"/tmp/pdf_{phone}_{int(time.time())}.pdf"
-        with open(temp_pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-
-        # Converter PDF para imagens
-        from pdf2image import convert_from_path
-        images = convert_from_path(temp_pdf_path, dpi=150)
-
-        logger.info(f"PDF convertido em {len(images)} paginas")
-
-        # Processar primeira pagina com Vision (para analise inicial)
-        first_page = images[0]
+        logger.info(f"Processando PDF ({midia_id[:12]})")
+
+        # Mesmo PDF ja enviado por este telefone: reaproveitar a analise
+        anterior = await buscar_documento(phone, midia_id, parecidos=False)
+        if anterior and anterior.get("analise_pdf"):
+            logger.info(f"[DOC-VISTO] {phone}: PDF ja analisado em {anterior.get('criado_em')}, reaproveitando")
+            analysis = anterior["analise_pdf"]
+            num_paginas = anterior.get("paginas") or 1
+        else:
+            # Numero de paginas pela estrutura do PDF (sem rasterizar)
+            num_paginas = await obter_num_paginas(midia_id)
 
-        # Converter para bytes
-        img_byte_arr = BytesIO()
-        first_page.save(img_byte_arr, format='PNG')
-        img_bytes = img_byte_arr.getvalue()
+            if num_paginas == 0:
+                num_paginas = 1
 
-        # Converter para base64
-        base64_image = base64.b64encode(img_bytes).decode('utf-8')
+            # Buscar treinamento dinamico
+            training_prompt = await get_bot_training()
 
-        # Buscar treinamento dinamico
-        training_prompt = await get_bot_training()
-
-        # Chamar GPT-4 Vision
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""{training_prompt}
+            prompt_sistema = f"""{training_prompt}
 
 TAREFA ESPECIAL - ANALISE DE PDF:
-Voce recebeu a primeira pagina de um documento PDF com {len(images)} paginas. Analise e forneca:
+Voce recebeu a primeira pagina de um documento PDF com {num_paginas} paginas. Analise e forneca:
 - Tipo de documento (certidao, diploma, contrato, etc)
 - Idioma detectado
-- Numero de paginas: {len(images)}
+- Numero de paginas: {num_paginas}
 - Orcamento baseado nas regras de preco do treinamento
 - Prazo de entrega
 Seja direto e objetivo na resposta."""
-                },
-                {
-                    "role": "user",
-                    "content": [
+
+            async def _analisar_pdf() -> str:
+                # Primeira pagina renderizada uma vez (reaproveitada pela extracao com Claude)
+                base64_image = await obter_primeira_pagina_base64(midia_id)
+                if not base64_image:
+                    raise ValueError("Nao foi possivel renderizar a primeira pagina do PDF")
+
+                logger.info(f"PDF com {num_paginas} paginas (renderizada apenas a primeira)")
+
+                # Chamar GPT-4 Vision
+                response = await chat_completion(
+                    task="pdf_vision",
+                    model="gpt-4o",
+                    messages=[
                         {
-                            "type": "text",
-                            "text": f"Analise este documento PDF de {len(images)} paginas e me de um orcamento de traducao."
+                            "role": "system",
+                            "content": prompt_sistema
                         },
                         {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": f"Analise este documento PDF de {num_paginas} paginas e me de um orcamento de traducao."
+                                },
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/png;base64,{base64_image}"
+                                    }
+                                }
+                            ]
                         }
-                    ]
-                }
-            ],
-            max_tokens=800
-        )
-
-        analysis = response.choices[0].message.content
+                    ],
+                    max_tokens=800
+                )
+                return response.choices[0].message.content
 
-        # Limpar arquivo temporario
-        os.remove(temp_pdf_path)
+            analysis = await obter_ou_calcular(
+                midia_id, "pdf_vision", versao_prompt(prompt_sistema, "gpt-4o"), _analisar_pdf
+            )
+            await registrar_documento(phone, midia_id, anterior, analise_pdf=analysis, paginas=num_paginas)
 
         # Salvar no banco
-        await db.conversas.insert_one({
+        await salvar_conversa({
             "phone": phone,
-            "message": f"[PDF ENVIADO - {len(images)} paginas]",
+            "message": f"[PDF ENVIADO - {num_paginas} paginas]",
             "role": "user",
             "timestamp": datetime.now(),
             "canal": "WhatsApp",
             "type": "document"
         })
 
-        await db.conversas.insert_one({
+        await salvar_conversa({
             "phone": phone,
             "message": analysis,
             "role": "assistant",
@@ -3230,17 +3368,21 @@ async def process_audio_with_whisper(audio_bytes: bytes, phone: str) -> Optional
         temp_file = BytesIO(audio_bytes)
         temp_file.name = "audio.ogg"
 
-        # Chamar Whisper
-        transcription = openai_client.audio.transcriptions.create(
+        # Chamar Whisper com o idioma da conversa; sem idioma no estado,
+        # o Whisper detecta sozinho (forcar "pt" estragava audios em en/es)
+        idioma = await get_idioma_salvo(phone)
+        parametros = {"language": idioma} if idioma else {}
+        transcription = await transcribe_audio(
+            task="whisper",
             model="whisper-1",
             file=temp_file,
-            language="pt"  # Pode ser pt, en, es
+            **parametros
         )
 
         transcribed_text = transcription.text
 
         # Salvar no banco
-        await db.conversas.insert_one({
+        await salvar_conversa({
             "phone": phone,
             "message": f"[AUDIO] {transcribed_text}",
             "role": "user",
@@ -3292,12 +3434,19 @@ def get_transfer_message(idioma: str = "pt") -> str:
     }
     return messages.get(idioma, messages["pt"])
 
-async def process_message_with_ai(phone: str, message: str, skip_auto_transfer: bool = False) -> str:
+async def process_message_with_ai(
+    phone: str,
+    message: str,
+    skip_auto_transfer: bool = False,
+    permitir_atalhos: bool = True
+) -> str:
     """Processar mensagem com GPT-4 usando treinamento dinamico
 
     Args:
         skip_auto_transfer: Se True, pula deteccao automatica de transferencia.
             Usado para audio (transcricoes Whisper geram falsos positivos).
+        permitir_atalhos: Se False, nao passa pelas camadas baratas do
+            response_router (ex: mensagem com contexto interno do orcamento).
     """
     try:
         if not skip_auto_transfer:
@@ -3321,18 +3470,42 @@ async def process_message_with_ai(phone: str, message: str, skip_auto_transfer:
                 else:
                     return "Entendi! Vou te conectar com nossa equipe para que possam te ajudar com isso. Um atendente entrara em contato em breve. 😊"
 
-        # Buscar treinamento dinamico do MongoDB
-        system_prompt = await get_bot_training()
+        # Buscar contexto
+        context = await get_conversation_context(phone)
+
+        # Treinamento com os conhecimentos relevantes para esta mensagem
+        # (inclui a ultima mensagem do cliente para perguntas de continuacao)
+        ultima_do_cliente = next(
+            (m["content"] for m in reversed(context) if m.get("role") == "user" and m.get("content") != message),
+            ""
+        )
+        system_prompt = await get_bot_training_relevante(f"{message} {ultima_do_cliente}")
 
-        # Detectar idioma do cliente e injetar instrucao explicita
+        # Idioma da resposta: o da mensagem atual quando a deteccao e confiavel,
+        # senao o da conversa (estado). Sem nenhum dos dois, a IA segue o cliente
+        deteccao = identificar_idioma(message)
+        if deteccao.confiavel:
+            idioma_cliente = deteccao.idioma
+        else:
+            idioma_cliente = await get_idioma_salvo(phone)
+        if idioma_cliente:
+            idioma_map = {"en": "English", "es": "Spanish", "pt": "Portuguese"}
+            idioma_nome = idioma_map.get(idioma_cliente, "Portuguese")
+            system_prompt += f"\n\n**IDIOMA OBRIGATÓRIO:** O cliente está se comunicando em {idioma_nome}. Você DEVE responder EXCLUSIVAMENTE em {idioma_nome}. NÃO responda em outro idioma."
+
+        # Cliente com documento/orcamento em andamento: respostas do cache
+        # (geradas para outros clientes) nao servem, nem para consulta nem gravacao
         estado = await get_cliente_estado(phone)
-        idioma_cliente = estado.get("idioma", detectar_idioma(message))
-        idioma_map = {"en": "English", "es": "Spanish", "pt": "Portuguese"}
-        idioma_nome = idioma_map.get(idioma_cliente, "Portuguese")
-        system_prompt += f"\n\n**IDIOMA OBRIGATÓRIO:** O cliente está se comunicando em {idioma_nome}. Você DEVE responder EXCLUSIVAMENTE em {idioma_nome}. NÃO responda em outro idioma."
+        sem_atendimento_em_andamento = not estado.get("documento_info") and not estado.get("valor_orcamento")
 
-        # Buscar contexto
-        context = await get_conversation_context(phone)
+        # Camadas baratas (resposta pronta, FAQ, cache, modelo pequeno) antes do GPT-4o
+        if permitir_atalhos:
+            roteado = await rotear_mensagem(
+                "whatsapp", message, idioma_cliente, context, system_prompt,
+                usar_cache=sem_atendimento_em_andamento
+            )
+            if roteado:
+                return roteado.resposta
 
         # Montar mensagens
         messages = [
@@ -3342,15 +3515,22 @@ async def process_message_with_ai(phone: str, message: str, skip_auto_transfer:
         ]
 
         # Chamar GPT-4
-        response = openai_client.chat.completions.create(
+        inicio_llm = time.monotonic()
+        response = await chat_completion(
+            task="chat_whatsapp",
             model="gpt-4o",
             messages=messages,
             max_tokens=500,
             temperature=0.7
         )
+        registrar_chamada_llm("gpt-4o", (time.monotonic() - inicio_llm) * 1000, getattr(response, "usage", None))
 
         reply = response.choices[0].message.content
 
+        # Primeira pergunta de quem ainda nao tem documento/orcamento: resposta reaproveitavel
+        if permitir_atalhos and reply and sem_atendimento_em_andamento:
+            await guardar_resposta_gerada("whatsapp", message, idioma_cliente, reply, context, estado.get("nome"))
+
         # NOTA: Nao salvar no banco aqui - os callers (webhook handler) ja salvam
         # para evitar duplicacao de mensagens no contexto da conversa
 
@@ -3366,8 +3546,8 @@ async def process_message_with_ai(phone: str, message: str, skip_auto_transfer:
 # FUNCAO AUXILIAR: NORMALIZAR TELEFONE
 # ============================================================
 def normalize_phone(phone: str) -> str:
-    """Normaliza numero de telefone para comparacao"""
-    return ''.join(filter(str.isdigit, phone))[-10:]
+    """Normaliza numero de telefone para comparacao (mesma regra do phone_key)"""
+    return phone_key(phone)
 
 
 # ============================================================
@@ -3427,6 +3607,23 @@ async def api_debug_config():
             "openai": {
                 "api_key": "OK" if openai_ok else "FALTANDO!"
             },
+            "llm_gateway": get_llm_stats(),
+            "http_clients": get_http_stats(),
+            "treinamento_cache": get_cache_info(),
+            "kb_busca": get_retrieval_stats(),
+            "estado_cache": get_estado_cache_stats(),
+            "pdf": get_pdf_stats(),
+            "midia": get_media_stats(),
+            "preparo_imagens": get_image_prep_stats(),
+            "lote_imagens": get_image_batch_stats(),
+            "documentos_vistos": get_doc_fingerprint_stats(),
+            "visao_cache": await get_visao_cache_stats(),
+            "pipeline_portal": get_pipeline_stats(),
+            "google_drive": get_drive_stats(),
+            "intencoes": get_intent_stats(),
+            "idiomas": get_idioma_stats(),
+            "roteamento": get_roteamento_stats(),
+            "respostas_cache": await get_respostas_cache_stats(),
             "mongodb": {
                 "conectado": mongodb_ok,
                 "erro": mongodb_error
@@ -3492,7 +3689,8 @@ async def api_bot_toggle(enabled: bool):
 @app.get("/admin/api/cliente/{phone}/modo")
 async def api_get_modo_cliente(phone: str):
     """Verifica o modo atual de um cliente (ia ou human)"""
-    estado = await db.cliente_estados.find_one({"phone": phone})
+    # Pelo cache de estado: ve o que o bot ja gravou para o telefone
+    estado = await obter_estado(phone)
 
     if not estado:
         return {
@@ -3573,33 +3771,77 @@ async def api_listar_clientes_modo_humano():
 @app.post("/webhook/whatsapp")
 async def webhook_whatsapp(request: Request):
     """
-    Webhook principal para receber mensagens do WhatsApp via Z-API
-    Suporta: texto, imagens e audios
+    Webhook principal para receber mensagens do WhatsApp via Z-API.
+    Apenas valida, deduplica e grava o evento na fila (webhook_jobs);
+    o processamento acontece nos workers (processar_evento_webhook).
+    Assim o Z-API recebe 200 em milissegundos e nao reenvia o evento.
     """
     try:
         data = await request.json()
-        logger.info(f"Webhook recebido: {json.dumps(data, indent=2)}")
+    except Exception:
+        return JSONResponse({"status": "ignored", "reason": "invalid_json"}, status_code=400)
+
+    if not isinstance(data, dict):
+        return JSONResponse({"status": "ignored", "reason": "invalid_payload"}, status_code=400)
+
+    message_id = data.get("messageId", "")
+
+    # Dedup rapido em memoria (o indice unico de webhook_jobs cobre restarts)
+    if verificar_mensagem_duplicada(message_id):
+        return JSONResponse({
+            "status": "ignored",
+            "reason": "duplicate_message",
+            "messageId": message_id
+        })
+
+    try:
+        job_id = await enfileirar_evento(data)
+    except Exception as e:
+        # Mongo indisponivel: nao perder o evento, processar direto em background
+        logger.error(f"[FILA] Erro ao enfileirar evento {message_id}: {e} - processando sem fila")
+        asyncio.create_task(processar_evento_em_turno(data))
+        return JSONResponse({"status": "accepted", "queued": False})
+
+    if job_id is None:
+        return JSONResponse({
+            "status": "ignored",
+            "reason": "duplicate_message",
+            "messageId": message_id
+        })
+
+    return JSONResponse({"status": "queued", "job_id": job_id})
+
+
+async def processar_job_webhook(data: dict):
+    """Handler dos workers da fila: falhas (status 500) disparam retentativa"""
+    resultado = await processar_evento_em_turno(data)
+    if getattr(resultado, "status_code", 200) >= 500:
+        raise RuntimeError(bytes(resultado.body).decode("utf-8", errors="ignore")[:300])
+
+
+async def processar_evento_em_turno(data: dict):
+    """Processa o evento como um turno: as escritas no cliente_estados saem num unico update no fim"""
+    async with turno_estado():
+        return await processar_evento_webhook(data)
+
+
+async def processar_evento_webhook(data: dict):
+    """
+    Processa um evento do WhatsApp (Z-API) ja persistido na fila.
+    Suporta: texto, imagens e audios
+    """
+    try:
+        logger.info(f"Webhook recebido: {json.dumps(data, indent=2, default=str)}")
 
         # ============================================
         # EXTRAIR DADOS BASICOS
         # ============================================
         phone_raw = data.get("phone", "")
-        # Limpar sufixos Z-API como @lid, @c.us, @s.whatsapp.net
-        phone = phone_raw.split("@")[0] if "@" in phone_raw else phone_raw
-        # Remover caracteres nao-numericos (manter apenas digitos)
-        phone = ''.join(c for c in phone if c.isdigit())
-
-        # Z-API tambem pode enviar chatId com o telefone real (formato: phone@c.us)
-        chat_id_raw = data.get("chatId", "") or data.get("chat", {}).get("id", "") if isinstance(data.get("chat"), dict) else ""
-        chat_id_phone = ""
-        if chat_id_raw:
-            chat_id_phone = chat_id_raw.split("@")[0]
-            chat_id_phone = ''.join(c for c in chat_id_phone if c.isdigit())
-
-        # Se phone parece ser LID mas chatId tem telefone real, usar chatId
-        if is_phone_lid(phone) and chat_id_phone and not is_phone_lid(chat_id_phone):
-            logger.info(f"[PHONE-LID] phone={phone} e LID, usando chatId={chat_id_phone}")
-            phone = chat_id_phone
+        # Sem sufixo Z-API (@lid, @c.us), so digitos; LID resolvido pelo chatId ou
+        # pelo mapa de LIDs - o mesmo telefone da chave do ator na fila (chave_ordem)
+        phone = telefone_do_evento(data)
+        if is_phone_lid(''.join(c for c in phone_raw.split("@")[0] if c.isdigit())) and not is_phone_lid(phone):
+            logger.info(f"[PHONE-LID] phone={phone_raw} e LID, usando {phone}")
 
         if phone_raw != phone:
             logger.info(f"[PHONE-CLEAN] Telefone limpo: '{phone_raw}' -> '{phone}'")
@@ -3628,15 +3870,7 @@ async def webhook_whatsapp(request: Request):
         # LOG DETALHADO PARA DEBUG DE COMANDOS
         logger.info(f"[DEBUG] fromMe={from_me} (raw={from_me_raw}, type={type(from_me_raw).__name__})")
 
-        # ============================================
-        # VERIFICAR MENSAGEM DUPLICADA
-        # ============================================
-        if verificar_mensagem_duplicada(message_id):
-            return JSONResponse({
-                "status": "ignored",
-                "reason": "duplicate_message",
-                "messageId": message_id
-            })
+        # Deduplicacao de messageId ja feita no recebimento (webhook_whatsapp)
 
         # Extrair texto de forma mais robusta
         # Z-API pode enviar o texto em diferentes formatos
@@ -3774,12 +4008,12 @@ async def webhook_whatsapp(request: Request):
 
                     # Verificar se o phone existe em cliente_estados (seguranca extra)
                     if cliente_phone:
-                        estado_existe = await db.cliente_estados.find_one({"phone": cliente_phone})
+                        estado_existe = await obter_estado(cliente_phone)
                         if not estado_existe:
                             logger.warning(f"[OPERADOR] Phone {cliente_phone} NAO encontrado em cliente_estados, buscando alternativa...")
                             # Tentar encontrar por conversas recentes
                             ultimo_msg = await db.conversas.find_one(
-                                {"role": "user", "phone": {"$regex": f".*{cliente_phone[-10:]}$"}} if len(cliente_phone) >= 10 else {"role": "user", "phone": cliente_phone},
+                                {"role": "user", "phone_key": phone_key(cliente_phone)} if len(cliente_phone) >= 10 else {"role": "user", "phone": cliente_phone},
                                 sort=[("timestamp", -1)]
                             )
                             if ultimo_msg:
@@ -3848,7 +4082,7 @@ async def webhook_whatsapp(request: Request):
                             if msg_phone and msg_phone not in phones_vistos and not is_operator_phone(msg_phone):
                                 phones_vistos.add(msg_phone)
                                 # Verificar se este cliente esta em modo IA (nao esta pausado)
-                                estado_cli = await db.cliente_estados.find_one({"phone": msg_phone})
+                                estado_cli = await obter_estado(msg_phone)
                                 modo_cli = estado_cli.get("mode", "ia") if estado_cli else "ia"
                                 if modo_cli == "ia":
                                     cliente_phone = msg_phone
@@ -3966,7 +4200,7 @@ async def webhook_whatsapp(request: Request):
         if not bot_status["enabled"] or modo_humano:
             logger.info(f"[WEBHOOK] Bot {'DESLIGADO' if not bot_status['enabled'] else 'em MODO HUMANO para ' + phone} - Mensagem nao sera processada pela IA")
 
-            await db.conversas.insert_one({
+            await salvar_conversa({
                 "phone": phone,
                 "message": message_text or "[MENSAGEM]",
                 "timestamp": datetime.now(),
@@ -4163,10 +4397,8 @@ Para urgencias: (contato)"""
             estado = await get_cliente_estado(phone)
             etapa_atual = estado.get("etapa", ETAPAS["INICIAL"])
 
-            # Atualizar idioma baseado na resposta do cliente
-            idioma_detectado = detectar_idioma(text)
-            if idioma_detectado != estado.get("idioma", "pt"):
-                await set_cliente_estado(phone, idioma=idioma_detectado)
+            # Atualizar idioma baseado na resposta do cliente (so com deteccao confiavel)
+            await atualizar_idioma_cliente(phone, text, estado)
 
             # Extrair quantidade de documentos/paginas mencionada no texto
             # Ex: "2 certidoes", "3 paginas", "tenho 4 documentos"
@@ -4188,7 +4420,7 @@ Para urgencias: (contato)"""
                         logger.info(f"[PAGES-TEXT] Cliente {phone} mencionou {doc_count} documentos/paginas no texto")
 
             # Salvar mensagem do usuario
-            await db.conversas.insert_one({
+            await salvar_conversa({
                 "phone": phone,
                 "message": text,
                 "role": "user",
@@ -4221,7 +4453,7 @@ Para urgencias: (contato)"""
                     )
 
                 await send_whatsapp_message(phone, reply)
-                await db.conversas.insert_one({
+                await salvar_conversa({
                     "phone": phone,
                     "message": reply,
                     "role": "assistant",
@@ -4252,7 +4484,7 @@ Para urgencias: (contato)"""
                     )
 
                 await send_whatsapp_message(phone, reply)
-                await db.conversas.insert_one({
+                await salvar_conversa({
                     "phone": phone,
                     "message": reply,
                     "role": "assistant",
@@ -4285,7 +4517,7 @@ Para urgencias: (contato)"""
                     )
 
                 await send_whatsapp_message(phone, reply)
-                await db.conversas.insert_one({
+                await salvar_conversa({
                     "phone": phone,
                     "message": reply,
                     "role": "assistant",
@@ -4381,7 +4613,11 @@ Para urgencias: (contato)"""
                     )
 
                 # Processar com IA
-                reply = await process_message_with_ai(phone, text + extra_context if extra_context else text)
+                reply = await process_message_with_ai(
+                    phone,
+                    text + extra_context if extra_context else text,
+                    permitir_atalhos=not extra_context
+                )
 
                 # PROTECAO: Impedir que a IA gere respostas de transferencia por conta propria
                 # A transferencia so deve acontecer quando o CLIENTE pede explicitamente
@@ -4422,7 +4658,7 @@ Para urgencias: (contato)"""
                 }, status_code=500)
 
             # Salvar resposta do bot (somente se envio foi bem sucedido)
-            await db.conversas.insert_one({
+            await salvar_conversa({
                 "phone": phone,
                 "message": reply,
                 "role": "assistant",
@@ -4466,17 +4702,17 @@ Para urgencias: (contato)"""
                 await send_whatsapp_message(phone, msg)
                 return JSONResponse({"status": "error", "reason": "download failed"})
 
+            # Bytes entram uma vez no media_store; as etapas recebem o midia_id
+            midia_id = guardar_midia(image_bytes, "image/jpeg")
+
             # Salvar imagem no Google Drive (background, nao bloqueia)
             if is_drive_enabled():
-                _create_gdrive_task(
-                    save_whatsapp_media_to_drive(
-                        file_bytes=image_bytes,
-                        phone=phone,
-                        media_type="image",
-                        filename=f"imagem_{phone}_{int(time.time())}.jpg",
-                        mime_type="image/jpeg"
-                    ),
+                iniciar_upload_drive(
                     phone=phone,
+                    midia_id=midia_id,
+                    media_type="image",
+                    filename=f"imagem_{phone}_{int(time.time())}.jpg",
+                    mime_type="image/jpeg",
                     description="upload imagem"
                 )
 
@@ -4490,12 +4726,12 @@ Para urgencias: (contato)"""
                 # Tratar imagem como possivel comprovante - SEMPRE processar na etapa de pagamento
                 logger.info(f"[ETAPA] {phone}: Recebeu imagem na etapa AGUARDANDO_PAGAMENTO - tratando como comprovante")
 
-                reply = await processar_etapa_pagamento(phone, "", is_image=True, image_bytes=image_bytes)
+                reply = await processar_etapa_pagamento(phone, "", is_image=True, midia_id=midia_id)
 
                 # reply SEMPRE tera valor (nunca None) na etapa de pagamento
                 if reply:
                     # Salvar no banco
-                    await db.conversas.insert_one({
+                    await salvar_conversa({
                         "phone": phone,
                         "message": "[IMAGEM RECEBIDA - ETAPA PAGAMENTO]",
                         "role": "user",
@@ -4504,7 +4740,7 @@ Para urgencias: (contato)"""
                         "type": "image"
                     })
 
-                    await db.conversas.insert_one({
+                    await salvar_conversa({
                         "phone": phone,
                         "message": reply,
                         "role": "assistant",
@@ -4550,7 +4786,7 @@ Para urgencias: (contato)"""
                         f"Me avise!"
                     )
 
-                await db.conversas.insert_one({
+                await salvar_conversa({
                     "phone": phone,
                     "message": "[IMAGEM RECEBIDA - ETAPA CONFIRMACAO]",
                     "role": "user",
@@ -4558,7 +4794,7 @@ Para urgencias: (contato)"""
                     "canal": "WhatsApp",
                     "type": "image"
                 })
-                await db.conversas.insert_one({
+                await salvar_conversa({
                     "phone": phone,
                     "message": reply,
                     "role": "assistant",
@@ -4584,11 +4820,11 @@ Para urgencias: (contato)"""
 
                 pos_pagamento_respondido[phone] = agora
 
-                reply = await processar_etapa_pos_pagamento(phone, "", is_image=True, image_bytes=image_bytes)
+                reply = await processar_etapa_pos_pagamento(phone, "", is_image=True, midia_id=midia_id)
 
                 if reply:
                     # Salvar no banco
-                    await db.conversas.insert_one({
+                    await salvar_conversa({
                         "phone": phone,
                         "message": "[IMAGEM RECEBIDA - POS PAGAMENTO]",
                         "role": "user",
@@ -4597,7 +4833,7 @@ Para urgencias: (contato)"""
                         "type": "image"
                     })
 
-                    await db.conversas.insert_one({
+                    await salvar_conversa({
                         "phone": phone,
                         "message": reply,
                         "role": "assistant",
@@ -4609,72 +4845,12 @@ Para urgencias: (contato)"""
                     return JSONResponse({"status": "processed", "type": "post_payment_image"})
 
             # ============================================
-            # FLUXO NORMAL: Sistema de agrupamento (4 segundos)
+            # FLUXO NORMAL: Lote de imagens (janela de silencio)
+            # O webhook retorna na hora; a pergunta de confirmacao sai
+            # uma unica vez quando o lote fecha (fechar_lote_imagens)
             # ============================================
-            deve_perguntar = await adicionar_imagem_sessao(phone, image_bytes, image_url)
-
-            if deve_perguntar:
-                # VERIFICAR SE JÁ PERGUNTOU (EVITAR DUPLICATA)
-                session = image_sessions[phone]
-
-                # Se já está aguardando confirmação, não perguntar de novo
-                if session.get("already_asked"):
-                    logger.info(f"Já perguntou para {phone}, aguardando resposta...")
-                    return JSONResponse({"status": "waiting_response", "pages": session["count"]})
-
-                # Marcar como "já perguntou"
-                session["already_asked"] = True
-
-                total_atual = session["count"]
-                idioma = estado.get("idioma", "pt")
-
-                # ============================================
-                # VERIFICAR SE É PRIMEIRA INTERAÇÃO (NOVO CLIENTE)
-                # Se for, dar boas-vindas contextualizadas
-                # ============================================
-                conversas_anteriores = await db.conversas.count_documents({"phone": phone})
-                e_primeiro_contato = conversas_anteriores <= 1  # Primeira ou segunda mensagem
-
-                if e_primeiro_contato:
-                    # NOVO CLIENTE - Mensagem de boas-vindas contextualizada
-                    logger.info(f"[NOVO-CLIENTE] {phone}: Primeiro contato com documento - enviando boas-vindas")
-                    if idioma == "en":
-                        pergunta = (
-                            f"Hi there! 👋 Welcome to Legacy Translations!\n\n"
-                            f"I'm Mia, your virtual assistant. I received {total_atual} page{'s' if total_atual > 1 else ''} of your document! 📄\n\n"
-                            f"Can you confirm that {'these are all the pages' if total_atual > 1 else 'this is the only page'} for translation?\n\n"
-                            f"Once you confirm, I'll analyze the document and provide a quick quote! ⚡"
-                        )
-                    elif idioma == "es":
-                        pergunta = (
-                            f"¡Hola! 👋 ¡Bienvenido(a) a Legacy Translations!\n\n"
-                            f"Soy Mia, tu asistente virtual. ¡Recibí {total_atual} página{'s' if total_atual > 1 else ''} de tu documento! 📄\n\n"
-                            f"¿Puedes confirmar que {'son todas las páginas' if total_atual > 1 else 'es solo esta página'} para la traducción?\n\n"
-                            f"¡Cuando confirmes, analizaré el documento y te daré una cotización rápida! ⚡"
-                        )
-                    else:
-                        pergunta = (
-                            f"Oi! 👋 Bem-vindo(a) a Legacy Translations!\n\n"
-                            f"Sou a Mia, sua assistente virtual. Recebi {total_atual} pagina{'s' if total_atual > 1 else ''} do seu documento! 📄\n\n"
-                            f"Pode confirmar se {'sao todas as paginas' if total_atual > 1 else 'e somente essa pagina'} para a traducao?\n\n"
-                            f"Assim que confirmar, vou analisar o documento e te passar um orcamento rapidinho! ⚡"
-                        )
-                else:
-                    # CLIENTE JÁ CONHECIDO - Mensagem mais direta
-                    if idioma == "en":
-                        pergunta = f"I received {total_atual} page{'s' if total_atual > 1 else ''}. Can you confirm {'these are all the pages' if total_atual > 1 else 'this is the only page'} for translation?"
-                    elif idioma == "es":
-                        pergunta = f"Recibí {total_atual} página{'s' if total_atual > 1 else ''}. ¿Puedes confirmar que {'son todas las páginas' if total_atual > 1 else 'es solo esta página'} para la traducción?"
-                    else:
-                        pergunta = f"Recebi {total_atual} pagina{'s' if total_atual > 1 else ''}. Pode confirmar se {'sao todas as paginas' if total_atual > 1 else 'e somente essa pagina'} para a traducao?"
-
-                await send_whatsapp_message(phone, pergunta)
-
-                logger.info(f"Pergunta enviada para {phone} ({total_atual} páginas)")
-                return JSONResponse({"status": "waiting_confirmation", "pages": total_atual})
-
-            # Se não deve perguntar, apenas aguardar mais imagens
-            return JSONResponse({"status": "receiving", "pages": image_sessions[phone]["count"]})
+            status_lote = receber_imagem_lote(phone, midia_id, image_url, chave_ordem(data))
+            return JSONResponse({"status": "receiving" if status_lote == ADICIONADA else "duplicate", "pages": imagens_no_lote(phone)})
 
         # ============================================
         # PROCESSAR AUDIO
@@ -4716,9 +4892,10 @@ Para urgencias: (contato)"""
                 return JSONResponse({"status": "error", "reason": "transcription failed"})
 
             logger.info(f"Transcricao: {transcription}")
+            await atualizar_idioma_cliente(phone, transcription)
 
             # Salvar mensagem do usuario (transcricao do audio)
-            await db.conversas.insert_one({
+            await salvar_conversa({
                 "phone": phone,
                 "message": f"[AUDIO] {transcription}",
                 "role": "user",
@@ -4758,7 +4935,7 @@ Para urgencias: (contato)"""
             await send_whatsapp_message(phone, reply)
 
             # Salvar resposta do bot
-            await db.conversas.insert_one({
+            await salvar_conversa({
                 "phone": phone,
                 "message": reply,
                 "role": "assistant",
@@ -4792,27 +4969,23 @@ Para urgencias: (contato)"""
                 doc_bytes = await download_media_from_zapi(document_url)
                 if doc_bytes:
                     doc_filename = data.get("document", {}).get("fileName", f"documento_{phone}_{int(time.time())}")
+                    doc_midia_id = guardar_midia(doc_bytes, mime_type)
                     # Salvar no Google Drive (background)
                     if is_drive_enabled():
-                        _create_gdrive_task(
-                            save_whatsapp_media_to_drive(
-                                file_bytes=doc_bytes,
-                                phone=phone,
-                                media_type="document",
-                                filename=doc_filename,
-                                mime_type=mime_type
-                            ),
-                            phone=phone,
-                            description="upload documento"
-                        )
-                    asyncio.create_task(
-                        processar_documento_para_portal(
+                        iniciar_upload_drive(
                             phone=phone,
-                            file_bytes=doc_bytes,
+                            midia_id=doc_midia_id,
+                            media_type="document",
                             filename=doc_filename,
                             mime_type=mime_type,
-                            is_image=False
+                            description="upload documento"
                         )
+                    iniciar_pipeline_portal(
+                        phone=phone,
+                        midia_id=doc_midia_id,
+                        filename=doc_filename,
+                        mime_type=mime_type,
+                        is_image=False
                     )
                     estado = await get_cliente_estado(phone)
                     idioma = estado.get("idioma", "pt")
@@ -4836,23 +5009,23 @@ Para urgencias: (contato)"""
                 await send_whatsapp_message(phone, "Desculpe, nao consegui baixar o PDF. Pode tentar enviar novamente?")
                 return JSONResponse({"status": "error", "reason": "download failed"})
 
+            midia_id = guardar_midia(pdf_bytes, mime_type or "application/pdf")
+            reter(midia_id)  # Ate o pipeline do Portal assumir a midia
+
             # Salvar PDF no Google Drive (background)
             if is_drive_enabled():
                 pdf_filename = data.get("document", {}).get("fileName", f"documento_{phone}_{int(time.time())}.pdf")
-                _create_gdrive_task(
-                    save_whatsapp_media_to_drive(
-                        file_bytes=pdf_bytes,
-                        phone=phone,
-                        media_type="document",
-                        filename=pdf_filename,
-                        mime_type=mime_type or "application/pdf"
-                    ),
+                iniciar_upload_drive(
                     phone=phone,
+                    midia_id=midia_id,
+                    media_type="document",
+                    filename=pdf_filename,
+                    mime_type=mime_type or "application/pdf",
                     description="upload PDF"
                 )
 
             # Analisar com Vision
-            analysis = await process_pdf_with_vision(pdf_bytes, phone)
+            analysis = await process_pdf_with_vision(midia_id, phone)
 
             # Enviar resposta
             await send_whatsapp_message(phone, analysis)
@@ -4861,15 +5034,14 @@ Para urgencias: (contato)"""
             # INTEGRACAO PORTAL: Criar pedido em background
             # ============================================
             doc_filename = data.get("document", {}).get("fileName", f"documento_{phone}_{int(time.time())}.pdf")
-            asyncio.create_task(
-                processar_documento_para_portal(
-                    phone=phone,
-                    file_bytes=pdf_bytes,
-                    filename=doc_filename,
-                    mime_type=mime_type or "application/pdf",
-                    is_image=False
-                )
+            iniciar_pipeline_portal(
+                phone=phone,
+                midia_id=midia_id,
+                filename=doc_filename,
+                mime_type=mime_type or "application/pdf",
+                is_image=False
             )
+            liberar(midia_id)
 
             return JSONResponse({"status": "processed", "type": "document"})
 
@@ -0,0 +1,242 @@
+"""
+============================================================
+REPOSITORIO DE MIDIA - Bytes e artefatos por hash do conteudo
+============================================================
+A mesma imagem do cliente era codificada em base64 varias vezes
+(analise do documento, comprovante de pagamento, extracao com
+Claude) e copiada entre sessoes de imagem, Portal e Drive.
+
+Agora cada midia recebida entra uma unica vez no repositorio,
+identificada pelo SHA-256 do conteudo, e as etapas trocam apenas
+o hash (midia_id). Artefatos derivados sao calculados uma vez e
+reaproveitados:
+
+- "base64"          - bytes originais em base64
+- "preparada:<tarefa>" - imagem normalizada para a tarefa (image_prep)
+- "pagina1_png"     - primeira pagina de um PDF (pdf_engine)
+- "visao:<tarefa>"  - resultado de uma chamada de Vision
+
+Despejo (LRU) por tamanho total e por idade. Midias em uso por
+uma etapa (sessao de imagens, pipeline do Portal) ficam retidas
+(reter/liberar): nao saem por falta de espaco, apenas quando
+passam da idade maxima sem nenhum acesso (sessao abandonada).
+
+Configuracao:
+  - MEDIA_STORE_MAX_MB: tamanho maximo em memoria (padrao 256)
+  - MEDIA_STORE_MAX_IDADE_SEGUNDOS: idade maxima sem uso (padrao 1800)
+============================================================
+"""
+
+import os
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable, Union, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEDIA_STORE_MAX_MB = float(os.getenv("MEDIA_STORE_MAX_MB", "256"))
+MEDIA_STORE_MAX_IDADE_SEGUNDOS = float(os.getenv("MEDIA_STORE_MAX_IDADE_SEGUNDOS", "1800"))
+
+# {midia_id: {"bytes", "mime", "criado_em", "acesso_em", "retencoes", "artefatos": {nome: valor}}}
+_midias: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# {midia_id: {nome_artefato: Lock}} - um artefato pode depender de outro da mesma midia
+_locks: Dict[str, Dict[str, asyncio.Lock]] = {}
+_bytes_total: int = 0
+
+_stats: Dict[str, int] = {
+    "midias_guardadas": 0, "duplicadas": 0, "bytes_deduplicados": 0,
+    "artefatos_hits": 0, "artefatos_calculados": 0, "despejos": 0
+}
+
+
+def _tamanho(valor: Any) -> int:
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    if isinstance(valor, tuple):
+        return sum(_tamanho(v) for v in valor)
+    return 1024  # Resultados estruturados (dict/str curta): estimativa fixa
+
+
+def _tamanho_entrada(entrada: Dict[str, Any]) -> int:
+    return len(entrada["bytes"]) + sum(_tamanho(v) for v in entrada["artefatos"].values())
+
+
+def _despejar():
+    """Remove midias expiradas e, se preciso, as menos usadas ate caber no limite"""
+    global _bytes_total
+    agora = time.time()
+    limite = MEDIA_STORE_MAX_MB * 1024 * 1024
+    for midia_id in list(_midias.keys()):
+        entrada = _midias[midia_id]
+        expirada = agora - entrada["acesso_em"] > MEDIA_STORE_MAX_IDADE_SEGUNDOS
+        if not expirada:
+            if _bytes_total <= limite:
+                # Ordem LRU: daqui para frente todas sao mais recentes
+                break
+            if entrada["retencoes"] > 0:
+                continue
+        _bytes_total -= _tamanho_entrada(entrada)
+        del _midias[midia_id]
+        _locks.pop(midia_id, None)
+        _stats["despejos"] += 1
+
+
+def guardar_midia(dados: bytes, mime: str = "") -> str:
+    """Guarda os bytes (uma vez por conteudo) e retorna o midia_id (SHA-256)"""
+    global _bytes_total
+    midia_id = hashlib.sha256(dados).hexdigest()
+    entrada = _midias.get(midia_id)
+    if entrada is not None:
+        _stats["duplicadas"] += 1
+        _stats["bytes_deduplicados"] += len(dados)
+        entrada["acesso_em"] = time.time()
+        if mime and not entrada["mime"]:
+            entrada["mime"] = mime
+        _midias.move_to_end(midia_id)
+        return midia_id
+
+    agora = time.time()
+    _midias[midia_id] = {
+        "bytes": dados, "mime": mime, "criado_em": agora, "acesso_em": agora,
+        "retencoes": 0, "artefatos": {}
+    }
+    _bytes_total += len(dados)
+    _stats["midias_guardadas"] += 1
+    _despejar()
+    return midia_id
+
+
+def _entrada(midia_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    entrada = _midias.get(midia_id) if midia_id else None
+    if entrada is not None:
+        entrada["acesso_em"] = time.time()
+        _midias.move_to_end(midia_id)
+    return entrada
+
+
+def obter_bytes(midia_id: Optional[str]) -> Optional[bytes]:
+    """Bytes originais da midia (None se desconhecida ou ja despejada)"""
+    entrada = _entrada(midia_id)
+    return entrada["bytes"] if entrada else None
+
+
+def obter_mime(midia_id: Optional[str]) -> str:
+    entrada = _midias.get(midia_id) if midia_id else None
+    return entrada["mime"] if entrada else ""
+
+
+def reter(midia_id: Optional[str]):
+    """Impede o despejo enquanto uma etapa usa a midia (par com liberar)"""
+    entrada = _midias.get(midia_id) if midia_id else None
+    if entrada is not None:
+        entrada["retencoes"] += 1
+
+
+def liberar(midia_id: Optional[str]):
+    entrada = _midias.get(midia_id) if midia_id else None
+    if entrada is not None and entrada["retencoes"] > 0:
+        entrada["retencoes"] -= 1
+
+
+async def obter_artefato(
+    midia_id: str,
+    nome: str,
+    gerador: Callable[[bytes], Union[Any, Awaitable[Any]]]
+) -> Any:
+    """
+    Artefato derivado da midia, calculado uma unica vez.
+    `gerador(bytes)` pode ser sincrono ou async; chamadas concorrentes
+    para o mesmo artefato esperam o primeiro calculo.
+    """
+    global _bytes_total
+    entrada = _entrada(midia_id)
+    if entrada is None:
+        raise KeyError(f"Midia {midia_id[:12] if midia_id else None} nao esta no repositorio")
+
+    if nome in entrada["artefatos"]:
+        _stats["artefatos_hits"] += 1
+        return entrada["artefatos"][nome]
+
+    lock = _locks.setdefault(midia_id, {}).setdefault(nome, asyncio.Lock())
+    async with lock:
+        if nome in entrada["artefatos"]:
+            _stats["artefatos_hits"] += 1
+            return entrada["artefatos"][nome]
+
+        valor = gerador(entrada["bytes"])
+        if asyncio.iscoroutine(valor):
+            valor = await valor
+        if valor is None:
+            return None  # Falha no calculo: nao memoizar
+        if _midias.get(midia_id) is not entrada:
+            return valor  # Despejada durante o calculo
+
+        entrada["artefatos"][nome] = valor
+        _bytes_total += _tamanho(valor)
+        _stats["artefatos_calculados"] += 1
+        _despejar()
+        return valor
+
+
+async def obter_base64(midia_id: str) -> str:
+    """Bytes originais em base64"""
+    return await obter_artefato(midia_id, "base64", lambda dados: base64.b64encode(dados).decode("utf-8"))
+
+
+async def obter_imagem_preparada(midia_id: str, tarefa: str) -> Tuple[bytes, str]:
+    """(bytes, mime) da imagem normalizada para a tarefa (calculado fora do event loop)"""
+    from image_prep import preparar_imagem
+    return await obter_artefato(
+        midia_id, f"preparada:{tarefa}",
+        lambda dados: asyncio.to_thread(preparar_imagem, dados, tarefa)
+    )
+
+
+async def obter_base64_preparada(midia_id: str, tarefa: str) -> Tuple[str, str]:
+    """(base64, mime) da imagem normalizada para a tarefa (classificacao / extracao)"""
+    preparada, mime = await obter_imagem_preparada(midia_id, tarefa)
+    base64_img = await obter_artefato(
+        midia_id, f"preparada_base64:{tarefa}",
+        lambda _: base64.b64encode(preparada).decode("utf-8")
+    )
+    return base64_img, mime
+
+
+async def obter_primeira_pagina_png(midia_id: str) -> Optional[bytes]:
+    """Primeira pagina de um PDF em PNG (None se nao renderizar)"""
+    from pdf_engine import renderizar_pagina
+    return await obter_artefato(midia_id, "pagina1_png", lambda dados: renderizar_pagina(dados, 1))
+
+
+async def obter_primeira_pagina_base64(midia_id: str) -> Optional[str]:
+    """Primeira pagina de um PDF em PNG base64 (compartilhada por Vision e Claude)"""
+    png = await obter_primeira_pagina_png(midia_id)
+    if not png:
+        return None
+    return await obter_artefato(midia_id, "pagina1_base64", lambda _: base64.b64encode(png).decode("utf-8"))
+
+
+async def obter_num_paginas(midia_id: str) -> int:
+    """Numero de paginas de um PDF pela estrutura do documento (0 se ilegivel)"""
+    from pdf_engine import contar_paginas
+    return await obter_artefato(midia_id, "paginas", contar_paginas)
+
+
+async def obter_resultado_visao(midia_id: str, tarefa: str, gerador: Callable[[bytes], Awaitable[Any]]) -> Any:
+    """Resultado de Vision da midia para a tarefa (ex: analise_documento), calculado uma vez"""
+    return await obter_artefato(midia_id, f"visao:{tarefa}", gerador)
+
+
+def get_media_stats() -> Dict[str, Any]:
+    """Metricas do repositorio (para endpoints de debug/admin)"""
+    return {
+        "midias_em_memoria": len(_midias),
+        "mb_em_memoria": round(_bytes_total / (1024 * 1024), 2),
+        "max_mb": MEDIA_STORE_MAX_MB,
+        "retidas": sum(1 for e in _midias.values() if e["retencoes"] > 0),
+        **_stats
+    }
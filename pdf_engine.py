@@ -0,0 +1,143 @@
+"""
+============================================================
+MOTOR DE PDF - Contagem de paginas e renderizacao sob demanda
+============================================================
+Antes, cada PDF recebido era gravado em /tmp e TODAS as paginas
+eram rasterizadas a 150 DPI (convert_from_path), mantendo todas
+as imagens PIL em memoria - so para usar a primeira pagina e a
+contagem de paginas. Um scan de 60 paginas custava 60
+rasterizacoes e centenas de MB de RAM.
+
+Agora:
+- Numero de paginas lido da estrutura do documento (PyPDF2),
+  sem rasterizar nada
+- Apenas as paginas pedidas sao rasterizadas, direto dos bytes:
+  o PDF vai pelo stdin do pdftoppm (poppler) e a imagem volta
+  pelo stdout, sem arquivo temporario
+- A renderizacao roda num pool de processos criado sob demanda
+  (primeiro PDF), fora do event loop; varias paginas rodam em
+  paralelo, limitadas pelo tamanho do pool
+
+Configuracao:
+  - PDF_RENDER_WORKERS: processos do pool (padrao 2)
+  - PDF_RENDER_DPI: resolucao padrao (padrao 150)
+  - PDF_RENDER_TIMEOUT: limite por pagina em segundos (padrao 60)
+============================================================
+"""
+
+import os
+import asyncio
+import logging
+import subprocess
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "60"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+_stats: Dict[str, int] = {"pdfs_inspecionados": 0, "paginas_no_total": 0, "paginas_renderizadas": 0, "erros": 0}
+
+
+# ============================================================
+# INSPECAO (estrutura do documento)
+# ============================================================
+
+def contar_paginas(pdf_bytes: bytes) -> int:
+    """Numero de paginas pela estrutura do PDF (sem rasterizar). 0 se ilegivel."""
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(BytesIO(pdf_bytes), strict=False)
+        if reader.is_encrypted:
+            # PDFs com senha vazia (comum em documentos escaneados) ainda abrem
+            reader.decrypt("")
+        total = len(reader.pages)
+        _stats["pdfs_inspecionados"] += 1
+        _stats["paginas_no_total"] += total
+        return total
+    except Exception as e:
+        logger.warning(f"[PDF] Nao foi possivel ler a estrutura do PDF: {e}")
+        return 0
+
+
+# ============================================================
+# RENDERIZACAO (roda nos processos do pool)
+# ============================================================
+
+def _renderizar_pagina(pdf_bytes: bytes, pagina: int, dpi: int, formato: str, timeout: float) -> bytes:
+    """
+    Rasteriza UMA pagina: PDF pelo stdin do pdftoppm, PPM pelo stdout,
+    codificado em PNG/JPEG com Pillow. Executa dentro do pool de processos.
+    """
+    from PIL import Image
+
+    comando = ["pdftoppm", "-r", str(dpi), "-f", str(pagina), "-l", str(pagina), "-singlefile", "-"]
+    resultado = subprocess.run(comando, input=pdf_bytes, capture_output=True, timeout=timeout, check=False)
+    if resultado.returncode != 0 or not resultado.stdout:
+        raise RuntimeError(f"pdftoppm falhou (pagina {pagina}): {resultado.stderr.decode('utf-8', errors='ignore')[:200]}")
+
+    imagem = Image.open(BytesIO(resultado.stdout))
+    saida = BytesIO()
+    if formato == "JPEG":
+        imagem.convert("RGB").save(saida, format="JPEG", quality=85, optimize=True)
+    else:
+        imagem.save(saida, format="PNG", optimize=False)
+    return saida.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Cria o pool no primeiro uso ("spawn": nao herda o event loop nem sockets do processo pai)"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"[PDF] Pool de renderizacao criado ({PDF_RENDER_WORKERS} processos)")
+    return _pool
+
+
+async def renderizar_pagina(pdf_bytes: bytes, pagina: int = 1, dpi: int = None, formato: str = "PNG") -> Optional[bytes]:
+    """Imagem (PNG/JPEG) de uma pagina do PDF (1 = primeira). None em caso de erro."""
+    loop = asyncio.get_running_loop()
+    try:
+        imagem = await loop.run_in_executor(
+            _get_pool(), _renderizar_pagina,
+            pdf_bytes, pagina, dpi or PDF_RENDER_DPI, formato, PDF_RENDER_TIMEOUT
+        )
+        _stats["paginas_renderizadas"] += 1
+        return imagem
+    except Exception as e:
+        _stats["erros"] += 1
+        logger.error(f"[PDF] Erro ao renderizar pagina {pagina}: {e}")
+        return None
+
+
+async def renderizar_paginas(pdf_bytes: bytes, paginas: List[int], dpi: int = None, formato: str = "PNG") -> List[Optional[bytes]]:
+    """Renderiza varias paginas em paralelo (limitado pelo tamanho do pool), na ordem pedida"""
+    return list(await asyncio.gather(*(renderizar_pagina(pdf_bytes, p, dpi, formato) for p in paginas)))
+
+
+def fechar_pool():
+    """Encerra o pool de processos (chamar no shutdown)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def get_pdf_stats() -> Dict[str, Any]:
+    """Metricas do motor de PDF (para endpoints de debug/admin)"""
+    return {
+        "workers": PDF_RENDER_WORKERS,
+        "pool_ativo": _pool is not None,
+        "dpi": PDF_RENDER_DPI,
+        **_stats,
+        "rasterizacoes_evitadas": max(0, _stats["paginas_no_total"] - _stats["paginas_renderizadas"])
+    }
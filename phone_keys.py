@@ -0,0 +1,141 @@
+"""
+============================================================
+CHAVE DE TELEFONE - Busca indexada por telefone normalizado
+============================================================
+O mesmo cliente aparece com formatos diferentes de telefone
+(com/sem DDI, com sufixo @c.us/@lid). Em vez de buscar com
+$regex (que varre a colecao inteira), todo documento de
+conversas, cliente_estados e crm_contacts grava o campo
+`phone_key` = ultimos 10 digitos do telefone, e as buscas
+viram igualdade simples sobre um campo indexado.
+
+- phone_key(): normalizacao unica usada por todo o projeto
+- telefone_do_evento(): telefone de um evento do Z-API (LID vira
+  o telefone do chatId ou do mapa de LIDs). Usado pelo webhook e
+  pela chave do ator da fila, para o mesmo cliente nunca ter dois
+  atores nem dois lotes de imagens
+- migrar_phone_keys(): backfill unico dos documentos antigos,
+  registrado na colecao `sistema` para nao rodar de novo
+============================================================
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Colecoes que recebem o campo phone_key
+COLECOES_PHONE_KEY = ["conversas", "cliente_estados", "crm_contacts"]
+
+MIGRACAO_KEY = "migracao_phone_key"
+TAMANHO_LOTE = 500
+
+
+# Z-API pode enviar LIDs (Linked IDs) em vez de telefones reais
+# quando fromMe=true: {lid_digits: real_phone}, preenchido pelo main.py
+lid_to_phone_map: Dict[str, str] = {}
+
+
+def is_phone_lid(phone_digits: str) -> bool:
+    """Detecta se um numero e um LID (Linked ID) do WhatsApp/Z-API em vez de telefone real.
+    LIDs sao IDs internos com 14+ digitos que NAO correspondem a numeros de telefone validos.
+    Telefones validos: EUA=11 digitos (1+10), Brasil=12-13 digitos (55+DDD+num)."""
+    if not phone_digits:
+        return True
+    # LIDs tipicamente tem 14+ digitos e NAO comecam com codigo de pais conhecido
+    if len(phone_digits) >= 14:
+        return True
+    # Telefone sem digitos suficientes para ser valido
+    if len(phone_digits) < 10:
+        return True
+    return False
+
+
+def _digitos(valor: Any) -> str:
+    """Digitos antes do sufixo Z-API (@lid, @c.us, @s.whatsapp.net)"""
+    return ''.join(c for c in str(valor or "").split("@")[0] if c.isdigit())
+
+
+def telefone_do_evento(data: Dict[str, Any]) -> str:
+    """Telefone (so digitos) de um evento do Z-API, com o LID resolvido pelo chatId ou pelo mapa"""
+    phone = _digitos(data.get("phone"))
+    if not is_phone_lid(phone):
+        return phone
+
+    # Z-API tambem pode enviar chatId com o telefone real (formato: phone@c.us)
+    chat = data.get("chat")
+    chat_id_phone = _digitos(data.get("chatId") or (chat.get("id") if isinstance(chat, dict) else ""))
+    if chat_id_phone and not is_phone_lid(chat_id_phone):
+        return chat_id_phone
+    return lid_to_phone_map.get(phone, phone)
+
+
+def phone_key(phone: Optional[str]) -> str:
+    """Ultimos 10 digitos do telefone (ignora @lid/@c.us, +, espacos e tracos)"""
+    if not phone:
+        return ""
+    return ''.join(c for c in str(phone).split("@")[0] if c.isdigit())[-10:]
+
+
+def com_phone_key(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Adiciona phone_key ao documento (a partir do campo phone) e o retorna"""
+    if doc.get("phone"):
+        doc["phone_key"] = phone_key(doc["phone"])
+    return doc
+
+
+async def _migrar_colecao(colecao) -> int:
+    """Preenche phone_key nos documentos que ainda nao tem, em lotes"""
+    total = 0
+    while True:
+        docs = await colecao.find(
+            {"phone_key": {"$exists": False}, "phone": {"$exists": True}},
+            {"_id": 1, "phone": 1}
+        ).limit(TAMANHO_LOTE).to_list(length=TAMANHO_LOTE)
+        if not docs:
+            return total
+
+        # Documentos sem phone utilizavel recebem "" para nao voltarem no proximo lote
+        operacoes = [
+            UpdateOne({"_id": d["_id"]}, {"$set": {"phone_key": phone_key(d.get("phone"))}})
+            for d in docs
+        ]
+        await colecao.bulk_write(operacoes, ordered=False)
+        total += len(operacoes)
+
+
+async def migrar_phone_keys(db, forcar: bool = False) -> Dict[str, Any]:
+    """
+    Backfill unico de phone_key nas colecoes de telefone.
+    Fica registrado em `sistema` e so roda de novo com forcar=True.
+    """
+    if not forcar:
+        try:
+            registro = await db.sistema.find_one({"key": MIGRACAO_KEY})
+        except Exception as e:
+            logger.error(f"[PHONE-KEY] Erro ao verificar migracao: {e}")
+            return {"executada": False, "erro": str(e)}
+        if registro and registro.get("concluida"):
+            return {"executada": False, "motivo": "ja concluida", "em": registro.get("concluida_em")}
+
+    resultado = {}
+    for nome in COLECOES_PHONE_KEY:
+        try:
+            resultado[nome] = await _migrar_colecao(db[nome])
+        except Exception as e:
+            logger.error(f"[PHONE-KEY] Erro no backfill de '{nome}': {e}")
+            return {"executada": True, "concluida": False, "erro": str(e), "atualizados": resultado}
+
+    try:
+        await db.sistema.update_one(
+            {"key": MIGRACAO_KEY},
+            {"$set": {"concluida": True, "concluida_em": datetime.now(), "atualizados": resultado}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"[PHONE-KEY] Erro ao registrar migracao: {e}")
+    logger.info(f"[PHONE-KEY] Backfill concluido: {resultado}")
+    return {"executada": True, "concluida": True, "atualizados": resultado}
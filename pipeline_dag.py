@@ -0,0 +1,213 @@
+"""
+============================================================
+PIPELINE EM DAG - Etapas com dependencias, idempotencia e tempos
+============================================================
+O pipeline do Portal rodava tudo em sequencia (extracao com
+Claude -> pedido -> upload -> Drive -> notificacao -> Mongo),
+embora o Drive nao dependa do Portal e a notificacao nao dependa
+do Drive. Uma retentativa recomecava do zero e criava um segundo
+pedido no Portal.
+
+Agora o pipeline e uma lista de etapas com dependencias:
+
+- Cada etapa comeca assim que as suas dependencias terminam;
+  etapas independentes rodam ao mesmo tempo
+- Uma etapa falha quando levanta excecao ou retorna None/False;
+  as etapas que dependem dela sao puladas, as outras continuam
+- Cada execucao tem uma chave de idempotencia (ex: phone_key +
+  SHA-256 do documento) gravada no documento da colecao. Uma
+  nova execucao com a mesma chave reaproveita o resultado das
+  etapas ja concluidas (o pedido nunca e criado duas vezes) e
+  refaz so as que falharam
+- Uma reserva com prazo (executando_ate) impede duas execucoes
+  simultaneas da mesma chave
+- Status, tempo (ms) e erro de cada etapa ficam em
+  `etapas.<nome>` no documento
+
+Configuracao:
+  - PIPELINE_RESERVA_SEGUNDOS: prazo da reserva de uma execucao (padrao 600)
+============================================================
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_RESERVA_SEGUNDOS = float(os.getenv("PIPELINE_RESERVA_SEGUNDOS", "600"))
+
+# Status de uma etapa
+OK = "ok"
+FALHOU = "falhou"
+PULADA = "pulada"
+
+# Metricas por etapa: {nome: {"execucoes", "ok", "falhas", "puladas", "reaproveitadas", "ms_total"}}
+_stats: Dict[str, Dict[str, float]] = {}
+_execucoes: Dict[str, int] = {"iniciadas": 0, "concluidas": 0, "em_andamento_outra": 0, "erros_reserva": 0}
+
+
+def _stats_for(nome: str) -> Dict[str, float]:
+    if nome not in _stats:
+        _stats[nome] = {"execucoes": 0, "ok": 0, "falhas": 0, "puladas": 0, "reaproveitadas": 0, "ms_total": 0.0}
+    return _stats[nome]
+
+
+class Etapa:
+    """
+    Uma etapa do pipeline. `funcao(resultados)` recebe os resultados
+    das etapas anteriores por nome. `campos(resultado)` (opcional)
+    devolve campos gravados no topo do documento quando a etapa conclui.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        funcao: Callable[[Dict[str, Any]], Awaitable[Any]],
+        depende: Optional[List[str]] = None,
+        campos: Optional[Callable[[Any], Dict[str, Any]]] = None
+    ):
+        self.nome = nome
+        self.funcao = funcao
+        self.depende = depende or []
+        self.campos = campos
+
+
+async def reservar_execucao(colecao, chave: str, campos: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Reserva a chave de idempotencia e retorna o documento da execucao
+    (novo ou de uma execucao anterior). None se outra execucao da mesma
+    chave ainda esta em andamento (ou se o Mongo falhou).
+    """
+    agora = datetime.now()
+    try:
+        doc = await colecao.find_one_and_update(
+            {
+                "chave_idempotencia": chave,
+                "$or": [{"executando_ate": None}, {"executando_ate": {"$lt": agora}}]
+            },
+            {
+                "$set": {"executando_ate": agora + timedelta(seconds=PIPELINE_RESERVA_SEGUNDOS)},
+                "$setOnInsert": {**campos, "created_at": agora},
+                "$inc": {"execucoes": 1}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        _execucoes["iniciadas"] += 1
+        return doc
+    except DuplicateKeyError:
+        # O documento existe e a reserva dele ainda vale
+        _execucoes["em_andamento_outra"] += 1
+        logger.warning(f"[PIPELINE] Execucao {chave} ja em andamento, ignorando")
+        return None
+    except Exception as e:
+        _execucoes["erros_reserva"] += 1
+        logger.error(f"[PIPELINE] Erro ao reservar execucao {chave}: {e}")
+        return None
+
+
+async def executar_dag(colecao, doc: Dict[str, Any], etapas: List[Etapa]) -> Dict[str, Any]:
+    """
+    Executa as etapas (em ordem topologica) respeitando as dependencias,
+    grava o registro de cada etapa no documento e libera a reserva.
+    Retorna os resultados por nome das etapas concluidas.
+    """
+    anteriores = doc.get("etapas") or {}
+    resultados: Dict[str, Any] = {}
+    tarefas: Dict[str, asyncio.Task] = {}
+    inicio_total = time.monotonic()
+
+    async def _registrar(nome: str, registro: Dict[str, Any], extras: Dict[str, Any]):
+        try:
+            await colecao.update_one({"_id": doc["_id"]}, {"$set": {f"etapas.{nome}": registro, **extras}})
+        except Exception as e:
+            logger.error(f"[PIPELINE] Erro ao gravar etapa {nome} de {doc.get('chave_idempotencia')}: {e}")
+
+    async def _rodar(etapa: Etapa) -> bool:
+        stats = _stats_for(etapa.nome)
+        deps_ok = []
+        for dep in etapa.depende:
+            try:
+                deps_ok.append(await tarefas[dep])
+            except Exception:
+                deps_ok.append(False)
+
+        anterior = anteriores.get(etapa.nome) or {}
+        if anterior.get("status") == OK:
+            stats["reaproveitadas"] += 1
+            resultados[etapa.nome] = anterior.get("resultado")
+            return True
+
+        if not all(deps_ok):
+            stats["puladas"] += 1
+            await _registrar(etapa.nome, {"status": PULADA, "em": datetime.now()}, {})
+            return False
+
+        stats["execucoes"] += 1
+        inicio = time.monotonic()
+        erro = None
+        extras: Dict[str, Any] = {}
+        try:
+            resultado = await etapa.funcao(resultados)
+            if resultado is not None and resultado is not False and etapa.campos:
+                extras = etapa.campos(resultado)
+        except Exception as e:
+            resultado, erro = None, str(e)
+            logger.error(f"[PIPELINE] Etapa {etapa.nome} falhou: {e}")
+        ms = round((time.monotonic() - inicio) * 1000, 1)
+        stats["ms_total"] += ms
+
+        ok = resultado is not None and resultado is not False
+        registro = {"status": OK if ok else FALHOU, "ms": ms, "em": datetime.now(), "tentativas": anterior.get("tentativas", 0) + 1}
+        if ok:
+            stats["ok"] += 1
+            resultados[etapa.nome] = resultado
+            registro["resultado"] = resultado
+        else:
+            stats["falhas"] += 1
+            registro["erro"] = erro or "sem resultado"
+        await _registrar(etapa.nome, registro, extras)
+        return ok
+
+    # Todas as tarefas sao criadas antes de qualquer uma rodar: as dependencias ja existem no dict
+    status: List[Any] = []
+    try:
+        for etapa in etapas:
+            tarefas[etapa.nome] = asyncio.create_task(_rodar(etapa))
+        status = await asyncio.gather(*tarefas.values(), return_exceptions=True)
+        for nome, s in zip(tarefas, status):
+            if isinstance(s, Exception):
+                logger.error(f"[PIPELINE] Erro inesperado na etapa {nome} de {doc.get('chave_idempotencia')}: {s}")
+    finally:
+        # Libera a reserva mesmo com erro: retentativas nao esperam PIPELINE_RESERVA_SEGUNDOS
+        try:
+            await colecao.update_one({"_id": doc["_id"]}, {"$set": {
+                "executando_ate": None,
+                "concluido": bool(status) and all(s is True for s in status),
+                "ms_total": round((time.monotonic() - inicio_total) * 1000, 1),
+                "updated_at": datetime.now()
+            }})
+        except Exception as e:
+            logger.error(f"[PIPELINE] Erro ao liberar execucao {doc.get('chave_idempotencia')}: {e}")
+    _execucoes["concluidas"] += 1
+    return resultados
+
+
+def get_pipeline_stats() -> Dict[str, Any]:
+    """Tempo medio e resultados por etapa (para endpoints de debug/admin)"""
+    por_etapa = {
+        nome: {**s, "ms_medio": round(s["ms_total"] / s["execucoes"], 1) if s["execucoes"] else 0}
+        for nome, s in _stats.items()
+    }
+    return {
+        "reserva_segundos": PIPELINE_RESERVA_SEGUNDOS,
+        **_execucoes,
+        "por_etapa": por_etapa
+    }
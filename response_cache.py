@@ -0,0 +1,341 @@
+"""
+============================================================
+CACHE DE RESPOSTAS - Perguntas repetidas sem nova chamada ao GPT-4o
+============================================================
+Muitos clientes (WhatsApp e WebChat) fazem as mesmas perguntas:
+preco por pagina, prazo, certificacao, formas de pagamento.
+Cada uma pagava um GPT-4o completo.
+
+Agora a resposta do GPT-4o a uma pergunta generica fica gravada
+na colecao `respostas_cache`, com a chave:
+
+- pergunta normalizada (text_normalizer: sem acento, minusculas,
+  sem emoji/pontuacao)
+- idioma do cliente (language_id)
+- canal (whatsapp, webchat): cada canal tem o seu treinamento
+- versao do treinamento (training_cache): editar o treinamento
+  muda a versao e as entradas antigas deixam de valer e sao
+  apagadas na primeira consulta com a versao nova
+
+Consulta (camada "cache" do response_router):
+1. exata: mesma pergunta normalizada (memoria, depois Mongo)
+2. parecida: conjunto de palavras (kb_retrieval.tokenizar) com
+   similaridade de Jaccard >= RESPOSTAS_CACHE_SIMILARIDADE e os
+   mesmos numeros ("3 paginas" nunca reaproveita "5 paginas").
+   Indice invertido por palavra: so as entradas que dividem
+   alguma palavra com a pergunta sao comparadas
+
+So entram perguntas genericas (com "?" ou palavra interrogativa,
+ate PALAVRAS_MAX palavras, sem "e ..."/"and ..." de continuacao)
+e respostas sem o nome do cliente. O response_router so grava e
+so consulta na primeira pergunta da conversa (a resposta nao
+depende de mensagens anteriores) e, no WhatsApp, antes de o
+cliente ter documento ou orcamento (a resposta citaria os dele).
+As entradas tambem expiram pelo campo `expira_em` (TTL).
+
+Configuracao:
+  - RESPOSTAS_CACHE_TTL_HORAS: validade maxima de uma resposta (padrao 168 = 7 dias)
+  - RESPOSTAS_CACHE_MAX: entradas no indice em memoria (padrao 2000)
+  - RESPOSTAS_CACHE_SIMILARIDADE: similaridade minima da busca parecida (padrao 0.8)
+============================================================
+"""
+
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+from admin_training_routes import db
+from text_normalizer import normalizar
+from kb_retrieval import tokenizar
+from training_cache import get_versao_treinamento
+
+logger = logging.getLogger(__name__)
+
+RESPOSTAS_CACHE_TTL_HORAS = float(os.getenv("RESPOSTAS_CACHE_TTL_HORAS", "168"))
+RESPOSTAS_CACHE_MAX = int(os.getenv("RESPOSTAS_CACHE_MAX", "2000"))
+RESPOSTAS_CACHE_SIMILARIDADE = float(os.getenv("RESPOSTAS_CACHE_SIMILARIDADE", "0.8"))
+
+# Perguntas mais longas que isso quase nunca se repetem (e costumam ter detalhes do cliente)
+PALAVRAS_MAX = 25
+
+# Primeira palavra (normalizada) que marca pergunta mesmo sem "?"
+_INTERROGATIVAS = {
+    "qual", "quais", "quanto", "quantos", "quanta", "quantas", "como", "onde", "quando", "voces", "vcs",
+    "what", "which", "how", "when", "where", "do", "does", "can", "is", "are",
+    "cual", "cuales", "cuanto", "cuantos", "cuanta", "donde", "hacen", "aceptan", "tienen",
+}
+
+# Primeira palavra de continuacao ("e pra 3 paginas?"): a pergunta depende da conversa
+_CONTINUACOES = {"e", "mas", "entao", "and", "but", "so", "y", "pero", "entonces"}
+
+_PALAVRA = re.compile(r"\w+")
+_NUMERO = re.compile(r"\d+")
+
+
+class Entrada(NamedTuple):
+    canal: str
+    idioma: str
+    palavras: FrozenSet[str]
+    numeros: FrozenSet[str]
+    resposta: str
+
+
+# Indice em memoria da versao atual: {_id: Entrada} e {(canal, idioma, palavra): {_id}}
+_entradas: Dict[str, Entrada] = {}
+_indice: Dict[Tuple[str, str, str], Set[str]] = {}
+_versao_carregada: Optional[str] = None
+_lock: Optional[asyncio.Lock] = None
+
+_stats: Dict[str, int] = {
+    "consultas": 0, "hits_exatos": 0, "hits_similares": 0, "misses": 0,
+    "gravacoes": 0, "ignoradas": 0, "invalidacoes": 0, "erros": 0
+}
+
+
+def _get_lock() -> asyncio.Lock:
+    global _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+    return _lock
+
+
+def chave_pergunta(texto: str) -> str:
+    """Pergunta normalizada (sem acento, minusculas, so palavras)"""
+    return " ".join(_PALAVRA.findall(normalizar(texto or "")))
+
+
+def _id_para(versao: str, canal: str, idioma: str, chave: str) -> str:
+    return hashlib.sha1(f"{versao}|{canal}|{idioma}|{chave}".encode("utf-8")).hexdigest()[:24]
+
+
+def _indexar(_id: str, canal: str, idioma: str, pergunta: str, resposta: str):
+    palavras = frozenset(tokenizar(pergunta))
+    _entradas[_id] = Entrada(canal, idioma, palavras, _numeros(pergunta), resposta)
+    for palavra in palavras:
+        _indice.setdefault((canal, idioma, palavra), set()).add(_id)
+
+
+def _numeros(texto: str) -> FrozenSet[str]:
+    # tokenizar descarta "3" (uma letra so); os numeros saem do texto original
+    return frozenset(n.lstrip("0") or "0" for n in _NUMERO.findall(texto))
+
+
+def _limpar_memoria():
+    _entradas.clear()
+    _indice.clear()
+
+
+async def _sincronizar_versao() -> Optional[str]:
+    """
+    Versao atual do treinamento. Na primeira consulta de uma versao nova,
+    apaga as entradas das versoes anteriores e carrega as da versao atual.
+    """
+    global _versao_carregada
+    versao = get_versao_treinamento()
+    if not versao or versao == _versao_carregada:
+        return versao or None
+
+    async with _get_lock():
+        if versao == _versao_carregada:
+            return versao
+        _limpar_memoria()
+        try:
+            removidas = await db.respostas_cache.delete_many({"versao_treinamento": {"$ne": versao}})
+            if removidas.deleted_count:
+                _stats["invalidacoes"] += removidas.deleted_count
+                logger.info(f"[RESPOSTAS-CACHE] Treinamento mudou ({versao}): {removidas.deleted_count} respostas antigas removidas")
+            docs = await db.respostas_cache.find(
+                {"versao_treinamento": versao, "expira_em": {"$gt": datetime.now()}},
+                {"canal": 1, "idioma": 1, "pergunta": 1, "resposta": 1}
+            ).sort("hits", -1).limit(RESPOSTAS_CACHE_MAX).to_list(length=RESPOSTAS_CACHE_MAX)
+            for doc in docs:
+                _indexar(doc["_id"], doc["canal"], doc["idioma"], doc["pergunta"], doc["resposta"])
+        except Exception as e:
+            _stats["erros"] += 1
+            logger.error(f"[RESPOSTAS-CACHE] Erro ao carregar versao {versao}: {e}")
+        _versao_carregada = versao
+    return versao
+
+
+async def _contar_hit(_id: str):
+    try:
+        await db.respostas_cache.update_one({"_id": _id}, {"$inc": {"hits": 1}, "$set": {"ultimo_uso": datetime.now()}})
+    except Exception as e:
+        logger.error(f"[RESPOSTAS-CACHE] Erro ao contar hit: {e}")
+
+
+def _buscar_parecida(
+    canal: str, idioma: str, palavras: FrozenSet[str], numeros: FrozenSet[str]
+) -> Optional[Tuple[str, float]]:
+    candidatos: Set[str] = set()
+    for palavra in palavras:
+        candidatos |= _indice.get((canal, idioma, palavra), set())
+
+    melhor, melhor_similaridade = None, 0.0
+    for _id in candidatos:
+        entrada = _entradas[_id]
+        if entrada.numeros != numeros:
+            continue
+        similaridade = len(palavras & entrada.palavras) / len(palavras | entrada.palavras)
+        if similaridade > melhor_similaridade:
+            melhor, melhor_similaridade = _id, similaridade
+    if melhor is None or melhor_similaridade < RESPOSTAS_CACHE_SIMILARIDADE:
+        return None
+    return melhor, melhor_similaridade
+
+
+async def buscar_resposta(pergunta: str, idioma: Optional[str], canal: str) -> Optional[str]:
+    """Resposta em cache para a pergunta (exata ou parecida), ou None"""
+    chave = chave_pergunta(pergunta)
+    if not idioma or not chave:
+        return None
+    versao = await _sincronizar_versao()
+    if not versao:
+        return None
+    _stats["consultas"] += 1
+
+    _id = _id_para(versao, canal, idioma, chave)
+    entrada = _entradas.get(_id)
+    if entrada is None:
+        # Outra instancia pode ter gravado depois do carregamento
+        try:
+            doc = await db.respostas_cache.find_one({"_id": _id, "expira_em": {"$gt": datetime.now()}})
+            if doc is not None:
+                _indexar(_id, doc["canal"], doc["idioma"], doc["pergunta"], doc["resposta"])
+                entrada = _entradas[_id]
+        except Exception as e:
+            _stats["erros"] += 1
+            logger.error(f"[RESPOSTAS-CACHE] Erro ao ler cache: {e}")
+
+    if entrada is not None:
+        _stats["hits_exatos"] += 1
+        await _contar_hit(_id)
+        return entrada.resposta
+
+    palavras = frozenset(tokenizar(pergunta))
+    if len(palavras) >= 2:
+        parecida = _buscar_parecida(canal, idioma, palavras, _numeros(pergunta))
+        if parecida:
+            _stats["hits_similares"] += 1
+            logger.info(f"[RESPOSTAS-CACHE] Pergunta parecida (similaridade {parecida[1]:.2f})")
+            await _contar_hit(parecida[0])
+            return _entradas[parecida[0]].resposta
+
+    _stats["misses"] += 1
+    return None
+
+
+def pergunta_generica(pergunta: str) -> bool:
+    """Pergunta curta e independente da conversa, com "?" ou palavra interrogativa no inicio"""
+    palavras = chave_pergunta(pergunta).split()
+    if not 2 <= len(palavras) <= PALAVRAS_MAX or palavras[0] in _CONTINUACOES:
+        return False
+    return "?" in pergunta or palavras[0] in _INTERROGATIVAS
+
+
+async def guardar_resposta(
+    pergunta: str,
+    idioma: Optional[str],
+    resposta: str,
+    canal: str,
+    nome_cliente: Optional[str] = None
+) -> bool:
+    """Grava a resposta do GPT-4o para a pergunta, se ela puder ser reaproveitada"""
+    versao = get_versao_treinamento()
+    if not idioma or not versao or not resposta or not pergunta_generica(pergunta):
+        return False
+    # Resposta que cita o cliente nao serve para outro cliente
+    if nome_cliente and len(nome_cliente.strip()) > 2 and nome_cliente.strip().lower() in resposta.lower():
+        _stats["ignoradas"] += 1
+        return False
+    if len(_entradas) >= RESPOSTAS_CACHE_MAX:
+        _stats["ignoradas"] += 1
+        return False
+
+    chave = chave_pergunta(pergunta)
+    _id = _id_para(versao, canal, idioma, chave)
+    agora = datetime.now()
+    try:
+        await db.respostas_cache.update_one(
+            {"_id": _id},
+            {
+                "$set": {
+                    "pergunta": pergunta,
+                    "pergunta_normalizada": chave,
+                    "idioma": idioma,
+                    "versao_treinamento": versao,
+                    "canal": canal,
+                    "resposta": resposta,
+                    "expira_em": agora + timedelta(hours=RESPOSTAS_CACHE_TTL_HORAS)
+                },
+                "$setOnInsert": {"criado_em": agora, "hits": 0}
+            },
+            upsert=True
+        )
+    except Exception as e:
+        _stats["erros"] += 1
+        logger.error(f"[RESPOSTAS-CACHE] Erro ao gravar resposta: {e}")
+        return False
+
+    if versao == _versao_carregada:
+        _indexar(_id, canal, idioma, pergunta, resposta)
+    _stats["gravacoes"] += 1
+    return True
+
+
+async def listar_respostas(limite: int = 100) -> List[Dict[str, Any]]:
+    """Respostas em cache da versao atual, mais usadas primeiro (para o painel admin)"""
+    versao = get_versao_treinamento()
+    filtro = {"versao_treinamento": versao} if versao else {}
+    docs = await db.respostas_cache.find(filtro).sort([("hits", -1), ("criado_em", -1)]).limit(limite).to_list(length=limite)
+    return [
+        {
+            "id": doc["_id"],
+            "pergunta": doc.get("pergunta", ""),
+            "idioma": doc.get("idioma"),
+            "canal": doc.get("canal"),
+            "resposta": doc.get("resposta", ""),
+            "hits": doc.get("hits", 0),
+            "criado_em": doc["criado_em"].isoformat() if doc.get("criado_em") else None,
+            "ultimo_uso": doc["ultimo_uso"].isoformat() if doc.get("ultimo_uso") else None
+        }
+        for doc in docs
+    ]
+
+
+async def remover_resposta(_id: Optional[str] = None) -> int:
+    """Remove uma resposta (ou todas) do indice em memoria e do Mongo"""
+    if _id:
+        entrada = _entradas.pop(_id, None)
+        if entrada:
+            for palavra in entrada.palavras:
+                _indice.get((entrada.canal, entrada.idioma, palavra), set()).discard(_id)
+        resultado = await db.respostas_cache.delete_one({"_id": _id})
+    else:
+        _limpar_memoria()
+        resultado = await db.respostas_cache.delete_many({})
+    return resultado.deleted_count
+
+
+async def get_respostas_cache_stats() -> Dict[str, Any]:
+    """Hit rate e tamanho do cache de respostas (para o painel admin)"""
+    hits = _stats["hits_exatos"] + _stats["hits_similares"]
+    try:
+        entradas_mongo = await db.respostas_cache.estimated_document_count()
+    except Exception as e:
+        logger.error(f"[RESPOSTAS-CACHE] Erro ao contar entradas: {e}")
+        entradas_mongo = None
+    return {
+        "versao_treinamento": _versao_carregada,
+        "ttl_horas": RESPOSTAS_CACHE_TTL_HORAS,
+        "similaridade_min": RESPOSTAS_CACHE_SIMILARIDADE,
+        "max_memoria": RESPOSTAS_CACHE_MAX,
+        "entradas_memoria": len(_entradas),
+        "entradas_mongo": entradas_mongo,
+        "hit_rate": round(hits / _stats["consultas"] * 100, 1) if _stats["consultas"] else 0,
+        **_stats
+    }
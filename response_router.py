@@ -0,0 +1,351 @@
+"""
+============================================================
+ROTEAMENTO DE RESPOSTAS - Camadas baratas antes do GPT-4o
+============================================================
+Todo turno de texto livre que nao caia numa etapa
+(processar_etapa_*) ia para o GPT-4o com o treinamento e as
+ultimas 10 mensagens - inclusive "ok", "obrigado", "bom dia" e
+perguntas que ja tem resposta pronta nas FAQs do treinamento.
+
+Agora rotear_mensagem() tenta, em ordem, camadas mais baratas.
+A primeira que resolve devolve a resposta; se nenhuma resolve,
+o chamador segue para o GPT-4o:
+
+1. deterministico: mensagem que e SO agradecimento, "ok" ou
+   saudacao (intent_engine) recebe resposta pronta no idioma
+   do cliente. Nunca no primeiro contato, nem quando a ultima
+   mensagem do bot foi uma pergunta (o "ok" pode ser resposta)
+2. faq: pergunta parecida (conjunto de palavras, Jaccard) com
+   uma FAQ do treinamento no mesmo idioma recebe a resposta da
+   FAQ como esta cadastrada
+3. cache: resposta do GPT-4o ja dada a mesma pergunta (ou a uma
+   parecida) no mesmo idioma e versao do treinamento
+   (response_cache). guardar_resposta_gerada() alimenta o cache
+   depois de cada chamada ao GPT-4o. Consulta e gravacao so na
+   primeira pergunta da conversa e sem documento/orcamento em
+   andamento (usar_cache=False): a resposta nao pode depender do
+   contexto de um cliente
+4. modelo_pequeno (opcional): modelo barato com o mesmo prompt
+   e contexto curto; responde ESCALAR quando nao tem certeza
+
+Configuracao: pelo admin de treinamento (campo `roteamento` do
+bot Mia, ver CONFIG_PADRAO), lida pelo training_cache junto com
+as FAQs - salvar o treinamento recarrega tudo.
+
+Metricas: fatia dos turnos resolvida por camada, tempo medio e
+economia estimada de tempo e custo contra a media real das
+chamadas ao GPT-4o (registrar_chamada_llm).
+============================================================
+"""
+
+import re
+import time
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from llm_gateway import chat_completion
+from training_cache import obter_artefato
+from kb_retrieval import tokenizar
+from intent_engine import analisar, texto_restante
+from language_id import identificar_idioma
+from response_cache import buscar_resposta, guardar_resposta
+
+logger = logging.getLogger(__name__)
+
+CAMADAS = ("deterministico", "faq", "cache", "modelo_pequeno")
+
+# Camadas que devolvem texto pronto num idioma: puladas quando o idioma do cliente e desconhecido
+CAMADAS_COM_IDIOMA = ("deterministico", "faq", "cache")
+
+CONFIG_PADRAO: Dict[str, Any] = {
+    "habilitado": True,
+    "deterministico": True,
+    "faq": True,
+    "faq_similaridade_min": 0.6,
+    "cache": True,
+    "modelo_pequeno": False,
+    "modelo_pequeno_nome": "gpt-4o-mini",
+}
+
+# Precos OpenAI em USD por milhao de tokens (entrada, saida)
+PRECOS_USD_MILHAO = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Resposta do modelo pequeno quando o turno deve ir para o GPT-4o
+SINAL_ESCALAR = "ESCALAR"
+
+# Intencoes da camada deterministica, em ordem de prioridade
+INTENCOES_DIRETAS = ("agradecimento", "ok", "saudacao")
+
+# Palavras que podem sobrar numa mensagem "so agradecimento/ok/saudacao"
+_PALAVRAS_NEUTRAS = {
+    "muito", "mt", "mto", "mesmo", "muchas", "so", "much", "very", "a", "lot", "e", "y", "and",
+    "entao", "pessoal", "gente", "mia", "ai", "la", "de", "novo", "again", "voce", "vc"
+}
+
+RESPOSTAS_PRONTAS: Dict[str, Dict[str, str]] = {
+    "agradecimento": {
+        "pt": "Por nada! Se precisar de mais alguma coisa, é só chamar. 😊",
+        "en": "You're welcome! If you need anything else, just let me know. 😊",
+        "es": "¡De nada! Si necesitas algo más, aquí estoy. 😊",
+    },
+    "ok": {
+        "pt": "Perfeito! Qualquer dúvida, estou à disposição. 😊",
+        "en": "Great! If you have any questions, I'm here to help. 😊",
+        "es": "¡Perfecto! Cualquier duda, estoy a tu disposición. 😊",
+    },
+    "saudacao": {
+        "pt": "Olá! Como posso te ajudar? 😊",
+        "en": "Hi! How can I help you? 😊",
+        "es": "¡Hola! ¿En qué puedo ayudarte? 😊",
+    },
+}
+
+_PALAVRA = re.compile(r"[^\W\d_]+")
+
+
+class Roteamento(NamedTuple):
+    camada: str
+    resposta: str
+
+
+# Metricas: turnos roteados, por camada e das chamadas completas ao GPT-4o
+_stats: Dict[str, Any] = {
+    "turnos": 0,
+    "camadas": {nome: {"resolvidas": 0, "tentativas": 0, "ms_total": 0.0, "custo_usd": 0.0} for nome in CAMADAS},
+    "llm": {"chamadas": 0, "ms_total": 0.0, "custo_usd": 0.0},
+}
+
+
+def custo_usd(modelo: str, uso: Any) -> float:
+    """Custo de uma chamada pelo `usage` da resposta OpenAI"""
+    if uso is None:
+        return 0.0
+    entrada, saida = PRECOS_USD_MILHAO.get(modelo, PRECOS_USD_MILHAO["gpt-4o"])
+    return (getattr(uso, "prompt_tokens", 0) * entrada + getattr(uso, "completion_tokens", 0) * saida) / 1_000_000
+
+
+def registrar_chamada_llm(modelo: str, ms: float, uso: Any):
+    """Registra uma chamada completa ao GPT-4o (base para calcular a economia das camadas)"""
+    _stats["llm"]["chamadas"] += 1
+    _stats["llm"]["ms_total"] += ms
+    _stats["llm"]["custo_usd"] += custo_usd(modelo, uso)
+
+
+# ============================================================
+# CONFIGURACAO E FAQS (artefato do training_cache)
+# ============================================================
+def _compilar(bot: Optional[dict]) -> Dict[str, Any]:
+    config = {**CONFIG_PADRAO, **((bot or {}).get("roteamento") or {})}
+    faqs = []
+    for item in (bot or {}).get("faqs", []):
+        pergunta = item.get("question") or item.get("pergunta") or ""
+        resposta = item.get("answer") or item.get("resposta") or ""
+        palavras = set(tokenizar(pergunta))
+        if palavras and resposta:
+            faqs.append({
+                "pergunta": pergunta,
+                "resposta": resposta,
+                "palavras": palavras,
+                "idioma": identificar_idioma(resposta).idioma
+            })
+    return {"config": config, "faqs": faqs}
+
+
+# ============================================================
+# CAMADAS
+# ============================================================
+def _camada_deterministica(mensagem: str, idioma: str, contexto: List[Dict]) -> Optional[str]:
+    respostas_bot = [m.get("content") or "" for m in contexto if m.get("role") == "assistant"]
+    # Primeiro contato fica com o GPT-4o (apresentacao do treinamento);
+    # depois de uma pergunta do bot, "ok"/"obrigado" pode ser a resposta dela
+    if not respostas_bot or "?" in respostas_bot[-1]:
+        return None
+
+    encontradas = analisar(mensagem)
+    intencao = next((nome for nome in INTENCOES_DIRETAS if nome in encontradas), None)
+    if intencao is None:
+        return None
+    restante = set(_PALAVRA.findall(texto_restante(mensagem, INTENCOES_DIRETAS)))
+    if restante - _PALAVRAS_NEUTRAS:
+        return None
+    return RESPOSTAS_PRONTAS[intencao].get(idioma, RESPOSTAS_PRONTAS[intencao]["pt"])
+
+
+def _primeira_pergunta(mensagem: str, contexto: List[Dict]) -> bool:
+    """Nenhuma mensagem anterior do cliente no contexto (a resposta nao depende da conversa)"""
+    return not any(
+        m.get("role") == "user" and m.get("content") != mensagem for m in contexto
+    )
+
+
+def _camada_faq(mensagem: str, idioma: str, faqs: List[Dict], similaridade_min: float) -> Optional[str]:
+    palavras = set(tokenizar(mensagem))
+    if len(palavras) < 2:
+        return None
+    melhor, melhor_similaridade = None, 0.0
+    for faq in faqs:
+        if faq["idioma"] != idioma:
+            continue
+        similaridade = len(palavras & faq["palavras"]) / len(palavras | faq["palavras"])
+        if similaridade > melhor_similaridade:
+            melhor, melhor_similaridade = faq, similaridade
+    if melhor is None or melhor_similaridade < similaridade_min:
+        return None
+    logger.info(f"[ROTEAMENTO] FAQ '{melhor['pergunta'][:60]}' (similaridade {melhor_similaridade:.2f})")
+    return melhor["resposta"]
+
+
+async def _camada_modelo_pequeno(
+    canal: str, mensagem: str, contexto: List[Dict], prompt_sistema: str, modelo: str
+) -> Optional[str]:
+    instrucao = (
+        f"\n\n**ROTEAMENTO:** Responda somente se a resposta estiver clara nas informacoes acima. "
+        f"Se a mensagem envolver orcamento, documento, pagamento, reclamacao ou pedido de atendente, "
+        f"ou se voce tiver qualquer duvida, responda apenas: {SINAL_ESCALAR}"
+    )
+    stats = _stats["camadas"]["modelo_pequeno"]
+    resposta = await chat_completion(
+        task=f"roteamento_{canal}",
+        model=modelo,
+        messages=[{"role": "system", "content": prompt_sistema + instrucao}]
+        + contexto[-4:] + [{"role": "user", "content": mensagem}],
+        max_tokens=300,
+        temperature=0.3
+    )
+    stats["custo_usd"] += custo_usd(modelo, getattr(resposta, "usage", None))
+    texto = (resposta.choices[0].message.content or "").strip()
+    if not texto or SINAL_ESCALAR in texto:
+        return None
+    return texto
+
+
+async def rotear_mensagem(
+    canal: str,
+    mensagem: str,
+    idioma: Optional[str],
+    contexto: List[Dict],
+    prompt_sistema: str,
+    usar_cache: bool = True
+) -> Optional[Roteamento]:
+    """
+    Resposta da primeira camada barata que resolver o turno, ou None
+    (o chamador segue para o GPT-4o). Erros de uma camada nunca
+    impedem o turno: a camada e pulada.
+
+    idioma=None (deteccao nao confiavel e nenhum idioma salvo): so o
+    modelo pequeno, que segue o idioma da conversa.
+
+    usar_cache=False pula a camada de cache (cliente com documento
+    ou orcamento em andamento).
+    """
+    try:
+        artefato = await obter_artefato("roteamento", _compilar)
+    except Exception as e:
+        logger.error(f"[ROTEAMENTO] Erro ao carregar configuracao: {e}")
+        return None
+    config = artefato["config"]
+    if not config.get("habilitado"):
+        return None
+
+    _stats["turnos"] += 1
+    usar_cache = usar_cache and _primeira_pergunta(mensagem, contexto)
+
+    for camada in CAMADAS:
+        if not config.get(camada):
+            continue
+        if camada == "cache" and not usar_cache:
+            continue
+        # Sem idioma conhecido, resposta pronta/FAQ/cache poderiam sair no idioma errado
+        if camada in CAMADAS_COM_IDIOMA and not idioma:
+            continue
+        stats = _stats["camadas"][camada]
+        stats["tentativas"] += 1
+        inicio = time.monotonic()
+        try:
+            if camada == "deterministico":
+                resposta = _camada_deterministica(mensagem, idioma, contexto)
+            elif camada == "faq":
+                resposta = _camada_faq(mensagem, idioma, artefato["faqs"], float(config.get("faq_similaridade_min", 0.6)))
+            elif camada == "cache":
+                resposta = await buscar_resposta(mensagem, idioma, canal)
+            else:
+                resposta = await _camada_modelo_pequeno(
+                    canal, mensagem, contexto, prompt_sistema, config.get("modelo_pequeno_nome") or "gpt-4o-mini"
+                )
+        except Exception as e:
+            logger.error(f"[ROTEAMENTO] Erro na camada {camada}: {e}")
+            resposta = None
+        ms = (time.monotonic() - inicio) * 1000
+        stats["ms_total"] += ms
+
+        if resposta:
+            stats["resolvidas"] += 1
+            logger.info(f"[ROTEAMENTO] {canal}: turno resolvido na camada {camada} ({ms:.0f}ms)")
+            return Roteamento(camada, resposta)
+    return None
+
+
+async def guardar_resposta_gerada(
+    canal: str,
+    mensagem: str,
+    idioma: Optional[str],
+    resposta: str,
+    contexto: List[Dict],
+    nome_cliente: Optional[str] = None
+) -> bool:
+    """
+    Oferece a resposta do GPT-4o ao cache de respostas (se a camada
+    estiver ativa). So a primeira pergunta da conversa: com mensagens
+    anteriores no contexto a resposta pode depender delas. Sem idioma
+    conhecido nao guarda (a consulta tambem pula o cache).
+    """
+    if not idioma or not _primeira_pergunta(mensagem, contexto):
+        return False
+    try:
+        config = (await obter_artefato("roteamento", _compilar))["config"]
+        if not (config.get("habilitado") and config.get("cache")):
+            return False
+        return await guardar_resposta(mensagem, idioma, resposta, canal, nome_cliente)
+    except Exception as e:
+        logger.error(f"[ROTEAMENTO] Erro ao guardar resposta no cache: {e}")
+        return False
+
+
+def get_roteamento_stats() -> Dict[str, Any]:
+    """Fatia dos turnos resolvida por camada e economia estimada (para o admin)"""
+    turnos = _stats["turnos"]
+    llm = _stats["llm"]
+    llm_ms_medio = llm["ms_total"] / llm["chamadas"] if llm["chamadas"] else 0
+    llm_custo_medio = llm["custo_usd"] / llm["chamadas"] if llm["chamadas"] else 0
+
+    camadas = {}
+    for nome, s in _stats["camadas"].items():
+        ms_medio = s["ms_total"] / s["tentativas"] if s["tentativas"] else 0
+        camadas[nome] = {
+            "resolvidas": s["resolvidas"],
+            "tentativas": s["tentativas"],
+            "fatia": round(s["resolvidas"] / turnos * 100, 1) if turnos else 0,
+            "ms_medio": round(ms_medio, 1),
+            "custo_usd": round(s["custo_usd"], 4),
+            # Cada turno resolvido evitou uma chamada media ao GPT-4o
+            "economia_ms": round(s["resolvidas"] * llm_ms_medio - s["ms_total"]),
+            "economia_usd": round(s["resolvidas"] * llm_custo_medio - s["custo_usd"], 4),
+        }
+
+    resolvidas = sum(c["resolvidas"] for c in camadas.values())
+    return {
+        "turnos": turnos,
+        "resolvidas": resolvidas,
+        "fatia_resolvida": round(resolvidas / turnos * 100, 1) if turnos else 0,
+        "gpt4o": {
+            "chamadas": llm["chamadas"],
+            "ms_medio": round(llm_ms_medio, 1),
+            "custo_medio_usd": round(llm_custo_medio, 5),
+        },
+        "economia_ms": sum(c["economia_ms"] for c in camadas.values()),
+        "economia_usd": round(sum(c["economia_usd"] for c in camadas.values()), 4),
+        "camadas": camadas,
+    }
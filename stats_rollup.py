@@ -0,0 +1,321 @@
+"""
+============================================================
+ESTATISTICAS PRE-AGREGADAS - Rollup incremental para os paineis
+============================================================
+Os paineis do admin contavam mensagens, clientes e conversoes
+varrendo `conversas` inteira a cada carregamento (find().to_list
+so para len(), distinct de telefones, 4-6 count_documents).
+
+Agora cada gravacao atualiza contadores na colecao `stats_rollup`:
+
+- tipo "mensagens":  por hora x canal x role x mode -> total
+- tipo "conversoes": por hora x canal -> total, valor
+- tipo "orcamentos": por hora x canal -> total, valor
+- tipo "clientes":   por dia -> telefones (phone_key) que
+  conversaram e que converteram
+
+Os endpoints leem alguns documentos do rollup (O(dias)) em vez
+de O(mensagens). O mode registrado e o do momento da mensagem.
+reconstruir_rollup() recalcula tudo a partir das colecoes
+originais (roda uma vez no primeiro startup e sob demanda no admin).
+O resultado e montado numa colecao temporaria com os mesmos
+indices e trocado de uma vez (rename com dropTarget): os paineis
+nunca veem um rollup pela metade, as gravacoes incrementais nao
+colidem com os inserts e um erro no meio deixa o rollup antigo
+intacto. Incrementos feitos durante a reconstrucao (segundos)
+ficam de fora do resultado.
+============================================================
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from admin_training_routes import db
+from db_indexes import INDICES
+from phone_keys import phone_key
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEY = "stats_rollup_inicial"
+
+# Colecao onde a reconstrucao e montada antes da troca
+COLECAO_RECONSTRUCAO = "stats_rollup_reconstrucao"
+
+
+def extrair_valor(doc: dict) -> float:
+    """Extrai valor de forma flexível (numero ou texto com $/R$)"""
+    valor = doc.get("valor") or doc.get("value") or 0
+    if isinstance(valor, str):
+        try:
+            valor = valor.replace("$", "").replace("R$", "").replace(",", "").strip()
+            valor = float(valor)
+        except Exception:
+            valor = 0
+    return float(valor) if valor else 0.0
+
+
+def _hora(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _dia(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _canal_orcamento(doc: dict) -> str:
+    return doc.get("canal") or ("API" if doc.get("created_via") else "WhatsApp")
+
+
+# ============================================================
+# ESCRITA INCREMENTAL
+# ============================================================
+
+async def registrar_mensagem(doc: dict):
+    """Conta uma mensagem gravada em `conversas` (nunca levanta excecao)"""
+    try:
+        ts = doc.get("timestamp") or datetime.now()
+        operacoes = [UpdateOne(
+            {
+                "tipo": "mensagens",
+                "inicio": _hora(ts),
+                "canal": doc.get("canal") or "WhatsApp",
+                "role": doc.get("role") or "user",
+                "mode": doc.get("mode") or "ia"
+            },
+            {"$inc": {"total": 1}},
+            upsert=True
+        )]
+        if doc.get("phone"):
+            operacoes.append(UpdateOne(
+                {"tipo": "clientes", "inicio": _dia(ts)},
+                {"$addToSet": {"phones": phone_key(doc["phone"])}},
+                upsert=True
+            ))
+        await db.stats_rollup.bulk_write(operacoes, ordered=False)
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erro ao registrar mensagem: {e}")
+
+
+async def _outra_conversao_no_dia(doc: dict, ts: datetime) -> bool:
+    """O telefone tem outra conversao no mesmo dia (continua entre os convertidos)"""
+    chave = phone_key(doc["phone"])
+    inicio = _dia(ts)
+    async for outra in db.conversoes.find(
+        {"timestamp": {"$gte": inicio, "$lt": inicio + timedelta(days=1)}, "_id": {"$ne": doc.get("_id")}},
+        {"phone": 1}
+    ):
+        if phone_key(outra.get("phone")) == chave:
+            return True
+    return False
+
+
+async def registrar_conversao(doc: dict, sinal: int = 1):
+    """Conta (sinal=1) ou desconta (sinal=-1, exclusao) uma conversao"""
+    try:
+        ts = doc.get("timestamp") or datetime.now()
+        operacoes = [UpdateOne(
+            {"tipo": "conversoes", "inicio": _hora(ts), "canal": doc.get("canal") or "WhatsApp"},
+            {"$inc": {"total": sinal, "valor": sinal * extrair_valor(doc)}},
+            upsert=True
+        )]
+        if sinal > 0 and doc.get("phone"):
+            operacoes.append(UpdateOne(
+                {"tipo": "clientes", "inicio": _dia(ts)},
+                {"$addToSet": {"convertidos": phone_key(doc["phone"])}},
+                upsert=True
+            ))
+        elif sinal < 0 and doc.get("phone") and not await _outra_conversao_no_dia(doc, ts):
+            operacoes.append(UpdateOne(
+                {"tipo": "clientes", "inicio": _dia(ts)},
+                {"$pull": {"convertidos": phone_key(doc["phone"])}}
+            ))
+        await db.stats_rollup.bulk_write(operacoes, ordered=False)
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erro ao registrar conversao: {e}")
+
+
+async def ajustar_valor_conversao(doc_antigo: dict, valor_novo: float):
+    """Aplica a diferenca de valor quando uma conversao e editada"""
+    try:
+        ts = doc_antigo.get("timestamp") or datetime.now()
+        delta = float(valor_novo) - extrair_valor(doc_antigo)
+        if delta:
+            await db.stats_rollup.update_one(
+                {"tipo": "conversoes", "inicio": _hora(ts), "canal": doc_antigo.get("canal") or "WhatsApp"},
+                {"$inc": {"valor": delta}},
+                upsert=True
+            )
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erro ao ajustar conversao: {e}")
+
+
+async def registrar_orcamento(doc: dict):
+    """Conta um orcamento gravado em `orcamentos`"""
+    try:
+        ts = doc.get("created_at") or datetime.now()
+        await db.stats_rollup.update_one(
+            {"tipo": "orcamentos", "inicio": _hora(ts), "canal": _canal_orcamento(doc)},
+            {"$inc": {"total": 1, "valor": extrair_valor(doc)}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erro ao registrar orcamento: {e}")
+
+
+# ============================================================
+# LEITURA (PAINEIS)
+# ============================================================
+
+def _filtro(tipo: str, desde: Optional[datetime], filtros: Dict[str, Any]) -> Dict[str, Any]:
+    filtro = {"tipo": tipo, **filtros}
+    if desde is not None:
+        filtro["inicio"] = {"$gte": _hora(desde)}
+    return filtro
+
+
+async def somar(tipo: str, desde: Optional[datetime] = None, **filtros) -> Dict[str, float]:
+    """Soma total/valor de um tipo no periodo (filtros: canal, role, mode)"""
+    pipeline = [
+        {"$match": _filtro(tipo, desde, filtros)},
+        {"$group": {"_id": None, "total": {"$sum": "$total"}, "valor": {"$sum": "$valor"}}}
+    ]
+    resultado = await db.stats_rollup.aggregate(pipeline).to_list(length=1)
+    if not resultado:
+        return {"total": 0, "valor": 0.0}
+    return {"total": int(resultado[0]["total"]), "valor": float(resultado[0]["valor"] or 0)}
+
+
+async def somar_por(tipo: str, campo: str, desde: Optional[datetime] = None, **filtros) -> Dict[str, int]:
+    """Total de um tipo agrupado por canal/role/mode"""
+    pipeline = [
+        {"$match": _filtro(tipo, desde, filtros)},
+        {"$group": {"_id": f"${campo}", "total": {"$sum": "$total"}}}
+    ]
+    return {r["_id"]: int(r["total"]) async for r in db.stats_rollup.aggregate(pipeline)}
+
+
+async def serie_diaria(tipo: str, desde: datetime, **filtros) -> Dict[str, Dict[str, float]]:
+    """{"YYYY-MM-DD": {"total", "valor"}} de um tipo a partir de `desde`"""
+    pipeline = [
+        {"$match": _filtro(tipo, desde, filtros)},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$inicio"}},
+            "total": {"$sum": "$total"},
+            "valor": {"$sum": "$valor"}
+        }}
+    ]
+    return {
+        r["_id"]: {"total": int(r["total"]), "valor": float(r["valor"] or 0)}
+        async for r in db.stats_rollup.aggregate(pipeline)
+    }
+
+
+async def clientes_no_periodo(desde: datetime) -> Tuple[Set[str], Set[str]]:
+    """Telefones (phone_key) que conversaram e que converteram desde o dia de `desde`"""
+    clientes: Set[str] = set()
+    convertidos: Set[str] = set()
+    async for doc in db.stats_rollup.find({"tipo": "clientes", "inicio": {"$gte": _dia(desde)}}):
+        clientes.update(doc.get("phones", []))
+        convertidos.update(doc.get("convertidos", []))
+    return clientes, convertidos
+
+
+# ============================================================
+# RECONSTRUCAO
+# ============================================================
+
+async def reconstruir_rollup(forcar: bool = False) -> Dict[str, Any]:
+    """
+    Recalcula o rollup a partir de conversas, conversoes e orcamentos.
+    Sem forcar, so roda se ainda nao foi feito (registro em `sistema`).
+    """
+    try:
+        if not forcar:
+            registro = await db.sistema.find_one({"key": ROLLUP_KEY})
+            if registro and registro.get("concluida"):
+                return {"executada": False, "motivo": "ja concluida"}
+
+        docs: Dict[tuple, Dict[str, Any]] = {}
+
+        def _acumular(chave: Dict[str, Any], **incrementos):
+            ident = tuple(sorted(chave.items()))
+            doc = docs.setdefault(ident, {**chave})
+            for campo, valor in incrementos.items():
+                doc[campo] = doc.get(campo, 0) + valor
+
+        # Mensagens: agregadas no Mongo por hora x canal x role x mode
+        pipeline = [
+            {"$match": {"timestamp": {"$type": "date"}}},
+            {"$group": {
+                "_id": {
+                    "inicio": {"$dateFromParts": {
+                        "year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"},
+                        "day": {"$dayOfMonth": "$timestamp"}, "hour": {"$hour": "$timestamp"}
+                    }},
+                    "canal": {"$ifNull": ["$canal", "WhatsApp"]},
+                    "role": {"$ifNull": ["$role", "user"]},
+                    "mode": {"$ifNull": ["$mode", "ia"]}
+                },
+                "total": {"$sum": 1}
+            }}
+        ]
+        async for r in db.conversas.aggregate(pipeline, allowDiskUse=True):
+            _acumular({"tipo": "mensagens", **r["_id"]}, total=r["total"])
+
+        # Clientes por dia
+        clientes: Dict[datetime, Dict[str, set]] = {}
+        pipeline = [
+            {"$match": {"timestamp": {"$type": "date"}, "phone": {"$exists": True}}},
+            {"$group": {
+                "_id": {"$dateFromParts": {
+                    "year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"},
+                    "day": {"$dayOfMonth": "$timestamp"}
+                }},
+                "phones": {"$addToSet": "$phone"}
+            }}
+        ]
+        async for r in db.conversas.aggregate(pipeline, allowDiskUse=True):
+            dia = clientes.setdefault(r["_id"], {"phones": set(), "convertidos": set()})
+            dia["phones"].update(phone_key(p) for p in r["phones"] if p)
+
+        # Conversoes e orcamentos sao colecoes pequenas: valor extraido em Python
+        async for c in db.conversoes.find({"timestamp": {"$type": "date"}}):
+            _acumular({"tipo": "conversoes", "inicio": _hora(c["timestamp"]), "canal": c.get("canal") or "WhatsApp"},
+                      total=1, valor=extrair_valor(c))
+            if c.get("phone"):
+                dia = clientes.setdefault(_dia(c["timestamp"]), {"phones": set(), "convertidos": set()})
+                dia["convertidos"].add(phone_key(c["phone"]))
+
+        async for o in db.orcamentos.find({"created_at": {"$type": "date"}}):
+            _acumular({"tipo": "orcamentos", "inicio": _hora(o["created_at"]), "canal": _canal_orcamento(o)},
+                      total=1, valor=extrair_valor(o))
+
+        novos = list(docs.values()) + [
+            {"tipo": "clientes", "inicio": inicio, "phones": sorted(d["phones"]), "convertidos": sorted(d["convertidos"])}
+            for inicio, d in clientes.items()
+        ]
+
+        # Monta fora da colecao em uso e troca de uma vez
+        temporaria = db[COLECAO_RECONSTRUCAO]
+        await temporaria.drop()
+        await temporaria.create_indexes(INDICES["stats_rollup"])
+        if novos:
+            await temporaria.insert_many(novos, ordered=False)
+            await temporaria.rename("stats_rollup", dropTarget=True)
+        else:
+            await db.stats_rollup.delete_many({})
+
+        await db.sistema.update_one(
+            {"key": ROLLUP_KEY},
+            {"$set": {"concluida": True, "concluida_em": datetime.now(), "documentos": len(novos)}},
+            upsert=True
+        )
+        logger.info(f"[ROLLUP] Rollup reconstruido: {len(novos)} documentos")
+        return {"executada": True, "concluida": True, "documentos": len(novos)}
+
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erro ao reconstruir rollup: {e}")
+        return {"executada": True, "concluida": False, "erro": str(e)}
@@ -0,0 +1,80 @@
+"""
+============================================================
+NORMALIZACAO DE TEXTO - Forma canonica das mensagens
+============================================================
+Clientes escrevem "não", "nao", "NÃO", "naaaao", "nãooo 😅".
+As listas de palavras-chave tinham que repetir cada termo com e
+sem acento, e mesmo assim perdiam alongamentos e erros de
+digitacao.
+
+normalizar(texto) roda uma vez por mensagem (cache por texto):
+
+1. ’ ‘ viram apostrofo simples ("let’s" == "let's")
+2. Unicode NFKD + remocao dos acentos (marcas combinantes)
+3. casefold (minusculas agressivas: "ß" -> "ss")
+4. Emojis e simbolos graficos viram espaco
+5. Letras repetidas 3+ vezes viram uma ("siiiim" -> "sim");
+   duplas legitimas ("isso", "carro") ficam como estao
+6. Espacos colapsados
+
+distancia_limitada(a, b, limite) e a distancia de edicao
+(Damerau, transposicao conta 1) que para assim que passa do
+limite - usada pelo intent_engine para tolerar erros de digitacao.
+============================================================
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# Mensagens distintas normalizadas em cache
+CACHE_NORMALIZACAO = 1024
+
+# Categorias Unicode removidas: simbolos graficos (emoji), modificadores
+# (tons de pele), formatacao (ZWJ, seletores de variacao) e uso privado
+_CATEGORIAS_REMOVIDAS = {"So", "Sk", "Cf", "Co", "Cs"}
+
+_APOSTROFOS = str.maketrans({"’": "'", "‘": "'", "´": "'", "`": "'"})
+_LETRA_REPETIDA = re.compile(r"([^\W\d_])\1{2,}")
+_ESPACOS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=CACHE_NORMALIZACAO)
+def normalizar(texto: str) -> str:
+    """Forma canonica do texto (sem acento, casefold, sem emoji, sem alongamento)"""
+    if not texto:
+        return ""
+    texto = unicodedata.normalize("NFKD", texto.translate(_APOSTROFOS))
+    texto = "".join(
+        " " if unicodedata.category(c) in _CATEGORIAS_REMOVIDAS else c
+        for c in texto if not unicodedata.combining(c)
+    ).casefold()
+    texto = _LETRA_REPETIDA.sub(r"\1", texto)
+    return _ESPACOS.sub(" ", texto).strip()
+
+
+def distancia_limitada(a: str, b: str, limite: int) -> int:
+    """
+    Distancia de edicao (insercao, remocao, troca, transposicao de vizinhas).
+    Retorna limite + 1 assim que a distancia passa do limite.
+    """
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    if a == b:
+        return 0
+
+    anterior2 = None
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        atual = [i] + [0] * len(b)
+        menor = atual[0]
+        for j in range(1, len(b) + 1):
+            custo = 0 if a[i - 1] == b[j - 1] else 1
+            atual[j] = min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + custo)
+            if anterior2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                atual[j] = min(atual[j], anterior2[j - 2] + 1)
+            menor = min(menor, atual[j])
+        if menor > limite:
+            return limite + 1
+        anterior2, anterior = anterior, atual
+    return min(anterior[len(b)], limite + 1)
@@ -0,0 +1,365 @@
+"""
+Treina os perfis de n-gramas do language_id e grava
+language_id_profile.json. Depois confere a acuracia em mensagens
+curtas separadas do treino, compara com a contagem de palavras
+antiga (detectar_idioma) e mede o tempo por mensagem.
+
+Execute: python train_language_id.py                    (corpus embutido)
+         python train_language_id.py --arquivo extra.tsv (soma linhas "idioma<TAB>texto")
+         python train_language_id.py --avaliar           (so avalia o perfil atual)
+"""
+
+import sys
+import json
+import math
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import language_id
+from language_id import IDIOMAS, ARQUIVO_PERFIL, preparar, ngramas, identificar_idioma
+
+# N-gramas mais frequentes mantidos por idioma
+MAX_NGRAMAS = 1500
+
+# Frases tipicas de clientes (WhatsApp/WebChat) e textos gerais de cada idioma
+CORPUS: Dict[str, List[str]] = {
+    "pt": [
+        "Olá, bom dia! Gostaria de um orçamento para tradução de certidão de nascimento",
+        "Boa tarde, tudo bem? Vocês traduzem histórico escolar?",
+        "Quanto fica para traduzir meu diploma e o histórico da faculdade?",
+        "Preciso da tradução juramentada para o consulado até sexta-feira",
+        "Quero falar com um atendente, por favor",
+        "Você não entende o que eu estou falando",
+        "Achei caro, tem como fazer um desconto?",
+        "Vou pensar e te aviso amanhã",
+        "Pode seguir, estou de acordo com o valor",
+        "Paguei agora pelo Zelle, segue o comprovante",
+        "Fiz o pix de cento e cinquenta reais",
+        "Ainda não recebi a tradução, poderia verificar se já foi enviada?",
+        "A Beatriz me atendeu da outra vez, pode passar para ela?",
+        "Perfeito, muito obrigada pela ajuda!",
+        "São três páginas, frente e verso",
+        "Preciso para o USCIS, é para o processo do green card",
+        "Vamos fechar então, como faço o pagamento?",
+        "Mandei a foto, consegue ver direitinho?",
+        "Meu nome é Carlos e moro em Boston",
+        "A certidão de casamento precisa de apostila?",
+        "Quanto tempo demora para ficar pronta a tradução?",
+        "Vocês fazem tradução de carteira de motorista para tirar a habilitação aqui?",
+        "Obrigado, vou mandar os documentos ainda hoje à noite",
+        "Meu filho vai estudar nos Estados Unidos e precisamos traduzir o boletim",
+        "Eu preciso traduzir os documentos do meu pai que faleceu no Brasil",
+        "Sim, pode ser enviado por e-mail mesmo",
+        "Não consegui abrir o link que vocês mandaram",
+        "Onde eu assino? É necessário reconhecer firma?",
+        "Qual é o prazo de entrega se eu pagar hoje?",
+        "Tenho quatro documentos, dois com carimbo no verso",
+        "Gostaria de saber se a tradução é aceita pela imigração",
+        "Oi, tudo bom? Vi o anúncio de vocês no Instagram",
+        "Estou esperando a resposta desde ontem, ninguém me respondeu",
+        "Consegue me mandar o valor total com o frete?",
+        "Bom dia, estou com pressa, preciso para amanhã cedo",
+        "O cartório pediu a tradução com assinatura do tradutor",
+        "Ela vai levar os papéis na embaixada na semana que vem",
+        "Eles cobraram muito mais em outro lugar",
+        "A gente pode pagar metade agora e o resto na entrega?",
+        "Não sei quantas páginas são, vou contar e te falo",
+        "Desculpa a demora, estava trabalhando",
+        "Beleza, combinado então",
+        "Valeu, deu tudo certo com o pagamento",
+        "Você pode conferir se o nome da minha mãe está escrito certo?",
+        "Tem um erro na data de nascimento, precisa corrigir",
+        "Meu marido também precisa traduzir o diploma dele",
+        "Eu moro na Flórida, vocês atendem aqui?",
+        "Seria possível receber a versão impressa pelo correio?",
+        "Acabei de transferir, confirma para mim por favor",
+        "Fico no aguardo, obrigada",
+        "A cidade estava cheia de gente durante o feriado de carnaval",
+        "O governo anunciou novas regras para a educação pública no país",
+        "Ontem choveu muito e as ruas ficaram alagadas no centro",
+        "As crianças brincavam no parque enquanto os pais conversavam",
+        "Não tenho certeza se vou conseguir chegar a tempo na reunião",
+        "Quando eu era pequeno, morava numa casa perto do mar",
+        "Essa empresa trabalha com clientes do mundo inteiro há muitos anos",
+        "Precisamos de mais informações para concluir o seu pedido",
+        "Então, deixa eu ver aqui e já te respondo",
+        "Muito obrigado pela atenção e pela paciência de vocês",
+        "Tá bom, vou aguardar o retorno de vocês",
+        "Nossa, que rápido! Adorei o atendimento",
+        "Você já recebeu o meu documento? Mandei ontem à tarde",
+        "Eu não tenho cartão de crédito, posso pagar com boleto?",
+        "Quais documentos vocês precisam para começar?",
+        "Minha irmã indicou vocês, disse que o serviço é ótimo",
+        "Depois eu mando o restante das páginas",
+        "Agora não posso falar, mais tarde eu chamo",
+        "Está certo, pode fazer a tradução da certidão de óbito também",
+        "Isso mesmo, são duas cópias autenticadas",
+        "Quanto custa a tradução do passaporte?",
+        "Tô aguardando o retorno, vc consegue ver pra mim?",
+        "Blz, vou te mandar o print do pagamento",
+        "Então tá, fico esperando a resposta",
+    ],
+    "en": [
+        "Hi, I need a certified translation of my birth certificate, how much?",
+        "Where is my translation? I paid yesterday",
+        "Is it ready yet?",
+        "Too expensive, is there any discount?",
+        "Let me think about it, I'm comparing prices",
+        "Thanks! Sending the payment now",
+        "Good morning, do you translate school transcripts?",
+        "How long does it take to get the translation done?",
+        "I would like to speak to a person please",
+        "Can you send me the total price including shipping?",
+        "I sent the pictures, can you see them clearly?",
+        "My name is John and I live in New Jersey",
+        "We need it for USCIS, it's for my green card application",
+        "Does the marriage certificate need an apostille?",
+        "Okay, let's do it, how do I pay?",
+        "I just made the transfer through Zelle",
+        "Please confirm when you receive the payment",
+        "There is a typo in my mother's name, could you fix it?",
+        "My husband also needs his diploma translated",
+        "Could you mail me a printed copy?",
+        "I have four documents, two of them are double sided",
+        "Is the translation accepted by immigration?",
+        "Hello, I saw your ad on Instagram",
+        "I've been waiting since yesterday and nobody answered",
+        "I'm in a hurry, I need it by tomorrow morning",
+        "The court asked for a notarized translation",
+        "She will take the papers to the embassy next week",
+        "They charged me much more somewhere else",
+        "Can we pay half now and the rest on delivery?",
+        "I don't know how many pages, I'll count and let you know",
+        "Sorry for the delay, I was at work",
+        "Sounds good, thank you so much",
+        "Great, everything went through with the payment",
+        "What documents do you need to get started?",
+        "My sister recommended you, she said the service was great",
+        "I'll send the rest of the pages later",
+        "I can't talk right now, I'll call you back",
+        "That's right, please also translate the death certificate",
+        "Yes, two certified copies please",
+        "Do you accept credit cards or only bank transfers?",
+        "Would it be possible to have it done by Friday?",
+        "I want to know the price for a driver's license translation",
+        "Thank you for your patience and your help",
+        "Wow, that was fast! Great service",
+        "Did you get my document? I sent it yesterday afternoon",
+        "I'm waiting for your answer",
+        "No problem, take your time",
+        "Could you check whether the dates are correct?",
+        "The city was crowded during the holiday weekend",
+        "The government announced new rules for public education",
+        "It rained a lot yesterday and the streets were flooded downtown",
+        "The children were playing in the park while their parents talked",
+        "I'm not sure whether I will make it to the meeting on time",
+        "When I was a kid, I lived in a house near the beach",
+        "This company has been working with clients all over the world",
+        "We need more information to complete your order",
+        "Let me check and I'll get back to you",
+        "What's the turnaround time for a rush order?",
+        "Which payment methods do you have?",
+        "Got it, I'll wait for your reply",
+        "Awesome, thanks a lot",
+        "Please let me know if you need anything else",
+        "My appointment is next Monday, will it be ready?",
+        "I already paid, here is the receipt",
+        "Can someone help me with my order?",
+        "This is the wrong document, I'll send the right one",
+        "Yes please go ahead",
+        "How much would it cost for three pages?",
+        "Should I bring the original documents to your office?",
+        "I think there is a mistake on the second page",
+    ],
+    "es": [
+        "Hola, necesito traducir mi título universitario, ¿cuánto cuesta?",
+        "Buenos días, ¿ustedes traducen certificados de nacimiento?",
+        "Dale, hagámoslo",
+        "¿Cuánto tiempo tarda la traducción?",
+        "Quiero hablar con una persona, por favor",
+        "Me parece caro, ¿tienen algún descuento?",
+        "Lo voy a pensar y te aviso mañana",
+        "Ya pagué por Zelle, aquí está el comprobante",
+        "Todavía no recibí la traducción, ¿podrían verificar si ya fue enviada?",
+        "Perfecto, muchas gracias por la ayuda",
+        "Son tres páginas, de ambos lados",
+        "La necesito para USCIS, es para mi residencia",
+        "Entonces vamos a cerrar, ¿cómo hago el pago?",
+        "Mandé la foto, ¿se ve bien?",
+        "Me llamo Carlos y vivo en Miami",
+        "¿El acta de matrimonio necesita apostilla?",
+        "¿Hacen traducción de licencia de conducir?",
+        "Gracias, voy a mandar los documentos esta noche",
+        "Mi hijo va a estudiar en Estados Unidos y necesitamos traducir sus notas",
+        "Necesito traducir los documentos de mi padre que falleció en México",
+        "Sí, puede ser por correo electrónico",
+        "No pude abrir el enlace que me mandaron",
+        "¿Cuál es el plazo de entrega si pago hoy?",
+        "Tengo cuatro documentos, dos con sello atrás",
+        "Quisiera saber si la traducción es aceptada por inmigración",
+        "Hola, ¿qué tal? Vi su anuncio en Instagram",
+        "Estoy esperando la respuesta desde ayer, nadie me contestó",
+        "¿Me puedes mandar el precio total con el envío?",
+        "Tengo prisa, la necesito para mañana temprano",
+        "El juzgado pidió la traducción con firma del traductor",
+        "Ella va a llevar los papeles a la embajada la próxima semana",
+        "En otro lugar me cobraron mucho más",
+        "¿Podemos pagar la mitad ahora y el resto en la entrega?",
+        "No sé cuántas páginas son, las cuento y te digo",
+        "Perdón por la demora, estaba trabajando",
+        "Listo, quedamos así entonces",
+        "Todo salió bien con el pago, gracias",
+        "¿Puedes revisar si el nombre de mi madre está bien escrito?",
+        "Hay un error en la fecha de nacimiento, hay que corregirlo",
+        "Mi esposo también necesita traducir su diploma",
+        "Vivo en Texas, ¿atienden aquí?",
+        "¿Sería posible recibir la versión impresa por correo?",
+        "Acabo de transferir, confírmame por favor",
+        "Quedo atento, gracias",
+        "La ciudad estaba llena de gente durante las fiestas",
+        "El gobierno anunció nuevas reglas para la educación pública",
+        "Ayer llovió mucho y las calles del centro se inundaron",
+        "Los niños jugaban en el parque mientras los padres conversaban",
+        "No estoy seguro de llegar a tiempo a la reunión",
+        "Cuando era pequeño vivía en una casa cerca del mar",
+        "Esta empresa trabaja con clientes de todo el mundo desde hace años",
+        "Necesitamos más información para completar su pedido",
+        "Déjame ver y ya te respondo",
+        "Muchísimas gracias por la atención y la paciencia",
+        "Está bien, espero su respuesta",
+        "¡Qué rápido! Me encantó la atención",
+        "¿Ya recibiste mi documento? Lo mandé ayer en la tarde",
+        "No tengo tarjeta de crédito, ¿puedo pagar en efectivo?",
+        "¿Qué documentos necesitan para empezar?",
+        "Mi hermana me los recomendó, dijo que el servicio es excelente",
+        "Después te mando el resto de las páginas",
+        "Ahora no puedo hablar, más tarde te escribo",
+        "Así es, también traduzcan el acta de defunción",
+        "Sí, dos copias certificadas por favor",
+        "¿Aceptan tarjeta o solo transferencia?",
+        "¿Se puede tener lista para el viernes?",
+        "Quiero saber el precio de la traducción de mi pasaporte",
+        "Oye, ¿me ayudas con mi pedido?",
+        "Bueno, vale, lo hacemos así",
+        "¿Cuánto me sale por tres hojas?",
+    ],
+}
+
+# Mensagens curtas fora do treino (o caso dificil) para avaliacao
+TESTE: List[Tuple[str, str]] = [
+    ("pt", "quanto custa?"), ("pt", "obrigada!!"), ("pt", "nao recebi ainda"),
+    ("pt", "vc pode me ajudar"), ("pt", "to esperando"), ("pt", "blz, fechado"),
+    ("pt", "mandei agora"), ("pt", "cade minha traducao"), ("pt", "qual o valor?"),
+    ("pt", "preciso urgente"), ("pt", "quero fazer o pedido"), ("pt", "sim, pode mandar"),
+    ("pt", "ja paguei"), ("pt", "boa noite"), ("pt", "certidão de casamento"),
+    ("en", "how much?"), ("en", "thank you!!"), ("en", "not received yet"),
+    ("en", "can you help me"), ("en", "i'm waiting"), ("en", "ok, deal"),
+    ("en", "just sent it"), ("en", "where's my translation"), ("en", "what's the price?"),
+    ("en", "i need it urgently"), ("en", "i want to place an order"), ("en", "yes, send it"),
+    ("en", "already paid"), ("en", "good night"), ("en", "marriage certificate"),
+    ("es", "cuánto cuesta?"), ("es", "gracias!!"), ("es", "no lo recibí todavía"),
+    ("es", "me puedes ayudar"), ("es", "estoy esperando"), ("es", "vale, listo"),
+    ("es", "lo mandé ahora"), ("es", "dónde está mi traducción"), ("es", "cuál es el precio?"),
+    ("es", "lo necesito urgente"), ("es", "quiero hacer el pedido"), ("es", "sí, mándalo"),
+    ("es", "ya pagué"), ("es", "buenas noches"), ("es", "acta de matrimonio"),
+]
+
+# Contagem de palavras tipicas que detectar_idioma usava (para comparacao)
+_PALAVRAS_LEGADO = {
+    "pt": ["ola", "bom dia", "boa tarde", "boa noite", "obrigado", "obrigada",
+           "por favor", "quero", "preciso", "pode", "gostaria", "como", "quanto"],
+    "en": ["hello", "hi", "good morning", "good afternoon", "thank you", "thanks",
+           "please", "want", "need", "can", "would", "how", "much", "price"],
+    "es": ["hola", "buenos dias", "buenas tardes", "gracias", "por favor",
+           "quiero", "necesito", "puede", "cuanto", "precio", "traduccion"],
+}
+
+
+def _sem_acento(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto)
+    return unicodedata.normalize("NFC", "".join(c for c in texto if not unicodedata.combining(c)))
+
+
+def _legado(texto: str) -> str:
+    texto_lower = _sem_acento(texto.lower())
+    count = {idioma: sum(1 for p in palavras if p in texto_lower) for idioma, palavras in _PALAVRAS_LEGADO.items()}
+    if count["en"] > count["pt"] and count["en"] > count["es"]:
+        return "en"
+    elif count["es"] > count["pt"] and count["es"] > count["en"]:
+        return "es"
+    return "pt"
+
+
+def treinar(corpus: Dict[str, List[str]]) -> Dict:
+    """Log-probabilidades (suavizacao de Laplace) dos n-gramas mais frequentes de cada idioma"""
+    perfis, pisos = {}, {}
+    for idioma in IDIOMAS:
+        contagem: Counter = Counter()
+        for frase in corpus.get(idioma, []):
+            # Com e sem acento: clientes escrevem das duas formas
+            for variante in {frase, _sem_acento(frase)}:
+                contagem.update(ngramas(preparar(variante)))
+        total = sum(contagem.values())
+        vocabulario = len(contagem) + 1
+        perfis[idioma] = {
+            ngrama: round(math.log((n + 1) / (total + vocabulario)), 3)
+            for ngrama, n in contagem.most_common(MAX_NGRAMAS)
+        }
+        pisos[idioma] = round(math.log(1 / (total + vocabulario)), 3)
+        print(f"  {idioma}: {len(corpus.get(idioma, []))} frases, {len(contagem)} n-gramas distintos, {len(perfis[idioma])} mantidos")
+    return {"ordens": list(language_id.ORDENS), "piso": pisos, "perfis": perfis}
+
+
+def avaliar():
+    acertos_modelo = acertos_legado = confiaveis = confiaveis_certos = 0
+    for idioma, texto in TESTE:
+        deteccao = identificar_idioma(texto)
+        acertos_modelo += deteccao.idioma == idioma
+        acertos_legado += _legado(texto) == idioma
+        confiaveis += deteccao.confiavel
+        confiaveis_certos += deteccao.confiavel and deteccao.idioma == idioma
+        marca = "ok " if deteccao.idioma == idioma else "ERR"
+        print(f"  {marca} {idioma} -> {deteccao.idioma} ({deteccao.confianca:.3f}{', confiavel' if deteccao.confiavel else ''})  {texto!r}")
+
+    total = len(TESTE)
+    print(f"\nAcuracia n-gramas:          {acertos_modelo / total * 100:.1f}%")
+    print(f"Acuracia contagem antiga:   {acertos_legado / total * 100:.1f}%")
+    print(f"Confiaveis:                 {confiaveis}/{total} ({confiaveis_certos} corretas)")
+
+    textos = [t for _, t in TESTE]
+    repeticoes = 200
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        identificar_idioma.cache_clear()
+        for texto in textos:
+            identificar_idioma(texto)
+    us = (time.perf_counter() - inicio) / (repeticoes * len(textos)) * 1e6
+    print(f"Tempo (sem cache):          {us:.1f} us/mensagem")
+
+
+def main():
+    if "--avaliar" not in sys.argv:
+        corpus = {idioma: list(frases) for idioma, frases in CORPUS.items()}
+        if "--arquivo" in sys.argv:
+            caminho = sys.argv[sys.argv.index("--arquivo") + 1]
+            with open(caminho, encoding="utf-8") as arquivo:
+                for linha in arquivo:
+                    idioma, _, texto = linha.rstrip("\n").partition("\t")
+                    if idioma in IDIOMAS and texto.strip():
+                        corpus[idioma].append(texto)
+
+        print("Treinando perfis:")
+        perfil = treinar(corpus)
+        with open(ARQUIVO_PERFIL, "w", encoding="utf-8") as arquivo:
+            json.dump(perfil, arquivo, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        print(f"Perfil gravado em {ARQUIVO_PERFIL}\n")
+        language_id.carregar_perfil()
+
+    print("Avaliacao (mensagens curtas fora do treino):")
+    avaliar()
+
+
+if __name__ == "__main__":
+    main()
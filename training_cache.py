@@ -0,0 +1,217 @@
+"""
+============================================================
+CACHE DO TREINAMENTO - Prompt compilado por canal
+============================================================
+O documento do bot "Mia" (personalidade, base de conhecimento,
+FAQs) so muda quando alguem edita o treinamento no admin. Em vez
+de ler o Mongo e remontar o prompt a cada mensagem, cada canal
+(whatsapp, webchat) guarda o prompt ja compilado em memoria.
+O mesmo cache guarda outros artefatos derivados do treinamento
+(ex: indice de busca do kb_retrieval).
+
+- Versao do treinamento = hash do conteudo (estavel entre
+  processos e restarts)
+- Invalidado pelas rotas de treinamento (admin_training_routes)
+- Opcional: change stream do Mongo na colecao `bots` invalida o
+  cache de todas as instancias
+- TTL de seguranca caso nenhuma invalidacao chegue
+
+Configuracao:
+  - TRAINING_CACHE_TTL_SEGUNDOS: validade maxima do cache (padrao 600)
+  - TRAINING_CHANGE_STREAM: "true" para observar a colecao bots (padrao true)
+  - TRAINING_CHANGE_STREAM_BACKOFF_MAX: espera maxima entre reconexoes
+    do change stream, em segundos (padrao 60)
+============================================================
+"""
+
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from typing import Optional, Callable, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+TRAINING_CACHE_TTL_SEGUNDOS = float(os.getenv("TRAINING_CACHE_TTL_SEGUNDOS", "600"))
+TRAINING_CHANGE_STREAM = os.getenv("TRAINING_CHANGE_STREAM", "true").lower() == "true"
+TRAINING_CHANGE_STREAM_BACKOFF_MAX = float(os.getenv("TRAINING_CHANGE_STREAM_BACKOFF_MAX", "60"))
+
+# Erros do Mongo: servidor sem change streams (standalone) e resume token fora do oplog
+_CODIGOS_SEM_CHANGE_STREAM = {40573}
+_CODIGOS_HISTORICO_PERDIDO = {136, 280, 286}
+
+# {canal: {"artefato", "versao", "geracao", "compilado_em"}}
+_prompts: Dict[str, Dict[str, Any]] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+# Incrementada a cada invalidacao; entradas de geracoes antigas sao recompiladas
+_geracao: int = 0
+_versao_treinamento: str = ""
+
+_change_stream_task: Optional[asyncio.Task] = None
+
+
+def calcular_versao(bot: Optional[dict]) -> str:
+    """Hash curto do conteudo de treinamento do bot"""
+    if not bot:
+        return "default"
+    conteudo = {
+        "personality": bot.get("personality", {}),
+        "knowledge_base": bot.get("knowledge_base", []),
+        "faqs": bot.get("faqs", [])
+    }
+    bruto = json.dumps(conteudo, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(bruto.encode("utf-8")).hexdigest()[:12]
+
+
+async def _carregar_bot() -> Optional[dict]:
+    from admin_training_routes import db
+    return await db.bots.find_one({"name": "Mia"})
+
+
+async def obter_artefato(canal: str, compilador: Callable[[Optional[dict]], Any]) -> Any:
+    """
+    Retorna o artefato compilado do canal, usando o cache quando valido.
+    `compilador(bot)` monta o artefato a partir do documento do bot (ou None).
+    Erros de Mongo sao propagados para o chamador usar seu fallback.
+    """
+    global _versao_treinamento
+
+    entrada = _prompts.get(canal)
+    if _entrada_valida(entrada):
+        return entrada["artefato"]
+
+    lock = _locks.setdefault(canal, asyncio.Lock())
+    async with lock:
+        # Outra chamada pode ter recompilado enquanto esperavamos o lock
+        entrada = _prompts.get(canal)
+        if _entrada_valida(entrada):
+            return entrada["artefato"]
+
+        geracao = _geracao
+        bot = await _carregar_bot()
+        artefato = compilador(bot)
+        versao = calcular_versao(bot)
+
+        _prompts[canal] = {
+            "artefato": artefato,
+            "versao": versao,
+            "geracao": geracao,
+            "compilado_em": time.time()
+        }
+        if versao != _versao_treinamento:
+            logger.info(f"[TREINAMENTO] Versao do treinamento: {versao}")
+        _versao_treinamento = versao
+        logger.info(f"[TREINAMENTO] '{canal}' compilado (versao {versao}, tamanho {_tamanho(artefato)})")
+        return artefato
+
+
+async def obter_prompt(canal: str, compilador: Callable[[Optional[dict]], str]) -> str:
+    """Prompt compilado do canal (ver obter_artefato)"""
+    return await obter_artefato(canal, compilador)
+
+
+def _tamanho(artefato: Any) -> Optional[int]:
+    """Tamanho do artefato para logs/admin (None quando o bot nao existe)"""
+    return len(artefato) if hasattr(artefato, "__len__") else None
+
+
+def _entrada_valida(entrada: Optional[Dict[str, Any]]) -> bool:
+    if not entrada:
+        return False
+    if entrada["geracao"] != _geracao:
+        return False
+    return (time.time() - entrada["compilado_em"]) < TRAINING_CACHE_TTL_SEGUNDOS
+
+
+def invalidar_treinamento(motivo: str = ""):
+    """Descarta os prompts compilados (chamar apos qualquer alteracao no treinamento)"""
+    global _geracao
+    _geracao += 1
+    logger.info(f"[TREINAMENTO] Cache de prompts invalidado{f' ({motivo})' if motivo else ''}")
+
+
+def get_versao_treinamento() -> str:
+    """Versao (hash) do ultimo treinamento compilado"""
+    return _versao_treinamento
+
+
+def get_cache_info() -> Dict[str, Any]:
+    """Estado do cache (para endpoints de debug/admin)"""
+    return {
+        "versao": _versao_treinamento,
+        "geracao": _geracao,
+        "change_stream": _change_stream_task is not None and not _change_stream_task.done(),
+        "canais": {
+            canal: {
+                "versao": e["versao"],
+                "tamanho": _tamanho(e["artefato"]),
+                "valido": _entrada_valida(e),
+                "idade_segundos": int(time.time() - e["compilado_em"])
+            }
+            for canal, e in _prompts.items()
+        }
+    }
+
+
+async def _observar_bots():
+    """
+    Observa a colecao bots ate ser cancelado. Quedas (rede, eleicao do
+    replica set) reconectam com backoff e retomam do resume token; so
+    um servidor sem change streams encerra o observador.
+    """
+    from admin_training_routes import db
+    from pymongo.errors import OperationFailure
+
+    resume_token = None
+    conectado_antes = False
+    espera = 1.0
+    while True:
+        try:
+            if conectado_antes and resume_token is None:
+                # Sem token nao da para reproduzir o que mudou enquanto estavamos fora
+                invalidar_treinamento("change stream reconectado")
+            async with db.bots.watch(resume_after=resume_token) as stream:
+                if not conectado_antes:
+                    logger.info("[TREINAMENTO] Change stream da colecao bots ativo")
+                conectado_antes = True
+                espera = 1.0
+                async for _ in stream:
+                    resume_token = stream.resume_token
+                    invalidar_treinamento("change stream")
+            # Stream invalidado (colecao removida/renomeada): o token nao serve para retomar
+            resume_token = None
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code in _CODIGOS_SEM_CHANGE_STREAM:
+                # Change streams exigem replica set (Atlas ok); fora disso ficamos so com a invalidacao local + TTL
+                logger.warning(f"[TREINAMENTO] Change stream indisponivel, usando invalidacao local + TTL: {e}")
+                return
+            if e.code in _CODIGOS_HISTORICO_PERDIDO:
+                resume_token = None
+            logger.warning(f"[TREINAMENTO] Change stream caiu, reconectando em {espera:.0f}s: {e}")
+        except Exception as e:
+            logger.warning(f"[TREINAMENTO] Change stream caiu, reconectando em {espera:.0f}s: {e}")
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, TRAINING_CHANGE_STREAM_BACKOFF_MAX)
+
+
+def iniciar_change_stream():
+    """Inicia o observador da colecao bots (chamar no startup)"""
+    global _change_stream_task
+    if TRAINING_CHANGE_STREAM and _change_stream_task is None:
+        _change_stream_task = asyncio.create_task(_observar_bots())
+
+
+async def parar_change_stream():
+    global _change_stream_task
+    if _change_stream_task:
+        _change_stream_task.cancel()
+        try:
+            await _change_stream_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _change_stream_task = None
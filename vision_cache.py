@@ -0,0 +1,166 @@
+"""
+============================================================
+CACHE DE VISION - Resultados de GPT-4o por hash do documento
+============================================================
+A mesma imagem passava de novo pelo GPT-4o em retentativas da
+fila, reenvios do cliente e reprocessamentos do operador -
+cada vez pagando a chamada de Vision inteira.
+
+Agora o resultado fica gravado na colecao `visao_cache` com a
+chave (hash do conteudo, tarefa, versao do prompt):
+
+- hash:   SHA-256 dos bytes (midia_id do media_store)
+- tarefa: analise_documento, imagem_vision, comprovante_pagamento...
+- versao: hash curto do prompt + modelo (versao_prompt). Mudar o
+  prompt ou o treinamento embutido nele invalida sozinho as
+  entradas antigas
+
+Na frente do Mongo ha um LRU em memoria. As entradas expiram
+pelo campo `expira_em` (indice TTL em db_indexes) e o LRU
+respeita a mesma validade. Resultados None (falha) nao sao
+gravados.
+
+Configuracao:
+  - VISAO_CACHE_TTL_HORAS: validade de um resultado (padrao 720 = 30 dias)
+  - VISAO_CACHE_MAX: entradas no LRU em memoria (padrao 500)
+============================================================
+"""
+
+import os
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Any, Callable, Awaitable, Dict, Optional
+
+from admin_training_routes import db
+
+logger = logging.getLogger(__name__)
+
+VISAO_CACHE_TTL_HORAS = float(os.getenv("VISAO_CACHE_TTL_HORAS", "720"))
+VISAO_CACHE_MAX = int(os.getenv("VISAO_CACHE_MAX", "500"))
+
+# {chave: {"resultado", "expira_em": epoch}} em ordem LRU
+_lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+# Metricas por tarefa: {tarefa: {"hits_memoria", "hits_mongo", "misses", "gravacoes", "erros"}}
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _stats_for(tarefa: str) -> Dict[str, int]:
+    if tarefa not in _stats:
+        _stats[tarefa] = {"hits_memoria": 0, "hits_mongo": 0, "misses": 0, "gravacoes": 0, "erros": 0}
+    return _stats[tarefa]
+
+
+def versao_prompt(*partes: Any) -> str:
+    """Versao curta (12 hex) do prompt/modelo usados numa tarefa"""
+    return hashlib.sha1("\n".join(str(p) for p in partes).encode("utf-8")).hexdigest()[:12]
+
+
+def _guardar_lru(chave: str, resultado: Any, expira_em: float):
+    _lru[chave] = {"resultado": resultado, "expira_em": expira_em}
+    _lru.move_to_end(chave)
+    while len(_lru) > VISAO_CACHE_MAX:
+        _lru.popitem(last=False)
+
+
+async def obter_ou_calcular(
+    hash_conteudo: str,
+    tarefa: str,
+    versao: str,
+    calcular: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Resultado de Vision para (hash, tarefa, versao): LRU -> Mongo -> calcular().
+    Erros do cache nunca impedem a chamada; erros de calcular() sobem normalmente.
+    """
+    stats = _stats_for(tarefa)
+    chave = f"{hash_conteudo}:{tarefa}:{versao}"
+    agora = time.time()
+
+    entrada = _lru.get(chave)
+    if entrada is not None:
+        if entrada["expira_em"] > agora:
+            _lru.move_to_end(chave)
+            stats["hits_memoria"] += 1
+            return entrada["resultado"]
+        del _lru[chave]
+
+    try:
+        doc = await db.visao_cache.find_one({"_id": chave, "expira_em": {"$gt": datetime.now()}})
+        if doc is not None:
+            stats["hits_mongo"] += 1
+            _guardar_lru(chave, doc["resultado"], doc["expira_em"].timestamp())
+            await db.visao_cache.update_one({"_id": chave}, {"$inc": {"hits": 1}, "$set": {"ultimo_uso": datetime.now()}})
+            return doc["resultado"]
+    except Exception as e:
+        stats["erros"] += 1
+        logger.error(f"[VISAO-CACHE] Erro ao ler cache ({tarefa}): {e}")
+
+    stats["misses"] += 1
+    resultado = await calcular()
+    if resultado is None:
+        return None
+
+    expira_em = datetime.now() + timedelta(hours=VISAO_CACHE_TTL_HORAS)
+    _guardar_lru(chave, resultado, expira_em.timestamp())
+    try:
+        await db.visao_cache.update_one(
+            {"_id": chave},
+            {"$set": {
+                "hash": hash_conteudo,
+                "tarefa": tarefa,
+                "versao": versao,
+                "resultado": resultado,
+                "criado_em": datetime.now(),
+                "expira_em": expira_em,
+                "hits": 0
+            }},
+            upsert=True
+        )
+        stats["gravacoes"] += 1
+    except Exception as e:
+        stats["erros"] += 1
+        logger.error(f"[VISAO-CACHE] Erro ao gravar cache ({tarefa}): {e}")
+    return resultado
+
+
+async def limpar_cache_visao(tarefa: Optional[str] = None) -> int:
+    """Remove as entradas (de uma tarefa ou todas) do LRU e do Mongo"""
+    filtro = {"tarefa": tarefa} if tarefa else {}
+    for chave in [c for c in _lru if not tarefa or c.split(":")[1] == tarefa]:
+        del _lru[chave]
+    resultado = await db.visao_cache.delete_many(filtro)
+    return resultado.deleted_count
+
+
+async def get_visao_cache_stats() -> Dict[str, Any]:
+    """Hit rate por tarefa e tamanho do cache (para o painel admin)"""
+    por_tarefa = {}
+    for tarefa, s in _stats.items():
+        consultas = s["hits_memoria"] + s["hits_mongo"] + s["misses"]
+        por_tarefa[tarefa] = {
+            **s,
+            "consultas": consultas,
+            "hit_rate": round((s["hits_memoria"] + s["hits_mongo"]) / consultas * 100, 1) if consultas else 0
+        }
+
+    total_hits = sum(s["hits_memoria"] + s["hits_mongo"] for s in _stats.values())
+    total_consultas = sum(p["consultas"] for p in por_tarefa.values())
+    try:
+        entradas_mongo = await db.visao_cache.estimated_document_count()
+    except Exception as e:
+        logger.error(f"[VISAO-CACHE] Erro ao contar entradas: {e}")
+        entradas_mongo = None
+
+    return {
+        "ttl_horas": VISAO_CACHE_TTL_HORAS,
+        "max_memoria": VISAO_CACHE_MAX,
+        "entradas_memoria": len(_lru),
+        "entradas_mongo": entradas_mongo,
+        "hit_rate": round(total_hits / total_consultas * 100, 1) if total_consultas else 0,
+        "consultas": total_consultas,
+        "por_tarefa": por_tarefa
+    }
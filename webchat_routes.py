@@ -13,12 +13,17 @@ from datetime import datetime
 from typing import Optional, Dict, List
 from pydantic import BaseModel
 import os
+import time
 import logging
 import traceback
 import uuid
 
-from openai import OpenAI
 from admin_training_routes import get_database
+from llm_gateway import chat_completion
+from training_cache import obter_prompt, obter_artefato
+from kb_retrieval import IndiceConhecimento, montar_prompt_relevante, KB_RETRIEVAL_ENABLED
+from language_id import identificar_idioma
+from response_router import rotear_mensagem, registrar_chamada_llm, guardar_resposta_gerada
 
 # ============================================================
 # CONFIGURACAO
@@ -26,9 +31,6 @@ from admin_training_routes import get_database
 router = APIRouter(prefix="/webchat", tags=["webchat"])
 logger = logging.getLogger(__name__)
 
-# Cliente OpenAI
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Database
 db = get_database()
 
@@ -61,13 +63,13 @@ class WebChatResponse(BaseModel):
 # ============================================================
 # FUNCOES AUXILIARES
 # ============================================================
-async def get_webchat_training() -> str:
-    """Busca treinamento dinamico do bot para WebChat"""
-    try:
-        bot = await db.bots.find_one({"name": "Mia"})
-
-        if not bot:
-            return """Voce e a Mia, assistente virtual da Legacy Translations.
+def _compilar_treinamento_webchat(bot: Optional[dict], incluir_conhecimento: bool = True) -> str:
+    """
+    Monta o prompt do WebChat a partir do documento do bot Mia.
+    Com incluir_conhecimento=False monta apenas contexto e personalidade.
+    """
+    if not bot:
+        return """Voce e a Mia, assistente virtual da Legacy Translations.
 
 Especialidades:
 - Traducoes certificadas
@@ -77,56 +79,87 @@ Especialidades:
 
 Responda de forma profissional, educada e objetiva."""
 
-        # Extrair dados do bot
-        personality = bot.get("personality", {})
-        knowledge_base = bot.get("knowledge_base", [])
-        faqs = bot.get("faqs", [])
+    # Extrair dados do bot
+    personality = bot.get("personality", {})
+    knowledge_base = bot.get("knowledge_base", [])
+    faqs = bot.get("faqs", [])
 
-        # Montar prompt dinamico
-        prompt_parts = []
+    # Montar prompt dinamico
+    prompt_parts = []
 
-        # Contexto especifico para WebChat
-        prompt_parts.append("""CONTEXTO: Voce esta atendendo pelo chat do portal web.
+    # Contexto especifico para WebChat
+    prompt_parts.append("""CONTEXTO: Voce esta atendendo pelo chat do portal web.
 O visitante pode estar em qualquer pagina do site.
 Seja proativo em oferecer ajuda e coletar informacoes de contato.""")
 
-        # Objetivos
-        if personality.get("goals"):
-            goals_text = "\n".join(personality["goals"]) if isinstance(personality["goals"], list) else personality["goals"]
-            prompt_parts.append(f"**OBJETIVOS:**\n{goals_text}")
-
-        # Tom de voz
-        if personality.get("tone"):
-            prompt_parts.append(f"**TOM DE VOZ:**\n{personality['tone']}")
-
-        # Restricoes
-        if personality.get("restrictions"):
-            restrictions_text = "\n".join(personality["restrictions"]) if isinstance(personality["restrictions"], list) else personality["restrictions"]
-            prompt_parts.append(f"**RESTRICOES:**\n{restrictions_text}")
-
-        # Base de conhecimento
-        if knowledge_base:
-            kb_text = "\n\n".join([
-                f"**{item.get('title', 'Info')}:**\n{item.get('content', '')}"
-                for item in knowledge_base
-            ])
-            prompt_parts.append(f"**BASE DE CONHECIMENTO:**\n{kb_text}")
-
-        # FAQs
-        if faqs:
-            faq_text = "\n\n".join([
-                f"P: {item.get('question', '')}\nR: {item.get('answer', '')}"
-                for item in faqs
-            ])
-            prompt_parts.append(f"**PERGUNTAS FREQUENTES:**\n{faq_text}")
+    # Objetivos
+    if personality.get("goals"):
+        goals_text = "\n".join(personality["goals"]) if isinstance(personality["goals"], list) else personality["goals"]
+        prompt_parts.append(f"**OBJETIVOS:**\n{goals_text}")
 
+    # Tom de voz
+    if personality.get("tone"):
+        prompt_parts.append(f"**TOM DE VOZ:**\n{personality['tone']}")
+
+    # Restricoes
+    if personality.get("restrictions"):
+        restrictions_text = "\n".join(personality["restrictions"]) if isinstance(personality["restrictions"], list) else personality["restrictions"]
+        prompt_parts.append(f"**RESTRICOES:**\n{restrictions_text}")
+
+    if not incluir_conhecimento:
         return "\n\n".join(prompt_parts)
 
+    # Base de conhecimento
+    if knowledge_base:
+        kb_text = "\n\n".join([
+            f"**{item.get('title', 'Info')}:**\n{item.get('content', '')}"
+            for item in knowledge_base
+        ])
+        prompt_parts.append(f"**BASE DE CONHECIMENTO:**\n{kb_text}")
+
+    # FAQs
+    if faqs:
+        faq_text = "\n\n".join([
+            f"P: {item.get('question', '')}\nR: {item.get('answer', '')}"
+            for item in faqs
+        ])
+        prompt_parts.append(f"**PERGUNTAS FREQUENTES:**\n{faq_text}")
+
+    return "\n\n".join(prompt_parts)
+
+
+def _compilar_indice_webchat(bot: Optional[dict]) -> Optional[IndiceConhecimento]:
+    """Indice de busca sobre a base de conhecimento/FAQs (WebChat)"""
+    if not bot:
+        return None
+    return IndiceConhecimento(bot.get("knowledge_base", []), bot.get("faqs", []))
+
+
+async def get_webchat_training() -> str:
+    """Retorna o treinamento do bot para WebChat (prompt compilado em cache, ver training_cache)"""
+    try:
+        return await obter_prompt("webchat", _compilar_treinamento_webchat)
     except Exception as e:
         logger.error(f"Erro ao buscar treinamento webchat: {e}")
         return "Voce e a Mia, assistente da Legacy Translations. Responda de forma profissional."
 
 
+async def get_webchat_training_relevante(consulta: str) -> str:
+    """Treinamento do WebChat com apenas os conhecimentos/FAQs relevantes (ver kb_retrieval)"""
+    if not KB_RETRIEVAL_ENABLED:
+        return await get_webchat_training()
+    try:
+        prompt_base = await obter_prompt(
+            "webchat_base",
+            lambda bot: _compilar_treinamento_webchat(bot, incluir_conhecimento=False)
+        )
+        indice = await obter_artefato("webchat_indice", _compilar_indice_webchat)
+        return montar_prompt_relevante("webchat", prompt_base, indice, consulta)
+    except Exception as e:
+        logger.error(f"Erro na busca da base de conhecimento (webchat): {e}")
+        return await get_webchat_training()
+
+
 async def get_webchat_context(session_id: str, limit: int = 10) -> List[Dict]:
     """Busca ultimas mensagens da sessao de webchat"""
     try:
@@ -145,36 +178,72 @@ async def get_webchat_context(session_id: str, limit: int = 10) -> List[Dict]:
         return []
 
 
+async def get_idioma_sessao(session_id: str) -> Optional[str]:
+    """Ultimo idioma detectado com confianca nas mensagens do visitante (None se nenhum)"""
+    try:
+        doc = await db.webchat_conversas.find_one(
+            {"session_id": session_id, "role": "user", "idioma": {"$ne": None}},
+            {"idioma": 1},
+            sort=[("timestamp", -1)]
+        )
+        return doc.get("idioma") if doc else None
+    except Exception as e:
+        logger.error(f"Erro ao buscar idioma da sessao webchat: {e}")
+        return None
+
+
 async def process_webchat_message(session_id: str, message: str, visitor_info: Dict = None) -> str:
     """Processa mensagem do webchat com GPT-4"""
     try:
-        # Buscar treinamento
-        system_prompt = await get_webchat_training()
+        # Buscar treinamento (apenas conhecimentos relevantes para a mensagem)
+        system_prompt = await get_webchat_training_relevante(message)
 
         # Adicionar info do visitante se disponivel
         if visitor_info:
             visitor_context = f"\nINFO DO VISITANTE: Nome: {visitor_info.get('name', 'Desconhecido')}, Email: {visitor_info.get('email', 'Nao informado')}"
             system_prompt += visitor_context
 
+        # Responder no idioma do visitante (so com deteccao confiavel;
+        # mensagens curtas ficam no idioma que a IA ja vinha usando)
+        deteccao = identificar_idioma(message)
+        if deteccao.confiavel:
+            idioma_nome = {"en": "English", "es": "Spanish", "pt": "Portuguese"}[deteccao.idioma]
+            system_prompt += f"\n\n**IDIOMA OBRIGATÓRIO:** O visitante está se comunicando em {idioma_nome}. Você DEVE responder EXCLUSIVAMENTE em {idioma_nome}."
+
         # Buscar contexto
         context = await get_webchat_context(session_id)
 
-        # Montar mensagens
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ] + context + [
-            {"role": "user", "content": message}
-        ]
+        # Camadas baratas (resposta pronta, FAQ, modelo pequeno) antes do GPT-4o.
+        # "ok"/"hola" nao tem deteccao confiavel: vale o idioma da sessao
+        idioma_roteamento = deteccao.idioma if deteccao.confiavel else await get_idioma_sessao(session_id)
+        roteado = await rotear_mensagem("webchat", message, idioma_roteamento, context, system_prompt)
+        if roteado:
+            reply = roteado.resposta
+        else:
+            # Montar mensagens
+            messages = [
+                {"role": "system", "content": system_prompt}
+            ] + context + [
+                {"role": "user", "content": message}
+            ]
+
+            # Chamar GPT-4
+            inicio_llm = time.monotonic()
+            response = await chat_completion(
+                task="chat_webchat",
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            )
+            registrar_chamada_llm("gpt-4o", (time.monotonic() - inicio_llm) * 1000, getattr(response, "usage", None))
 
-        # Chamar GPT-4
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
+            reply = response.choices[0].message.content
 
-        reply = response.choices[0].message.content
+            if reply and deteccao.confiavel:
+                await guardar_resposta_gerada(
+                    "webchat", message, deteccao.idioma, reply, context, (visitor_info or {}).get("name")
+                )
 
         # Salvar conversa
         await db.webchat_conversas.insert_one({
@@ -183,6 +252,7 @@ async def process_webchat_message(session_id: str, message: str, visitor_info: D
             "role": "user",
             "timestamp": datetime.now(),
             "visitor_info": visitor_info,
+            "idioma": deteccao.idioma if deteccao.confiavel else None,
             "canal": "WebChat"
         })
 
@@ -226,7 +296,8 @@ Gere:
 TITULO: [titulo curto]
 CONTEUDO: [explicacao completa]"""
 
-            suggestion_response = openai_client.chat.completions.create(
+            suggestion_response = await chat_completion(
+                task="sugestao_conhecimento_webchat",
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "Voce ajuda a criar base de conhecimento."},
@@ -0,0 +1,508 @@
+"""
+============================================================
+FILA DE WEBHOOKS - Responde rapido ao Z-API, processa depois
+============================================================
+O webhook apenas valida, deduplica e grava o evento bruto na
+colecao `webhook_jobs`. Os eventos sao processados em segundo
+plano por "atores" por telefone:
+
+- Cada conversa ativa tem sua propria caixa de entrada (mailbox)
+  e uma task asyncio que processa os eventos estritamente em ordem
+- Telefones diferentes rodam em paralelo, sem lock global
+- Atores ociosos sao encerrados automaticamente
+- Retentativas com backoff exponencial
+- Apos esgotar as tentativas o job vai para "dead" (dead-letter),
+  visivel em /admin/fila
+- Jobs pendentes sao recuperados no startup (fila duravel)
+- Job em processamento tem dono (INSTANCIA_ID) e prazo
+  (`processando_ate`), renovado enquanto o handler roda. So e
+  retomado por outra instancia quando o prazo vence: num deploy
+  com instancias sobrepostas, o job que ainda roda na antiga nao
+  roda de novo na nova. Uma varredura periodica retoma jobs de
+  instancias que morreram (em processamento com prazo vencido, ou
+  pendentes parados ha mais de WEBHOOK_PENDENTE_ORFAO_SEGUNDOS)
+- Retentativa nao repete respostas: cada envio feito por um job
+  (enviar_uma_vez) fica registrado no job (`envios`) e, numa nova
+  tentativa, o mesmo envio (mesma posicao, destino e texto) e pulado
+- Tarefas internas (ex: fechamento do lote de imagens) podem ser
+  colocadas na mailbox do telefone e rodam na mesma ordem
+- O handler pode adiar a conclusao do proprio job
+  (adiar_conclusao): o job fica em processamento, com prazo, ate
+  concluir_jobs(), com o prazo renovado pela varredura. Se a
+  instancia cair antes, o prazo vence e o job roda de novo (ex:
+  imagem num lote ainda aberto)
+
+Configuracao:
+  - WEBHOOK_ATOR_OCIOSO_SEGUNDOS: tempo sem eventos ate encerrar o ator (padrao 120)
+  - WEBHOOK_MAX_TENTATIVAS: tentativas antes do dead-letter (padrao 3)
+  - WEBHOOK_BACKOFF_SEGUNDOS: espera base entre tentativas (padrao 2)
+  - WEBHOOK_LEASE_SEGUNDOS: prazo de um job em processamento sem renovacao (padrao 120)
+  - WEBHOOK_PENDENTE_ORFAO_SEGUNDOS: job pendente parado ha mais que isso e retomado (padrao 600)
+============================================================
+"""
+
+import os
+import uuid
+import socket
+import hashlib
+import asyncio
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional, Callable, Awaitable, List, Dict, Any, Set
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from admin_training_routes import db
+from phone_keys import telefone_do_evento
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_ATOR_OCIOSO_SEGUNDOS = float(os.getenv("WEBHOOK_ATOR_OCIOSO_SEGUNDOS", "120"))
+WEBHOOK_MAX_TENTATIVAS = int(os.getenv("WEBHOOK_MAX_TENTATIVAS", "3"))
+WEBHOOK_BACKOFF_SEGUNDOS = float(os.getenv("WEBHOOK_BACKOFF_SEGUNDOS", "2"))
+WEBHOOK_LEASE_SEGUNDOS = float(os.getenv("WEBHOOK_LEASE_SEGUNDOS", "120"))
+WEBHOOK_PENDENTE_ORFAO_SEGUNDOS = float(os.getenv("WEBHOOK_PENDENTE_ORFAO_SEGUNDOS", "600"))
+
+# Dono dos jobs que esta instancia processa
+INSTANCIA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# Status possiveis de um job
+STATUS_PENDENTE = "pending"
+STATUS_PROCESSANDO = "processing"
+STATUS_CONCLUIDO = "done"
+STATUS_DEAD = "dead"
+
+# Funcao que processa o payload do webhook (registrada pelo main.py)
+_handler: Optional[Callable[[dict], Awaitable[Any]]] = None
+
+# Atores por telefone: {chave: mailbox} e {chave: task}
+# A mailbox recebe IDs de job (ObjectId) ou tarefas internas (funcao que retorna coroutine)
+_mailboxes: Dict[str, asyncio.Queue] = {}
+_atores: Dict[str, asyncio.Task] = {}
+_fila_ativa: bool = False
+_varredura: Optional[asyncio.Task] = None
+
+# Job em execucao no contexto atual e jobs com conclusao adiada ainda abertos
+_job_atual: ContextVar[Optional[ObjectId]] = ContextVar("job_atual", default=None)
+_adiados: Set[ObjectId] = set()
+
+# Envios da tentativa atual: {"job": id, "n": envios feitos, "feitos": assinaturas ja enviadas pelo job}
+_envios: ContextVar[Optional[Dict[str, Any]]] = ContextVar("envios", default=None)
+
+
+def chave_ordem(data: dict) -> str:
+    """Chave de ordenacao do evento: o mesmo telefone que o webhook usa (LID resolvido)"""
+    return telefone_do_evento(data)
+
+
+def _entregar(chave: str, item):
+    """Coloca o job na mailbox do telefone, criando o ator se ele nao estiver ativo"""
+    mailbox = _mailboxes.get(chave)
+    if mailbox is None:
+        mailbox = asyncio.Queue()
+        _mailboxes[chave] = mailbox
+        _atores[chave] = asyncio.create_task(_ator(chave, mailbox))
+    mailbox.put_nowait(item)
+
+
+def executar_no_ator(chave: str, tarefa: Callable[[], Awaitable[Any]]):
+    """
+    Executa `tarefa()` na vez do telefone, serializada com os eventos do
+    webhook (nao roda no meio do processamento de outra mensagem).
+    Sem fila ativa, roda numa task avulsa. Nao e persistida.
+    """
+    if _fila_ativa:
+        _entregar(chave, tarefa)
+    else:
+        asyncio.create_task(tarefa())
+
+
+def eventos_pendentes(chave: str) -> int:
+    """Quantos eventos do telefone ainda aguardam na mailbox (0 se nao ha ator ativo)"""
+    mailbox = _mailboxes.get(chave)
+    return mailbox.qsize() if mailbox else 0
+
+
+async def enfileirar_evento(data: dict) -> Optional[str]:
+    """
+    Persiste o evento bruto e entrega na mailbox do ator do telefone.
+    Retorna o ID do job, ou None se o messageId ja estava na fila (duplicado).
+    """
+    agora = datetime.now()
+    chave = chave_ordem(data)
+    job = {
+        "message_id": data.get("messageId", "") or "",
+        "phone": chave,
+        "payload": data,
+        "status": STATUS_PENDENTE,
+        "attempts": 0,
+        "created_at": agora,
+        "updated_at": agora
+    }
+
+    try:
+        result = await db.webhook_jobs.insert_one(job)
+    except DuplicateKeyError:
+        logger.warning(f"[FILA] Evento duplicado ignorado: {job['message_id']}")
+        return None
+
+    job_id = result.inserted_id
+    if _fila_ativa:
+        _entregar(chave, job_id)
+    else:
+        logger.warning(f"[FILA] Fila nao iniciada - job {job_id} fica pendente ate o proximo startup")
+    return str(job_id)
+
+
+def _filtro_disponivel(agora: datetime) -> dict:
+    """Jobs que podem ser assumidos: pendentes ou em processamento com prazo vencido"""
+    return {"$or": [
+        {"status": STATUS_PENDENTE},
+        {"status": STATUS_PROCESSANDO, "processando_ate": {"$lt": agora}},
+        # Jobs gravados antes do prazo existir
+        {"status": STATUS_PROCESSANDO, "processando_ate": None},
+    ]}
+
+
+async def _renovar_lease(job_id: ObjectId):
+    """Estende o prazo do job enquanto o handler roda"""
+    while True:
+        await asyncio.sleep(WEBHOOK_LEASE_SEGUNDOS / 3)
+        try:
+            await db.webhook_jobs.update_one(
+                {"_id": job_id, "dono": INSTANCIA_ID, "status": STATUS_PROCESSANDO},
+                {"$set": {"processando_ate": datetime.now() + timedelta(seconds=WEBHOOK_LEASE_SEGUNDOS)}}
+            )
+        except Exception as e:
+            logger.error(f"[FILA] Erro ao renovar prazo do job {job_id}: {e}")
+
+
+async def _executar_job(job_id: ObjectId):
+    """Processa um job com retentativas; em caso de falha final move para dead-letter"""
+    while True:
+        agora = datetime.now()
+        job = await db.webhook_jobs.find_one_and_update(
+            {"_id": job_id, **_filtro_disponivel(agora)},
+            {
+                "$set": {
+                    "status": STATUS_PROCESSANDO,
+                    "dono": INSTANCIA_ID,
+                    "processando_ate": agora + timedelta(seconds=WEBHOOK_LEASE_SEGUNDOS),
+                    "updated_at": agora
+                },
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return  # Ja concluido, descartado, em dead-letter ou rodando em outra instancia
+
+        inicio = datetime.now()
+        renovacao = asyncio.create_task(_renovar_lease(job_id))
+        token = _job_atual.set(job_id)
+        token_envios = _envios.set({"job": job_id, "n": 0, "feitos": set(job.get("envios") or [])})
+        try:
+            await _handler(job["payload"])
+            renovacao.cancel()
+            if job_id in _adiados:
+                # Conclusao adiada: segue em processamento ate concluir_jobs()
+                await db.webhook_jobs.update_one(
+                    {"_id": job_id, "dono": INSTANCIA_ID},
+                    {"$set": {
+                        "processando_ate": datetime.now() + timedelta(seconds=WEBHOOK_LEASE_SEGUNDOS),
+                        "updated_at": datetime.now()
+                    }}
+                )
+                return
+            fim = datetime.now()
+            await db.webhook_jobs.update_one(
+                {"_id": job_id, "dono": INSTANCIA_ID},
+                {"$set": {
+                    "status": STATUS_CONCLUIDO,
+                    "finished_at": fim,
+                    "updated_at": fim,
+                    "duration_ms": int((fim - inicio).total_seconds() * 1000)
+                }}
+            )
+            return
+
+        except asyncio.CancelledError:
+            renovacao.cancel()
+            # Shutdown: vence o prazo na hora para outra instancia retomar o job
+            try:
+                await db.webhook_jobs.update_one(
+                    {"_id": job_id, "dono": INSTANCIA_ID, "status": STATUS_PROCESSANDO},
+                    {"$set": {"processando_ate": datetime.now()}}
+                )
+            except Exception:
+                pass
+            raise
+        except Exception as e:
+            renovacao.cancel()
+            tentativas = job.get("attempts", 1)
+            erro = str(e)[:500]
+
+            if tentativas >= WEBHOOK_MAX_TENTATIVAS:
+                await db.webhook_jobs.update_one(
+                    {"_id": job_id, "dono": INSTANCIA_ID},
+                    {"$set": {"status": STATUS_DEAD, "last_error": erro, "updated_at": datetime.now()}}
+                )
+                logger.error(f"[FILA] Job {job_id} ({job.get('phone')}) movido para DEAD-LETTER apos {tentativas} tentativas: {erro}")
+                return
+
+            espera = WEBHOOK_BACKOFF_SEGUNDOS * (2 ** (tentativas - 1))
+            await db.webhook_jobs.update_one(
+                {"_id": job_id, "dono": INSTANCIA_ID},
+                {"$set": {"status": STATUS_PENDENTE, "last_error": erro, "updated_at": datetime.now()}}
+            )
+            logger.warning(f"[FILA] Job {job_id} falhou (tentativa {tentativas}/{WEBHOOK_MAX_TENTATIVAS}), nova tentativa em {espera:.0f}s: {erro}")
+            # Retentativa no proprio ator para manter a ordem do telefone
+            await asyncio.sleep(espera)
+        finally:
+            _job_atual.reset(token)
+            _envios.reset(token_envios)
+
+
+async def enviar_uma_vez(destino: str, texto: str, enviar: Callable[[], Awaitable[bool]]) -> bool:
+    """
+    Executa `enviar()` a menos que uma tentativa anterior do job atual ja
+    tenha feito o mesmo envio (mesma posicao no job, destino e texto).
+    Fora de um job (tarefas internas, scripts) sempre envia.
+    """
+    estado = _envios.get()
+    if estado is None:
+        return await enviar()
+    estado["n"] += 1
+    assinatura = f"{estado['n']}:{hashlib.sha1(f'{destino}|{texto}'.encode('utf-8')).hexdigest()[:16]}"
+    if assinatura in estado["feitos"]:
+        logger.info(f"[FILA] Job {estado['job']}: envio {estado['n']} para {destino} ja feito numa tentativa anterior, pulando")
+        return True
+
+    ok = await enviar()
+    if ok:
+        estado["feitos"].add(assinatura)
+        try:
+            await db.webhook_jobs.update_one({"_id": estado["job"]}, {"$addToSet": {"envios": assinatura}})
+        except Exception as e:
+            logger.error(f"[FILA] Erro ao registrar envio do job {estado['job']}: {e}")
+    return ok
+
+
+def job_atual() -> Optional[ObjectId]:
+    """ID do job da fila em execucao no contexto atual (None fora da fila)"""
+    return _job_atual.get()
+
+
+def adiar_conclusao() -> Optional[ObjectId]:
+    """
+    Chamado pelo handler: o job atual nao e concluido quando o handler
+    retorna, so em concluir_jobs(). Retorna o ID do job (None fora da fila).
+    """
+    job_id = _job_atual.get()
+    if job_id is not None:
+        _adiados.add(job_id)
+    return job_id
+
+
+async def concluir_jobs(job_ids: List[ObjectId], erro: Optional[str] = None):
+    """Conclui jobs adiados (ou move para dead-letter, com o erro, para reprocessar pelo admin)"""
+    job_ids = [j for j in job_ids if j is not None]
+    if not job_ids:
+        return
+    _adiados.difference_update(job_ids)
+    agora = datetime.now()
+    campos = {"status": STATUS_DEAD, "last_error": erro[:500]} if erro else {"status": STATUS_CONCLUIDO, "finished_at": agora}
+    try:
+        await db.webhook_jobs.update_many(
+            {"_id": {"$in": job_ids}, "status": STATUS_PROCESSANDO},
+            {"$set": {**campos, "updated_at": agora}}
+        )
+    except Exception as e:
+        logger.error(f"[FILA] Erro ao concluir {len(job_ids)} jobs adiados: {e}")
+
+
+async def _ator(chave: str, mailbox: asyncio.Queue):
+    """
+    Processa os eventos de um telefone, um por vez, na ordem de chegada.
+    Encerra sozinho depois de WEBHOOK_ATOR_OCIOSO_SEGUNDOS sem eventos.
+    """
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(mailbox.get(), timeout=WEBHOOK_ATOR_OCIOSO_SEGUNDOS)
+            except asyncio.TimeoutError:
+                # Sem await entre a checagem e a remocao: nenhum evento pode se perder
+                if mailbox.empty():
+                    return
+                continue
+
+            try:
+                if callable(item):
+                    await item()
+                else:
+                    await _executar_job(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[FILA] Erro inesperado no ator {chave} ({item}): {e}")
+            finally:
+                mailbox.task_done()
+    finally:
+        if _mailboxes.get(chave) is mailbox:
+            del _mailboxes[chave]
+            _atores.pop(chave, None)
+
+
+async def _recuperar_jobs(filtro: dict) -> int:
+    """Entrega nas mailboxes os jobs do filtro, na ordem de criacao"""
+    jobs = await db.webhook_jobs.find(filtro, {"_id": 1, "phone": 1}).sort("created_at", 1).to_list(length=5000)
+    for job in jobs:
+        _entregar(job.get("phone", ""), job["_id"])
+    return len(jobs)
+
+
+async def _varrer_jobs_abandonados():
+    """
+    Renova o prazo dos jobs adiados desta instancia e retoma jobs de
+    instancias que morreram: em processamento com prazo vencido ou
+    pendentes parados (nunca entregues a um ator vivo).
+    """
+    while True:
+        await asyncio.sleep(WEBHOOK_LEASE_SEGUNDOS / 3)
+        agora = datetime.now()
+        try:
+            if _adiados:
+                await db.webhook_jobs.update_many(
+                    {"_id": {"$in": list(_adiados)}, "dono": INSTANCIA_ID, "status": STATUS_PROCESSANDO},
+                    {"$set": {"processando_ate": agora + timedelta(seconds=WEBHOOK_LEASE_SEGUNDOS)}}
+                )
+        except Exception as e:
+            logger.error(f"[FILA] Erro ao renovar prazo dos jobs adiados: {e}")
+        try:
+            retomados = await _recuperar_jobs({"$or": [
+                {"status": STATUS_PROCESSANDO, "processando_ate": {"$lt": agora}},
+                {"status": STATUS_PROCESSANDO, "processando_ate": None},
+                {"status": STATUS_PENDENTE,
+                 "updated_at": {"$lt": agora - timedelta(seconds=WEBHOOK_PENDENTE_ORFAO_SEGUNDOS)}},
+            ]})
+            if retomados:
+                logger.warning(f"[FILA] {retomados} jobs abandonados retomados")
+        except Exception as e:
+            logger.error(f"[FILA] Erro na varredura de jobs abandonados: {e}")
+
+
+async def iniciar_workers(handler: Callable[[dict], Awaitable[Any]]):
+    """Registra o handler, ativa a fila e recupera jobs pendentes (chamar no startup)"""
+    global _handler, _fila_ativa, _varredura
+    _handler = handler
+
+    if _fila_ativa:
+        return
+
+    _fila_ativa = True
+
+    # Recuperar jobs pendentes e os de instancias que pararam (prazo vencido).
+    # Jobs ainda no prazo rodam em outra instancia (deploy sobreposto): a
+    # varredura os retoma se o prazo vencer
+    try:
+        recuperados = await _recuperar_jobs(_filtro_disponivel(datetime.now()))
+        if recuperados:
+            logger.info(f"[FILA] {recuperados} jobs pendentes recolocados na fila")
+    except Exception as e:
+        logger.error(f"[FILA] Erro ao recuperar jobs pendentes: {e}")
+
+    _varredura = asyncio.create_task(_varrer_jobs_abandonados())
+    logger.info(f"[FILA] Fila de webhooks ativa (um ator por telefone, instancia {INSTANCIA_ID})")
+
+
+async def parar_workers():
+    """Cancela os atores (jobs em andamento sao retomados quando o prazo vencer)"""
+    global _fila_ativa, _varredura
+    _fila_ativa = False
+    tasks = list(_atores.values())
+    if _varredura is not None:
+        tasks.append(_varredura)
+        _varredura = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _atores.clear()
+    _mailboxes.clear()
+
+    # Jobs adiados (lotes abertos em memoria): prazo vence na hora para outra instancia retomar
+    if _adiados:
+        try:
+            await db.webhook_jobs.update_many(
+                {"_id": {"$in": list(_adiados)}, "dono": INSTANCIA_ID, "status": STATUS_PROCESSANDO},
+                {"$set": {"processando_ate": datetime.now()}}
+            )
+        except Exception as e:
+            logger.error(f"[FILA] Erro ao liberar jobs adiados: {e}")
+        _adiados.clear()
+
+
+# ============================================================
+# DEAD-LETTER / ADMIN
+# ============================================================
+
+async def listar_jobs(status: str = STATUS_DEAD, limit: int = 100) -> List[Dict[str, Any]]:
+    """Lista jobs por status (padrao: dead-letter), mais recentes primeiro"""
+    jobs = await db.webhook_jobs.find({"status": status}).sort("updated_at", -1).limit(limit).to_list(length=limit)
+    resultado = []
+    for job in jobs:
+        payload = job.get("payload", {})
+        texto = payload.get("text", {})
+        if isinstance(texto, dict):
+            texto = texto.get("message", "")
+        resultado.append({
+            "id": str(job["_id"]),
+            "phone": job.get("phone", ""),
+            "message_id": job.get("message_id", ""),
+            "tipo": payload.get("type", ""),
+            "texto": str(texto or "")[:120],
+            "attempts": job.get("attempts", 0),
+            "last_error": job.get("last_error", ""),
+            "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+            "updated_at": job["updated_at"].isoformat() if job.get("updated_at") else None
+        })
+    return resultado
+
+
+async def reprocessar_job(job_id: str) -> bool:
+    """Volta um job do dead-letter para a fila (zera as tentativas)"""
+    oid = ObjectId(job_id)
+    job = await db.webhook_jobs.find_one_and_update(
+        {"_id": oid, "status": STATUS_DEAD},
+        {"$set": {"status": STATUS_PENDENTE, "attempts": 0, "updated_at": datetime.now()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return False
+    if _fila_ativa:
+        _entregar(job.get("phone", ""), oid)
+    logger.info(f"[FILA] Job {job_id} reenviado para a fila pelo admin")
+    return True
+
+
+async def descartar_job(job_id: str) -> bool:
+    """Remove um job do dead-letter"""
+    result = await db.webhook_jobs.delete_one({"_id": ObjectId(job_id), "status": STATUS_DEAD})
+    return result.deleted_count > 0
+
+
+async def get_fila_stats() -> Dict[str, Any]:
+    """Contagem de jobs por status + atores ativos em memoria"""
+    contagem = {}
+    async for item in db.webhook_jobs.aggregate([{"$group": {"_id": "$status", "total": {"$sum": 1}}}]):
+        contagem[item["_id"]] = item["total"]
+    return {
+        "atores_ativos": len(_atores),
+        "eventos_em_memoria": sum(m.qsize() for m in _mailboxes.values()),
+        "pending": contagem.get(STATUS_PENDENTE, 0),
+        "processing": contagem.get(STATUS_PROCESSANDO, 0),
+        "done": contagem.get(STATUS_CONCLUIDO, 0),
+        "dead": contagem.get(STATUS_DEAD, 0)
+    }